@@ -20,9 +20,12 @@ Starting point for routing EC2 requests.
 
 """
 
+import hashlib
+import socket
 import urlparse
 
 from eventlet.green import httplib
+from eventlet import pools
 import webob
 import webob.dec
 import webob.exc
@@ -56,6 +59,15 @@ ec2_opts = [
     cfg.StrOpt('keystone_ec2_url',
                default='http://localhost:5000/v2.0/ec2tokens',
                help='URL to get token from ec2 request.'),
+    cfg.IntOpt('keystone_ec2_pool_size',
+               default=10,
+               help='Number of keep-alive connections to keystone_ec2_url '
+                    'kept open per API worker.'),
+    cfg.IntOpt('keystone_ec2_cache_ttl',
+               default=30,
+               help='Seconds a signed request validated by keystone is '
+                    'remembered, so identical requests skip keystone '
+                    '(0 disables the cache).'),
     cfg.BoolOpt('ec2_private_dns_show_ip',
                 default=False,
                 help='Return the IP address as private dns hostname in '
@@ -186,6 +198,96 @@ class Lockout(wsgi.Middleware):
         return res
 
 
+class KeystoneConnectionPool(pools.Pool):
+    """Keep-alive connections to the keystone EC2 token endpoint."""
+
+    def __init__(self, scheme, netloc, *args, **kwargs):
+        self.scheme = scheme
+        self.netloc = netloc
+        super(KeystoneConnectionPool, self).__init__(*args, **kwargs)
+
+    def create(self):
+        if self.scheme == "http":
+            return httplib.HTTPConnection(self.netloc)
+        else:
+            return httplib.HTTPSConnection(self.netloc)
+
+
+_keystone_pools = {}
+
+
+def keystone_ec2_request(creds_json):
+    """POST credentials to keystone_ec2_url over a pooled connection.
+
+    :returns: (status, reason, body) of the keystone response
+
+    """
+    # Disable "has no x member" pylint error
+    # for httplib and urlparse
+    # pylint: disable-msg=E1101
+    o = urlparse.urlparse(FLAGS.keystone_ec2_url)
+    pool = _keystone_pools.get((o.scheme, o.netloc))
+    if pool is None:
+        pool = KeystoneConnectionPool(o.scheme, o.netloc,
+                                      max_size=FLAGS.keystone_ec2_pool_size)
+        _keystone_pools[(o.scheme, o.netloc)] = pool
+    headers = {'Content-Type': 'application/json'}
+
+    # A kept-alive connection may have been closed by keystone in the
+    # meantime, in which case the request is retried on a new one.
+    for attempt in (1, 2):
+        conn = pool.get()
+        try:
+            conn.request('POST', o.path, body=creds_json, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            if attempt == 2:
+                raise
+            continue
+        finally:
+            pool.put(conn)
+        return response.status, response.reason, data
+
+
+class KeystoneEC2Cache(object):
+    """Remembers signed requests keystone has already validated.
+
+    The key covers the signature and everything it signs, so only an
+    identical request (e.g. a client polling within the granularity of
+    its timestamp, or retrying) is answered from the cache.  Keystone
+    does not hand out EC2 secrets, so requests with a new signature
+    always have to go to keystone.
+
+    """
+
+    def __init__(self):
+        if FLAGS.memcached_servers:
+            import memcache
+        else:
+            from nova.common import memorycache as memcache
+        self.mc = memcache.Client(FLAGS.memcached_servers, debug=0)
+
+    @staticmethod
+    def _key(cred_dict):
+        return 'ec2token-%s' % hashlib.sha1(utils.dumps(
+            [cred_dict['access'], cred_dict['signature'], cred_dict['host'],
+             cred_dict['verb'], cred_dict['path'],
+             sorted(cred_dict['params'].items())])).hexdigest()
+
+    def get(self, cred_dict):
+        if not FLAGS.keystone_ec2_cache_ttl:
+            return None
+        return self.mc.get(self._key(cred_dict))
+
+    def set(self, cred_dict, value):
+        if not FLAGS.keystone_ec2_cache_ttl:
+            return
+        self.mc.set(self._key(cred_dict), value,
+                    time=FLAGS.keystone_ec2_cache_ttl)
+
+
 class EC2Token(wsgi.Middleware):
     """Deprecated, only here to make merging easier."""
 
@@ -226,19 +328,7 @@ class EC2Token(wsgi.Middleware):
                                         'params': auth_params,
                                        }}}
         creds_json = utils.dumps(creds)
-        headers = {'Content-Type': 'application/json'}
-
-        # Disable "has no x member" pylint error
-        # for httplib and urlparse
-        # pylint: disable-msg=E1101
-        o = urlparse.urlparse(FLAGS.keystone_ec2_url)
-        if o.scheme == "http":
-            conn = httplib.HTTPConnection(o.netloc)
-        else:
-            conn = httplib.HTTPSConnection(o.netloc)
-        conn.request('POST', o.path, body=creds_json, headers=headers)
-        response = conn.getresponse().read()
-        conn.close()
+        _status, _reason, response = keystone_ec2_request(creds_json)
 
         # NOTE(vish): We could save a call to keystone by
         #             having keystone return token, tenant,
@@ -259,6 +349,51 @@ class EC2Token(wsgi.Middleware):
 class EC2KeystoneAuth(wsgi.Middleware):
     """Authenticate an EC2 request with keystone and convert to context."""
 
+    def __init__(self, application):
+        self.cache = KeystoneEC2Cache()
+        super(EC2KeystoneAuth, self).__init__(application)
+
+    def _authenticate(self, cred_dict):
+        """Return token, user, project and roles for the credentials.
+
+        :returns: (error message, None) on failure, (None, auth) otherwise
+
+        """
+        auth = self.cache.get(cred_dict)
+        if auth is not None:
+            return None, auth
+
+        if "ec2" in FLAGS.keystone_ec2_url:
+            creds = {'ec2Credentials': cred_dict}
+        else:
+            creds = {'auth': {'OS-KSEC2:ec2Credentials': cred_dict}}
+        creds_json = utils.dumps(creds)
+
+        status, reason, data = keystone_ec2_request(creds_json)
+        if status != 200:
+            if status == 401:
+                msg = reason
+            else:
+                msg = _("Failure communicating with keystone")
+            return msg, None
+        result = utils.loads(data)
+
+        try:
+            auth = {
+                'token_id': result['access']['token']['id'],
+                'user_id': result['access']['user']['id'],
+                'project_id': result['access']['token']['tenant']['id'],
+                'roles': [role['name'] for role
+                          in result['access']['user']['roles']],
+            }
+        except (AttributeError, KeyError), e:
+            LOG.exception("Keystone failure: %s" % e)
+            msg = _("Failure communicating with keystone")
+            return msg, None
+
+        self.cache.set(cred_dict, auth)
+        return None, auth
+
     @webob.dec.wsgify(RequestClass=wsgi.Request)
     def __call__(self, req):
         request_id = context.generate_request_id()
@@ -284,49 +419,18 @@ class EC2KeystoneAuth(wsgi.Middleware):
             'path': req.path,
             'params': auth_params,
         }
-        if "ec2" in FLAGS.keystone_ec2_url:
-            creds = {'ec2Credentials': cred_dict}
-        else:
-            creds = {'auth': {'OS-KSEC2:ec2Credentials': cred_dict}}
-        creds_json = utils.dumps(creds)
-        headers = {'Content-Type': 'application/json'}
-
-        o = urlparse.urlparse(FLAGS.keystone_ec2_url)
-        if o.scheme == "http":
-            conn = httplib.HTTPConnection(o.netloc)
-        else:
-            conn = httplib.HTTPSConnection(o.netloc)
-        conn.request('POST', o.path, body=creds_json, headers=headers)
-        response = conn.getresponse()
-        data = response.read()
-        if response.status != 200:
-            if response.status == 401:
-                msg = response.reason
-            else:
-                msg = _("Failure communicating with keystone")
-            return ec2_error(req, request_id, "Unauthorized", msg)
-        result = utils.loads(data)
-        conn.close()
-
-        try:
-            token_id = result['access']['token']['id']
-            user_id = result['access']['user']['id']
-            project_id = result['access']['token']['tenant']['id']
-            roles = [role['name'] for role
-                     in result['access']['user']['roles']]
-        except (AttributeError, KeyError), e:
-            LOG.exception("Keystone failure: %s" % e)
-            msg = _("Failure communicating with keystone")
+        msg, auth = self._authenticate(cred_dict)
+        if msg:
             return ec2_error(req, request_id, "Unauthorized", msg)
 
         remote_address = req.remote_addr
         if FLAGS.use_forwarded_for:
             remote_address = req.headers.get('X-Forwarded-For',
                                              remote_address)
-        ctxt = context.RequestContext(user_id,
-                                      project_id,
-                                      roles=roles,
-                                      auth_token=token_id,
+        ctxt = context.RequestContext(auth['user_id'],
+                                      auth['project_id'],
+                                      roles=auth['roles'],
+                                      auth_token=auth['token_id'],
                                       remote_address=remote_address)
 
         req.environ['nova.context'] = ctxt
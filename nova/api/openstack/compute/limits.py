@@ -25,6 +25,7 @@ import math
 import re
 import time
 
+from eventlet import pools
 import webob.dec
 import webob.exc
 
@@ -151,32 +152,53 @@ class Limit(object):
         if self.verb != verb or not re.match(self.regex, url):
             return
 
-        now = self._get_time()
+        state = [self.water_level, self.last_request,
+                 self.remaining, self.next_request]
+        delay = self.update(state, self._get_time())
+        (self.water_level, self.last_request,
+         self.remaining, self.next_request) = state
+        return delay
 
-        if self.last_request is None:
-            self.last_request = now
+    def new_state(self):
+        """Return the bucket state of a limit nobody has used yet."""
+        return [0, None, self.value, None]
 
-        leak_value = now - self.last_request
+    def update(self, state, now):
+        """
+        Record a request made at `now` against the bucket `state`.
+
+        @param state: list of water level, time of the last request,
+                      remaining requests and time of the next allowed
+                      request, as returned by `new_state`; updated in place
+        @param now: current time
+        @return: Seconds to wait if the request is over the limit, or None
+        """
+        water_level, last_request = state[0], state[1]
+
+        if last_request is None:
+            last_request = now
+
+        leak_value = now - last_request
 
-        self.water_level -= leak_value
-        self.water_level = max(self.water_level, 0)
-        self.water_level += self.request_value
+        water_level -= leak_value
+        water_level = max(water_level, 0)
+        water_level += self.request_value
 
-        difference = self.water_level - self.capacity
+        difference = water_level - self.capacity
 
-        self.last_request = now
+        state[1] = now
 
         if difference > 0:
-            self.water_level -= self.request_value
-            self.next_request = now + difference
+            state[0] = water_level - self.request_value
+            state[3] = now + difference
             return difference
 
         cap = self.capacity
-        water = self.water_level
         val = self.value
 
-        self.remaining = math.floor(((cap - water) / cap) * val)
-        self.next_request = now
+        state[0] = water_level
+        state[2] = math.floor(((cap - water_level) / cap) * val)
+        state[3] = now
 
     def _get_time(self):
         """Retrieve the current time. Broken out for testability."""
@@ -186,16 +208,20 @@ class Limit(object):
         """Display the string name of the unit."""
         return self.UNITS.get(self.unit, "UNKNOWN")
 
-    def display(self):
+    def display(self, state=None):
         """Return a useful representation of this class."""
+        if state is None:
+            remaining, next_request = self.remaining, self.next_request
+        else:
+            remaining, next_request = state[2], state[3]
         return {
             "verb": self.verb,
             "URI": self.uri,
             "regex": self.regex,
             "value": self.value,
-            "remaining": int(self.remaining),
+            "remaining": int(remaining),
             "unit": self.display_unit(),
-            "resetTime": int(self.next_request or self._get_time()),
+            "resetTime": int(next_request or self._get_time()),
         }
 
 # "Limit" format is a dictionary with the HTTP verb, human-readable URI,
@@ -239,7 +265,7 @@ class RateLimitingMiddleware(base_wsgi.Middleware):
         if limits is not None:
             limits = limiter.parse_limits(limits)
 
-        self._limiter = limiter(limits or DEFAULT_LIMITS, **kwargs)
+        self._limiter = limiter(limits=limits or DEFAULT_LIMITS, **kwargs)
 
     @webob.dec.wsgify(RequestClass=wsgi.Request)
     def __call__(self, req):
@@ -272,11 +298,86 @@ class RateLimitingMiddleware(base_wsgi.Middleware):
         return self.application
 
 
+class LimitSet(object):
+    """
+    A list of `Limit` objects with their regexes compiled into a single
+    matcher per HTTP verb, so finding every limit that applies to a
+    request costs one regex match.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        # A user's buckets are all empty again once the longest unit has
+        # passed without requests.
+        self.max_unit = max([limit.unit for limit in limits] or [0])
+        indexes = collections.defaultdict(list)
+        for index, limit in enumerate(limits):
+            indexes[limit.verb].append(index)
+        self._matchers = dict((verb, self._compile(verb_indexes))
+                              for verb, verb_indexes in indexes.items())
+
+    def _compile(self, indexes):
+        # Numbered back references would point at the wrong group in the
+        # combined pattern, so the limits using them are matched one by one.
+        separate = [index for index in indexes
+                    if self._has_back_reference(self.limits[index].regex)]
+        combined = [index for index in indexes if index not in separate]
+
+        # Every other limit becomes an optional lookahead anchored at the
+        # start of the URL, which matches exactly when re.match(regex, url)
+        # would; the named group tells which of them did.
+        pattern = ''.join('(?:(?=(?P<_limit%d>%s)))?' %
+                          (index, self.limits[index].regex)
+                          for index in combined)
+        try:
+            regex = re.compile(pattern)
+        except re.error:
+            separate, combined = indexes, []
+            regex = re.compile('')
+
+        groups = [(index, regex.groupindex['_limit%d' % index])
+                  for index in combined]
+        regexes = [(index, re.compile(self.limits[index].regex))
+                   for index in separate]
+
+        def matcher(url):
+            match = regex.match(url)
+            found = [index for index, group in groups
+                     if match.group(group) is not None]
+            if regexes:
+                found.extend(index for index, regex in regexes
+                             if regex.match(url))
+                found.sort()
+            return found
+
+        return matcher
+
+    @staticmethod
+    def _has_back_reference(regex):
+        """Whether regex may use a numbered back reference."""
+        return bool(re.compile(regex).groups and
+                    re.search(r'\\[1-9]', regex))
+
+    def match(self, verb, url):
+        """Return the indexes of the limits that apply to verb and url."""
+        matcher = self._matchers.get(verb)
+        if matcher is None:
+            return []
+        return matcher(url)
+
+
 class Limiter(object):
     """
     Rate-limit checking class which handles limits in memory.
+
+    Limits are shared between users; each user only gets a compact list
+    of bucket states, created on their first limited request and dropped
+    again once all of their buckets have drained.
     """
 
+    # Seconds between sweeps for users whose buckets have drained.
+    EVICT_INTERVAL = 60
+
     def __init__(self, limits, **kwargs):
         """
         Initialize the new `Limiter`.
@@ -284,7 +385,7 @@ class Limiter(object):
         @param limits: List of `Limit` objects
         """
         self.limits = copy.deepcopy(limits)
-        self.levels = collections.defaultdict(lambda: copy.deepcopy(limits))
+        self.levels = {}
 
         # Pick up any per-user limit information
         for key, value in kwargs.items():
@@ -292,11 +393,33 @@ class Limiter(object):
                 username = key[5:]
                 self.levels[username] = self.parse_limits(value)
 
+        self._default_set = LimitSet(self.limits)
+        self._user_sets = dict((username, LimitSet(user_limits))
+                               for username, user_limits in
+                               self.levels.items())
+        self._buckets = {}
+        self._next_eviction = None
+
+    def _limit_set(self, username):
+        return self._user_sets.get(username, self._default_set)
+
+    def _evict(self, now):
+        """Forget users whose buckets are all empty again."""
+        for username, (last_seen, _states) in self._buckets.items():
+            if now - last_seen >= self._limit_set(username).max_unit:
+                del self._buckets[username]
+        self._next_eviction = now + self.EVICT_INTERVAL
+
     def get_limits(self, username=None):
         """
         Return the limits for a given user.
         """
-        return [limit.display() for limit in self.levels[username]]
+        limit_set = self._limit_set(username)
+        states = self._buckets.get(username, (None, None))[1]
+        if states is None:
+            states = [limit.new_state() for limit in limit_set.limits]
+        return [limit.display(state)
+                for limit, state in zip(limit_set.limits, states)]
 
     def check_for_delay(self, verb, url, username=None):
         """
@@ -304,10 +427,25 @@ class Limiter(object):
 
         @return: Tuple of delay (in seconds) and error message (or None, None)
         """
+        limit_set = self._limit_set(username)
+        indexes = limit_set.match(verb, url)
+        if not indexes:
+            return None, None
+
+        now = limit_set.limits[indexes[0]]._get_time()
+        if self._next_eviction is None or now >= self._next_eviction:
+            self._evict(now)
+
+        states = self._buckets.get(username, (None, None))[1]
+        if states is None:
+            states = [limit.new_state() for limit in limit_set.limits]
+        self._buckets[username] = (now, states)
+
         delays = []
 
-        for limit in self.levels[username]:
-            delay = limit(verb, url)
+        for index in indexes:
+            limit = limit_set.limits[index]
+            delay = limit.update(states[index], now)
             if delay:
                 delays.append((delay, limit.error_message))
 
@@ -392,6 +530,10 @@ class WsgiLimiter(object):
     and receive a 204 No Content, or a 403 Forbidden with an X-Wait-Seconds
     header containing the number of seconds to wait before the action would
     succeed.
+
+    Serving one of these (for example on localhost) and pointing the
+    `RateLimitingMiddleware` of every API worker at it with
+    `WsgiLimiterProxy` enforces the limits across all of them.
     """
 
     def __init__(self, limits=None):
@@ -430,36 +572,71 @@ class WsgiLimiter(object):
             return webob.exc.HTTPNoContent()
 
 
+class _HTTPConnectionPool(pools.Pool):
+    """Keeps connections to the limiter open between requests."""
+
+    def __init__(self, address, *args, **kwargs):
+        self.address = address
+        super(_HTTPConnectionPool, self).__init__(*args, **kwargs)
+
+    def create(self):
+        return httplib.HTTPConnection(self.address)
+
+
 class WsgiLimiterProxy(object):
     """
     Rate-limit requests based on answers from a remote source.
     """
 
-    def __init__(self, limiter_address):
+    def __init__(self, limiter_address, limits=None, pool_size=10):
         """
         Initialize the new `WsgiLimiterProxy`.
 
         @param limiter_address: IP/port combination of where to request limit
+        @param limits: Ignored, the remote limiter owns the limits
+        @param pool_size: Connections to keep open to the limiter
         """
         self.limiter_address = limiter_address
+        self._pool = _HTTPConnectionPool(limiter_address,
+                                         max_size=int(pool_size))
 
     def check_for_delay(self, verb, path, username=None):
         body = json.dumps({"verb": verb, "path": path})
         headers = {"Content-Type": "application/json"}
 
-        conn = httplib.HTTPConnection(self.limiter_address)
-
-        if username:
-            conn.request("POST", "/%s" % (username), body, headers)
-        else:
-            conn.request("POST", "/", body, headers)
-
-        resp = conn.getresponse()
-
-        if 200 >= resp.status < 300:
+        conn = self._pool.get()
+        try:
+            if username:
+                conn.request("POST", "/%s" % (username), body, headers)
+            else:
+                conn.request("POST", "/", body, headers)
+
+            resp = conn.getresponse()
+            # The body has to be consumed before the connection is reused
+            error = resp.read() or None
+        except Exception:
+            # Don't hand a connection in an unknown state to the next user
+            conn.close()
+            raise
+        finally:
+            self._pool.put(conn)
+
+        if 200 <= resp.status < 300:
             return None, None
 
-        return resp.getheader("X-Wait-Seconds"), resp.read() or None
+        # A limiter failing without telling how long to wait, a 500 for
+        # instance, doesn't rate limit the request.
+        delay = resp.getheader("X-Wait-Seconds")
+        if delay is None:
+            return None, error
+        return float(delay), error
+
+    def get_limits(self, username=None):
+        """
+        The limit state lives in the remote limiter, so there is nothing
+        to report locally.
+        """
+        return []
 
     # Note: This method gets called before the class is instantiated,
     # so this must be either a static method or a class method.  It is
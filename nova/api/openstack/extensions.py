@@ -16,7 +16,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
 import os
+import tempfile
 
 import webob.dec
 import webob.exc
@@ -27,12 +29,24 @@ from nova.api.openstack import xmlutil
 from nova import exception
 from nova import flags
 from nova import log as logging
+from nova.openstack.common import cfg
 import nova.policy
 from nova import utils
 
 
 LOG = logging.getLogger(__name__)
+
+extension_opts = [
+    cfg.StrOpt('osapi_extension_manifest',
+               default='',
+               help='File caching what the standard API extensions provide. '
+                    'Extensions that only add resources are then imported '
+                    'on the first request to them rather than at startup. '
+                    'Empty to always import all extensions'),
+    ]
+
 FLAGS = flags.FLAGS
+FLAGS.register_opts(extension_opts)
 
 
 class ExtensionDescriptor(object):
@@ -308,8 +322,180 @@ def wrap_errors(fn):
     return wrapped
 
 
+class LazyController(object):
+    """Stands in for the controller of a not yet imported extension."""
+
+    # Extensions whose controllers have actions are never deferred
+    wsgi_actions = {}
+
+    def __init__(self, loader, alias, index):
+        self._loader = loader
+        self._alias = alias
+        self._index = index
+        self._controller = None
+
+    def __getattr__(self, name):
+        if self._controller is None:
+            self._controller = self._loader.controller(self._alias,
+                                                       self._index)
+        return getattr(self._controller, name)
+
+
+class LazyExtension(object):
+    """Extension registered from the manifest, imported on first use."""
+
+    def __init__(self, loader, info):
+        self._loader = loader
+        self._resources = info['resources']
+        self.name = info['name']
+        self.alias = info['alias']
+        self.namespace = info['namespace']
+        self.updated = info['updated']
+        self.__doc__ = info['description']
+
+    def get_resources(self):
+        resources = []
+        for index, resource in enumerate(self._resources):
+            controller = LazyController(self._loader, self.alias, index)
+            resources.append(ResourceExtension(
+                    resource['collection'], controller,
+                    parent=resource['parent'],
+                    collection_actions=resource['collection_actions'],
+                    member_actions=resource['member_actions']))
+        return resources
+
+    def get_controller_extensions(self):
+        return []
+
+
+class _ExtensionLoader(object):
+    """Calls an extension factory the first time a controller is needed."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.extensions = []
+        self._controllers = None
+
+    def register(self, ext):
+        self.extensions.append(ext)
+
+    def controller(self, alias, index):
+        if self._controllers is None:
+            LOG.debug(_('Loading deferred extension %s'), self.factory)
+            self.extensions = []
+            utils.import_class(self.factory)(self)
+            controllers = {}
+            for ext in self.extensions:
+                for i, resource in enumerate(ext.get_resources()):
+                    controllers[(ext.alias, i)] = resource.controller
+            self._controllers = controllers
+        return self._controllers[(alias, index)]
+
+
+def _describe_extension(ext):
+    """Describe ext for the manifest, or None if it can't be deferred."""
+    try:
+        if ext.get_controller_extensions():
+            return None
+    except AttributeError:
+        pass
+    try:
+        resources = ext.get_resources()
+    except AttributeError:
+        resources = []
+
+    described = []
+    for resource in resources:
+        if (resource.custom_routes_fn or resource.controller is None or
+            getattr(resource.controller, 'wsgi_actions', None)):
+            return None
+        described.append({'collection': resource.collection,
+                          'parent': resource.parent,
+                          'collection_actions': resource.collection_actions,
+                          'member_actions': resource.member_actions})
+    info = {'name': ext.name,
+            'alias': ext.alias,
+            'namespace': ext.namespace,
+            'updated': ext.updated,
+            'description': ext.__doc__,
+            'resources': described}
+    try:
+        json.dumps(info)
+    except (TypeError, ValueError):
+        return None
+    return info
+
+
+class _ExtensionManifest(object):
+    """What each extension factory registered, keyed by its class path.
+
+    Entries are only trusted while the module file keeps the mtime and
+    size it had when the factory was last called.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)['extensions']
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+    @staticmethod
+    def _stamp(filename):
+        st = os.stat(filename)
+        return [st.st_mtime, st.st_size]
+
+    def load_lazily(self, ext_mgr, classpath, filename):
+        """Register the extensions of classpath without importing it.
+
+        Returns False if they must be loaded by calling the factory.
+        """
+        entry = self.entries.get(classpath)
+        if (not entry or entry['extensions'] is None or
+            entry['stamp'] != self._stamp(filename)):
+            return False
+        loader = _ExtensionLoader(classpath)
+        for info in entry['extensions']:
+            ext_mgr.register(LazyExtension(loader, info))
+        return True
+
+    def record(self, classpath, filename, extensions):
+        described = [_describe_extension(ext) for ext in extensions]
+        if None in described:
+            described = None
+        self.entries[classpath] = {'stamp': self._stamp(filename),
+                                   'extensions': described}
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=dirname)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'extensions': self.entries}, f)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError), e:
+            LOG.warn(_('Unable to write extension manifest %(path)s: '
+                       '%(e)s') % {'path': self.path, 'e': e})
+        self.changed = False
+
+
 def load_standard_extensions(ext_mgr, logger, path, package, ext_list=None):
-    """Registers all standard API extensions."""
+    """Registers all standard API extensions.
+
+    With the osapi_extension_manifest flag set, extensions found in the
+    manifest that only add resources are registered without importing
+    them; their module is imported on the first request to one of them.
+    """
+
+    manifest = None
+    if FLAGS.osapi_extension_manifest:
+        manifest = _ExtensionManifest(FLAGS.osapi_extension_manifest)
 
     # Walk through all the modules in our directory...
     our_dir = path[0]
@@ -338,11 +524,23 @@ def load_standard_extensions(ext_mgr, logger, path, package, ext_list=None):
                 logger.debug("Skipping extension: %s" % classpath)
                 continue
 
+            filename = os.path.join(dirpath, fname)
+            if manifest and manifest.load_lazily(ext_mgr, classpath,
+                                                 filename):
+                continue
+
             try:
+                loaded = set(ext_mgr.extensions)
                 ext_mgr.load_extension(classpath)
             except Exception as exc:
                 logger.warn(_('Failed to load extension %(classpath)s: '
                               '%(exc)s') % locals())
+                continue
+
+            if manifest:
+                new = [e for alias, e in ext_mgr.extensions.iteritems()
+                       if alias not in loaded]
+                manifest.record(classpath, filename, new)
 
         # Now, let's consider any subdirectories we may have...
         subdirs = []
@@ -371,6 +569,9 @@ def load_standard_extensions(ext_mgr, logger, path, package, ext_list=None):
         # Update the list of directories we'll explore...
         dirnames[:] = subdirs
 
+    if manifest:
+        manifest.save()
+
 
 def extension_authorizer(api_name, extension_name):
     def authorize(context, target=None):
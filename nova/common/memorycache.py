@@ -16,36 +16,122 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-"""Super simple fake memcache client."""
+"""Super simple fake memcache client.
 
+Entries live in a dict and are additionally threaded on a doubly linked
+list in least recently used order, so lookups, stores and evicting the
+oldest entry are all O(1).  Expiry times go on a heap that is pruned
+lazily as time passes, so expired entries are reclaimed without ever
+scanning the whole cache.
+
+None of the methods yield to other greenthreads, so add() and incr()
+are atomic within a process, like they are on a memcached server.
+"""
+
+import heapq
+
+from nova import flags
+from nova.openstack.common import cfg
 from nova import utils
 
 
+memorycache_opts = [
+    cfg.IntOpt('memorycache_max_items',
+               default=100000,
+               help='Maximum number of entries kept by the in-process cache '
+                    'used when memcached_servers is not set (0 = unlimited)'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(memorycache_opts)
+
+# Slots of the linked list entries
+PREV, NEXT, KEY, VALUE, TIMEOUT = range(5)
+
+
 class Client(object):
     """Replicates a tiny subset of memcached client interface."""
 
     def __init__(self, *args, **kwargs):
-        """Ignores the passed in args."""
+        """Ignores the passed in args, apart from max_items."""
+        self.max_items = kwargs.get('max_items', FLAGS.memorycache_max_items)
         self.cache = {}
+        # Sentinel of the circular LRU list: root[NEXT] is the least
+        # recently used entry and root[PREV] the most recently used one.
+        self._root = root = []
+        root[:] = [root, root, None, None, 0]
+        self._expiry = []
+        self.stats = {'get_hits': 0,
+                      'get_misses': 0,
+                      'evictions': 0,
+                      'reclaimed': 0}
 
-    def get(self, key):
-        """Retrieves the value for a key or None.
+    def _unlink(self, entry):
+        entry[PREV][NEXT] = entry[NEXT]
+        entry[NEXT][PREV] = entry[PREV]
+
+    def _link_last(self, entry):
+        root = self._root
+        last = root[PREV]
+        entry[PREV] = last
+        entry[NEXT] = root
+        last[NEXT] = root[PREV] = entry
 
-        this expunges expired keys during each get"""
+    def _delete(self, key):
+        entry = self.cache.pop(key)
+        self._unlink(entry)
 
-        for k in self.cache.keys():
-            (timeout, _value) = self.cache[k]
-            if timeout and utils.utcnow_ts() >= timeout:
-                del self.cache[k]
+    def _expire(self, now):
+        """Drop the entries whose timeout has passed."""
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            timeout, key = heapq.heappop(expiry)
+            entry = self.cache.get(key)
+            # The key may have been deleted or stored again since.
+            if entry is not None and entry[TIMEOUT] == timeout:
+                self._delete(key)
+                self.stats['reclaimed'] += 1
+        # Overwritten keys leave stale heap items behind; rebuild the
+        # heap before they can outnumber the live entries.
+        if len(expiry) > 2 * len(self.cache) + 64:
+            self._expiry = [(live[TIMEOUT], live[KEY])
+                            for live in self.cache.itervalues()
+                            if live[TIMEOUT]]
+            heapq.heapify(self._expiry)
 
-        return self.cache.get(key, (0, None))[1]
+    def get(self, key):
+        """Retrieves the value for a key or None."""
+        self._expire(utils.utcnow_ts())
+        entry = self.cache.get(key)
+        if entry is None:
+            self.stats['get_misses'] += 1
+            return None
+        self.stats['get_hits'] += 1
+        self._unlink(entry)
+        self._link_last(entry)
+        return entry[VALUE]
 
     def set(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key."""
+        now = utils.utcnow_ts()
+        self._expire(now)
         timeout = 0
         if time != 0:
-            timeout = utils.utcnow_ts() + time
-        self.cache[key] = (timeout, value)
+            timeout = now + time
+            heapq.heappush(self._expiry, (timeout, key))
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            self._unlink(entry)
+            entry[VALUE] = value
+            entry[TIMEOUT] = timeout
+        else:
+            if self.max_items and len(self.cache) >= self.max_items:
+                self._delete(self._root[NEXT][KEY])
+                self.stats['evictions'] += 1
+            entry = [None, None, key, value, timeout]
+            self.cache[key] = entry
+        self._link_last(entry)
         return True
 
     def add(self, key, value, time=0, min_compress_len=0):
@@ -60,5 +146,17 @@ class Client(object):
         if value is None:
             return None
         new_value = int(value) + delta
-        self.cache[key] = (self.cache[key][0], str(new_value))
+        self.cache[key][VALUE] = str(new_value)
         return new_value
+
+    def delete(self, key, time=0):
+        """Deletes the value for a key."""
+        if key in self.cache:
+            self._delete(key)
+        return 1
+
+    def get_stats(self):
+        """Returns counters in the shape python-memcached reports them."""
+        stats = dict(self.stats)
+        stats['curr_items'] = len(self.cache)
+        return [('memorycache', stats)]
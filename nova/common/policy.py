@@ -116,8 +116,20 @@ def enforce(match_list, target_dict, credentials_dict):
         raise NotAuthorized()
 
 
+def _deny(target_dict, cred_dict):
+    return False
+
+
 class Brain(object):
-    """Implements policy checking."""
+    """Implements policy checking.
+
+    Match lists are compiled into nested functions the first time they
+    are checked, so parsing the ``kind:value`` strings and looking up the
+    check methods is only done once.  The compiled functions give the same
+    answers as the interpreting methods below, which remain the reference
+    implementation and are still used for kinds a subclass implements
+    itself (like ``http:``) or overrides.
+    """
     @classmethod
     def load_json(cls, data, default_rule=None):
         """Init a brain using json instead of a rules dictionary."""
@@ -127,6 +139,8 @@ class Brain(object):
     def __init__(self, rules=None, default_rule=None):
         self.rules = rules or {}
         self.default_rule = default_rule
+        self._compiled_rules = {}
+        self._compiled_lists = {}
 
     def add_rule(self, key, match):
         self.rules[key] = match
@@ -155,15 +169,103 @@ class Brain(object):
         :returns: True if the check passes
 
         """
+        try:
+            compiled = self._compiled_lists[match_list]
+        except KeyError:
+            compiled = self._compile_list(match_list)
+            self._compiled_lists[match_list] = compiled
+        except TypeError:
+            # Lists coming from json are not hashable
+            compiled = self._compile_list(match_list)
+        return compiled(target_dict, cred_dict)
+
+    def _is_inherited(self, name):
+        """True unless a subclass overrides the method called name."""
+        return getattr(type(self), name).im_func is Brain.__dict__[name]
+
+    def _compile_list(self, match_list):
+        """Compile a match list into a function of (target, creds)."""
         if not match_list:
-            return True
+            return lambda target_dict, cred_dict: True
+
+        or_list = []
         for and_list in match_list:
             if isinstance(and_list, basestring):
                 and_list = (and_list,)
-            if all([self._check(item, target_dict, cred_dict)
-                    for item in and_list]):
-                return True
-        return False
+            or_list.append([self._compile_match(item) for item in and_list])
+
+        def check(target_dict, cred_dict):
+            for and_checks in or_list:
+                # NOTE: every item is evaluated, like all([...]) used to.
+                if all([f(target_dict, cred_dict) for f in and_checks]):
+                    return True
+            return False
+
+        return check
+
+    def _compile_match(self, match):
+        """Compile a single ``kind:value`` match."""
+        def interpret(target_dict, cred_dict):
+            return self._check(match, target_dict, cred_dict)
+
+        match_kind, sep, match_value = match.partition(':')
+        if (not sep or not self._is_inherited('_check') or
+            not self._is_inherited('check')):
+            return interpret
+
+        if hasattr(self, '_check_%s' % match_kind):
+            if match_kind == 'rule' and self._is_inherited('_check_rule'):
+                return self._compile_rule_ref(match_value)
+            if match_kind == 'role' and self._is_inherited('_check_role'):
+                return self._compile_role(match_value)
+            return interpret
+
+        if '%' in match_kind or not self._is_inherited('_check_generic'):
+            return interpret
+        return self._compile_generic(match_kind, match_value)
+
+    def _rule_checker(self, name):
+        """Return the compiled function of rule name."""
+        try:
+            match_list = self.rules[name]
+        except KeyError:
+            if self.default_rule and name != self.default_rule:
+                return self._rule_checker(self.default_rule)
+            return _deny
+
+        compiled = self._compiled_rules.get(name)
+        # Rules may be replaced after compilation, see add_rule()
+        if compiled is None or compiled[0] is not match_list:
+            compiled = (match_list, self._compile_list(match_list))
+            self._compiled_rules[name] = compiled
+        return compiled[1]
+
+    def _compile_rule_ref(self, name):
+        def check(target_dict, cred_dict):
+            return self._rule_checker(name)(target_dict, cred_dict)
+        return check
+
+    def _compile_role(self, role):
+        role = role.lower()
+
+        def check(target_dict, cred_dict):
+            return role in [x.lower() for x in cred_dict['roles']]
+        return check
+
+    def _compile_generic(self, key, value):
+        if '%' in value:
+            def check(target_dict, cred_dict):
+                # Format first, a missing target key must still raise
+                expected = value % target_dict
+                if key in cred_dict:
+                    return expected == cred_dict[key]
+                return False
+        else:
+            def check(target_dict, cred_dict):
+                if key in cred_dict:
+                    return value == cred_dict[key]
+                return False
+        return check
 
     def _check_rule(self, match, target_dict, cred_dict):
         """Recursively checks credentials based on the brains rules."""
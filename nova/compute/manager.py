@@ -53,6 +53,7 @@ from nova.compute import power_state
 from nova.compute import task_states
 from nova.compute import utils as compute_utils
 from nova.compute import vm_states
+from nova.consoleauth import tokens as console_tokens
 from nova import exception
 from nova import flags
 import nova.image
@@ -138,6 +139,8 @@ compute_opts = [
 FLAGS = flags.FLAGS
 FLAGS.register_opts(compute_opts)
 
+flags.DECLARE('console_token_ttl', 'nova.consoleauth.manager')
+
 LOG = logging.getLogger(__name__)
 
 
@@ -1667,22 +1670,27 @@ class ComputeManager(manager.SchedulerDependentManager):
         instance_ref = self.db.instance_get_by_uuid(context, instance_uuid)
 
         LOG.debug(_("Getting vnc console"), instance=instance_ref)
-        token = str(utils.gen_uuid())
 
         if console_type == 'novnc':
             # For essex, novncproxy_base_url must include the full path
             # including the html file (like http://myhost/vnc_auto.html)
-            access_url = '%s?token=%s' % (FLAGS.novncproxy_base_url, token)
+            base_url = FLAGS.novncproxy_base_url
         elif console_type == 'xvpvnc':
-            access_url = '%s?token=%s' % (FLAGS.xvpvncproxy_base_url, token)
+            base_url = FLAGS.xvpvncproxy_base_url
         else:
             raise exception.ConsoleTypeInvalid(console_type=console_type)
 
         # Retrieve connect info from driver, and then decorate with our
-        # access info token
+        # access info token, signed for the proxy when keys are set
         connect_info = self.driver.get_vnc_console(instance_ref)
+        token = console_tokens.sign(console_type, connect_info['host'],
+                                    connect_info['port'],
+                                    connect_info['internal_access_path'],
+                                    FLAGS.console_token_ttl)
+        if token is None:
+            token = str(utils.gen_uuid())
         connect_info['token'] = token
-        connect_info['access_url'] = access_url
+        connect_info['access_url'] = '%s?token=%s' % (base_url, token)
 
         return connect_info
 
@@ -2230,7 +2238,8 @@ class ComputeManager(manager.SchedulerDependentManager):
         try:
             # Call to network API to get instance info.. this will
             # force an update to the instance's info_cache
-            self.network_api.get_instance_nw_info(context, instance)
+            self.network_api.get_instance_nw_info(context, instance,
+                                                  use_cache=False)
             LOG.debug(_('Updated the info_cache for instance'),
                     instance=instance)
         except Exception:
@@ -16,19 +16,50 @@
 
 """Compute-related Utilities and helpers."""
 
+import json
+import os
+
+import eventlet
 import netaddr
 
 import nova.context
 from nova import db
 from nova import exception
 from nova import flags
+from nova import log as logging
 from nova import network
 from nova.network import model as network_model
 from nova.notifier import api as notifier_api
+from nova.openstack.common import cfg
 from nova import utils
 
 
+LOG = logging.getLogger(__name__)
+
+usage_audit_opts = [
+    cfg.BoolOpt('usage_audit_bulk',
+                default=False,
+                help='Generate the exists notifications of an audit period '
+                     'in bulk: bandwidth usage is read in one query, network '
+                     'info only comes from the instance info caches and '
+                     'notifications are sent in parallel'),
+    cfg.IntOpt('usage_audit_chunk_size',
+               default=1000,
+               help='Number of instances whose exists notifications are '
+                    'built and sent together by a bulk usage audit'),
+    cfg.IntOpt('usage_audit_concurrency',
+               default=20,
+               help='Maximum number of exists notifications being sent at '
+                    'the same time by a bulk usage audit'),
+    cfg.StrOpt('usage_audit_checkpoint',
+               default=None,
+               help='File where a bulk usage audit records its progress, so '
+                    'that an interrupted audit of a period resumes where it '
+                    'stopped'),
+    ]
+
 FLAGS = flags.FLAGS
+FLAGS.register_opts(usage_audit_opts)
 
 
 def notify_usage_exists(context, instance_ref, current_period=False):
@@ -39,7 +70,6 @@ def notify_usage_exists(context, instance_ref, current_period=False):
         is True."""
     admin_context = nova.context.get_admin_context(read_deleted='yes')
     begin, end = utils.last_completed_audit_period()
-    bw = {}
     if current_period:
         audit_start = end
         audit_end = utils.utcnow()
@@ -57,16 +87,9 @@ def notify_usage_exists(context, instance_ref, current_period=False):
                                                          instance_ref)
 
     macs = [vif['address'] for vif in nw_info]
-    for b in db.bw_usage_get_by_macs(admin_context,
-                                     macs,
-                                     audit_start):
-        label = 'net-name-not-found-%s' % b['mac']
-        for vif in nw_info:
-            if vif['address'] == b['mac']:
-                label = vif['network']['label']
-                break
-
-        bw[label] = dict(bw_in=b.bw_in, bw_out=b.bw_out)
+    bw = _bandwidth_usage(nw_info, db.bw_usage_get_by_macs(admin_context,
+                                                           macs,
+                                                           audit_start))
 
     extra_usage_info = dict(audit_period_beginning=str(audit_start),
                             audit_period_ending=str(audit_end),
@@ -76,6 +99,105 @@ def notify_usage_exists(context, instance_ref, current_period=False):
             context, instance_ref, 'exists', extra_usage_info=extra_usage_info)
 
 
+def _bandwidth_usage(nw_info, bw_usages):
+    """Return the bandwidth usages of the vifs of nw_info by network."""
+    bw = {}
+    for b in bw_usages:
+        label = 'net-name-not-found-%s' % b['mac']
+        for vif in nw_info:
+            if vif['address'] == b['mac']:
+                label = vif['network']['label']
+                break
+
+        bw[label] = dict(bw_in=b.bw_in, bw_out=b.bw_out)
+    return bw
+
+
+class _AuditCheckpoint(object):
+    """Highest id of the instances audited so far in a period."""
+
+    def __init__(self, path, begin, end):
+        self.path = path
+        self.period = '%s/%s' % (begin, end)
+        self.last_id = 0
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (IOError, ValueError), e:
+            LOG.warn(_('Ignoring unreadable usage audit checkpoint '
+                       '%(path)s: %(e)s') % locals())
+            return
+        if state.get('period') == self.period:
+            self.last_id = state['last_id']
+
+    def save(self, last_id):
+        self.last_id = last_id
+        if not self.path:
+            return
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as f:
+            json.dump({'period': self.period, 'last_id': last_id}, f)
+        os.rename(tmp_path, self.path)
+
+
+def notify_usage_exists_bulk(context, instances, begin, end):
+    """Generates the 'exists' notifications of an audit period.
+
+    Unlike notify_usage_exists for each instance, bandwidth usage is read
+    in a single query and network info only comes from the info caches.
+    Notifications are built usage_audit_chunk_size instances at a time
+    and sent by up to usage_audit_concurrency greenthreads. Instances
+    are audited by increasing id and, with usage_audit_checkpoint set,
+    an audit of the same period resumes after the last complete chunk.
+
+    Returns the number of notifications sent.
+    """
+    admin_context = nova.context.get_admin_context(read_deleted='yes')
+    checkpoint = _AuditCheckpoint(FLAGS.usage_audit_checkpoint, begin, end)
+    instances = sorted((instance for instance in instances
+                        if instance['id'] > checkpoint.last_id),
+                       key=lambda instance: instance['id'])
+    if checkpoint.last_id:
+        LOG.info(_('Resuming the usage audit after instance %d') %
+                 checkpoint.last_id)
+    if not instances:
+        return 0
+
+    bw_usages = {}
+    for b in db.bw_usage_get_by_period(admin_context, begin):
+        bw_usages[b['mac']] = b
+
+    publisher_id = 'compute.%s' % FLAGS.host
+    pool = eventlet.GreenPool(FLAGS.usage_audit_concurrency)
+    chunk_size = FLAGS.usage_audit_chunk_size
+    for start in xrange(0, len(instances), chunk_size):
+        chunk = instances[start:start + chunk_size]
+        payloads = []
+        for instance_ref in chunk:
+            nw_info = network_model.NetworkInfo()
+            if (instance_ref.get('info_cache') and
+                instance_ref['info_cache'].get('network_info')):
+                nw_info = network_model.NetworkInfo.hydrate(
+                        instance_ref['info_cache']['network_info'])
+            bw = _bandwidth_usage(nw_info,
+                                  [bw_usages[vif['address']]
+                                   for vif in nw_info
+                                   if vif['address'] in bw_usages])
+            payloads.append(_usage_from_instance(context, instance_ref,
+                    audit_period_beginning=str(begin),
+                    audit_period_ending=str(end),
+                    bandwidth=bw))
+        for payload in payloads:
+            pool.spawn_n(notifier_api.notify, publisher_id,
+                         'compute.instance.exists', notifier_api.INFO,
+                         payload)
+        pool.waitall()
+        checkpoint.save(chunk[-1]['id'])
+    return len(instances)
+
+
 def legacy_network_info(network_model):
     """
     Return the legacy network_info representation of the network_model
@@ -18,15 +18,14 @@
 
 """Auth Components for Consoles."""
 
-import os
-import sys
+import heapq
 import time
 
+from nova.consoleauth import tokens
 from nova import flags
 from nova import log as logging
 from nova import manager
 from nova.openstack.common import cfg
-from nova import utils
 
 
 LOG = logging.getLogger(__name__)
@@ -45,37 +44,78 @@ FLAGS.register_opts(consoleauth_opts)
 
 
 class ConsoleAuthManager(manager.Manager):
-    """Manages token based authentication."""
+    """Manages token based authentication.
+
+    Random tokens are kept until they expire.  Signed tokens (see
+    nova.consoleauth.tokens) are checked without being stored, only the
+    ids of the revoked ones are kept, until they would have expired.
+    Both expire in order from a heap, so expiring tokens costs
+    O(log n) per token rather than a scan of all of them.
+    """
 
     def __init__(self, scheduler_driver=None, *args, **kwargs):
         super(ConsoleAuthManager, self).__init__(*args, **kwargs)
         self.tokens = {}
-        utils.LoopingCall(self._delete_expired_tokens).start(1)
+        self.revoked = {}
+        # (expiry time, 'tokens' or 'revoked', key in that dict)
+        self._expiry = []
 
     def _delete_expired_tokens(self):
         now = time.time()
-        to_delete = []
-        for k, v in self.tokens.items():
-            if now - v['last_activity_at'] > FLAGS.console_token_ttl:
-                to_delete.append(k)
-
-        for k in to_delete:
-            LOG.audit(_("Deleting Expired Token: (%s)"), k)
-            del self.tokens[k]
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            expires, kind, key = heapq.heappop(expiry)
+            entries = getattr(self, kind)
+            entry = entries.get(key)
+            # The token may have been authorized again since
+            if entry is not None and entry['expires_at'] == expires:
+                LOG.audit(_("Deleting Expired Token: (%s)"), key)
+                del entries[key]
 
     def authorize_console(self, context, token, console_type, host, port,
                           internal_access_path):
+        self._delete_expired_tokens()
+        now = time.time()
         self.tokens[token] = {'token': token,
                               'console_type': console_type,
                               'host': host,
                               'port': port,
                               'internal_access_path': internal_access_path,
-                              'last_activity_at': time.time()}
+                              'last_activity_at': now,
+                              'expires_at': now + FLAGS.console_token_ttl}
+        heapq.heappush(self._expiry,
+                       (self.tokens[token]['expires_at'], 'tokens', token))
         token_dict = self.tokens[token]
         LOG.audit(_("Received Token: %(token)s, %(token_dict)s)"), locals())
 
     def check_token(self, context, token):
-        token_valid = token in self.tokens
+        self._delete_expired_tokens()
+        if tokens.is_signed(token):
+            info = tokens.decode(token)
+            if info is not None and info['id'] in self.revoked:
+                info = None
+            if info is not None:
+                info['token'] = token
+        else:
+            info = self.tokens.get(token)
+        token_valid = info is not None
         LOG.audit(_("Checking Token: %(token)s, %(token_valid)s)"), locals())
-        if token_valid:
-            return self.tokens[token]
+        return info
+
+    def revoke_token(self, context, token):
+        """Make a token invalid before it expires."""
+        self._delete_expired_tokens()
+        self.tokens.pop(token, None)
+        info = tokens.is_signed(token) and tokens.decode(token)
+        if info and info['id'] not in self.revoked:
+            entry = {'expires_at': info['expires']}
+            self.revoked[info['id']] = entry
+            heapq.heappush(self._expiry,
+                           (entry['expires_at'], 'revoked', info['id']))
+        LOG.audit(_("Revoked Token: %s"), token)
+
+    def get_revoked_tokens(self, context):
+        """Return (id, expiry time) of the revoked signed tokens."""
+        self._delete_expired_tokens()
+        return [(token_id, entry['expires_at'])
+                for token_id, entry in self.revoked.iteritems()]
@@ -0,0 +1,180 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Self-contained console tokens that proxies can verify locally.
+
+A signed token carries everything a console proxy needs to connect:
+
+    v1.<key id>.<base64 JSON payload>.<base64 HMAC-SHA256>
+
+The payload holds a unique id, the console type, host, port, internal
+access path and expiry time.  Tokens are signed with the first key of
+console_token_keys and any key listed there is accepted, so keys are
+rotated by adding a new key in front and dropping the old one once the
+tokens it signed have expired.
+
+Tokens can be revoked through consoleauth before they expire; proxies
+fetch the list of revoked ids every console_token_revocation_interval
+seconds.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from nova import context
+from nova import flags
+from nova import log as logging
+from nova.openstack.common import cfg
+from nova import rpc
+from nova import utils
+
+
+LOG = logging.getLogger(__name__)
+
+console_token_opts = [
+    cfg.ListOpt('console_token_keys',
+                default=[],
+                help='Keys used to sign console tokens so that console '
+                     'proxies can check them without asking consoleauth, '
+                     'as <key id>:<secret>. The first key signs new tokens, '
+                     'all of them are accepted. Empty to use random tokens '
+                     'only known to consoleauth'),
+    cfg.IntOpt('console_token_revocation_interval',
+               default=30,
+               help='Seconds between two fetches of the revoked console '
+                    'tokens by console proxies, 0 to never fetch them'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(console_token_opts)
+
+flags.DECLARE('consoleauth_topic', 'nova.consoleauth')
+
+VERSION = 'v1'
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(str(data) + '=' * (-len(data) % 4))
+
+
+def _keys():
+    """Return the configured (key id, secret) pairs, signing key first."""
+    keys = []
+    for item in FLAGS.console_token_keys:
+        key_id, sep, secret = item.partition(':')
+        if sep and key_id and secret and '.' not in key_id:
+            keys.append((key_id, secret))
+        else:
+            LOG.error(_('Ignoring malformed console token key %s'), key_id)
+    return keys
+
+
+def _signature(secret, signed):
+    return _b64encode(hmac.new(secret, signed, hashlib.sha256).digest())
+
+
+def is_signed(token):
+    return token.startswith(VERSION + '.')
+
+
+def sign(console_type, host, port, internal_access_path, ttl):
+    """Return a token valid for ttl seconds, or None without keys."""
+    keys = _keys()
+    if not keys:
+        return None
+    key_id, secret = keys[0]
+    payload = {'id': utils.gen_uuid().hex,
+               'console_type': console_type,
+               'host': host,
+               'port': port,
+               'internal_access_path': internal_access_path,
+               'expires': int(time.time() + ttl)}
+    signed = '%s.%s.%s' % (VERSION, key_id,
+                           _b64encode(json.dumps(payload)))
+    return '%s.%s' % (signed, _signature(secret, signed))
+
+
+def decode(token, now=None):
+    """Return the payload of a valid signed token, None otherwise.
+
+    Revocation is not checked here.
+    """
+    try:
+        version, key_id, payload, signature = str(token).split('.')
+    except (ValueError, UnicodeError):
+        return None
+    secret = dict(_keys()).get(key_id)
+    if version != VERSION or not secret:
+        return None
+    signed = '%s.%s.%s' % (version, key_id, payload)
+    if not utils.strcmp_const_time(signature, _signature(secret, signed)):
+        return None
+    try:
+        info = json.loads(_b64decode(payload))
+    except (TypeError, ValueError):
+        return None
+    if (now or time.time()) >= info['expires']:
+        return None
+    return info
+
+
+class Verifier(object):
+    """Checks signed tokens for a console proxy.
+
+    The revoked token ids are fetched from consoleauth when they are
+    older than console_token_revocation_interval; if that fails the
+    previous list is kept.
+    """
+
+    def __init__(self):
+        self.revoked = {}
+        self._fetched_at = None
+
+    def _sync_revocations(self, now):
+        interval = FLAGS.console_token_revocation_interval
+        if not interval or (self._fetched_at is not None and
+                            now - self._fetched_at < interval):
+            return
+        self._fetched_at = now
+        try:
+            revoked = rpc.call(context.get_admin_context(),
+                               FLAGS.consoleauth_topic,
+                               {'method': 'get_revoked_tokens', 'args': {}})
+        except Exception:
+            LOG.exception(_('Unable to fetch the revoked console tokens'))
+            return
+        self.revoked = dict((token_id, expires)
+                            for token_id, expires in revoked)
+
+    def verify(self, token):
+        """Return the connection info for token, or None if invalid."""
+        now = time.time()
+        info = decode(token, now)
+        if info is None:
+            return None
+        self._sync_revocations(now)
+        if info['id'] in self.revoked:
+            return None
+        info['token'] = token
+        return info
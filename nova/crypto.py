@@ -28,8 +28,17 @@ import base64
 import hashlib
 import os
 import string
+import struct
 
 import Crypto.Cipher.AES
+import Crypto.Random
+from Crypto.PublicKey import RSA
+
+try:
+    from Crypto.Cipher import PKCS1_v1_5
+except ImportError:
+    # pycrypto older than 2.5
+    PKCS1_v1_5 = None
 
 from nova import context
 from nova import db
@@ -61,6 +70,10 @@ crypto_opts = [
     cfg.BoolOpt('use_project_ca',
                 default=False,
                 help=_('Should we use a CA for each project?')),
+    cfg.BoolOpt('use_inprocess_crypto',
+                default=True,
+                help=_('Generate key pairs and decrypt text with pycrypto '
+                       'instead of running ssh-keygen and openssl')),
     cfg.StrOpt('user_cert_subject',
                default='/C=US/ST=California/O=OpenStack/'
                        'OU=NovaDev/CN=%.16s-%.16s-%s',
@@ -124,7 +137,37 @@ def _generate_fingerprint(public_key_file):
     return fingerprint
 
 
+def _compute_fingerprint(public_key):
+    """Return the MD5 fingerprint of an OpenSSH public key, as ssh-keygen.
+
+    :raises: ValueError if the key is malformed
+
+    """
+    parts = public_key.strip().split()
+    if len(parts) < 2:
+        raise ValueError(_('Public key must contain a type and a key'))
+    key_type = parts[0]
+    try:
+        blob = base64.b64decode(parts[1])
+    except TypeError:
+        raise ValueError(_('Public key is not valid base64'))
+    # The blob starts with the length-prefixed key type again
+    if len(blob) < 4:
+        raise ValueError(_('Public key is truncated'))
+    (type_len,) = struct.unpack('>I', blob[:4])
+    if blob[4:4 + type_len] != key_type:
+        raise ValueError(_('Public key type does not match its data'))
+    digest = hashlib.md5(blob).hexdigest()
+    return ':'.join(a + b for a, b in zip(digest[::2], digest[1::2]))
+
+
 def generate_fingerprint(public_key):
+    if FLAGS.use_inprocess_crypto:
+        try:
+            return _compute_fingerprint(public_key)
+        except ValueError:
+            raise exception.InvalidKeypair()
+
     with utils.tempdir() as tmpdir:
         try:
             pubfile = os.path.join(tmpdir, 'temp.pub')
@@ -135,7 +178,26 @@ def generate_fingerprint(public_key):
             raise exception.InvalidKeypair()
 
 
+_rng_pid = None
+
+
+def _ensure_rng():
+    """Reseed pycrypto's RNG in processes forked since it was used."""
+    global _rng_pid
+    pid = os.getpid()
+    if _rng_pid != pid:
+        Crypto.Random.atfork()
+        _rng_pid = pid
+
+
 def generate_key_pair(bits=1024):
+    if FLAGS.use_inprocess_crypto:
+        _ensure_rng()
+        key = RSA.generate(bits)
+        private_key = key.exportKey('PEM')
+        public_key = key.publickey().exportKey('OpenSSH')
+        return (private_key, public_key, _compute_fingerprint(public_key))
+
     # what is the magic 65537?
 
     with utils.tempdir() as tmpdir:
@@ -157,10 +219,43 @@ def fetch_crl(project_id):
         return crlfile.read()
 
 
+# Loaded CA private keys, by path: (mtime, cipher)
+_decrypt_ciphers = {}
+
+
+def _load_decrypt_cipher(private_key):
+    """Return a PKCS#1 v1.5 cipher for a key file, or None if unusable."""
+    mtime = os.path.getmtime(private_key)
+    cached = _decrypt_ciphers.get(private_key)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(private_key) as f:
+            cipher = PKCS1_v1_5.new(RSA.importKey(f.read()))
+    except (ValueError, IndexError, TypeError):
+        LOG.warn(_('Unable to load %s, falling back to openssl'),
+                 private_key)
+        cipher = None
+    _decrypt_ciphers[private_key] = (mtime, cipher)
+    return cipher
+
+
 def decrypt_text(project_id, text):
     private_key = key_path(project_id)
     if not os.path.exists(private_key):
         raise exception.ProjectNotFound(project_id=project_id)
+    if FLAGS.use_inprocess_crypto and PKCS1_v1_5 is not None:
+        cipher = _load_decrypt_cipher(private_key)
+        if cipher is not None:
+            _ensure_rng()
+            sentinel = object()
+            try:
+                dec = cipher.decrypt(text, sentinel)
+            except ValueError:
+                dec = sentinel
+            if dec is sentinel:
+                raise exception.DecryptionFailure()
+            return dec
     try:
         dec, _err = utils.execute('openssl',
                                  'rsautl',
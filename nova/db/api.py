@@ -159,6 +159,16 @@ def service_update(context, service_id, values):
     return IMPL.service_update(context, service_id, values)
 
 
+def service_heartbeat(context, service_id, availability_zone):
+    """Record a heartbeat of a service with a single UPDATE.
+
+    Bumps report_count and updated_at without reading the row first.
+    Raises NotFound if service does not exist.
+
+    """
+    return IMPL.service_heartbeat(context, service_id, availability_zone)
+
+
 ###################
 
 
@@ -667,6 +677,11 @@ def instance_info_cache_update(context, instance_uuid, values):
     return IMPL.instance_info_cache_update(context, instance_uuid, values)
 
 
+def instance_info_cache_invalidate(context, instance_uuid):
+    """Mark the network info cache of an instance as out of date."""
+    return IMPL.instance_info_cache_invalidate(context, instance_uuid)
+
+
 def instance_info_cache_delete(context, instance_uuid):
     """Deletes an existing instance_info_cache record
 
@@ -760,6 +775,11 @@ def network_get_all(context):
     return IMPL.network_get_all(context)
 
 
+def network_get_all_by_ids(context, network_ids):
+    """Get networks by id or raise if one of them does not exist."""
+    return IMPL.network_get_all_by_ids(context, network_ids)
+
+
 def network_get_all_by_uuids(context, network_uuids, project_id=None):
     """Return networks by ids."""
     return IMPL.network_get_all_by_uuids(context, network_uuids, project_id)
@@ -1016,6 +1036,11 @@ def volume_get_iscsi_target_num(context, volume_id):
     return IMPL.volume_get_iscsi_target_num(context, volume_id)
 
 
+def volume_get_iscsi_target_nums_by_host(context, host):
+    """Get {volume_id: target num} for every volume with a tid on host."""
+    return IMPL.volume_get_iscsi_target_nums_by_host(context, host)
+
+
 def volume_update(context, volume_id, values):
     """Set the given properties on an volume and update it.
 
@@ -1502,6 +1527,11 @@ def bw_usage_get_by_macs(context, macs, start_period):
     return IMPL.bw_usage_get_by_macs(context, macs, start_period)
 
 
+def bw_usage_get_by_period(context, start_period):
+    """Return the bw usages of every mac in a given audit period."""
+    return IMPL.bw_usage_get_by_period(context, start_period)
+
+
 def bw_usage_update(context,
                     mac,
                     start_period,
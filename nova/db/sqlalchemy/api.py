@@ -408,6 +408,18 @@ def service_update(context, service_id, values):
         service_ref.save(session=session)
 
 
+@require_admin_context
+def service_heartbeat(context, service_id, availability_zone):
+    result = model_query(context, models.Service, read_deleted="no").\
+                     filter_by(id=service_id).\
+                     update({'report_count': models.Service.report_count + 1,
+                             'availability_zone': availability_zone,
+                             'updated_at': utils.utcnow()},
+                            synchronize_session=False)
+    if not result:
+        raise exception.ServiceNotFound(service_id=service_id)
+
+
 ###################
 
 
@@ -1750,6 +1762,20 @@ def instance_info_cache_update(context, instance_uuid, values,
     return info_cache
 
 
+@require_context
+def instance_info_cache_invalidate(context, instance_uuid):
+    """Increment the generation of an instance info cache record.
+
+    :param instance_uuid: = uuid of info cache's instance
+    """
+    session = get_session()
+    with session.begin():
+        session.query(models.InstanceInfoCache).\
+                filter_by(instance_id=instance_uuid).\
+                update({'generation': models.InstanceInfoCache.generation + 1},
+                       synchronize_session=False)
+
+
 @require_context
 def instance_info_cache_delete(context, instance_uuid, session=None):
     """Deletes an existing instance_info_cache record
@@ -1944,6 +1970,22 @@ def network_get(context, network_id, session=None):
     return result
 
 
+@require_context
+def network_get_all_by_ids(context, network_ids):
+    if not network_ids:
+        return []
+    result = model_query(context, models.Network, project_only=True).\
+                    filter(models.Network.id.in_(network_ids)).\
+                    all()
+
+    found = set(network['id'] for network in result)
+    for network_id in network_ids:
+        if network_id not in found:
+            raise exception.NetworkNotFound(network_id=network_id)
+
+    return result
+
+
 @require_admin_context
 def network_get_all(context):
     result = model_query(context, models.Network, read_deleted="no").all()
@@ -2534,6 +2576,17 @@ def volume_get_iscsi_target_num(context, volume_id):
     return result.target_num
 
 
+@require_admin_context
+def volume_get_iscsi_target_nums_by_host(context, host):
+    result = model_query(context, models.IscsiTarget.volume_id,
+                         models.IscsiTarget.target_num, read_deleted="yes").\
+                     filter(models.IscsiTarget.host == host).\
+                     filter(models.IscsiTarget.volume_id != None).\
+                     all()
+
+    return dict(result)
+
+
 @require_context
 def volume_update(context, volume_id, values):
     session = get_session()
@@ -3725,6 +3778,13 @@ def bw_usage_get_by_macs(context, macs, start_period):
                    all()
 
 
+@require_admin_context
+def bw_usage_get_by_period(context, start_period):
+    return model_query(context, models.BandwidthUsage, read_deleted="yes").\
+                   filter_by(start_period=start_period).\
+                   all()
+
+
 @require_context
 def bw_usage_update(context,
                     mac,
@@ -0,0 +1,37 @@
+#   Copyright 2012 OpenStack, LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from sqlalchemy import Column, Integer, MetaData, Table
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    instance_info_caches = Table("instance_info_caches", meta, autoload=True)
+    generation = Column("generation", Integer, default=0)
+    instance_info_caches.create_column(generation)
+    # Existing caches aren't known to be up to date: leaving their
+    # network_info_generation NULL makes them stale until rebuilt
+    network_info_generation = Column("network_info_generation", Integer)
+    instance_info_caches.create_column(network_info_generation)
+    migrate_engine.execute(instance_info_caches.update().
+                           values(generation=0))
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+    instance_info_caches = Table("instance_info_caches", meta, autoload=True)
+    instance_info_caches.drop_column('network_info_generation')
+    instance_info_caches.drop_column('generation')
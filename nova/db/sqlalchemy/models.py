@@ -292,6 +292,11 @@ class InstanceInfoCache(BASE, NovaBase):
     # text column used for storing a json object of network data for api
     network_info = Column(Text)
 
+    # incremented whenever the network of the instance changes, the cache
+    # is up to date when network_info was built for the current generation
+    generation = Column(Integer, default=0)
+    network_info_generation = Column(Integer)
+
     instance_id = Column(String(36), ForeignKey('instances.uuid'),
                                      nullable=False, unique=True)
     instance = relationship(Instance,
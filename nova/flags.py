@@ -399,6 +399,11 @@ global_opts = [
     cfg.StrOpt('root_helper',
                default='sudo',
                help='Command prefix to use for running commands as root'),
+    cfg.StrOpt('root_helper_daemon',
+               default=None,
+               help='Command starting a long running root helper, e.g. '
+                    '"sudo nova-rootwrap --daemon". When set, commands run '
+                    'as root go through it instead of root_helper'),
     cfg.StrOpt('network_driver',
                default='nova.network.linux_net',
                help='Driver to use for network creation'),
@@ -20,13 +20,13 @@
 
 import base64
 import binascii
+import collections
 import os
-import shutil
 import tarfile
-import tempfile
 from xml.etree import ElementTree
 
 import boto.s3.connection
+import Crypto.Cipher.AES
 import eventlet
 
 from nova import rpc
@@ -44,7 +44,11 @@ LOG = logging.getLogger(__name__)
 s3_opts = [
     cfg.StrOpt('image_decryption_dir',
                default='/tmp',
-               help='parent dir for tempdir used for image decryption'),
+               help='unused, images are decrypted in memory'),
+    cfg.IntOpt('s3_download_concurrency',
+               default=4,
+               help='number of image parts fetched from s3 at the same '
+                    'time'),
     cfg.StrOpt('s3_access_key',
                default='notchecked',
                help='access key to use for s3 server for images'),
@@ -172,13 +176,6 @@ class S3ImageService(object):
                                                port=FLAGS.s3_port,
                                                host=FLAGS.s3_host)
 
-    @staticmethod
-    def _download_file(bucket, filename, local_dir):
-        key = bucket.get_key(filename)
-        local_filename = os.path.join(local_dir, os.path.basename(filename))
-        key.get_contents_to_filename(local_filename)
-        return local_filename
-
     def _s3_parse_manifest(self, context, metadata, manifest):
         manifest = ElementTree.fromstring(manifest)
         image_format = 'ami'
@@ -268,8 +265,6 @@ class S3ImageService(object):
     def _s3_create(self, context, metadata):
         """Gets a manifest from s3 and makes an image."""
 
-        image_path = tempfile.mkdtemp(dir=FLAGS.image_decryption_dir)
-
         image_location = metadata['properties']['image_location']
         bucket_name = image_location.split('/')[0]
         manifest_path = image_location[len(bucket_name) + 1:]
@@ -281,140 +276,249 @@ class S3ImageService(object):
                                                               metadata,
                                                               manifest)
 
-        def delayed_create():
-            """This handles the fetching and decrypting of the part files."""
-            context.update_store()
-            log_vars = {'image_location': image_location,
-                        'image_path': image_path}
-            metadata['properties']['image_state'] = 'downloading'
+        def _update_state(state):
+            metadata['properties']['image_state'] = state
             self.service.update(context, image_uuid, metadata)
 
-            try:
-                parts = []
-                elements = manifest.find('image').getiterator('filename')
-                for fn_element in elements:
-                    part = self._download_file(bucket,
-                                               fn_element.text,
-                                               image_path)
-                    parts.append(part)
-
-                # NOTE(vish): this may be suboptimal, should we use cat?
-                enc_filename = os.path.join(image_path, 'image.encrypted')
-                with open(enc_filename, 'w') as combined:
-                    for filename in parts:
-                        with open(filename) as part:
-                            shutil.copyfileobj(part, combined)
-
-            except Exception:
-                LOG.exception(_("Failed to download %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_download'
-                self.service.update(context, image_uuid, metadata)
-                return
-
-            metadata['properties']['image_state'] = 'decrypting'
-            self.service.update(context, image_uuid, metadata)
-
-            try:
-                hex_key = manifest.find('image/ec2_encrypted_key').text
-                encrypted_key = binascii.a2b_hex(hex_key)
-                hex_iv = manifest.find('image/ec2_encrypted_iv').text
-                encrypted_iv = binascii.a2b_hex(hex_iv)
-
-                dec_filename = os.path.join(image_path, 'image.tar.gz')
-                self._decrypt_image(context, enc_filename, encrypted_key,
-                                    encrypted_iv, dec_filename)
-            except Exception:
-                LOG.exception(_("Failed to decrypt %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_decrypt'
-                self.service.update(context, image_uuid, metadata)
-                return
+        def delayed_create():
+            """This streams the part files through decryption, gunzip,
+            untar and into the image service in a single pass."""
+            context.update_store()
+            log_vars = {'image_location': image_location}
+            _update_state('downloading')
 
-            metadata['properties']['image_state'] = 'untarring'
-            self.service.update(context, image_uuid, metadata)
+            # fetching the parts and decrypting the key and iv on
+            # nova-cert all happen at the same time
+            filenames = [fn_element.text for fn_element in
+                         manifest.find('image').getiterator('filename')]
+            parts = _PartFetcher(bucket, filenames)
+            keys = eventlet.spawn(self._decrypt_key_and_iv, context, manifest)
 
             try:
-                unz_filename = self._untarzip_image(image_path, dec_filename)
+                key, iv = keys.wait()
             except Exception:
-                LOG.exception(_("Failed to untar %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_untar'
-                self.service.update(context, image_uuid, metadata)
+                parts.cancel()
+                LOG.exception(_("Failed to decrypt %(image_location)s"),
+                              log_vars)
+                _update_state('failed_decrypt')
                 return
 
-            metadata['properties']['image_state'] = 'uploading'
-            self.service.update(context, image_uuid, metadata)
+            _update_state('decrypting')
+            image_file = _ImageReader(_DecryptingReader(parts, key, iv))
             try:
-                with open(unz_filename) as image_file:
-                    self.service.update(context, image_uuid,
-                                        metadata, image_file)
-            except Exception:
-                LOG.exception(_("Failed to upload %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_upload'
-                self.service.update(context, image_uuid, metadata)
+                image_file.open()
+                _update_state('uploading')
+                self.service.update(context, image_uuid, metadata, image_file)
+            except Exception, exc:
+                parts.cancel()
+                state = getattr(image_file.error or exc, 'state',
+                                'failed_upload')
+                LOG.exception(_("Failed to register %(image_location)s: "
+                                "%(state)s"),
+                              dict(log_vars, state=state))
+                _update_state(state)
                 return
 
             metadata['properties']['image_state'] = 'available'
             metadata['status'] = 'active'
             self.service.update(context, image_uuid, metadata)
 
-            shutil.rmtree(image_path)
-
         eventlet.spawn_n(delayed_create)
 
         return image
 
     @staticmethod
-    def _decrypt_image(context, encrypted_filename, encrypted_key,
-                       encrypted_iv, decrypted_filename):
+    def _decrypt_key_and_iv(context, manifest):
+        """Has nova-cert decrypt the image key and iv, in parallel."""
         elevated = context.elevated()
+
+        def _decrypt_text(tag):
+            text = binascii.a2b_hex(manifest.find(tag).text)
+            return rpc.call(elevated, FLAGS.cert_topic,
+                            {"method": "decrypt_text",
+                             "args": {"project_id": context.project_id,
+                                      "text": base64.b64encode(text)}})
+
+        key = eventlet.spawn(_decrypt_text, 'image/ec2_encrypted_key')
+        iv = eventlet.spawn(_decrypt_text, 'image/ec2_encrypted_iv')
         try:
-            key = rpc.call(elevated, FLAGS.cert_topic,
-                           {"method": "decrypt_text",
-                            "args": {"project_id": context.project_id,
-                                     "text": base64.b64encode(encrypted_key)}})
+            key = key.wait()
         except Exception, exc:
+            iv.kill()
             raise exception.Error(_('Failed to decrypt private key: %s')
                                   % exc)
         try:
-            iv = rpc.call(elevated, FLAGS.cert_topic,
-                          {"method": "decrypt_text",
-                           "args": {"project_id": context.project_id,
-                                    "text": base64.b64encode(encrypted_iv)}})
+            iv = iv.wait()
         except Exception, exc:
             raise exception.Error(_('Failed to decrypt initialization '
                                     'vector: %s') % exc)
-
-        try:
-            utils.execute('openssl', 'enc',
-                          '-d', '-aes-128-cbc',
-                          '-in', '%s' % (encrypted_filename,),
-                          '-K', '%s' % (key,),
-                          '-iv', '%s' % (iv,),
-                          '-out', '%s' % (decrypted_filename,))
-        except exception.ProcessExecutionError, exc:
-            raise exception.Error(_('Failed to decrypt image file '
-                                    '%(image_file)s: %(err)s') %
-                                    {'image_file': encrypted_filename,
-                                     'err': exc.stdout})
+        return binascii.a2b_hex(key.strip()), binascii.a2b_hex(iv.strip())
 
     @staticmethod
     def _test_for_malicious_tarball(path, filename):
         """Raises exception if extracting tarball would escape extract path"""
         tar_file = tarfile.open(filename, 'r|gz')
         for n in tar_file.getnames():
-            if not os.path.abspath(os.path.join(path, n)).startswith(path):
+            if not _is_safe_member(path, n):
                 tar_file.close()
                 raise exception.Error(_('Unsafe filenames in image'))
         tar_file.close()
 
-    @staticmethod
-    def _untarzip_image(path, filename):
-        S3ImageService._test_for_malicious_tarball(path, filename)
-        tar_file = tarfile.open(filename, 'r|gz')
-        tar_file.extractall(path)
-        image_file = tar_file.getnames()[0]
-        tar_file.close()
-        return os.path.join(path, image_file)
+
+def _is_safe_member(path, name):
+    return os.path.abspath(os.path.join(path, name)).startswith(path)
+
+
+class _PipelineError(Exception):
+    """Carries the image_state a failed registration should end up in."""
+
+    def __init__(self, state, message):
+        super(_PipelineError, self).__init__(message)
+        self.state = state
+
+
+class _PartFetcher(object):
+    """Yields the bundle parts in order, fetching a few ahead of time.
+
+    At most s3_download_concurrency parts are in flight or buffered, which
+    bounds memory use when the consumer is slower than s3.
+    """
+
+    def __init__(self, bucket, filenames):
+        self._bucket = bucket
+        self._filenames = iter(filenames)
+        self._pending = collections.deque()
+        for _i in xrange(max(FLAGS.s3_download_concurrency, 1)):
+            self._fetch_next()
+
+    def _fetch(self, filename):
+        return self._bucket.get_key(filename).get_contents_as_string()
+
+    def _fetch_next(self):
+        for filename in self._filenames:
+            self._pending.append(eventlet.spawn(self._fetch, filename))
+            break
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self._pending:
+            raise StopIteration()
+        try:
+            data = self._pending.popleft().wait()
+        except Exception, exc:
+            raise _PipelineError('failed_download', unicode(exc))
+        self._fetch_next()
+        return data
+
+    def cancel(self):
+        while self._pending:
+            self._pending.popleft().kill()
+
+
+class _DecryptingReader(object):
+    """File-like AES-128-CBC decryption of an iterator of chunks.
+
+    Behaves like ``openssl enc -d -aes-128-cbc``: the last block is held
+    back until the input ends so its PKCS#5 padding can be stripped.
+    """
+
+    block_size = 16
+
+    def __init__(self, chunks, key, iv):
+        self._chunks = chunks
+        self._cipher = Crypto.Cipher.AES.new(key, Crypto.Cipher.AES.MODE_CBC,
+                                             iv)
+        self._encrypted = ''
+        self._buffer = ''
+        self._offset = 0
+        self._eof = False
+
+    def _fill(self):
+        """Decrypt the next chunk into the buffer, False at end of input."""
+        if self._eof:
+            return False
+        try:
+            self._encrypted += self._chunks.next()
+        except StopIteration:
+            self._eof = True
+            self._buffer = self._unpad(self._encrypted)
+            self._offset = 0
+            return True
+        size = ((len(self._encrypted) - 1) // self.block_size *
+                self.block_size)
+        self._buffer = self._cipher.decrypt(self._encrypted[:size])
+        self._encrypted = self._encrypted[size:]
+        self._offset = 0
+        return True
+
+    def _unpad(self, last):
+        if len(last) != self.block_size:
+            raise _PipelineError('failed_decrypt',
+                                 _('Encrypted image has a bad length'))
+        last = self._cipher.decrypt(last)
+        padding = ord(last[-1])
+        if not 0 < padding <= self.block_size or (
+                last[-padding:] != last[-1] * padding):
+            raise _PipelineError('failed_decrypt',
+                                 _('Bad decrypt, wrong key or iv?'))
+        return last[:-padding]
+
+    def read(self, size=-1):
+        pieces = []
+        while size != 0:
+            if self._offset >= len(self._buffer):
+                if not self._fill():
+                    break
+                continue
+            if size < 0:
+                end = len(self._buffer)
+            else:
+                end = self._offset + size
+                size -= min(size, len(self._buffer) - self._offset)
+            pieces.append(self._buffer[self._offset:end])
+            self._offset = end
+        return ''.join(pieces)
+
+
+class _ImageReader(object):
+    """Reads the image file out of a streamed, gzipped bundle tarball.
+
+    Only read() is offered so the image service streams the upload instead
+    of trying to seek for the size.  The first error is kept in ``error``
+    so it can be reported even if the upload wraps it.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._tar_file = None
+        self._image = None
+        self.error = None
+
+    def open(self):
+        try:
+            self._tar_file = tarfile.open(fileobj=self._fileobj, mode='r|gz')
+            member = self._tar_file.next()
+        except _PipelineError, exc:
+            self.error = exc
+            raise
+        except Exception, exc:
+            self.error = _PipelineError('failed_untar', unicode(exc))
+            raise self.error
+        if (member is None or not member.isfile() or
+                not _is_safe_member('/image', member.name)):
+            self.error = _PipelineError('failed_untar',
+                                        _('Unsafe filenames in image'))
+            raise self.error
+        self._image = self._tar_file.extractfile(member)
+
+    def read(self, size=None):
+        try:
+            return self._image.read(size)
+        except _PipelineError, exc:
+            self.error = exc
+            raise
+        except Exception, exc:
+            self.error = _PipelineError('failed_untar', unicode(exc))
+            raise self.error
@@ -22,11 +22,21 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova.network import model as network_model
+from nova.openstack.common import cfg
 from nova import rpc
 from nova.rpc import common as rpc_common
 
 
+network_api_opts = [
+    cfg.BoolOpt('use_network_info_cache',
+                default=True,
+                help='Read the network info of instances from their info '
+                     'cache when it is up to date instead of asking '
+                     'nova-network for it'),
+    ]
+
 FLAGS = flags.FLAGS
+FLAGS.register_opts(network_api_opts)
 LOG = logging.getLogger(__name__)
 
 
@@ -177,6 +187,7 @@ class API(base.Base):
         args['instance_id'] = instance['id']
         args['project_id'] = instance['project_id']
         args['host'] = instance['host']
+        self.db.instance_info_cache_invalidate(context, instance['uuid'])
         rpc.cast(context, FLAGS.network_topic,
                  {'method': 'deallocate_for_instance',
                   'args': args})
@@ -186,6 +197,8 @@ class API(base.Base):
         args = {'instance_id': instance['id'],
                 'host': instance['host'],
                 'network_id': network_id}
+        # Until nova-network has made the change and refreshed the cache
+        self.db.instance_info_cache_invalidate(context, instance['uuid'])
         rpc.cast(context, FLAGS.network_topic,
                  {'method': 'add_fixed_ip_to_instance',
                   'args': args})
@@ -196,6 +209,7 @@ class API(base.Base):
         args = {'instance_id': instance['id'],
                 'host': instance['host'],
                 'address': address}
+        self.db.instance_info_cache_invalidate(context, instance['uuid'])
         rpc.cast(context, FLAGS.network_topic,
                  {'method': 'remove_fixed_ip_from_instance',
                   'args': args})
@@ -206,8 +220,21 @@ class API(base.Base):
                  {'method': 'add_network_to_project',
                   'args': {'project_id': project_id}})
 
-    def get_instance_nw_info(self, context, instance):
-        """Returns all network info related to an instance."""
+    def get_instance_nw_info(self, context, instance, use_cache=True):
+        """Returns all network info related to an instance.
+
+        The info cache of the instance is used when it is up to date,
+        unless use_cache is False.
+        """
+        if use_cache and FLAGS.use_network_info_cache:
+            info_cache = self.db.instance_info_cache_get(context,
+                                                         instance['uuid'])
+            if (info_cache and info_cache['network_info'] and
+                info_cache['network_info_generation'] ==
+                    info_cache['generation']):
+                return network_model.NetworkInfo.hydrate(
+                        info_cache['network_info'])
+
         args = {'instance_id': instance['id'],
                 'instance_uuid': instance['uuid'],
                 'rxtx_factor': instance['instance_type']['rxtx_factor'],
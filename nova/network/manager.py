@@ -493,6 +493,7 @@ class FloatingIP(object):
             if "Cannot find device" in str(e):
                 LOG.error(_('Interface %(interface)s not found'), locals())
                 raise exception.NoFloatingIpInterface(interface=interface)
+        self._fixed_ip_nw_info_changed(context, fixed_address)
 
     @wrap_check_policy
     def disassociate_floating_ip(self, context, address,
@@ -545,6 +546,17 @@ class FloatingIP(object):
 
         # go go driver time
         self.l3driver.remove_floating_ip(address, fixed_address, interface)
+        self._fixed_ip_nw_info_changed(context, fixed_address)
+
+    def _fixed_ip_nw_info_changed(self, context, fixed_address):
+        """Refresh the network info cache of the instance of a fixed ip."""
+        try:
+            fixed_ip = self.db.fixed_ip_get_by_address(context.elevated(),
+                                                       fixed_address)
+        except exception.FixedIpNotFoundForAddress:
+            return
+        if fixed_ip['instance_id'] is not None:
+            self._instance_nw_info_changed(context, fixed_ip['instance_id'])
 
     @wrap_check_policy
     def get_floating_ip(self, context, id):
@@ -934,6 +946,9 @@ class NetworkManager(manager.SchedulerDependentManager):
         # deallocate vifs (mac addresses)
         self.db.virtual_interface_delete_by_instance(read_deleted_context,
                                                      instance_id)
+        instance = self.db.instance_get(read_deleted_context, instance_id)
+        self.db.instance_info_cache_invalidate(read_deleted_context,
+                                               instance['uuid'])
 
     @wrap_check_policy
     def get_instance_nw_info(self, context, instance_id, instance_uuid,
@@ -946,6 +961,7 @@ class NetworkManager(manager.SchedulerDependentManager):
         where network = dict containing pertinent data from a network db object
         and info = dict containing pertinent networking data
         """
+        generation = self._info_cache_generation(context, instance_uuid)
         vifs = self.db.virtual_interface_get_by_instance(context, instance_id)
         networks = {}
 
@@ -958,9 +974,39 @@ class NetworkManager(manager.SchedulerDependentManager):
         nw_info = self.build_network_info_model(context, vifs, networks,
                                                          rxtx_factor, host)
         self.db.instance_info_cache_update(context, instance_uuid,
-                                          {'network_info': nw_info.as_cache()})
+                                          {'network_info': nw_info.as_cache(),
+                                           'network_info_generation':
+                                               generation})
         return nw_info
 
+    def _info_cache_generation(self, context, instance_uuid):
+        """Return the generation of the info cache of an instance.
+
+        It must be read before the network info is built: if the network
+        of the instance changes meanwhile, the cache is left out of date.
+        """
+        info_cache = self.db.instance_info_cache_get(context, instance_uuid)
+        return (info_cache and info_cache['generation']) or 0
+
+    def _instance_nw_info_changed(self, context, instance_id):
+        """Refresh the network info cache of an instance after a change.
+
+        The cache is marked out of date first, so that it isn't used if
+        it can't be rebuilt.
+        """
+        admin_context = context.elevated()
+        try:
+            instance = self.db.instance_get(admin_context, instance_id)
+            self.db.instance_info_cache_invalidate(admin_context,
+                                                   instance['uuid'])
+            self.get_instance_nw_info(admin_context, instance_id,
+                    instance['uuid'],
+                    instance['instance_type']['rxtx_factor'],
+                    instance['host'], project_id=instance['project_id'])
+        except Exception:
+            LOG.exception(_('Unable to refresh the network info cache of '
+                            'instance %s'), instance_id)
+
     def build_network_info_model(self, context, vifs, networks,
                                  rxtx_factor, instance_host):
         """Builds a NetworkInfo object containing all network information
@@ -1124,6 +1170,7 @@ class NetworkManager(manager.SchedulerDependentManager):
         """Adds a fixed ip to an instance from specified network."""
         networks = [self._get_network_by_id(context, network_id)]
         self._allocate_fixed_ips(context, instance_id, host, networks)
+        self._instance_nw_info_changed(context, instance_id)
 
     @wrap_check_policy
     def remove_fixed_ip_from_instance(self, context, instance_id, host,
@@ -1133,6 +1180,7 @@ class NetworkManager(manager.SchedulerDependentManager):
         for fixed_ip in fixed_ips:
             if fixed_ip['address'] == address:
                 self.deallocate_fixed_ip(context, address, host)
+                self._instance_nw_info_changed(context, instance_id)
                 return
         raise exception.FixedIpNotFoundForSpecificInstance(
                                     instance_id=instance_id, ip=address)
@@ -16,11 +16,13 @@
 #    under the License.
 #    @author: Tyler Smith, Cisco Systems
 
+import copy
 import httplib
 import json
 import socket
 import urllib
 
+from nova.network.quantum import http_pool
 from nova import utils
 
 
@@ -74,18 +76,13 @@ class api_call(object):
 
     def __get__(self, instance, owner):
         def with_params(*args, **kwargs):
-            """Temporarily set format and tenant for this request"""
-            (format, tenant) = (instance.format, instance.tenant)
-
-            instance.format = kwargs.pop('format', instance.format)
-            instance.tenant = kwargs.pop('tenant', instance.tenant)
-
-            ret = None
-            try:
-                ret = self.func(instance, *args, **kwargs)
-            finally:
-                (instance.format, instance.tenant) = (format, tenant)
-            return ret
+            """Set format and tenant for this request only"""
+            # A copy sharing the connection pool, so that concurrent
+            # requests for other tenants don't see these settings
+            client = copy.copy(instance)
+            client.format = kwargs.pop('format', instance.format)
+            client.tenant = kwargs.pop('tenant', instance.tenant)
+            return self.func(client, *args, **kwargs)
         return with_params
 
 
@@ -103,7 +100,7 @@ class Client(object):
 
     def __init__(self, host="127.0.0.1", port=9696, use_ssl=False, tenant=None,
                  format="xml", testing_stub=None, key_file=None,
-                 cert_file=None, logger=None):
+                 cert_file=None, logger=None, pool_size=0, retries=0):
         """Creates a new client to some service.
 
         :param host: The host where service resides
@@ -115,6 +112,9 @@ class Client(object):
         :param key_file: The SSL key file to use if use_ssl is true
         :param cert_file: The SSL cert file to use if use_ssl is true
         :param logger: logging object to be used by client library
+        :param pool_size: keep-alive connections kept open for reuse
+        :param retries: times a request failing to reach the server
+                        is retried
         """
         self.host = host
         self.port = port
@@ -126,6 +126,8 @@ class Client(object):
         self.key_file = key_file
         self.cert_file = cert_file
         self.logger = logger
+        self.retries = retries
+        self.pool = http_pool.HTTPConnectionPool(self._connect, pool_size)
 
     def get_connection_type(self):
         """Returns the proper connection type"""
@@ -136,6 +138,17 @@ class Client(object):
         else:
             return httplib.HTTPConnection
 
+    def _connect(self):
+        """Open a new connection, handling SSL certs"""
+        connection_type = self.get_connection_type()
+        certs = {'key_file': self.key_file, 'cert_file': self.cert_file}
+        certs = dict((x, certs[x]) for x in certs if certs[x] is not None)
+
+        if self.use_ssl and len(certs):
+            return connection_type(self.host, self.port, **certs)
+        else:
+            return connection_type(self.host, self.port)
+
     def do_request(self, method, action, body=None,
                    headers=None, params=None):
         """Connects to the server and issues a request.
@@ -162,19 +175,9 @@ class Client(object):
             action += '?' + urllib.urlencode(params)
 
         try:
-            connection_type = self.get_connection_type()
             headers = headers or {"Content-Type":
                                       "application/%s" % self.format}
 
-            # Open connection and send request, handling SSL certs
-            certs = {'key_file': self.key_file, 'cert_file': self.cert_file}
-            certs = dict((x, certs[x]) for x in certs if certs[x] is not None)
-
-            if self.use_ssl and len(certs):
-                c = connection_type(self.host, self.port, **certs)
-            else:
-                c = connection_type(self.host, self.port)
-
             if self.logger:
                 self.logger.debug(
                     _("Quantum Client Request: %(method)s %(action)s"),
@@ -182,10 +185,9 @@ class Client(object):
                 if body:
                     self.logger.debug(body)
 
-            c.request(method, action, body, headers)
-            res = c.getresponse()
+            res, data = self.pool.request(method, action, body, headers,
+                                          retries=self.retries)
             status_code = self.get_status_code(res)
-            data = res.read()
 
             if self.logger:
                 self.logger.debug("Quantum Client Reply (code = %s) :\n %s" %
@@ -206,7 +208,7 @@ class Client(object):
                       _("Server %(status_code)s error: %(data)s")
                                         % locals())
 
-        except (socket.error, IOError), e:
+        except (socket.error, IOError, httplib.HTTPException), e:
             raise QuantumIOException(_("Unable to connect to "
                               "server. Got error: %s") % e)
 
@@ -0,0 +1,92 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Keep-alive HTTP connections shared by the Quantum and Melange clients."""
+
+import collections
+import httplib
+import socket
+
+from nova import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+
+class HTTPConnectionPool(object):
+    """Reuses the connections to one HTTP server between requests.
+
+    Requests never wait for a connection: when none is idle a new one is
+    opened, and at most max_idle connections are kept open once their
+    request is finished.
+
+    :param connect: callable returning a new httplib connection
+    :param max_idle: connections kept open for reuse, 0 to close every
+                     connection after its request
+    """
+
+    def __init__(self, connect, max_idle=10):
+        self._connect = connect
+        self.max_idle = max_idle
+        self._idle = collections.deque()
+
+    def _get(self):
+        """Return an idle connection or a new one, and whether it's reused."""
+        try:
+            return self._idle.pop(), True
+        except IndexError:
+            return self._connect(), False
+
+    def _put(self, connection):
+        if len(self._idle) < self.max_idle:
+            self._idle.append(connection)
+        else:
+            connection.close()
+
+    def request(self, method, url, body=None, headers=None, retries=0):
+        """Send a request and return the response and its body.
+
+        A request failing on a reused connection, which the server may
+        have closed in the meantime, is sent again on a new connection.
+        Failures on new connections are retried up to retries times.
+        """
+        attempt = 0
+        while True:
+            connection, reused = self._get()
+            try:
+                connection.request(method, url, body, headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except (socket.error, IOError, httplib.HTTPException), e:
+                connection.close()
+                if not reused:
+                    if attempt >= retries:
+                        raise
+                    attempt += 1
+                    LOG.warn(_('%(method)s %(url)s failed, retrying: %(e)s')
+                             % locals())
+                continue
+            if getattr(response, 'will_close', False):
+                connection.close()
+            else:
+                self._put(connection)
+            return response, data
+
+    def close(self):
+        """Close the idle connections."""
+        while self._idle:
+            self._idle.pop().close()
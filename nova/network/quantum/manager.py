@@ -17,6 +17,7 @@
 
 import time
 
+from eventlet import greenpool
 import netaddr
 
 from nova import context
@@ -334,7 +335,11 @@ class QuantumManager(manager.FloatingIP, manager.FlatManager):
                 else:
                     net_proj_pairs.append((net_id, None))
 
-        # Create a port via quantum and attach the vif
+        # Create a port via quantum and attach the vif. The vifs are
+        # created in order, their ports concurrently
+        green_pool = greenpool.GreenPool()
+        port_threads = []
+        dhcp_vifs = []
         for proj_pair in net_proj_pairs:
             network = self.get_network(context, proj_pair)
 
@@ -361,15 +366,23 @@ class QuantumManager(manager.FloatingIP, manager.FlatManager):
                 pairs = [{'mac_address': vif_rec['address'],
                           'ip_address': ip} for ip in ips]
 
-            self.q_conn.create_and_attach_port(network['net_tenant_id'],
-                                               network['quantum_net_id'],
-                                               vif_rec['uuid'],
-                                               vm_id=instance['uuid'],
-                                               rxtx_factor=rxtx_factor,
-                                               nova_id=nova_id,
-                                               allowed_address_pairs=pairs)
-            # Set up/start the dhcp server for this network if necessary
-            if FLAGS.quantum_use_dhcp:
+            port_threads.append(green_pool.spawn(
+                    self.q_conn.create_and_attach_port,
+                    network['net_tenant_id'],
+                    network['quantum_net_id'],
+                    vif_rec['uuid'],
+                    vm_id=instance['uuid'],
+                    rxtx_factor=rxtx_factor,
+                    nova_id=nova_id,
+                    allowed_address_pairs=pairs))
+            dhcp_vifs.append((network, vif_rec))
+        # Raises the first failure of a port creation
+        for thread in port_threads:
+            thread.wait()
+
+        # Set up/start the dhcp server for the networks if necessary
+        if FLAGS.quantum_use_dhcp:
+            for network, vif_rec in dhcp_vifs:
                 self.enable_dhcp(context, network['quantum_net_id'], network,
                     vif_rec, network['net_tenant_id'])
         return self.get_instance_nw_info(context, instance_id,
@@ -527,16 +540,19 @@ class QuantumManager(manager.FloatingIP, manager.FlatManager):
            in the future.
         """
         project_id = kwargs['project_id']
+        generation = self._info_cache_generation(context, instance_uuid)
         vifs = db.virtual_interface_get_by_instance(context, instance_id)
 
         net_tenant_dict = dict((net_id, tenant_id)
                                for (net_id, tenant_id)
                                in self.ipam.get_project_and_global_net_ids(
                                                           context, project_id))
+        network_refs = self._get_vif_networks(context.elevated(),
+                [vif for vif in vifs if vif.get('network_id') is not None])
         networks = {}
         for vif in vifs:
             if vif.get('network_id') is not None:
-                network = db.network_get(context.elevated(), vif['network_id'])
+                network = network_refs[vif['network_id']]
                 net_tenant_id = net_tenant_dict[network['uuid']]
                 if net_tenant_id is None:
                     net_tenant_id = FLAGS.quantum_default_tenant_id
@@ -552,7 +568,8 @@ class QuantumManager(manager.FloatingIP, manager.FlatManager):
         nw_info = self.build_network_info_model(context, vifs, networks,
                                                 rxtx_factor, host)
         db.instance_info_cache_update(context, instance_uuid,
-                                      {'network_info': nw_info.as_cache()})
+                                      {'network_info': nw_info.as_cache(),
+                                       'network_info_generation': generation})
 
         return nw_info
 
@@ -569,12 +586,18 @@ class QuantumManager(manager.FloatingIP, manager.FlatManager):
         vifs = db.virtual_interface_get_by_instance(admin_context,
                                                     instance_id)
 
-        for vif in vifs:
-            network = db.network_get(admin_context, vif['network_id'])
+        networks = self._get_vif_networks(admin_context, vifs)
 
-            self.deallocate_port(vif['uuid'], network['uuid'], project_id,
-                                 instance_id)
+        # The ports are independent of each other, remove them concurrently
+        green_pool = greenpool.GreenPool()
+        for vif in vifs:
+            green_pool.spawn_n(self.deallocate_port, vif['uuid'],
+                               networks[vif['network_id']]['uuid'],
+                               project_id, instance_id)
+        green_pool.waitall()
 
+        for vif in vifs:
+            network = networks[vif['network_id']]
             ipam_tenant_id = self.deallocate_ip_address(context,
                                 network['uuid'], project_id, vif, instance_id)
 
@@ -584,6 +607,16 @@ class QuantumManager(manager.FloatingIP, manager.FlatManager):
 
             db.virtual_interface_delete(admin_context, vif['id'])
 
+        instance = db.instance_get(context.elevated(read_deleted='yes'),
+                                   instance_id)
+        db.instance_info_cache_invalidate(admin_context, instance['uuid'])
+
+    def _get_vif_networks(self, context, vifs):
+        """Return the networks of the vifs by id, in a single query."""
+        network_ids = list(set(vif['network_id'] for vif in vifs))
+        return dict((network['id'], network) for network in
+                    db.network_get_all_by_ids(context, network_ids))
+
     def deallocate_port(self, interface_id, net_id, q_tenant_id, instance_id):
         port_id = None
         try:
@@ -24,6 +24,7 @@ import urllib
 from nova import exception
 from nova import flags
 from nova import log as logging
+from nova.network.quantum import http_pool
 from nova.openstack.common import cfg
 
 
@@ -37,6 +38,10 @@ melange_opts = [
     cfg.IntOpt('melange_num_retries',
                default=0,
                help='Number retries when contacting melange'),
+    cfg.IntOpt('melange_connection_pool_size',
+               default=10,
+               help='Number of keep-alive connections to melange kept open '
+                    'for reuse, 0 to open a connection for every request'),
     ]
 
 FLAGS = flags.FLAGS
@@ -60,6 +65,8 @@ class MelangeConnection(object):
         self.port = port
         self.use_ssl = use_ssl
         self.version = "v0.1"
+        self.pool = http_pool.HTTPConnectionPool(
+                self._get_connection, FLAGS.melange_connection_pool_size)
 
     def get(self, path, params=None, headers=None):
         return self.do_request("GET", path, params=params, headers=headers,
@@ -86,15 +93,13 @@ class MelangeConnection(object):
         if params:
             url += "?%s" % urllib.urlencode(params)
         for i in xrange(retries + 1):
-            connection = self._get_connection()
             try:
-                connection.request(method, url, body, headers)
-                response = connection.getresponse()
-                response_str = response.read()
+                response, response_str = self.pool.request(method, url, body,
+                                                           headers)
                 if response.status < 400:
                     return response_str
                 raise Exception(_("Server returned error: %s") % response_str)
-            except (socket.error, IOError), e:
+            except (socket.error, IOError, httplib.HTTPException), e:
                 LOG.exception(_('Connection error contacting melange'
                                 ' service, retrying'))
 
@@ -33,6 +33,13 @@ quantum_opts = [
     cfg.StrOpt('quantum_default_tenant_id',
                default="default",
                help='Default tenant id when creating quantum networks'),
+    cfg.IntOpt('quantum_connection_pool_size',
+               default=10,
+               help='Number of keep-alive connections to quantum kept open '
+                    'for reuse, 0 to open a connection for every request'),
+    cfg.IntOpt('quantum_num_retries',
+               default=0,
+               help='Number retries when contacting quantum'),
     ]
 
 FLAGS = flags.FLAGS
@@ -54,8 +61,10 @@ class QuantumClientConnection(object):
         else:
             self.client = quantum_client.Client(FLAGS.quantum_connection_host,
                                             FLAGS.quantum_connection_port,
-                                            format="json",
-                                            logger=LOG)
+                                format="json",
+                                logger=LOG,
+                                pool_size=FLAGS.quantum_connection_pool_size,
+                                retries=FLAGS.quantum_num_retries)
 
     def create_network(self, tenant_id, network_name, **kwargs):
         """Create network using specified name, return Quantum
@@ -39,6 +39,7 @@ import datetime
 import hashlib
 import os
 import os.path
+import tempfile
 import urllib
 
 import routes
@@ -57,6 +58,14 @@ buckets_path_opt = cfg.StrOpt('buckets_path', default='$state_path/buckets',
 FLAGS = flags.FLAGS
 FLAGS.register_opt(buckets_path_opt)
 
+# Objects are read and written in pieces of this size so a multi-GB
+# bundle never has to fit in memory.
+CHUNK_SIZE = 65536
+
+# Uploads land in a temporary file next to their final path and are
+# renamed into place once complete; listings skip these files.
+UPLOAD_PREFIX = '.s3upload-'
+
 
 def get_wsgi_server():
     return wsgi.Server("S3 Objectstore",
@@ -88,8 +97,56 @@ class S3Application(wsgi.Router):
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
         self.bucket_depth = bucket_depth
+        self._key_indexes = {}
         super(S3Application, self).__init__(mapper)
 
+    def object_names(self, bucket_name, path):
+        """Return the sorted object names of a bucket.
+
+        The directory tree is only walked the first time a bucket is
+        listed, after that the index is kept current by the object
+        handlers through :meth:`index_add` and :meth:`index_remove`.
+
+        """
+        names = self._key_indexes.get(bucket_name)
+        if names is None:
+            names = self._scan_bucket(path)
+            self._key_indexes[bucket_name] = names
+        return names
+
+    def index_add(self, bucket_name, object_name):
+        names = self._key_indexes.get(bucket_name)
+        if names is None:
+            return
+        pos = bisect.bisect_left(names, object_name)
+        if pos == len(names) or names[pos] != object_name:
+            names.insert(pos, object_name)
+
+    def index_remove(self, bucket_name, object_name):
+        names = self._key_indexes.get(bucket_name)
+        if names is None:
+            return
+        pos = bisect.bisect_left(names, object_name)
+        if pos < len(names) and names[pos] == object_name:
+            del names[pos]
+
+    def index_drop(self, bucket_name):
+        self._key_indexes.pop(bucket_name, None)
+
+    def _scan_bucket(self, path):
+        object_names = []
+        for root, dirs, files in os.walk(path):
+            for file_name in files:
+                if file_name.startswith(UPLOAD_PREFIX):
+                    continue
+                object_names.append(os.path.join(root, file_name))
+        skip = len(path) + 1
+        for i in range(self.bucket_depth):
+            skip += 2 * (i + 1) + 1
+        object_names = [n[skip:] for n in object_names]
+        object_names.sort()
+        return object_names
+
 
 class BaseRequestHandler(object):
     """Base class emulating Tornado's web framework pattern in WSGI.
@@ -227,15 +284,7 @@ class BucketHandler(BaseRequestHandler):
             not os.path.isdir(path)):
             self.set_status(404)
             return
-        object_names = []
-        for root, dirs, files in os.walk(path):
-            for file_name in files:
-                object_names.append(os.path.join(root, file_name))
-        skip = len(path) + 1
-        for i in range(self.application.bucket_depth):
-            skip += 2 * (i + 1) + 1
-        object_names = [n[skip:] for n in object_names]
-        object_names.sort()
+        object_names = self.application.object_names(bucket_name, path)
         contents = []
 
         start_pos = 0
@@ -279,6 +328,7 @@ class BucketHandler(BaseRequestHandler):
             self.set_status(403)
             return
         os.makedirs(path)
+        self.application.index_drop(bucket_name)
         self.finish()
 
     def delete(self, bucket_name):
@@ -292,6 +342,7 @@ class BucketHandler(BaseRequestHandler):
             self.set_status(403)
             return
         os.rmdir(path)
+        self.application.index_drop(bucket_name)
         self.set_status(204)
         self.finish()
 
@@ -308,11 +359,34 @@ class ObjectHandler(BaseRequestHandler):
         self.set_header("Content-Type", "application/unknown")
         self.set_header("Last-Modified", datetime.datetime.utcfromtimestamp(
             info.st_mtime))
-        object_file = open(path, "r")
-        try:
-            self.finish(object_file.read())
-        finally:
-            object_file.close()
+        self.set_header("Accept-Ranges", "bytes")
+
+        size = info.st_size
+        start, end = 0, size - 1
+        if 'Range' in self.request.headers:
+            byte_range = _parse_range(self.request.headers['Range'], size)
+            if byte_range is None:
+                self.set_status(416)
+                self.set_header("Content-Range", "bytes */%d" % size)
+                return
+            if byte_range is not False:
+                start, end = byte_range
+                self.set_status(206)
+                self.set_header("Content-Range",
+                                "bytes %d-%d/%d" % (start, end, size))
+
+        object_file = open(path, "rb")
+        length = end - start + 1
+        file_wrapper = self.request.environ.get('wsgi.file_wrapper')
+        if file_wrapper and length == size:
+            # Let a server that supports it hand the file straight to
+            # the socket (e.g. with sendfile).
+            self.response.app_iter = file_wrapper(object_file, CHUNK_SIZE)
+        else:
+            object_file.seek(start)
+            self.response.app_iter = FileIterator(object_file, length)
+        # Setting app_iter clears the length, so it has to come last.
+        self.response.content_length = length
 
     def put(self, bucket, object_name):
         object_name = urllib.unquote(object_name)
@@ -329,11 +403,19 @@ class ObjectHandler(BaseRequestHandler):
         directory = os.path.dirname(path)
         if not os.path.exists(directory):
             os.makedirs(directory)
-        object_file = open(path, "w")
-        object_file.write(self.request.body)
-        object_file.close()
-        self.set_header('ETag',
-                        '"%s"' % hashlib.md5(self.request.body).hexdigest())
+        md5 = hashlib.md5()
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=UPLOAD_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as object_file:
+                for chunk in _read_body(self.request):
+                    md5.update(chunk)
+                    object_file.write(chunk)
+            os.rename(tmp_path, path)
+        except Exception:
+            with utils.save_and_reraise_exception():
+                utils.delete_if_exists(tmp_path)
+        self.application.index_add(bucket, object_name)
+        self.set_header('ETag', '"%s"' % md5.hexdigest())
         self.finish()
 
     def delete(self, bucket, object_name):
@@ -344,5 +426,77 @@ class ObjectHandler(BaseRequestHandler):
             self.set_status(404)
             return
         os.unlink(path)
+        self.application.index_remove(bucket, object_name)
         self.set_status(204)
         self.finish()
+
+
+class FileIterator(object):
+    """Yields ``length`` bytes of an open file in chunks, then closes it."""
+
+    def __init__(self, object_file, length):
+        self.object_file = object_file
+        self.length = length
+
+    def __iter__(self):
+        remaining = self.length
+        try:
+            while remaining > 0:
+                chunk = self.object_file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self.object_file.close()
+
+
+def _parse_range(header, size):
+    """Parse a ``Range`` header against an object of ``size`` bytes.
+
+    Returns an inclusive ``(start, end)`` tuple, None if the range cannot
+    be satisfied, or False if the header should be ignored (it is
+    malformed or asks for several ranges) and the whole object served.
+
+    """
+    units, _sep, spec = header.partition('=')
+    if units.strip() != 'bytes' or ',' in spec:
+        return False
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return False
+    try:
+        if not first:
+            # bytes=-N asks for the last N bytes
+            suffix = int(last)
+            if suffix <= 0:
+                return None
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return False
+    if start >= size:
+        return None
+    if start > end:
+        return False
+    return start, min(end, size - 1)
+
+
+def _read_body(request):
+    """Yield the request body in chunks without buffering all of it."""
+    body_file = request.environ['wsgi.input']
+    remaining = request.content_length
+    while remaining is None or remaining > 0:
+        size = CHUNK_SIZE
+        if remaining is not None:
+            size = min(size, remaining)
+        chunk = body_file.read(size)
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
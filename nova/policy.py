@@ -17,7 +17,11 @@
 
 """Policy Engine For Nova"""
 
+import time
+import weakref
+
 from nova.common import policy
+from nova import context as nova_context
 from nova import exception
 from nova import flags
 from nova.openstack.common import cfg
@@ -31,6 +35,10 @@ policy_opts = [
     cfg.StrOpt('policy_default_rule',
                default='default',
                help=_('Rule checked when requested rule is not found')),
+    cfg.IntOpt('policy_reload_interval',
+               default=5,
+               help=_('Seconds between checks of the policy file for '
+                      'changes (0 = check on every request)')),
     ]
 
 FLAGS = flags.FLAGS
@@ -38,23 +46,36 @@ FLAGS.register_opts(policy_opts)
 
 _POLICY_PATH = None
 _POLICY_CACHE = {}
+_POLICY_NEXT_CHECK = 0
+
+# Decisions already taken for a request context, see enforce()
+_DECISIONS = weakref.WeakKeyDictionary()
+_MAX_DECISIONS = 1000
 
 
 def reset():
     global _POLICY_PATH
     global _POLICY_CACHE
+    global _POLICY_NEXT_CHECK
     _POLICY_PATH = None
     _POLICY_CACHE = {}
+    _POLICY_NEXT_CHECK = 0
+    _DECISIONS.clear()
     policy.reset()
 
 
 def init():
     global _POLICY_PATH
     global _POLICY_CACHE
+    global _POLICY_NEXT_CHECK
+    now = time.time()
+    if _POLICY_CACHE and now < _POLICY_NEXT_CHECK:
+        return
     if not _POLICY_PATH:
         _POLICY_PATH = utils.find_config(FLAGS.policy_file)
     utils.read_cached_file(_POLICY_PATH, _POLICY_CACHE,
                            reload_func=_set_brain)
+    _POLICY_NEXT_CHECK = now + FLAGS.policy_reload_interval
 
 
 def _set_brain(data):
@@ -81,10 +102,71 @@ def enforce(context, action, target):
     """
     init()
 
-    match_list = ('rule:%s' % action,)
-    credentials = context.to_dict()
+    memo = _memo(context)
+    if memo is None:
+        allowed = _check(action, target, context.to_dict())
+    else:
+        credentials, decisions = memo
+        key = _target_key(action, target)
+        if key is None:
+            allowed = _check(action, target, credentials)
+        else:
+            allowed = decisions.get(key)
+            if allowed is None:
+                allowed = _check(action, target, credentials)
+                decisions[key] = allowed
+
+    if not allowed:
+        raise exception.PolicyNotAuthorized(action=action)
 
+
+def _check(action, target, credentials):
+    match_list = ('rule:%s' % action,)
     try:
         policy.enforce(match_list, target, credentials)
     except policy.NotAuthorized:
-        raise exception.PolicyNotAuthorized(action=action)
+        return False
+    return True
+
+
+def _memo(context):
+    """Return the credentials and decisions cached for a request context.
+
+    Returns None if nothing can be cached for this context.  The cache is
+    dropped when the rules change or when any field the credentials are
+    built from changes, since some of them, like the roles, are modified
+    in place during a request.
+    """
+    if not isinstance(context, nova_context.RequestContext):
+        return None
+    fingerprint = (context.user_id,
+                   context.project_id,
+                   context.is_admin,
+                   context.read_deleted,
+                   tuple(context.roles),
+                   context.remote_address,
+                   context.timestamp,
+                   context.request_id,
+                   context.auth_token,
+                   context.quota_class)
+    memo = _DECISIONS.get(context)
+    if (memo is None or memo[0] is not policy._BRAIN or
+        memo[1] != fingerprint or len(memo[3]) >= _MAX_DECISIONS):
+        memo = (policy._BRAIN, fingerprint, context.to_dict(), {})
+        _DECISIONS[context] = memo
+    return memo[2], memo[3]
+
+
+def _target_key(action, target):
+    """Key of a decision about target, or None if it can't be cached.
+
+    Equal targets iterating in a different order only cost a cache miss.
+    """
+    if not isinstance(target, dict):
+        return None
+    key = (action, tuple(target.iteritems()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
@@ -0,0 +1,116 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Client side of the rootwrap daemon, used by utils.execute()."""
+
+import binascii
+import json
+import os
+import shlex
+
+import eventlet
+from eventlet.green import socket
+from eventlet.green import subprocess
+from eventlet import semaphore
+
+from nova import exception
+from nova import log as logging
+from nova.rootwrap import daemon
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Client(object):
+    """Runs commands through a "nova-rootwrap --daemon" process.
+
+    The daemon is started on first use and again whenever it died or the
+    service forked since, so every process talks to its own daemon.  Each
+    command gets its own connection, so commands run concurrently.
+    """
+
+    def __init__(self, daemon_cmd):
+        self.daemon_cmd = daemon_cmd
+        self._process = None
+        self._pid = None
+        self._address = None
+        self._authkey = None
+        self._lock = semaphore.Semaphore()
+
+    def _ensure_daemon(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._process.poll() is None:
+                return
+            LOG.debug(_('Starting rootwrap daemon: %s'), self.daemon_cmd)
+            process = subprocess.Popen(shlex.split(self.daemon_cmd),
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       close_fds=True)
+            try:
+                address, authkey = process.stdout.readline().split()
+                self._authkey = binascii.unhexlify(authkey)
+            except (TypeError, ValueError):
+                if process.poll() is None:
+                    process.kill()
+                raise exception.Error(_('Unable to start the rootwrap '
+                                        'daemon with %s') % self.daemon_cmd)
+            self._process = process
+            self._address = address
+            self._pid = os.getpid()
+
+    @staticmethod
+    def _send_input(sock, process_input):
+        try:
+            data = process_input or ''
+            for offset in xrange(0, len(data), daemon.CHUNK_SIZE):
+                daemon.send_frame(sock, 'i',
+                                  data[offset:offset + daemon.CHUNK_SIZE])
+            daemon.send_frame(sock, 'i', '')
+        except socket.error:
+            # The daemon stopped reading, e.g. for an unauthorized
+            # command, the reader gets the reason.
+            pass
+
+    def execute(self, cmd, process_input=None):
+        """Run cmd as root and return (exit_code, stdout, stderr)."""
+        self._ensure_daemon()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._address)
+            _kind, nonce = daemon.recv_frame(sock)
+            daemon.send_frame(sock, 'a', daemon.sign(self._authkey, nonce))
+            daemon.send_frame(sock, 'c', json.dumps(cmd))
+            writer = eventlet.spawn(self._send_input, sock, process_input)
+            stdout = []
+            stderr = []
+            while True:
+                kind, data = daemon.recv_frame(sock)
+                if kind == 'o':
+                    stdout.append(data)
+                elif kind == 'e':
+                    stderr.append(data)
+                elif kind == 'r':
+                    break
+            writer.wait()
+            return int(data), ''.join(stdout), ''.join(stderr)
+        except (socket.error, daemon.ProtocolError), e:
+            raise exception.ProcessExecutionError(
+                    cmd=' '.join(cmd),
+                    description=_('Lost connection to the rootwrap '
+                                  'daemon: %s') % e)
+        finally:
+            sock.close()
@@ -28,6 +28,10 @@ filterlist = [
     # nova/virt/xenapi/vm_utils.py: "tune2fs", "-j", partition_path
     filters.CommandFilter("/sbin/tune2fs", "root"),
 
+    # nova/virt/disk/extfs.py: 'debugfs', '-R', 'stat %s' % path, device
+    # nova/virt/disk/extfs.py: 'debugfs', '-w', '-f', '-', device
+    filters.CommandFilter("/sbin/debugfs", "root"),
+
     # nova/virt/disk/mount.py: 'mount', mapped_device, mount_dir
     # nova/virt/xenapi/vm_utils.py: 'mount', '-t', 'ext2,ext3,ext4,reiserfs'..
     filters.CommandFilter("/bin/mount", "root"),
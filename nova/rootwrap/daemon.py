@@ -0,0 +1,216 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long running root helper
+
+   Started once per service with "nova-rootwrap --daemon" (through sudo),
+   it loads the same filters as a one-shot nova-rootwrap call and then
+   serves commands over a unix socket until its stdin is closed, which
+   happens when the service that started it goes away.
+
+   The socket lives in a fresh directory only readable by the calling
+   user, and every connection must also answer an HMAC challenge with a
+   key that is only ever written to the daemon's stdout.
+
+   Messages are frames made of a one letter type, a 4 byte big endian
+   length and the payload:
+
+   n  nonce sent by the daemon when a client connects
+   a  HMAC-SHA256 of the nonce, hex encoded
+   c  JSON list with the command line to run
+   i  chunk of standard input, an empty chunk closes stdin
+   o  chunk of standard output
+   e  chunk of standard error
+   r  exit code of the command, sent last
+
+   Only the standard library may be used here: this runs as root on
+   nodes where the rest of nova might not be importable.
+"""
+
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import SocketServer
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+from nova.rootwrap import wrapper
+
+
+RC_UNAUTHORIZED = 99
+CHUNK_SIZE = 65536
+SOCKET_NAME = 'rootwrap.sock'
+
+_HEADER = struct.Struct('>cI')
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def send_frame(sock, kind, payload=''):
+    sock.sendall(_HEADER.pack(kind, len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        data = sock.recv(size)
+        if not data:
+            raise ProtocolError('Connection closed')
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+
+def recv_frame(sock):
+    kind, size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return kind, _recv_exactly(sock, size)
+
+
+def sign(authkey, nonce):
+    return hmac.new(authkey, nonce, hashlib.sha256).hexdigest()
+
+
+def _equal(a, b):
+    """Compare two strings in time independent of their contents."""
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+class RootwrapHandler(SocketServer.BaseRequestHandler):
+    """Runs one command for one authenticated connection."""
+
+    def handle(self):
+        sock = self.request
+        try:
+            nonce = os.urandom(16)
+            send_frame(sock, 'n', nonce)
+            kind, digest = recv_frame(sock)
+            if kind != 'a' or not _equal(digest,
+                                         sign(self.server.authkey, nonce)):
+                return
+            kind, payload = recv_frame(sock)
+            if kind != 'c':
+                return
+            self._run(sock, [str(arg) for arg in json.loads(payload)])
+        except (ProtocolError, ValueError, EnvironmentError):
+            pass
+
+    def _run(self, sock, userargs):
+        filtermatch = wrapper.match_filter(self.server.filters, userargs)
+        if not filtermatch:
+            send_frame(sock, 'o',
+                       'Unauthorized command: %s\n' % ' '.join(userargs))
+            send_frame(sock, 'r', str(RC_UNAUTHORIZED))
+            return
+
+        obj = subprocess.Popen(filtermatch.get_command(userargs),
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               close_fds=True,
+                               env=filtermatch.get_environment(userargs))
+        lock = threading.Lock()
+
+        def pump(pipe, kind):
+            try:
+                while True:
+                    data = os.read(pipe.fileno(), CHUNK_SIZE)
+                    if not data:
+                        break
+                    lock.acquire()
+                    try:
+                        send_frame(sock, kind, data)
+                    finally:
+                        lock.release()
+            except EnvironmentError:
+                # Nobody is reading the output anymore.
+                if obj.poll() is None:
+                    obj.kill()
+
+        pumps = [threading.Thread(target=pump, args=(obj.stdout, 'o')),
+                 threading.Thread(target=pump, args=(obj.stderr, 'e'))]
+        for thread in pumps:
+            thread.start()
+
+        try:
+            try:
+                while True:
+                    kind, data = recv_frame(sock)
+                    if kind != 'i' or not data:
+                        break
+                    obj.stdin.write(data)
+                    obj.stdin.flush()
+            finally:
+                try:
+                    obj.stdin.close()
+                except EnvironmentError:
+                    pass
+        except (ProtocolError, EnvironmentError):
+            if obj.poll() is None:
+                obj.kill()
+
+        for thread in pumps:
+            thread.join()
+        send_frame(sock, 'r', str(obj.wait()))
+
+
+class RootwrapServer(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, authkey, filters):
+        SocketServer.UnixStreamServer.__init__(self, path, RootwrapHandler)
+        self.authkey = authkey
+        self.filters = filters
+
+
+def daemon_main(filters):
+    """Serve commands until stdin is closed by the parent service."""
+    sockdir = tempfile.mkdtemp(prefix='nova-rootwrap-')
+    try:
+        path = os.path.join(sockdir, SOCKET_NAME)
+        authkey = os.urandom(32)
+        server = RootwrapServer(path, authkey, filters)
+        os.chmod(path, 0600)
+        # Let the unprivileged user that ran sudo reach the socket.
+        if 'SUDO_UID' in os.environ:
+            for owned in (sockdir, path):
+                os.chown(owned, int(os.environ['SUDO_UID']),
+                         int(os.environ.get('SUDO_GID', -1)))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        sys.stdout.write('%s %s\n' % (path, binascii.hexlify(authkey)))
+        sys.stdout.flush()
+        while sys.stdin.read(CHUNK_SIZE):
+            pass
+        server.shutdown()
+    finally:
+        shutil.rmtree(sockdir, ignore_errors=True)
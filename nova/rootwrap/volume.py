@@ -36,6 +36,15 @@ filterlist = [
     # nova/volume/driver.py: 'lvremove', '-f', "%s/%s" % ...
     filters.CommandFilter("/sbin/lvremove", "root"),
 
+    # nova/volume/wipe.py: 'lvrename', FLAGS.volume_group, lv_name, ...
+    filters.CommandFilter("/sbin/lvrename", "root"),
+
+    # nova/volume/wipe.py: 'lvs', '--noheadings', '-o', 'lv_name', ...
+    filters.CommandFilter("/sbin/lvs", "root"),
+
+    # nova/volume/wipe.py: 'blkdiscard', path
+    filters.CommandFilter("/sbin/blkdiscard", "root"),
+
     # nova/volume/driver.py: 'lvdisplay', '--noheading', '-C', '-o', 'Attr',..
     filters.CommandFilter("/sbin/lvdisplay", "root"),
 
@@ -31,6 +31,7 @@ from nova import log as logging
 from nova.openstack.common import cfg
 from nova import rpc
 from nova.rpc import common as rpc_common
+from nova.scheduler import liveness
 from nova import utils
 
 
@@ -134,6 +135,7 @@ class Scheduler(object):
         self.host_manager = utils.import_object(
                 FLAGS.scheduler_host_manager)
         self.compute_api = compute_api.API()
+        self.liveness = liveness.ServiceLiveness()
 
     def get_host_list(self):
         """Get a list of hosts from the HostManager."""
@@ -151,11 +153,7 @@ class Scheduler(object):
 
     def hosts_up(self, context, topic):
         """Return the list of hosts that have a running service for topic."""
-
-        services = db.service_get_all_by_topic(context, topic)
-        return [service['host']
-                for service in services
-                if utils.service_is_up(service)]
+        return self.liveness.hosts_up(context, topic)
 
     def create_instance_db_entry(self, context, request_spec):
         """Create instance DB entry based on request_spec"""
@@ -257,8 +255,7 @@ class Scheduler(object):
         # Checing volume node is running when any volumes are mounted
         # to the instance.
         if len(instance_ref['volumes']) != 0:
-            services = db.service_get_all_by_topic(context, 'volume')
-            if len(services) < 1 or not utils.service_is_up(services[0]):
+            if not self.liveness.hosts_up(context, 'volume'):
                 raise exception.VolumeServiceUnavailable()
 
         # Checking src host exists and compute node
@@ -266,7 +263,7 @@ class Scheduler(object):
         services = db.service_get_all_compute_by_host(context, src)
 
         # Checking src host is alive.
-        if not utils.service_is_up(services[0]):
+        if not self.liveness.service_is_up(context, services[0]):
             raise exception.ComputeServiceUnavailable(host=src)
 
     def _live_migration_dest_check(self, context, instance_ref, dest,
@@ -286,7 +283,7 @@ class Scheduler(object):
         dservice_ref = dservice_refs[0]
 
         # Checking dest host is alive.
-        if not utils.service_is_up(dservice_ref):
+        if not self.liveness.service_is_up(context, dservice_ref):
             raise exception.ComputeServiceUnavailable(host=dest)
 
         # Checking whether The host where instance is running
@@ -167,7 +167,8 @@ class FilterScheduler(driver.Scheduler):
         filter_properties.update({'context': context,
                                   'request_spec': request_spec,
                                   'config_options': config_options,
-                                  'instance_type': instance_type})
+                                  'instance_type': instance_type,
+                                  'liveness': self.liveness})
 
         self.populate_filter_properties(request_spec,
                                         filter_properties)
@@ -46,7 +46,14 @@ class ComputeFilter(filters.BaseHostFilter):
         capabilities = host_state.capabilities
         service = host_state.service
 
-        if not utils.service_is_up(service) or service['disabled']:
+        # The scheduler passes its cached view of the service heartbeats
+        liveness = filter_properties.get('liveness')
+        if liveness is not None:
+            is_up = liveness.service_is_up(filter_properties['context'],
+                                           service)
+        else:
+            is_up = utils.service_is_up(service)
+        if not is_up or service['disabled']:
             return False
         if not capabilities.get("enabled", True):
             return False
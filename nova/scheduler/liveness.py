@@ -0,0 +1,89 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cached view of which services are up, for use by the schedulers.
+
+Rather than scanning the services table on every scheduling request, the
+heartbeat times of all enabled services are loaded with a single query and
+kept for ``service_liveness_cache_interval`` seconds.  Whether a service is
+up is still decided against the current time, so a service that stops
+reporting is noticed as soon as its last heartbeat becomes too old.
+"""
+
+from nova import db
+from nova import flags
+from nova.openstack.common import cfg
+from nova import utils
+
+
+liveness_opts = [
+    cfg.IntOpt('service_liveness_cache_interval',
+               default=10,
+               help='Seconds the scheduler reuses the service heartbeat '
+                    'times loaded from the database (0 = always reload)'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(liveness_opts)
+
+
+class ServiceLiveness(object):
+    """Periodically refreshed map of service heartbeats by topic."""
+
+    def __init__(self):
+        self._heartbeats = {}
+        self._last_refresh = None
+
+    def _needs_refresh(self):
+        interval = FLAGS.service_liveness_cache_interval
+        if not interval or self._last_refresh is None:
+            return True
+        return utils.is_older_than(self._last_refresh, interval)
+
+    def refresh(self, context):
+        """Reload the heartbeat times of all enabled services."""
+        heartbeats = {}
+        for service in db.service_get_all(context.elevated(),
+                                          disabled=False):
+            heartbeats.setdefault(service['topic'], {})[service['host']] = {
+                    'host': service['host'],
+                    'updated_at': service['updated_at'],
+                    'created_at': service['created_at']}
+        self._heartbeats = heartbeats
+        self._last_refresh = utils.utcnow()
+
+    def _services(self, context, topic):
+        if self._needs_refresh():
+            self.refresh(context)
+        return self._heartbeats.get(topic, {})
+
+    def hosts_up(self, context, topic):
+        """Return the hosts with a running service for topic."""
+        services = self._services(context, topic)
+        return [host for host in sorted(services)
+                if utils.service_is_up(services[host])]
+
+    def service_is_up(self, context, service):
+        """Check whether a service record is up, by its cached heartbeat.
+
+        Services the map doesn't know, disabled ones or those created
+        since the last refresh, are judged by the record itself.
+        """
+        cached = self._services(context, service['topic']).get(
+                service['host'])
+        return utils.service_is_up(cached or service)
@@ -64,7 +64,7 @@ class SimpleScheduler(chance.ChanceScheduler):
 
         if host and context.is_admin:
             service = db.service_get_by_args(elevated, host, 'nova-compute')
-            if not utils.service_is_up(service):
+            if not self.liveness.service_is_up(elevated, service):
                 raise exception.WillNotSchedule(host=host)
             return host
 
@@ -86,7 +86,8 @@ class SimpleScheduler(chance.ChanceScheduler):
                 instance_cores + instance_opts['vcpus'] > FLAGS.max_cores):
                 msg = _("Not enough allocatable CPU cores remaining")
                 raise exception.NoValidHost(reason=msg)
-            if utils.service_is_up(service) and not service['disabled']:
+            if (self.liveness.service_is_up(elevated, service) and
+                    not service['disabled']):
                 return service['host']
         msg = _("Is the appropriate service running?")
         raise exception.NoValidHost(reason=msg)
@@ -121,7 +122,7 @@ class SimpleScheduler(chance.ChanceScheduler):
             zone, _x, host = availability_zone.partition(':')
         if host and context.is_admin:
             service = db.service_get_by_args(elevated, host, 'nova-volume')
-            if not utils.service_is_up(service):
+            if not self.liveness.service_is_up(elevated, service):
                 raise exception.WillNotSchedule(host=host)
             driver.cast_to_volume_host(context, host, 'create_volume',
                     volume_id=volume_id, **_kwargs)
@@ -136,7 +137,8 @@ class SimpleScheduler(chance.ChanceScheduler):
             if volume_gigabytes + volume_ref['size'] > FLAGS.max_gigabytes:
                 msg = _("Not enough allocatable volume gigabytes remaining")
                 raise exception.NoValidHost(reason=msg)
-            if utils.service_is_up(service) and not service['disabled']:
+            if (self.liveness.service_is_up(elevated, service) and
+                    not service['disabled']):
                 driver.cast_to_volume_host(context, service['host'],
                         'create_volume', volume_id=volume_id, **_kwargs)
                 return None
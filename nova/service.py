@@ -19,12 +19,17 @@
 
 """Generic Node base class for all workers that run on hosts."""
 
+import errno
 import inspect
 import os
 import random
 import signal
+import time
 
 import eventlet
+import eventlet.greenio
+import eventlet.hubs
+import eventlet.patcher
 import greenlet
 
 from nova import context
@@ -41,6 +46,10 @@ from nova import wsgi
 
 LOG = logging.getLogger(__name__)
 
+# The green waitpid of a monkey patched os polls and is never interrupted
+# by signals, the process launcher must wake up when it gets one.
+_waitpid = eventlet.patcher.original('os').waitpid
+
 service_opts = [
     cfg.IntOpt('report_interval',
                default=10,
@@ -59,12 +68,20 @@ service_opts = [
     cfg.IntOpt('ec2_listen_port',
                default=8773,
                help='port for ec2 api to listen'),
+    cfg.IntOpt('ec2_workers',
+               default=None,
+               help='Number of worker processes for the EC2 API '
+                    '(unset runs it in the main process)'),
     cfg.StrOpt('osapi_compute_listen',
                default="0.0.0.0",
                help='IP address for OpenStack API to listen'),
     cfg.IntOpt('osapi_compute_listen_port',
                default=8774,
                help='list port for osapi compute'),
+    cfg.IntOpt('osapi_compute_workers',
+               default=None,
+               help='Number of worker processes for the OpenStack API '
+                    '(unset runs it in the main process)'),
     cfg.StrOpt('metadata_manager',
                default='nova.api.manager.MetadataManager',
                help='OpenStack metadata service manager'),
@@ -74,12 +91,20 @@ service_opts = [
     cfg.IntOpt('metadata_listen_port',
                default=8775,
                help='port for metadata api to listen'),
+    cfg.IntOpt('metadata_workers',
+               default=None,
+               help='Number of worker processes for the metadata API '
+                    '(unset runs it in the main process)'),
     cfg.StrOpt('osapi_volume_listen',
                default="0.0.0.0",
                help='IP address for OpenStack Volume API to listen'),
     cfg.IntOpt('osapi_volume_listen_port',
                default=8776,
                help='port for os volume api to listen'),
+    cfg.IntOpt('osapi_volume_workers',
+               default=None,
+               help='Number of worker processes for the OpenStack Volume API '
+                    '(unset runs it in the main process)'),
     ]
 
 FLAGS = flags.FLAGS
@@ -149,6 +174,189 @@ class Launcher(object):
                 pass
 
 
+class ServerWrapper(object):
+    """A server run by a :class:`ProcessLauncher` and its worker pids."""
+
+    def __init__(self, server, workers):
+        self.server = server
+        self.workers = workers
+        self.children = set()
+        self.forktimes = []
+
+
+class ProcessLauncher(object):
+    """Run WSGI servers in pre-forked worker processes.
+
+    The parent binds every server's socket, forks the requested number of
+    workers for each and then only supervises them.  A worker that dies is
+    replaced.  SIGHUP asks every worker to finish its in-flight requests
+    and exit, and each is replaced as it does; the parent keeps the
+    sockets open meanwhile so no connection is refused.  SIGTERM or SIGINT
+    shut everything down.  Workers are forked before anything opens a
+    database or AMQP connection, so each one builds its own connection
+    pools.
+
+    """
+
+    def __init__(self):
+        self.children = {}
+        self.sigcaught = None
+        self.running = True
+        rfd, self.writepipe = os.pipe()
+        self.readpipe = eventlet.greenio.GreenPipe(rfd, 'r')
+
+    def _handle_signal(self, signo, frame):
+        self.sigcaught = signo
+        if signo != signal.SIGHUP:
+            self.running = False
+
+    def _pipe_watcher(self, server):
+        # The write end is only held by the parent, so this returns
+        # when the parent goes away, whichever way it died.
+        self.readpipe.read()
+        LOG.info(_('Parent process has died unexpectedly, exiting'))
+        server.stop()
+
+    def _child_process(self, server):
+        def _sigterm(*args):
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            LOG.info(_('Worker %d stopping'), os.getpid())
+            # The handler may interrupt the hub itself, so leave the
+            # actual stopping to a fresh greenthread.
+            eventlet.spawn_n(server.stop)
+
+        signal.signal(signal.SIGTERM, _sigterm)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        # The parent's hub (and its file descriptors) must not be shared.
+        eventlet.hubs.use_hub()
+
+        os.close(self.writepipe)
+        eventlet.spawn_n(self._pipe_watcher, server)
+
+        # start() blocks until the server is stopped and wait() then
+        # lets the requests it was handling run to completion.
+        Launcher.run_server(server)
+
+    def _start_child(self, wrap):
+        if len(wrap.forktimes) > wrap.workers:
+            # Don't respawn more than one worker a second on average
+            # when they keep dying right after starting.
+            if time.time() - wrap.forktimes[0] < wrap.workers:
+                LOG.info(_('Forking too fast, sleeping'))
+                time.sleep(1)
+            wrap.forktimes.pop(0)
+        wrap.forktimes.append(time.time())
+
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self._child_process(wrap.server)
+            except SystemExit as exc:
+                status = exc.code
+                if status is None:
+                    status = 0
+                elif not isinstance(status, int):
+                    # sys.exit() with a message, which is an error
+                    LOG.error(status)
+                    status = 1
+            except BaseException:
+                LOG.exception(_('Unhandled exception in worker'))
+                status = 2
+            os._exit(status)
+
+        LOG.info(_('Started worker %d'), pid)
+        wrap.children.add(pid)
+        self.children[pid] = wrap
+        return pid
+
+    def launch_server(self, server, workers=1):
+        """Bind ``server`` and start ``workers`` processes serving it.
+
+        :param server: A :class:`WSGIService` (anything with listen, start,
+                       stop and wait).
+        :param workers: Number of worker processes to keep running.
+        :returns: None
+
+        """
+        server.listen()
+        wrap = ServerWrapper(server, workers)
+        while self.running and len(wrap.children) < wrap.workers:
+            self._start_child(wrap)
+
+    def _wait_child(self):
+        # Signals interrupt the wait, so the caller gets to handle them.
+        try:
+            pid, status = _waitpid(0, 0)
+        except OSError as exc:
+            if exc.errno not in (errno.EINTR, errno.ECHILD):
+                raise
+            return None
+        if not pid:
+            return None
+
+        if os.WIFSIGNALED(status):
+            sig = os.WTERMSIG(status)
+            LOG.info(_('Worker %(pid)d killed by signal %(sig)d') % locals())
+        else:
+            code = os.WEXITSTATUS(status)
+            LOG.info(_('Worker %(pid)d exited with status %(code)d')
+                     % locals())
+
+        if pid not in self.children:
+            LOG.warning(_('pid %d not in child list'), pid)
+            return None
+
+        wrap = self.children.pop(pid)
+        wrap.children.discard(pid)
+        return wrap
+
+    def _restart_children(self):
+        LOG.info(_('SIGHUP received, restarting workers'))
+        for pid in self.children:
+            self._kill(pid, signal.SIGTERM)
+
+    @staticmethod
+    def _kill(pid, signo):
+        try:
+            os.kill(pid, signo)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+
+    def _respawn_children(self):
+        while self.running:
+            if self.sigcaught == signal.SIGHUP:
+                self.sigcaught = None
+                self._restart_children()
+
+            wrap = self._wait_child()
+            if not wrap:
+                continue
+
+            while self.running and len(wrap.children) < wrap.workers:
+                self._start_child(wrap)
+
+    def wait(self):
+        """Supervise the workers until SIGTERM or SIGINT is received."""
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGHUP, self._handle_signal)
+
+        self._respawn_children()
+        LOG.info(_('Caught signal %d, stopping workers'), self.sigcaught)
+
+        for pid in self.children:
+            self._kill(pid, signal.SIGTERM)
+
+        if self.children:
+            LOG.info(_('Waiting on %d workers to exit'), len(self.children))
+            while self.children:
+                self._wait_child()
+
+
 class Service(object):
     """Service object for binaries running on hosts.
 
@@ -312,22 +520,14 @@ class Service(object):
         """Update the state of this service in the datastore."""
         ctxt = context.get_admin_context()
         zone = FLAGS.node_availability_zone
-        state_catalog = {}
         try:
             try:
-                service_ref = db.service_get(ctxt, self.service_id)
+                db.service_heartbeat(ctxt, self.service_id, zone)
             except exception.NotFound:
                 LOG.debug(_('The service database object disappeared, '
                             'Recreating it.'))
                 self._create_service_ref(ctxt)
-                service_ref = db.service_get(ctxt, self.service_id)
-
-            state_catalog['report_count'] = service_ref['report_count'] + 1
-            if zone != service_ref['availability_zone']:
-                state_catalog['availability_zone'] = zone
-
-            db.service_update(ctxt,
-                             self.service_id, state_catalog)
+                db.service_heartbeat(ctxt, self.service_id, zone)
 
             # TODO(termie): make this pattern be more elegant.
             if getattr(self, 'model_disconnected', False):
@@ -358,6 +558,7 @@ class WSGIService(object):
         self.app = self.loader.load_app(name)
         self.host = getattr(FLAGS, '%s_listen' % name, "0.0.0.0")
         self.port = getattr(FLAGS, '%s_listen_port' % name, 0)
+        self.workers = getattr(FLAGS, '%s_workers' % name, None)
         self.server = wsgi.Server(name,
                                   self.app,
                                   host=self.host,
@@ -384,6 +585,15 @@ class WSGIService(object):
         manager_class = utils.import_class(manager_class_name)
         return manager_class()
 
+    def listen(self):
+        """Bind the listening socket so workers can be forked to share it.
+
+        :returns: None
+
+        """
+        self.server.listen()
+        self.port = self.server.port
+
     def start(self):
         """Start serving this service using loaded configuration.
 
@@ -88,6 +88,119 @@ class LockoutTestCase(test.TestCase):
         self.assertFalse(self._is_locked_out('test'))
 
 
+KEYSTONE_RESULT = {'access': {'token': {'id': 'token',
+                                         'tenant': {'id': 'project'}},
+                               'user': {'id': 'user',
+                                        'roles': [{'name': 'Member'}]}}}
+
+
+class FakeKeystoneResponse(object):
+    def __init__(self, status, reason, data):
+        self.status = status
+        self.reason = reason
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeKeystoneConnection(object):
+    """Counts connections and requests, answers like keystone would."""
+
+    created = 0
+    requests = []
+    status = 200
+
+    def __init__(self, netloc):
+        FakeKeystoneConnection.created += 1
+
+    def request(self, method, path, body=None, headers=None):
+        FakeKeystoneConnection.requests.append(utils.loads(body))
+
+    def getresponse(self):
+        if FakeKeystoneConnection.status == 401:
+            return FakeKeystoneResponse(401, 'Denied', '')
+        return FakeKeystoneResponse(200, 'OK',
+                                    utils.dumps(KEYSTONE_RESULT))
+
+    def close(self):
+        pass
+
+
+class EC2KeystoneAuthTestCase(test.TestCase):
+    """Test case for the EC2KeystoneAuth middleware."""
+    def setUp(self):
+        super(EC2KeystoneAuthTestCase, self).setUp()
+        utils.set_time_override()
+        self.flags(keystone_ec2_url='http://keystone:5000/v2.0/ec2tokens')
+        FakeKeystoneConnection.created = 0
+        FakeKeystoneConnection.requests = []
+        FakeKeystoneConnection.status = 200
+        self.stubs.Set(ec2.httplib, 'HTTPConnection', FakeKeystoneConnection)
+        self.stubs.Set(ec2, '_keystone_pools', {})
+        self.contexts = []
+
+        @webob.dec.wsgify
+        def record_context(req):
+            self.contexts.append(req.environ['nova.context'])
+            return 'OK'
+
+        self.auth = ec2.EC2KeystoneAuth(record_context)
+
+    def tearDown(self):
+        utils.clear_time_override()
+        super(EC2KeystoneAuthTestCase, self).tearDown()
+
+    def _request(self, signature='sig', timestamp='1'):
+        req = webob.Request.blank('/?AWSAccessKeyId=access&Signature=%s'
+                                  '&Timestamp=%s' % (signature, timestamp))
+        return req.get_response(self.auth)
+
+    def test_context(self):
+        self.assertEqual(self._request().status_int, 200)
+        ctxt = self.contexts[0]
+        self.assertEqual(ctxt.user_id, 'user')
+        self.assertEqual(ctxt.project_id, 'project')
+        self.assertEqual(ctxt.roles, ['Member'])
+        self.assertEqual(ctxt.auth_token, 'token')
+        creds = FakeKeystoneConnection.requests[0]['ec2Credentials']
+        self.assertEqual(creds['signature'], 'sig')
+        self.assertEqual(creds['params'], {'AWSAccessKeyId': 'access',
+                                           'Timestamp': '1'})
+
+    def test_connections_are_reused(self):
+        for i in xrange(5):
+            self._request(signature='sig%d' % i)
+        self.assertEqual(len(FakeKeystoneConnection.requests), 5)
+        self.assertEqual(FakeKeystoneConnection.created, 1)
+
+    def test_identical_requests_are_cached(self):
+        for i in xrange(3):
+            self.assertEqual(self._request().status_int, 200)
+        self.assertEqual(len(FakeKeystoneConnection.requests), 1)
+        self.assertEqual(len(self.contexts), 3)
+
+        self._request(timestamp='2')
+        self.assertEqual(len(FakeKeystoneConnection.requests), 2)
+
+        utils.advance_time_seconds(FLAGS.keystone_ec2_cache_ttl)
+        self._request()
+        self.assertEqual(len(FakeKeystoneConnection.requests), 3)
+
+    def test_cache_disabled(self):
+        self.flags(keystone_ec2_cache_ttl=0)
+        self._request()
+        self._request()
+        self.assertEqual(len(FakeKeystoneConnection.requests), 2)
+
+    def test_failures_are_not_cached(self):
+        FakeKeystoneConnection.status = 401
+        self.assertEqual(self._request().status_int, 400)
+        FakeKeystoneConnection.status = 200
+        self.assertEqual(self._request().status_int, 200)
+        self.assertEqual(len(FakeKeystoneConnection.requests), 2)
+
+
 class ExecutorTestCase(test.TestCase):
     def setUp(self):
         super(ExecutorTestCase, self).setUp()
@@ -17,6 +17,9 @@
 #    under the License.
 
 import json
+import os
+import shutil
+import tempfile
 
 import webob
 from lxml import etree
@@ -24,6 +27,7 @@ import iso8601
 
 from nova.api.openstack import compute
 from nova.api.openstack import extensions as base_extensions
+from nova.api.openstack.compute.contrib import keypairs
 from nova.api.openstack.compute import extensions as compute_extensions
 from nova.api.openstack import wsgi
 from nova.api.openstack import xmlutil
@@ -388,6 +392,91 @@ class ExtensionManagerTest(ExtensionTestCase):
         self.assertTrue('THIRD' not in ext_mgr.extensions)
 
 
+class ExtensionManifestTest(ExtensionTestCase):
+
+    def setUp(self):
+        super(ExtensionManifestTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.tmpdir, 'extensions.json')
+        self.flags(osapi_extension_manifest=self.manifest)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(ExtensionManifestTest, self).tearDown()
+
+    def _entries(self):
+        with open(self.manifest) as f:
+            return json.load(f)['extensions']
+
+    def test_manifest_is_written(self):
+        compute_extensions.ExtensionManager()
+        entries = self._entries()
+        contrib = 'nova.api.openstack.compute.contrib.'
+        keypairs_entry = entries[contrib + 'keypairs.Keypairs']
+        self.assertEqual(keypairs_entry['extensions'][0]['alias'],
+                         'os-keypairs')
+        self.assertEqual(
+            keypairs_entry['extensions'][0]['resources'][0]['collection'],
+            'os-keypairs')
+        # Controller extensions have to be imported at startup
+        self.assertEqual(entries[contrib + 'admin_actions.Admin_actions'],
+                         {'stamp': entries[contrib +
+                                           'admin_actions.Admin_actions'
+                                           ]['stamp'],
+                          'extensions': None})
+
+    def test_resource_only_extensions_are_deferred(self):
+        eager = compute_extensions.ExtensionManager()
+        ext_mgr = compute_extensions.ExtensionManager()
+        self.assertEqual(sorted(ext_mgr.extensions), sorted(eager.extensions))
+
+        lazy = ext_mgr.extensions['os-keypairs']
+        self.assertTrue(isinstance(lazy, base_extensions.LazyExtension))
+        self.assertFalse(isinstance(ext_mgr.extensions['os-admin-actions'],
+                                    base_extensions.LazyExtension))
+        self.assertEqual(lazy.name, eager.extensions['os-keypairs'].name)
+        self.assertEqual(lazy.__doc__,
+                         eager.extensions['os-keypairs'].__doc__)
+
+        resource, = lazy.get_resources()
+        self.assertEqual(resource.collection, 'os-keypairs')
+        self.assertTrue(isinstance(resource.controller,
+                                   base_extensions.LazyController))
+        self.assertEqual(resource.controller.create.im_class,
+                         keypairs.KeypairController)
+
+    def test_deferred_extension_is_routed(self):
+        compute_extensions.ExtensionManager()
+        app = compute.APIRouter()
+        self.assertTrue(isinstance(app.resources['os-keypairs'].controller,
+                                   base_extensions.LazyController))
+        request = webob.Request.blank("/fake/foxnsocks")
+        response = request.get_response(app)
+        self.assertEqual(200, response.status_int)
+        self.assertEqual(response_body, response.body)
+
+        request = webob.Request.blank("/fake/extensions/os-keypairs")
+        response = request.get_response(app)
+        self.assertEqual(200, response.status_int)
+        self.assertEqual(json.loads(response.body)['extension']['alias'],
+                         'os-keypairs')
+
+    def test_changed_module_is_imported(self):
+        compute_extensions.ExtensionManager()
+        entries = self._entries()
+        entry = entries['nova.api.openstack.compute.contrib.keypairs.Keypairs']
+        entry['stamp'][0] -= 1
+        with open(self.manifest, 'w') as f:
+            json.dump({'extensions': entries}, f)
+
+        ext_mgr = compute_extensions.ExtensionManager()
+        self.assertFalse(isinstance(ext_mgr.extensions['os-keypairs'],
+                                    base_extensions.LazyExtension))
+        self.assertTrue(isinstance(ext_mgr.extensions['os-hosts'],
+                                   base_extensions.LazyExtension))
+        self.assertNotEqual(self._entries(), entries)
+
+
 class ActionExtensionTest(ExtensionTestCase):
 
     def _send_server_action_request(self, url, body):
@@ -590,6 +590,60 @@ class LimiterTest(BaseLimitTestSuite):
         results = list(self._check(5, "PUT", "/anything", "user2"))
         self.assertEqual(expected, results)
 
+    def test_drained_users_are_evicted(self):
+        """
+        Ensure state for idle users is dropped once their buckets drained.
+        """
+        list(self._check(11, "PUT", "/anything", "user1"))
+        self.assertTrue('user1' in self.limiter._buckets)
+
+        self.time += 61.0
+        self.assertEqual(self.limiter.check_for_delay("PUT", "/anything",
+                                                      "user2"), (None, None))
+        self.assertFalse('user1' in self.limiter._buckets)
+
+        remaining = [l['remaining'] for l in self.limiter.get_limits('user1')]
+        self.assertEqual(remaining, [l.value for l in TEST_LIMITS])
+
+    def test_unlimited_requests_keep_no_state(self):
+        """
+        Ensure requests no limit applies to don't create user state.
+        """
+        self.limiter.check_for_delay("GET", "/anything", "user1")
+        self.assertEqual(self.limiter._buckets, {})
+
+
+class LimitSetTest(BaseLimitTestSuite):
+    """
+    Tests for the compiled matching in `limits.LimitSet`.
+    """
+
+    def test_overlapping_regexes(self):
+        limit_set = limits.LimitSet(TEST_LIMITS)
+        self.assertEqual(limit_set.match("PUT", "/servers/1"), [3, 4])
+        self.assertEqual(limit_set.match("PUT", "/images"), [3])
+        self.assertEqual(limit_set.match("GET", "/delayed"), [0])
+        self.assertEqual(limit_set.match("GET", "/other"), [])
+        self.assertEqual(limit_set.match("DELETE", "/delayed"), [])
+
+    def test_back_references(self):
+        limit_set = limits.LimitSet([
+            limits.Limit("GET", "*", r"^/(a+)/\1$", 1, limits.PER_MINUTE),
+            limits.Limit("GET", "*", ".*", 1, limits.PER_MINUTE),
+        ])
+        self.assertEqual(limit_set.match("GET", "/aa/aa"), [0, 1])
+        self.assertEqual(limit_set.match("GET", "/aa/a"), [1])
+
+        # A back reference after another limit's groups
+        limit_set = limits.LimitSet([
+            limits.Limit("GET", "*", ".*", 1, limits.PER_MINUTE),
+            limits.Limit("GET", "*", r"^/(a+)/\1$", 1, limits.PER_MINUTE),
+            limits.Limit("GET", "*", "^/(aa)", 1, limits.PER_MINUTE),
+        ])
+        self.assertEqual(limit_set.match("GET", "/aa/aa"), [0, 1, 2])
+        self.assertEqual(limit_set.match("GET", "/aa/a"), [0, 2])
+        self.assertEqual(limit_set.match("GET", "/a/a"), [0, 1])
+
 
 class WsgiLimiterTest(BaseLimitTestSuite):
     """
@@ -774,11 +828,30 @@ class WsgiLimiterProxyTest(BaseLimitTestSuite):
         delay, error = self.proxy.check_for_delay("GET", "/delayed")
         error = error.strip()
 
-        expected = ("60.00", "403 Forbidden\n\nOnly 1 GET request(s) can be "
+        expected = (60.0, "403 Forbidden\n\nOnly 1 GET request(s) can be "
                     "made to /delayed every minute.")
 
         self.assertEqual((delay, error), expected)
 
+    def test_500_without_wait(self):
+        """A failing limiter doesn't rate limit the request."""
+        def failing_limiter(environ, start_response):
+            start_response("500 Internal Server Error",
+                           [("Content-Type", "text/plain")])
+            return ["500 Internal Server Error"]
+
+        wire_HTTPConnection_to_WSGI("169.254.0.2:80", failing_limiter)
+        proxy = limits.WsgiLimiterProxy("169.254.0.2:80")
+        delay, error = proxy.check_for_delay("GET", "/anything")
+        self.assertEqual(delay, None)
+        self.assertTrue(error.startswith("500"))
+
+    def test_connections_are_reused(self):
+        """Consecutive checks share one connection to the limiter."""
+        for i in xrange(3):
+            self.proxy.check_for_delay("GET", "/anything")
+        self.assertEqual(self.proxy._pool.current_size, 1)
+
 
 class LimitsViewBuilderTest(test.TestCase):
     def setUp(self):
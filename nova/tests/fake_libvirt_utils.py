@@ -29,7 +29,7 @@ def create_image(disk_format, path, size):
     pass
 
 
-def create_cow_image(backing_file, path):
+def create_cow_image(backing_file, path, size=None):
     pass
 
 
@@ -37,11 +37,11 @@ def get_disk_size(path):
     return disk_sizes.get(path, 1024 * 1024 * 20)
 
 
-def get_disk_backing_file(path):
+def get_disk_backing_file(path, basename=True):
     return disk_backing_files.get(path, None)
 
 
-def copy_image(src, dest):
+def copy_image(src, dest, host=None):
     pass
 
 
@@ -69,8 +69,11 @@ def delete_snapshot(disk_path, snapshot_name):
     pass
 
 
-def extract_snapshot(disk_path, source_fmt, snapshot_name, out_path, dest_fmt):
+def extract_snapshot(disk_path, source_fmt, snapshot_name, out_path, dest_fmt,
+                     progress=None):
     files[out_path] = ''
+    if progress is not None:
+        progress(100.0)
 
 
 class File(object):
@@ -83,6 +86,12 @@ class File(object):
     def __exit__(self, *args):
         return
 
+    def read(self, *args):
+        return self.fp.read(*args)
+
+    def close(self):
+        pass
+
 
 def file_open(path, mode=None):
     return File(path, mode)
@@ -363,7 +363,7 @@ def stub_out_nw_api_get_instance_nw_info(stubs, func=None,
                                          spectacular=False):
     import nova.network
 
-    def get_instance_nw_info(self, context, instance):
+    def get_instance_nw_info(self, context, instance, use_cache=True):
         return fake_get_instance_nw_info(stubs, num_networks=num_networks,
                         ips_per_vif=ips_per_vif,
                         floating_ips_per_fixed_ip=floating_ips_per_fixed_ip,
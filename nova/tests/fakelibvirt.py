@@ -21,6 +21,8 @@ except AttributeError:
     from xml.parsers import expat
     ParseError = expat.ExpatError
 
+import os
+import shutil
 import uuid
 
 # Allow passing None to the various connect methods
@@ -73,6 +75,10 @@ VIR_DOMAIN_SHUTDOWN = 4
 VIR_DOMAIN_SHUTOFF = 5
 VIR_DOMAIN_CRASHED = 6
 
+VIR_DOMAIN_BLOCK_REBASE_SHALLOW = 1
+VIR_DOMAIN_BLOCK_REBASE_REUSE_EXT = 2
+VIR_DOMAIN_BLOCK_REBASE_COPY = 8
+
 VIR_CPU_COMPARE_ERROR = -1
 VIR_CPU_COMPARE_INCOMPATIBLE = 0
 VIR_CPU_COMPARE_IDENTICAL = 1
@@ -88,6 +94,7 @@ VIR_CRED_NOECHOPROMPT = 7
 VIR_FROM_QEMU = 100
 VIR_FROM_DOMAIN = 200
 VIR_FROM_NWFILTER = 330
+VIR_ERR_OPERATION_INVALID = 55
 VIR_ERR_XML_DETAIL = 350
 VIR_ERR_NO_DOMAIN = 420
 VIR_ERR_NO_NWFILTER = 620
@@ -160,6 +167,7 @@ class Domain(object):
         self._def = self._parse_definition(xml)
         self._has_saved_state = False
         self._snapshots = {}
+        self._block_jobs = {}
 
     def _parse_definition(self, xml):
         try:
@@ -268,7 +276,13 @@ class Domain(object):
         return int(self._state == VIR_DOMAIN_RUNNING)
 
     def undefine(self):
-        self._connection._undefine(self)
+        if self.isActive():
+            self._transient = True
+        else:
+            self._connection._undefine(self)
+
+    def isPersistent(self):
+        return int(not self._transient)
 
     def destroy(self):
         self._state = VIR_DOMAIN_SHUTOFF
@@ -410,6 +424,34 @@ class Domain(object):
         self._snapshots[name] = snapshot
         return snapshot
 
+    def blockRebase(self, disk, base, bandwidth, flags):
+        if flags & VIR_DOMAIN_BLOCK_REBASE_COPY and not self._transient:
+            raise libvirtError(VIR_ERR_OPERATION_INVALID, VIR_FROM_QEMU,
+                               "domain is not transient")
+        if disk in self._block_jobs:
+            raise libvirtError(VIR_ERR_OPERATION_INVALID, VIR_FROM_QEMU,
+                               "block job already active")
+        self._block_jobs[disk] = {'type': 1, 'bandwidth': bandwidth,
+                                  'cur': 0, 'end': 100, 'dest': base}
+
+    def blockJobInfo(self, disk, flags):
+        job = self._block_jobs.get(disk)
+        if job is None:
+            return {}
+        # Every call reports some more progress
+        job['cur'] = min(job['cur'] + 50, job['end'])
+        return dict((key, value) for key, value in job.iteritems()
+                    if key != 'dest')
+
+    def blockJobAbort(self, disk, flags):
+        job = self._block_jobs.pop(disk, None)
+        if job is None:
+            raise libvirtError(VIR_ERR_OPERATION_INVALID, VIR_FROM_QEMU,
+                               "no active block job")
+        # A finished copy leaves the destination with the disk content
+        if job['cur'] == job['end'] and os.path.exists(disk):
+            shutil.copyfile(disk, job['dest'])
+
 
 class DomainSnapshot(object):
     def __init__(self, name, domain):
@@ -497,6 +539,12 @@ class Connection(object):
 
     def defineXML(self, xml):
         dom = Domain(connection=self, running=False, transient=False, xml=xml)
+        running = self._vms.get(dom.name())
+        if running is not None and running.isActive():
+            # Defining a running transient domain makes it persistent
+            running._transient = False
+            running._def = dom._def
+            dom = running
         self._vms[dom.name()] = dom
         return dom
 
@@ -512,6 +560,9 @@ class Connection(object):
     def getVersion(self):
         return 14000
 
+    def getLibVersion(self):
+        return 9011
+
     def getCapabilities(self):
         return '''<capabilities>
   <host>
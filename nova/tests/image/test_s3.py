@@ -15,13 +15,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
+import binascii
 import os
+import StringIO
+import tarfile
+
+import Crypto.Cipher.AES
 
 from nova import context
 import nova.db.api
 from nova import exception
-from nova import test
 from nova.image import s3
+from nova import rpc
+from nova import test
 
 
 ami_manifest_xml = """<?xml version="1.0" ?>
@@ -140,3 +147,119 @@ class TestS3ImageService(test.TestCase):
         self.assertRaises(exception.Error,
             self.image_service._test_for_malicious_tarball,
             "/unused", os.path.join(os.path.dirname(__file__), 'rel.tar.gz'))
+
+
+class FakeKey(object):
+    def __init__(self, data):
+        self.data = data
+
+    def get_contents_as_string(self):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+class FakeBucket(object):
+    def __init__(self, files):
+        self.files = files
+
+    def get_key(self, name):
+        return FakeKey(self.files[name])
+
+
+class FakeConnection(object):
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_bucket(self, name):
+        return self.bucket
+
+
+class TestS3BundleRegistration(test.TestCase):
+    """Runs a whole bundle through the streaming registration pipeline."""
+
+    key = '0123456789abcdef'
+    iv = 'fedcba9876543210'
+
+    def setUp(self):
+        super(TestS3BundleRegistration, self).setUp()
+        self.flags(image_service='nova.image.fake.FakeImageService',
+                   s3_download_concurrency=2)
+        self.image_service = s3.S3ImageService()
+        self.context = context.RequestContext('fake', 'fake')
+        self.states = []
+        self.uploaded = []
+
+        def fake_update(context, image_id, metadata, data=None):
+            self.states.append(metadata['properties']['image_state'])
+            if data is not None:
+                self.uploaded.append(data.read())
+        self.stubs.Set(self.image_service.service, 'update', fake_update)
+        self.stubs.Set(s3.eventlet, 'spawn_n', lambda f, *a: f(*a))
+
+        def fake_call(context, topic, msg):
+            text = base64.b64decode(msg['args']['text'])
+            return {'encrypted-key': binascii.b2a_hex(self.key),
+                    'encrypted-iv': binascii.b2a_hex(self.iv)}[text]
+        self.stubs.Set(rpc, 'call', fake_call)
+
+    def _bundle(self, image_data, part_size=1000):
+        tar_data = StringIO.StringIO()
+        tar_file = tarfile.open(fileobj=tar_data, mode='w:gz')
+        info = tarfile.TarInfo('image')
+        info.size = len(image_data)
+        tar_file.addfile(info, StringIO.StringIO(image_data))
+        tar_file.close()
+
+        plain = tar_data.getvalue()
+        padding = 16 - len(plain) % 16
+        plain += chr(padding) * padding
+        cipher = Crypto.Cipher.AES.new(self.key, Crypto.Cipher.AES.MODE_CBC,
+                                       self.iv)
+        encrypted = cipher.encrypt(plain)
+        return [encrypted[i:i + part_size]
+                for i in xrange(0, len(encrypted), part_size)]
+
+    def _register(self, parts):
+        filenames = ''.join('<filename>part.%d</filename>' % i
+                            for i in xrange(len(parts)))
+        manifest = ('<manifest><image>'
+                    '<ec2_encrypted_key>%s</ec2_encrypted_key>'
+                    '<ec2_encrypted_iv>%s</ec2_encrypted_iv>'
+                    '<parts>%s</parts></image></manifest>' %
+                    (binascii.b2a_hex('encrypted-key'),
+                     binascii.b2a_hex('encrypted-iv'), filenames))
+        files = dict(('part.%d' % i, part) for i, part in enumerate(parts))
+        files['image.manifest.xml'] = manifest
+        self.stubs.Set(self.image_service, '_conn',
+                       lambda context: FakeConnection(FakeBucket(files)))
+        metadata = {'properties': {'image_location':
+                                   'bucket/image.manifest.xml'}}
+        self.image_service._s3_create(self.context, metadata)
+
+    def test_register_streams_image(self):
+        image_data = os.urandom(20000)
+        self._register(self._bundle(image_data))
+        self.assertEqual(self.uploaded, [image_data])
+        self.assertEqual(self.states, ['downloading', 'decrypting',
+                                       'uploading', 'uploading',
+                                       'available'])
+
+    def test_failed_download(self):
+        parts = self._bundle(os.urandom(5000))
+        parts[1] = IOError('lost part')
+        self._register(parts)
+        self.assertEqual(self.states[-1], 'failed_download')
+
+    def test_failed_decrypt(self):
+        parts = self._bundle(os.urandom(5000))
+        parts[-1] = parts[-1][:-1]
+        self._register(parts)
+        self.assertEqual(self.states[-1], 'failed_decrypt')
+
+    def test_decrypting_reader_matches_openssl_padding(self):
+        parts = self._bundle('x' * 100, part_size=7)
+        reader = s3._DecryptingReader(iter(parts), self.key, self.iv)
+        tar_file = tarfile.open(fileobj=reader, mode='r|gz')
+        member = tar_file.next()
+        self.assertEqual(tar_file.extractfile(member).read(), 'x' * 100)
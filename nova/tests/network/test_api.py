@@ -0,0 +1,91 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the network API."""
+
+from nova.compute import instance_types
+from nova import context
+from nova import db
+from nova import network
+from nova.network import model as network_model
+from nova import rpc
+from nova import test
+
+
+class ApiTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ApiTestCase, self).setUp()
+        self.network_api = network.API()
+        self.context = context.RequestContext('fake-user', 'fake-project')
+        type_id = instance_types.get_instance_type_by_name('m1.tiny')['id']
+        instance = db.instance_create(self.context,
+                                      {'instance_type_id': type_id,
+                                       'user_id': 'fake-user',
+                                       'project_id': 'fake-project'})
+        self.instance = db.instance_get_by_uuid(self.context,
+                                                instance['uuid'])
+        self.nw_info = network_model.NetworkInfo([network_model.VIF(
+                address='DE:AD:BE:EF:00:01',
+                network=network_model.Network(label='net1'))])
+        self.rpc_calls = []
+
+        def fake_call(context, topic, msg):
+            self.rpc_calls.append(msg['method'])
+            return []
+
+        self.stubs.Set(rpc, 'call', fake_call)
+        self.stubs.Set(rpc, 'cast', lambda *args: None)
+
+    def _cache_nw_info(self):
+        """Write the cache the way nova-network does."""
+        info_cache = db.instance_info_cache_get(self.context,
+                                                self.instance['uuid'])
+        db.instance_info_cache_update(self.context, self.instance['uuid'],
+                {'network_info': self.nw_info.as_cache(),
+                 'network_info_generation': info_cache['generation']})
+
+    def test_get_instance_nw_info_from_cache(self):
+        self._cache_nw_info()
+        nw_info = self.network_api.get_instance_nw_info(self.context,
+                                                        self.instance)
+        self.assertEqual(nw_info, self.nw_info)
+        self.assertEqual(self.rpc_calls, [])
+
+    def test_get_instance_nw_info_empty_cache(self):
+        self.network_api.get_instance_nw_info(self.context, self.instance)
+        self.assertEqual(self.rpc_calls, ['get_instance_nw_info'])
+
+    def test_get_instance_nw_info_stale_cache(self):
+        self._cache_nw_info()
+        self.network_api.add_fixed_ip_to_instance(self.context,
+                                                  self.instance, 1)
+        self.network_api.get_instance_nw_info(self.context, self.instance)
+        self.assertEqual(self.rpc_calls, ['get_instance_nw_info'])
+
+        # Up to date again once nova-network has rebuilt it
+        self._cache_nw_info()
+        self.network_api.get_instance_nw_info(self.context, self.instance)
+        self.assertEqual(self.rpc_calls, ['get_instance_nw_info'])
+
+    def test_get_instance_nw_info_bypass_cache(self):
+        self._cache_nw_info()
+        self.network_api.get_instance_nw_info(self.context, self.instance,
+                                              use_cache=False)
+        self.flags(use_network_info_cache=False)
+        self.network_api.get_instance_nw_info(self.context, self.instance)
+        self.assertEqual(self.rpc_calls, ['get_instance_nw_info'] * 2)
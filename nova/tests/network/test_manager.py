@@ -20,6 +20,7 @@ import shutil
 import sys
 import tempfile
 
+from nova.compute import instance_types
 from nova import context
 from nova import db
 from nova import exception
@@ -194,6 +195,19 @@ class FlatNetworkTestCase(test.TestCase):
                       for ip_num in xrange(1, num_fixed_ips + 1)]
             self.assertDictListMatch(info['ips'], check)
 
+    def test_instance_nw_info_changed(self):
+        ctxt = context.get_admin_context()
+        type_id = instance_types.get_instance_type_by_name('m1.tiny')['id']
+        instance = db.instance_create(ctxt, {'instance_type_id': type_id,
+                                             'host': HOST})
+        self.network._instance_nw_info_changed(self.context, instance['id'])
+
+        # The cache was invalidated, then rebuilt for the new generation
+        info_cache = db.instance_info_cache_get(ctxt, instance['uuid'])
+        self.assertEqual(info_cache['generation'], 1)
+        self.assertEqual(info_cache['network_info_generation'], 1)
+        self.assertEqual(info_cache['network_info'], '[]')
+
     def test_validate_networks(self):
         self.mox.StubOutWithMock(db, 'network_get')
         self.mox.StubOutWithMock(db, 'network_get_all_by_uuids')
@@ -21,6 +21,7 @@ from nova import context
 from nova import exception
 from nova import flags
 from nova.scheduler import filters
+from nova.scheduler import liveness
 from nova import test
 from nova.tests.scheduler import fakes
 from nova import utils
@@ -174,6 +175,27 @@ class HostFiltersTestCase(test.TestCase):
                  'service': service})
         self.assertTrue(filt_cls.host_passes(host, filter_properties))
 
+    def test_compute_filter_uses_scheduler_liveness(self):
+        self._stub_service_is_up(True)
+        filt_cls = self.class_map['ComputeFilter']()
+        service = {'disabled': False}
+        service_liveness = liveness.ServiceLiveness()
+        checked = []
+
+        def fake_service_is_up(context, service):
+            checked.append((context, service))
+            return False
+
+        self.stubs.Set(service_liveness, 'service_is_up', fake_service_is_up)
+        filter_properties = {'instance_type': {'memory_mb': 1024},
+                             'context': self.context,
+                             'liveness': service_liveness}
+        host = fakes.FakeHostState('host1', 'compute',
+                {'free_ram_mb': 1024, 'capabilities': {'enabled': True},
+                 'service': service})
+        self.assertFalse(filt_cls.host_passes(host, filter_properties))
+        self.assertEqual(checked, [(self.context, service)])
+
     def test_ram_filter_fails_on_memory(self):
         self._stub_service_is_up(True)
         filt_cls = self.class_map['RamFilter']()
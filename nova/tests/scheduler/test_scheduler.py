@@ -22,6 +22,8 @@ Tests For Scheduler
 import datetime
 import json
 
+import mox
+
 from nova.compute import api as compute_api
 from nova.compute import power_state
 from nova.compute import vm_states
@@ -354,22 +356,89 @@ class SchedulerTestCase(test.TestCase):
                 host, capabilities)
 
     def test_hosts_up(self):
-        service1 = {'host': 'host1'}
-        service2 = {'host': 'host2'}
-        services = [service1, service2]
-
-        self.mox.StubOutWithMock(db, 'service_get_all_by_topic')
+        service1 = {'host': 'host1', 'topic': self.topic,
+                    'updated_at': None, 'created_at': None}
+        service2 = {'host': 'host2', 'topic': self.topic,
+                    'updated_at': None, 'created_at': None}
+        service3 = {'host': 'host3', 'topic': 'other_topic',
+                    'updated_at': None, 'created_at': None}
+        services = [service1, service2, service3]
+
+        self.mox.StubOutWithMock(db, 'service_get_all')
         self.mox.StubOutWithMock(utils, 'service_is_up')
 
-        db.service_get_all_by_topic(self.context,
-                self.topic).AndReturn(services)
-        utils.service_is_up(service1).AndReturn(False)
-        utils.service_is_up(service2).AndReturn(True)
+        db.service_get_all(mox.IgnoreArg(), disabled=False).AndReturn(services)
+        utils.service_is_up(mox.ContainsKeyValue('host',
+                                                 'host1')).AndReturn(False)
+        utils.service_is_up(mox.ContainsKeyValue('host',
+                                                 'host2')).AndReturn(True)
 
         self.mox.ReplayAll()
         result = self.driver.hosts_up(self.context, self.topic)
         self.assertEqual(result, ['host2'])
 
+    def test_hosts_up_is_cached(self):
+        now = datetime.datetime(2012, 1, 1, 12, 0, 0)
+        services = [{'host': 'host1', 'topic': self.topic,
+                     'updated_at': now, 'created_at': now}]
+        calls = []
+
+        def fake_service_get_all(context, disabled=None):
+            calls.append(disabled)
+            return services
+
+        self.flags(service_liveness_cache_interval=10, service_down_time=60)
+        self.stubs.Set(db, 'service_get_all', fake_service_get_all)
+        utils.set_time_override(now)
+        try:
+            self.assertEqual(self.driver.hosts_up(self.context, self.topic),
+                             ['host1'])
+            utils.advance_time_seconds(5)
+            self.assertEqual(self.driver.hosts_up(self.context, 'other'), [])
+            self.assertEqual(len(calls), 1)
+
+            # Liveness is judged against the current time even while
+            # the cached heartbeats are reused.
+            utils.advance_time_seconds(5)
+            self.assertEqual(self.driver.hosts_up(self.context, self.topic),
+                             ['host1'])
+            self.flags(service_down_time=9)
+            self.assertEqual(self.driver.hosts_up(self.context, self.topic),
+                             [])
+            self.assertEqual(len(calls), 1)
+
+            utils.advance_time_seconds(1)
+            self.driver.hosts_up(self.context, self.topic)
+            self.assertEqual(len(calls), 2)
+        finally:
+            utils.clear_time_override()
+
+    def test_service_is_up_uses_cached_heartbeat(self):
+        now = datetime.datetime(2012, 1, 1, 12, 0, 0)
+        old = now - datetime.timedelta(seconds=120)
+        cached = [{'host': 'host1', 'topic': self.topic,
+                   'updated_at': now, 'created_at': now}]
+        self.flags(service_liveness_cache_interval=10, service_down_time=60)
+        self.stubs.Set(db, 'service_get_all',
+                       lambda context, disabled=None: cached)
+        utils.set_time_override(now)
+        try:
+            # A stale record of a service the map knows as up
+            service = {'host': 'host1', 'topic': self.topic,
+                       'updated_at': old, 'created_at': old}
+            self.assertTrue(self.driver.liveness.service_is_up(self.context,
+                                                               service))
+            # Services missing from the map are judged by their record
+            service = {'host': 'host2', 'topic': self.topic,
+                       'updated_at': old, 'created_at': old}
+            self.assertFalse(self.driver.liveness.service_is_up(
+                    self.context, service))
+            service['updated_at'] = now
+            self.assertTrue(self.driver.liveness.service_is_up(self.context,
+                                                               service))
+        finally:
+            utils.clear_time_override()
+
     def test_create_instance_db_entry(self):
         base_options = {'fake_option': 'meow'}
         image = 'fake_image'
@@ -469,8 +538,8 @@ class SchedulerTestCase(test.TestCase):
         """Test live migration when all checks pass."""
 
         self.mox.StubOutWithMock(db, 'instance_get')
-        self.mox.StubOutWithMock(db, 'service_get_all_by_topic')
-        self.mox.StubOutWithMock(utils, 'service_is_up')
+        self.mox.StubOutWithMock(self.driver.liveness, 'hosts_up')
+        self.mox.StubOutWithMock(self.driver.liveness, 'service_is_up')
         self.mox.StubOutWithMock(db, 'service_get_all_compute_by_host')
         self.mox.StubOutWithMock(self.driver, '_get_compute_info')
         self.mox.StubOutWithMock(db, 'instance_get_all_by_host')
@@ -488,17 +557,18 @@ class SchedulerTestCase(test.TestCase):
         db.instance_get(self.context, instance['id']).AndReturn(instance)
 
         # Source checks (volume and source compute are up)
-        db.service_get_all_by_topic(self.context, 'volume').AndReturn(
-                ['fake_service'])
-        utils.service_is_up('fake_service').AndReturn(True)
+        self.driver.liveness.hosts_up(self.context, 'volume').AndReturn(
+                ['fake_volume_host'])
         db.service_get_all_compute_by_host(self.context,
                 instance['host']).AndReturn(['fake_service2'])
-        utils.service_is_up('fake_service2').AndReturn(True)
+        self.driver.liveness.service_is_up(self.context,
+                'fake_service2').AndReturn(True)
 
         # Destination checks (compute is up, enough memory, disk)
         db.service_get_all_compute_by_host(self.context,
                 dest).AndReturn(['fake_service3'])
-        utils.service_is_up('fake_service3').AndReturn(True)
+        self.driver.liveness.service_is_up(self.context,
+                'fake_service3').AndReturn(True)
         # assert_compute_node_has_enough_memory()
         self.driver._get_compute_info(self.context, dest,
                 'memory_mb').AndReturn(2048)
@@ -586,17 +656,14 @@ class SchedulerTestCase(test.TestCase):
         """Raise exception when volume node is not alive."""
 
         self.mox.StubOutWithMock(db, 'instance_get')
-        self.mox.StubOutWithMock(db, 'service_get_all_by_topic')
-        self.mox.StubOutWithMock(utils, 'service_is_up')
+        self.mox.StubOutWithMock(self.driver.liveness, 'hosts_up')
 
         dest = 'fake_host2'
         block_migration = False
         instance = self._live_migration_instance()
         db.instance_get(self.context, instance['id']).AndReturn(instance)
         # Volume down
-        db.service_get_all_by_topic(self.context, 'volume').AndReturn(
-                ['fake_service'])
-        utils.service_is_up('fake_service').AndReturn(False)
+        self.driver.liveness.hosts_up(self.context, 'volume').AndReturn([])
 
         self.mox.ReplayAll()
         self.assertRaises(exception.VolumeServiceUnavailable,
@@ -608,8 +675,8 @@ class SchedulerTestCase(test.TestCase):
         """Raise exception when src compute node is not alive."""
 
         self.mox.StubOutWithMock(db, 'instance_get')
-        self.mox.StubOutWithMock(db, 'service_get_all_by_topic')
-        self.mox.StubOutWithMock(utils, 'service_is_up')
+        self.mox.StubOutWithMock(self.driver.liveness, 'hosts_up')
+        self.mox.StubOutWithMock(self.driver.liveness, 'service_is_up')
         self.mox.StubOutWithMock(db, 'service_get_all_compute_by_host')
 
         dest = 'fake_host2'
@@ -617,14 +684,14 @@ class SchedulerTestCase(test.TestCase):
         instance = self._live_migration_instance()
         db.instance_get(self.context, instance['id']).AndReturn(instance)
         # Volume up
-        db.service_get_all_by_topic(self.context, 'volume').AndReturn(
-                ['fake_service'])
-        utils.service_is_up('fake_service').AndReturn(True)
+        self.driver.liveness.hosts_up(self.context, 'volume').AndReturn(
+                ['fake_volume_host'])
 
         # Compute down
         db.service_get_all_compute_by_host(self.context,
                 instance['host']).AndReturn(['fake_service2'])
-        utils.service_is_up('fake_service2').AndReturn(False)
+        self.driver.liveness.service_is_up(self.context,
+                'fake_service2').AndReturn(False)
 
         self.mox.ReplayAll()
         self.assertRaises(exception.ComputeServiceUnavailable,
@@ -638,7 +705,7 @@ class SchedulerTestCase(test.TestCase):
         self.mox.StubOutWithMock(db, 'instance_get')
         self.mox.StubOutWithMock(self.driver, '_live_migration_src_check')
         self.mox.StubOutWithMock(db, 'service_get_all_compute_by_host')
-        self.mox.StubOutWithMock(utils, 'service_is_up')
+        self.mox.StubOutWithMock(self.driver.liveness, 'service_is_up')
 
         dest = 'fake_host2'
         block_migration = False
@@ -649,7 +716,8 @@ class SchedulerTestCase(test.TestCase):
         db.service_get_all_compute_by_host(self.context,
                 dest).AndReturn(['fake_service3'])
         # Compute is down
-        utils.service_is_up('fake_service3').AndReturn(False)
+        self.driver.liveness.service_is_up(self.context,
+                'fake_service3').AndReturn(False)
 
         self.mox.ReplayAll()
         self.assertRaises(exception.ComputeServiceUnavailable,
@@ -663,7 +731,7 @@ class SchedulerTestCase(test.TestCase):
         self.mox.StubOutWithMock(db, 'instance_get')
         self.mox.StubOutWithMock(self.driver, '_live_migration_src_check')
         self.mox.StubOutWithMock(db, 'service_get_all_compute_by_host')
-        self.mox.StubOutWithMock(utils, 'service_is_up')
+        self.mox.StubOutWithMock(self.driver.liveness, 'service_is_up')
 
         block_migration = False
         disk_over_commit = False
@@ -676,7 +744,8 @@ class SchedulerTestCase(test.TestCase):
         self.driver._live_migration_src_check(self.context, instance)
         db.service_get_all_compute_by_host(self.context,
                 dest).AndReturn(['fake_service3'])
-        utils.service_is_up('fake_service3').AndReturn(True)
+        self.driver.liveness.service_is_up(self.context,
+                'fake_service3').AndReturn(True)
 
         self.mox.ReplayAll()
         self.assertRaises(exception.UnableToMigrateToSelf,
@@ -691,7 +760,7 @@ class SchedulerTestCase(test.TestCase):
         self.mox.StubOutWithMock(db, 'instance_get')
         self.mox.StubOutWithMock(self.driver, '_live_migration_src_check')
         self.mox.StubOutWithMock(db, 'service_get_all_compute_by_host')
-        self.mox.StubOutWithMock(utils, 'service_is_up')
+        self.mox.StubOutWithMock(self.driver.liveness, 'service_is_up')
         self.mox.StubOutWithMock(self.driver, '_get_compute_info')
         self.mox.StubOutWithMock(db, 'instance_get_all_by_host')
 
@@ -704,7 +773,8 @@ class SchedulerTestCase(test.TestCase):
         self.driver._live_migration_src_check(self.context, instance)
         db.service_get_all_compute_by_host(self.context,
                 dest).AndReturn(['fake_service3'])
-        utils.service_is_up('fake_service3').AndReturn(True)
+        self.driver.liveness.service_is_up(self.context,
+                'fake_service3').AndReturn(True)
 
         self.driver._get_compute_info(self.context, dest,
                 'memory_mb').AndReturn(2048)
@@ -724,7 +794,7 @@ class SchedulerTestCase(test.TestCase):
         self.mox.StubOutWithMock(db, 'instance_get')
         self.mox.StubOutWithMock(self.driver, '_live_migration_src_check')
         self.mox.StubOutWithMock(db, 'service_get_all_compute_by_host')
-        self.mox.StubOutWithMock(utils, 'service_is_up')
+        self.mox.StubOutWithMock(self.driver.liveness, 'service_is_up')
         self.mox.StubOutWithMock(self.driver,
                 'assert_compute_node_has_enough_memory')
         self.mox.StubOutWithMock(self.driver, '_get_compute_info')
@@ -741,7 +811,8 @@ class SchedulerTestCase(test.TestCase):
         self.driver._live_migration_src_check(self.context, instance)
         db.service_get_all_compute_by_host(self.context,
                 dest).AndReturn(['fake_service3'])
-        utils.service_is_up('fake_service3').AndReturn(True)
+        self.driver.liveness.service_is_up(self.context,
+                'fake_service3').AndReturn(True)
 
         # Enough memory
         self.driver.assert_compute_node_has_enough_memory(self.context,
@@ -35,6 +35,7 @@ from nova.compute import manager as compute_manager
 from nova.compute import power_state
 from nova.compute import task_states
 from nova.compute import vm_states
+from nova.consoleauth import tokens as console_tokens
 from nova import context
 from nova import db
 from nova import exception
@@ -777,6 +778,24 @@ class ComputeTestCase(BaseTestCase):
         self.assert_(console)
         self.compute.terminate_instance(self.context, instance['uuid'])
 
+    def test_vnc_console_signed_token(self):
+        """Make sure the token is signed when keys are configured."""
+        self.flags(console_token_keys=['k1:secret'])
+        instance = self._create_fake_instance()
+        self.compute.run_instance(self.context, instance['uuid'])
+
+        console = self.compute.get_vnc_console(self.context,
+                                               instance['uuid'],
+                                               'xvpvnc')
+        info = console_tokens.decode(console['token'])
+        self.assertEqual(info['host'], console['host'])
+        self.assertEqual(info['port'], console['port'])
+        self.assertEqual(info['internal_access_path'],
+                         console['internal_access_path'])
+        self.assertTrue(console['access_url'].endswith(
+                '?token=%s' % console['token']))
+        self.compute.terminate_instance(self.context, instance['uuid'])
+
     def test_invalid_vnc_console_type(self):
         """Make sure we can a vnc console for an instance."""
         instance = self._create_fake_instance()
@@ -1734,12 +1753,13 @@ class ComputeTestCase(BaseTestCase):
             return instance_map[instance_uuid]
 
         # NOTE(comstud): Override the stub in setUp()
-        def fake_get_instance_nw_info(context, instance):
+        def fake_get_instance_nw_info(context, instance, use_cache=True):
             # Note that this exception gets caught in compute/manager
             # and is ignored.  However, the below increment of
             # 'get_nw_info' won't happen, and you'll get an assert
             # failure checking it below.
             self.assertEqual(instance, call_info['expected_instance'])
+            self.assertFalse(use_cache)
             call_info['get_nw_info'] += 1
 
         self.stubs.Set(db, 'instance_get_all_by_host',
@@ -17,6 +17,10 @@
 
 """Tests For miscellaneous util methods used with compute."""
 
+import datetime
+import json
+import os
+
 from nova import db
 from nova import flags
 from nova import context
@@ -26,6 +30,7 @@ from nova import utils
 import nova.image.fake
 from nova.compute import utils as compute_utils
 from nova.compute import instance_types
+from nova.network import model as network_model
 from nova.notifier import test_notifier
 from nova.tests import fake_network
 
@@ -103,3 +108,77 @@ class UsageInfoTestCase(test.TestCase):
         image_ref_url = "%s/images/1" % utils.generate_glance_url()
         self.assertEquals(payload['image_ref_url'], image_ref_url)
         self.compute.terminate_instance(self.context, instance['uuid'])
+
+    def _create_audited_instances(self, count):
+        self.begin = datetime.datetime(2012, 6, 1)
+        self.end = datetime.datetime(2012, 6, 2)
+        instance_ids = []
+        for i in xrange(count):
+            instance_id = self._create_instance({'launched_at': self.begin})
+            instance = db.instance_get(self.context, instance_id)
+            mac = 'DE:AD:BE:EF:00:%02x' % i
+            vif = network_model.VIF(address=mac,
+                    network=network_model.Network(label='net%d' % i))
+            db.instance_info_cache_update(self.context, instance['uuid'],
+                    {'network_info': network_model.NetworkInfo(
+                            [vif]).as_cache()})
+            db.bw_usage_update(self.context, mac, self.begin,
+                               10 * (i + 1), 20 * (i + 1))
+            instance_ids.append(instance_id)
+        return instance_ids
+
+    def _audited_instances(self):
+        return db.instance_get_active_by_window_joined(
+                self.context.elevated(), self.begin, self.end)
+
+    def test_notify_usage_exists_bulk(self):
+        self.flags(usage_audit_chunk_size=1)
+        self._create_audited_instances(2)
+
+        def fail(*args):
+            self.fail('Bulk audits only use the cached network info')
+
+        self.stubs.Set(nova.network.API, 'get_instance_nw_info', fail)
+        sent = compute_utils.notify_usage_exists_bulk(self.context,
+                self._audited_instances(), self.begin, self.end)
+        self.assertEquals(sent, 2)
+        self.assertEquals(len(test_notifier.NOTIFICATIONS), 2)
+        bandwidths = []
+        for msg in test_notifier.NOTIFICATIONS:
+            self.assertEquals(msg['event_type'], 'compute.instance.exists')
+            payload = msg['payload']
+            self.assertEquals(payload['audit_period_beginning'],
+                              str(self.begin))
+            self.assertEquals(payload['audit_period_ending'], str(self.end))
+            bandwidths.append(payload['bandwidth'])
+        self.assertEquals(sorted(bandwidths),
+                          [{'net0': {'bw_in': 10, 'bw_out': 20}},
+                           {'net1': {'bw_in': 20, 'bw_out': 40}}])
+
+    def test_notify_usage_exists_bulk_resumes(self):
+        with utils.tempdir() as tmpdir:
+            self._check_bulk_resumes(os.path.join(tmpdir, 'audit.json'))
+
+    def _check_bulk_resumes(self, checkpoint):
+        self.flags(usage_audit_chunk_size=1,
+                   usage_audit_checkpoint=checkpoint)
+        instance_ids = self._create_audited_instances(2)
+        with open(checkpoint, 'w') as f:
+            json.dump({'period': '%s/%s' % (self.begin, self.end),
+                       'last_id': min(instance_ids)}, f)
+
+        sent = compute_utils.notify_usage_exists_bulk(self.context,
+                self._audited_instances(), self.begin, self.end)
+        self.assertEquals(sent, 1)
+        self.assertEquals(len(test_notifier.NOTIFICATIONS), 1)
+        with open(checkpoint) as f:
+            self.assertEquals(json.load(f)['last_id'], max(instance_ids))
+
+        # Nothing is left to audit for the period, another one starts over
+        sent = compute_utils.notify_usage_exists_bulk(self.context,
+                self._audited_instances(), self.begin, self.end)
+        self.assertEquals(sent, 0)
+        sent = compute_utils.notify_usage_exists_bulk(self.context,
+                self._audited_instances(), self.begin,
+                self.end + datetime.timedelta(days=1))
+        self.assertEquals(sent, 2)
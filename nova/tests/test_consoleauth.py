@@ -22,13 +22,15 @@ Tests for Consoleauth Code.
 
 import time
 
+from nova.consoleauth import manager
+from nova.consoleauth import tokens
 from nova import context
 from nova import db
 from nova import flags
 from nova import log as logging
+from nova import rpc
 from nova import test
 from nova import utils
-from nova.consoleauth import manager
 
 
 FLAGS = flags.FLAGS
@@ -52,3 +54,112 @@ class ConsoleauthTestCase(test.TestCase):
         self.assertTrue(self.manager.check_token(self.context, token))
         time.sleep(1.1)
         self.assertFalse(self.manager.check_token(self.context, token))
+
+    def test_reauthorized_token_keeps_new_expiry(self):
+        now = [1000.0]
+        self.stubs.Set(time, 'time', lambda: now[0])
+        self.flags(console_token_ttl=10)
+        self.manager.authorize_console(self.context, 'a', 'novnc',
+                                       '127.0.0.1', '5900', '')
+        self.manager.authorize_console(self.context, 'b', 'novnc',
+                                       '127.0.0.1', '5901', '')
+        now[0] += 5
+        self.manager.authorize_console(self.context, 'a', 'novnc',
+                                       '127.0.0.1', '5900', '')
+        now[0] += 6
+        self.assertTrue(self.manager.check_token(self.context, 'a'))
+        self.assertFalse(self.manager.check_token(self.context, 'b'))
+        self.assertEqual(self.manager.tokens.keys(), ['a'])
+        now[0] += 5
+        self.assertFalse(self.manager.check_token(self.context, 'a'))
+        self.assertEqual(self.manager._expiry, [])
+
+
+class SignedConsoleTokenTestCase(test.TestCase):
+    """Test Case for signed console tokens."""
+
+    def setUp(self):
+        super(SignedConsoleTokenTestCase, self).setUp()
+        self.flags(console_token_keys=['k1:secret'])
+        self.manager = utils.import_object(FLAGS.consoleauth_manager)
+        self.context = context.get_admin_context()
+        self.now = 1000.0
+        self.stubs.Set(time, 'time', lambda: self.now)
+
+    def _sign(self, ttl=600):
+        return tokens.sign('xvpvnc', '10.0.0.1', 5900, '/path', ttl)
+
+    def test_no_keys(self):
+        self.flags(console_token_keys=[])
+        self.assertEqual(self._sign(), None)
+
+    def test_check_signed_token(self):
+        token = self._sign()
+        self.assertTrue(tokens.is_signed(token))
+        info = self.manager.check_token(self.context, token)
+        self.assertEqual(info['host'], '10.0.0.1')
+        self.assertEqual(info['port'], 5900)
+        self.assertEqual(info['internal_access_path'], '/path')
+        self.assertEqual(info['console_type'], 'xvpvnc')
+        self.assertEqual(info['token'], token)
+        self.assertEqual(self.manager.tokens, {})
+
+    def test_tampered_token(self):
+        version, key_id, payload, signature = self._sign().split('.')
+        other = self._sign(ttl=6000).split('.')[2]
+        for token in ('%s.%s.%s.%s' % (version, key_id, other, signature),
+                      '%s.%s.%s.%s' % (version, 'k2', payload, signature),
+                      '%s.%s.%s' % (version, key_id, payload),
+                      'v1.garbage'):
+            self.assertEqual(self.manager.check_token(self.context, token),
+                             None)
+
+    def test_expiry(self):
+        token = self._sign(ttl=10)
+        self.now += 9
+        self.assertTrue(self.manager.check_token(self.context, token))
+        self.now += 1
+        self.assertFalse(self.manager.check_token(self.context, token))
+
+    def test_key_rotation(self):
+        old_token = self._sign()
+        self.flags(console_token_keys=['k2:other', 'k1:secret'])
+        new_token = self._sign()
+        self.assertEqual(new_token.split('.')[1], 'k2')
+        self.assertTrue(self.manager.check_token(self.context, old_token))
+        self.assertTrue(self.manager.check_token(self.context, new_token))
+        self.flags(console_token_keys=['k2:other'])
+        self.assertFalse(self.manager.check_token(self.context, old_token))
+        self.assertTrue(self.manager.check_token(self.context, new_token))
+
+    def test_revocation(self):
+        token = self._sign(ttl=10)
+        token_id = tokens.decode(token)['id']
+        self.manager.revoke_token(self.context, token)
+        self.assertFalse(self.manager.check_token(self.context, token))
+        self.assertEqual(self.manager.get_revoked_tokens(self.context),
+                         [(token_id, 1010)])
+        self.now += 10
+        self.assertEqual(self.manager.get_revoked_tokens(self.context), [])
+
+    def test_verifier_syncs_revocations(self):
+        self.flags(console_token_revocation_interval=30)
+        token = self._sign()
+        calls = []
+
+        def fake_call(context, topic, msg):
+            calls.append(msg['method'])
+            return self.manager.get_revoked_tokens(context)
+
+        self.stubs.Set(rpc, 'call', fake_call)
+        verifier = tokens.Verifier()
+        self.assertEqual(verifier.verify(token)['host'], '10.0.0.1')
+        self.manager.revoke_token(self.context, token)
+        # The revocation is only seen once the list is fetched again
+        self.now += 29
+        self.assertTrue(verifier.verify(token))
+        self.now += 1
+        self.assertEqual(verifier.verify(token), None)
+        self.assertEqual(calls, ['get_revoked_tokens'] * 2)
+        self.assertEqual(verifier.verify('v1.forged.token.sig'), None)
+        self.assertEqual(len(calls), 2)
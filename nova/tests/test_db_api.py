@@ -103,6 +103,28 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(0, len(results))
         db.migration_update(ctxt, migration.id, {"status": "CONFIRMED"})
 
+    def test_service_heartbeat(self):
+        ctxt = context.get_admin_context()
+        service = db.service_create(ctxt, {'host': 'host1',
+                                           'binary': 'nova-compute',
+                                           'topic': 'compute',
+                                           'report_count': 0,
+                                           'availability_zone': 'nova'})
+        utils.set_time_override()
+        try:
+            db.service_heartbeat(ctxt, service['id'], 'zone2')
+            db.service_heartbeat(ctxt, service['id'], 'zone2')
+            service = db.service_get(ctxt, service['id'])
+            self.assertEqual(service['report_count'], 2)
+            self.assertEqual(service['availability_zone'], 'zone2')
+            self.assertEqual(service['updated_at'], utils.utcnow())
+        finally:
+            utils.clear_time_override()
+
+        db.service_destroy(ctxt, service['id'])
+        self.assertRaises(exception.ServiceNotFound, db.service_heartbeat,
+                          ctxt, service['id'], 'zone2')
+
     def test_instance_get_all_hung_in_rebooting(self):
         ctxt = context.get_admin_context()
 
@@ -300,6 +322,18 @@ class DbApiTestCase(test.TestCase):
         db.dnsdomain_unregister(ctxt, domain1)
         db.dnsdomain_unregister(ctxt, domain2)
 
+    def test_network_get_all_by_ids(self):
+        ctxt = context.get_admin_context()
+        net1 = db.network_create_safe(ctxt, {'label': 'net1'})
+        net2 = db.network_create_safe(ctxt, {'label': 'net2'})
+        networks = db.network_get_all_by_ids(ctxt, [net1['id'], net2['id']])
+        self.assertEqual(sorted(network['label'] for network in networks),
+                         ['net1', 'net2'])
+        self.assertEqual(db.network_get_all_by_ids(ctxt, []), [])
+        self.assertRaises(exception.NetworkNotFound,
+                          db.network_get_all_by_ids, ctxt,
+                          [net1['id'], 1000000])
+
     def test_network_get_associated_fixed_ips(self):
         ctxt = context.get_admin_context()
         values = {'host': 'foo', 'hostname': 'myname'}
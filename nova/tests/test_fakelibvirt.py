@@ -225,6 +225,33 @@ class FakeLibvirtTests(test.TestCase):
         dom.managedSaveRemove(0)
         self.assertEquals(dom.hasManagedSaveImage(0), 0)
 
+    def test_block_copy(self):
+        conn = self.get_openAuth_curry_func()('qemu:///system')
+        conn.defineXML(get_vm_xml())
+        dom = conn.lookupByName('testname')
+        dom.createWithFlags(0)
+        self.assertEquals(dom.isPersistent(), 1)
+        self.assertRaises(libvirt.libvirtError, dom.blockRebase,
+                          '/somefile', '/somecopy', 0,
+                          libvirt.VIR_DOMAIN_BLOCK_REBASE_COPY)
+
+        dom.undefine()
+        self.assertEquals(dom.isPersistent(), 0)
+        self.assertEquals(conn.lookupByName('testname'), dom)
+        dom.blockRebase('/somefile', '/somecopy', 0,
+                        libvirt.VIR_DOMAIN_BLOCK_REBASE_COPY)
+        while True:
+            info = dom.blockJobInfo('/somefile', 0)
+            if info['cur'] == info['end']:
+                break
+        dom.blockJobAbort('/somefile', 0)
+        self.assertEquals(dom.blockJobInfo('/somefile', 0), {})
+
+        conn.defineXML(get_vm_xml())
+        self.assertEquals(dom.isPersistent(), 1)
+        self.assertTrue(dom.isActive())
+        self.assertEquals(conn.lookupByName('testname'), dom)
+
     def test_listDomainsId_and_lookupById(self):
         conn = self.get_openAuth_curry_func()('qemu:///system')
         self.assertEquals(conn.listDomainsID(), [])
@@ -123,35 +123,103 @@ class ImageCacheManagerTestCase(test.TestCase):
                                 '10737418240')
         self.assertFalse(unexpected in image_cache_manager.originals)
 
+    def _stub_instances(self):
+        local = [{'image_ref': '1',
+                  'host': FLAGS.host,
+                  'name': 'inst-1',
+                  'uuid': '123'},
+                 {'image_ref': '2',
+                  'host': FLAGS.host,
+                  'name': 'inst-2',
+                  'uuid': '456'}]
+        remote = [{'image_ref': '2',
+                   'host': 'remotehost',
+                   'name': 'inst-3',
+                   'uuid': '789'}]
+        calls = []
+
+        def instance_get_all(context):
+            calls.append(context)
+            return local + remote
+
+        self.stubs.Set(db, 'instance_get_all_by_host',
+                       lambda x, y: [instance for instance in local
+                                     if instance['host'] == y])
+        self.stubs.Set(db, 'instance_get_all', instance_get_all)
+        self.local_instances = local
+        return calls
+
     def test_list_running_instances(self):
-        self.stubs.Set(db, 'instance_get_all',
-                       lambda x: [{'image_ref': '1',
-                                   'host': FLAGS.host,
-                                   'name': 'inst-1',
-                                   'uuid': '123'},
-                                  {'image_ref': '2',
-                                   'host': FLAGS.host,
-                                   'name': 'inst-2',
-                                   'uuid': '456'},
-                                  {'image_ref': '2',
-                                   'host': 'remotehost',
-                                   'name': 'inst-3',
-                                   'uuid': '789'}])
+        calls = self._stub_instances()
 
-        image_cache_manager = imagecache.ImageCacheManager()
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            image_cache_manager = imagecache.ImageCacheManager()
 
-        # The argument here should be a context, but it's mocked out
-        image_cache_manager._list_running_instances(None)
+            # The argument here should be a context, but it's mocked out
+            image_cache_manager._list_running_instances(None)
 
+        # Only the instances of this node were listed
+        self.assertEqual(calls, [])
         self.assertEqual(len(image_cache_manager.used_images), 2)
         self.assertTrue(image_cache_manager.used_images['1'] ==
                         (1, 0, ['inst-1']))
         self.assertTrue(image_cache_manager.used_images['2'] ==
-                        (1, 1, ['inst-2', 'inst-3']))
+                        (1, 0, ['inst-2']))
 
         self.assertEqual(len(image_cache_manager.image_popularity), 2)
         self.assertEqual(image_cache_manager.image_popularity['1'], 1)
-        self.assertEqual(image_cache_manager.image_popularity['2'], 2)
+        self.assertEqual(image_cache_manager.image_popularity['2'], 1)
+
+    def test_list_running_instances_shared_storage(self):
+        calls = self._stub_instances()
+
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            os.mkdir(os.path.join(tmpdir, 'inst-3'))
+            open(os.path.join(tmpdir, 'inst-3', 'disk'), 'w').close()
+            image_cache_manager = imagecache.ImageCacheManager()
+
+            # The argument here should be a context, but it's mocked out
+            image_cache_manager._list_running_instances(None)
+
+            self.assertEqual(len(calls), 1)
+            self.assertTrue(image_cache_manager.used_images['2'] ==
+                            (1, 1, ['inst-2', 'inst-3']))
+            self.assertEqual(image_cache_manager.image_popularity['2'], 2)
+            self.assertEqual(image_cache_manager.instance_names['inst-3'],
+                             '789')
+
+            # The instances of other nodes are only listed again when an
+            # unknown instance directory shows up
+            image_cache_manager._list_running_instances(None)
+            self.assertEqual(len(calls), 1)
+            self.assertTrue(image_cache_manager.used_images['2'] ==
+                            (1, 1, ['inst-2', 'inst-3']))
+
+            os.mkdir(os.path.join(tmpdir, 'inst-4'))
+            open(os.path.join(tmpdir, 'inst-4', 'disk'), 'w').close()
+            image_cache_manager._list_running_instances(None)
+            self.assertEqual(len(calls), 2)
+
+    def test_list_running_instances_moved_to_other_node(self):
+        calls = self._stub_instances()
+
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            for name in ('inst-2', 'inst-3'):
+                os.mkdir(os.path.join(tmpdir, name))
+                open(os.path.join(tmpdir, name, 'disk'), 'w').close()
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager._list_running_instances(None)
+            self.assertEqual(len(calls), 1)
+
+            # inst-2 is migrated to another node sharing instances_path
+            self.local_instances[1]['host'] = 'remotehost'
+            image_cache_manager._list_running_instances(None)
+            self.assertEqual(len(calls), 2)
+            self.assertTrue(image_cache_manager.used_images['2'] ==
+                            (0, 2, ['inst-2', 'inst-3']))
 
     def test_list_backing_images_small(self):
         self.stubs.Set(os, 'listdir',
@@ -217,6 +285,39 @@ class ImageCacheManagerTestCase(test.TestCase):
         self.assertEquals(inuse_images, [found])
         self.assertEquals(len(image_cache_manager.unexplained_images), 0)
 
+    def test_list_backing_images_cached(self):
+        lookups = []
+
+        def get_disk_backing_file(path):
+            lookups.append(path)
+            return 'e97222e91fc4241f49a7f520d1dcf446751129b3_sm'
+
+        self.stubs.Set(virtutils, 'get_disk_backing_file',
+                       get_disk_backing_file)
+
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            os.mkdir(os.path.join(tmpdir, 'instance-00000001'))
+            disk_path = os.path.join(tmpdir, 'instance-00000001', 'disk')
+            open(disk_path, 'w').close()
+
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager.instance_names = self.stock_instance_names
+            inuse_images = image_cache_manager._list_backing_images()
+            self.assertEqual(len(inuse_images), 1)
+            self.assertEqual(lookups, [disk_path])
+
+            # qemu-img is only asked again about replaced disks
+            self.assertEqual(image_cache_manager._list_backing_images(),
+                             inuse_images)
+            self.assertEqual(lookups, [disk_path])
+
+            os.rename(disk_path, disk_path + '.old')
+            open(disk_path, 'w').close()
+            self.assertEqual(image_cache_manager._list_backing_images(),
+                             inuse_images)
+            self.assertEqual(lookups, [disk_path, disk_path])
+
     def test_find_base_file_nothing(self):
         self.stubs.Set(os.path, 'exists', lambda x: False)
 
@@ -347,6 +448,55 @@ class ImageCacheManagerTestCase(test.TestCase):
                 # side effect of creating the checksum
                 self.assertTrue(os.path.exists('%s.sha1' % fname))
 
+    def test_verify_checksum_unchanged(self):
+        img = {'container_format': 'ami', 'id': '42'}
+        hashed = []
+        orig_hash_file = utils.hash_file
+
+        def hash_file(f):
+            hashed.append(f.name)
+            return orig_hash_file(f)
+
+        with self._make_base_file() as fname:
+            self.stubs.Set(utils, 'hash_file', hash_file)
+            image_cache_manager = imagecache.ImageCacheManager()
+            self.assertTrue(image_cache_manager._verify_checksum(img, fname))
+            self.assertEqual(len(hashed), 1)
+
+            # Unchanged files, even when touched, aren't hashed again
+            image_cache_manager._reset_state()
+            image_cache_manager._touch(fname)
+            self.assertTrue(image_cache_manager._verify_checksum(img, fname))
+            self.assertEqual(len(hashed), 1)
+            self.assertEqual(image_cache_manager.hashed_bytes, 0)
+
+            # Modified files are
+            f = open(fname, 'w')
+            f.write('corrupted data')
+            f.close()
+            self.assertFalse(image_cache_manager._verify_checksum(img, fname))
+            self.assertEqual(len(hashed), 2)
+
+    def test_verify_checksum_budget(self):
+        img = {'container_format': 'ami', 'id': '42'}
+        self.flags(checksum_base_images_budget_mb=1)
+
+        with self._make_base_file() as fname:
+            image_cache_manager = imagecache.ImageCacheManager()
+
+            # The first file of a pass is hashed whatever its size
+            self.assertTrue(image_cache_manager._verify_checksum(img, fname))
+            self.assertEqual(image_cache_manager.hashed_bytes, 4)
+
+            # Others wait for a later pass once the budget is spent
+            image_cache_manager._verified.clear()
+            image_cache_manager.hashed_bytes = 1024 * 1024
+            self.assertEqual(image_cache_manager._verify_checksum(img, fname),
+                             None)
+
+            image_cache_manager._reset_state()
+            self.assertTrue(image_cache_manager._verify_checksum(img, fname))
+
     @contextlib.contextmanager
     def _make_base_file(self, checksum=True):
         """Make a base file for testing."""
@@ -622,16 +772,18 @@ class ImageCacheManagerTestCase(test.TestCase):
 
         self.stubs.Set(os.path, 'isfile', lambda x: isfile(x))
 
-        # Fake the database call which lists running instances
-        self.stubs.Set(db, 'instance_get_all',
-                       lambda x: [{'image_ref': '1',
-                                   'host': FLAGS.host,
-                                   'name': 'instance-1',
-                                   'uuid': '123'},
-                                  {'image_ref': '1',
-                                   'host': FLAGS.host,
-                                   'name': 'instance-2',
-                                   'uuid': '456'}])
+        # Fake the database calls which list running instances
+        instances = [{'image_ref': '1',
+                      'host': FLAGS.host,
+                      'name': 'instance-1',
+                      'uuid': '123'},
+                     {'image_ref': '1',
+                      'host': FLAGS.host,
+                      'name': 'instance-2',
+                      'uuid': '456'}]
+        self.stubs.Set(db, 'instance_get_all_by_host',
+                       lambda x, y: instances)
+        self.stubs.Set(db, 'instance_get_all', lambda x: instances)
 
         image_cache_manager = imagecache.ImageCacheManager()
 
@@ -721,15 +873,15 @@ class ImageCacheManagerTestCase(test.TestCase):
             os.mkdir(os.path.join(tmpdir, '_base'))
 
             # Fake the database call which lists running instances
-            self.stubs.Set(db, 'instance_get_all',
-                           lambda x: [{'image_ref': '1',
-                                       'host': FLAGS.host,
-                                       'name': 'instance-1',
-                                       'uuid': '123'},
-                                      {'image_ref': '1',
-                                       'host': FLAGS.host,
-                                       'name': 'instance-2',
-                                       'uuid': '456'}])
+            self.stubs.Set(db, 'instance_get_all_by_host',
+                           lambda x, y: [{'image_ref': '1',
+                                          'host': FLAGS.host,
+                                          'name': 'instance-1',
+                                          'uuid': '123'},
+                                         {'image_ref': '1',
+                                          'host': FLAGS.host,
+                                          'name': 'instance-2',
+                                          'uuid': '456'}])
 
             def touch(filename):
                 f = open(filename, 'w')
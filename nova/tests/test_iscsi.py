@@ -114,3 +114,38 @@ class IetAdmTestCase(test.TestCase, TargetAdminTestCase):
                 "--params Path=%(path)s,Type=fileio",
         "ietadm --op delete --tid=%(tid)s --lun=%(lun)d",
         "ietadm --op delete --tid=%(tid)s"])
+
+
+class ShowTargetsTestCase(test.TestCase):
+
+    def test_tgtadm_show_targets(self):
+        out = "\n".join([
+            "Target 1: iqn.2010-10.org.openstack:volume-00000001",
+            "    System information:",
+            "        Driver: iscsi",
+            "    LUN information:",
+            "        LUN: 0",
+            "            Type: controller",
+            "        LUN: 1",
+            "            Type: disk",
+            "Target 2: iqn.2010-10.org.openstack:volume-00000002",
+            "    LUN information:",
+            "        LUN: 0",
+            "            Type: controller"])
+        tgtadm = iscsi.TgtAdm(execute=lambda *cmd, **kwargs: (out, None))
+        self.assertEqual(tgtadm.show_targets(), {
+            1: ('iqn.2010-10.org.openstack:volume-00000001', set([0])),
+            2: ('iqn.2010-10.org.openstack:volume-00000002', set()),
+        })
+
+    def test_ietadm_show_targets(self):
+        out = "\n".join([
+            "tid:3 name:iqn.2010-10.org.openstack:volume-00000003",
+            "\tlun:0 state:0 iotype:fileio iomode:wt path:/dev/vg/vol",
+            "tid:4 name:iqn.2010-10.org.openstack:volume-00000004"])
+        ietadm = iscsi.IetAdm()
+        self.stubs.Set(ietadm, '_read_volumes', lambda: out)
+        self.assertEqual(ietadm.show_targets(), {
+            3: ('iqn.2010-10.org.openstack:volume-00000003', set([0])),
+            4: ('iqn.2010-10.org.openstack:volume-00000004', set()),
+        })
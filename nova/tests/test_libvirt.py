@@ -39,17 +39,20 @@ from nova.compute import instance_types
 from nova.compute import power_state
 from nova.compute import utils as compute_utils
 from nova.compute import vm_states
+from nova.image import fake as fake_image
 from nova.virt import images
 from nova.virt import driver
 from nova.virt import firewall as base_firewall
 from nova.virt.libvirt import config
 from nova.virt.libvirt import connection
 from nova.virt.libvirt import firewall
+from nova.virt.libvirt import transfer
 from nova.virt.libvirt import volume
 from nova.volume import driver as volume_driver
 from nova.virt.libvirt import utils as libvirt_utils
 from nova.tests import fake_network
 from nova.tests import fake_libvirt_utils
+from nova.tests import fakelibvirt
 
 
 try:
@@ -712,6 +715,7 @@ class LibvirtConnTestCase(test.TestCase):
 
         self.mox.StubOutWithMock(connection.LibvirtConnection, '_conn')
         connection.LibvirtConnection._conn.lookupByName = self.fake_lookup
+        connection.LibvirtConnection._conn.getLibVersion = lambda: 9011
         self.mox.StubOutWithMock(connection.utils, 'execute')
         connection.utils.execute = self.fake_execute
 
@@ -746,6 +750,7 @@ class LibvirtConnTestCase(test.TestCase):
 
         self.mox.StubOutWithMock(connection.LibvirtConnection, '_conn')
         connection.LibvirtConnection._conn.lookupByName = self.fake_lookup
+        connection.LibvirtConnection._conn.getLibVersion = lambda: 9011
         self.mox.StubOutWithMock(connection.utils, 'execute')
         connection.utils.execute = self.fake_execute
 
@@ -781,6 +786,7 @@ class LibvirtConnTestCase(test.TestCase):
 
         self.mox.StubOutWithMock(connection.LibvirtConnection, '_conn')
         connection.LibvirtConnection._conn.lookupByName = self.fake_lookup
+        connection.LibvirtConnection._conn.getLibVersion = lambda: 9011
         self.mox.StubOutWithMock(connection.utils, 'execute')
         connection.utils.execute = self.fake_execute
 
@@ -820,6 +826,7 @@ class LibvirtConnTestCase(test.TestCase):
 
         self.mox.StubOutWithMock(connection.LibvirtConnection, '_conn')
         connection.LibvirtConnection._conn.lookupByName = self.fake_lookup
+        connection.LibvirtConnection._conn.getLibVersion = lambda: 9011
         self.mox.StubOutWithMock(connection.utils, 'execute')
         connection.utils.execute = self.fake_execute
 
@@ -854,6 +861,7 @@ class LibvirtConnTestCase(test.TestCase):
 
         self.mox.StubOutWithMock(connection.LibvirtConnection, '_conn')
         connection.LibvirtConnection._conn.lookupByName = self.fake_lookup
+        connection.LibvirtConnection._conn.getLibVersion = lambda: 9011
         self.mox.StubOutWithMock(connection.utils, 'execute')
         connection.utils.execute = self.fake_execute
 
@@ -2117,6 +2125,15 @@ class LibvirtUtilsTestCase(test.TestCase):
         self.mox.ReplayAll()
         libvirt_utils.create_cow_image('/some/path', '/the/new/cow')
 
+    def test_create_cow_image_with_size(self):
+        self.mox.StubOutWithMock(utils, 'execute')
+        utils.execute('qemu-img', 'create', '-f', 'qcow2',
+                      '-o', 'cluster_size=2M,backing_file=/some/path',
+                      '/the/new/cow', 1024)
+        # Start test
+        self.mox.ReplayAll()
+        libvirt_utils.create_cow_image('/some/path', '/the/new/cow', 1024)
+
     def test_get_disk_size(self):
         self.mox.StubOutWithMock(utils, 'execute')
         utils.execute('qemu-img',
@@ -2130,6 +2147,13 @@ disk size: 4.4M''', ''))
         self.mox.ReplayAll()
         self.assertEquals(libvirt_utils.get_disk_size('/some/path'), 4592640)
 
+    def test_copy_image_to_host(self):
+        self.mox.StubOutWithMock(utils, 'execute')
+        utils.execute('rsync', '--sparse', '/some/path', 'dest:/other/path')
+        # Start test
+        self.mox.ReplayAll()
+        libvirt_utils.copy_image('/some/path', '/other/path', host='dest')
+
     def test_copy_image(self):
         dst_fd, dst_path = tempfile.mkstemp()
         try:
@@ -2204,6 +2228,31 @@ disk size: 4.4M''', ''))
         libvirt_utils.extract_snapshot('/path/to/disk/image', 'qcow2',
                                        'snap1', '/extracted/snap', 'raw')
 
+    def test_extract_snapshot_with_progress(self):
+        self.mox.StubOutWithMock(libvirt_utils, '_execute_with_progress')
+        progress = lambda percent: None
+        libvirt_utils._execute_with_progress(['qemu-img', 'convert',
+                                              '-f', 'qcow2', '-O', 'raw',
+                                              '-p', '/path/to/disk/image',
+                                              '/extracted/snap'], progress)
+
+        # Start test
+        self.mox.ReplayAll()
+        libvirt_utils.extract_snapshot('/path/to/disk/image', 'qcow2',
+                                       None, '/extracted/snap', 'raw',
+                                       progress=progress)
+
+    def test_execute_with_progress(self):
+        reports = []
+        libvirt_utils._execute_with_progress(
+                ['printf', '    (0.00/100%%)\r    (42.50/100%%)\r'
+                           '    (100.00/100%%)\r\n'], reports.append)
+        self.assertEqual(reports, [0.0, 42.5, 100.0])
+
+        self.assertRaises(exception.ProcessExecutionError,
+                          libvirt_utils._execute_with_progress,
+                          ['false'], reports.append)
+
     def test_load_file(self):
         dst_fd, dst_path = tempfile.mkstemp()
         try:
@@ -2367,23 +2416,33 @@ class LibvirtConnectionTestCase(test.TestCase):
         def fake_execute(*args, **kwargs):
             pass
 
+        hosts = []
+
+        def fake_send(disk_transfer, src_dir, disk_info):
+            hosts.append(disk_transfer.host)
+            self.assertTrue(src_dir.endswith('_resize'))
+            return [dict(info, sent_as='raw') for info in disk_info]
+
         self.stubs.Set(self.libvirtconnection, 'get_instance_disk_info',
                        fake_get_instance_disk_info)
         self.stubs.Set(self.libvirtconnection, '_destroy', fake_destroy)
         self.stubs.Set(self.libvirtconnection, 'get_host_ip_addr',
                        fake_get_host_ip_addr)
         self.stubs.Set(utils, 'execute', fake_execute)
+        self.stubs.Set(transfer.DiskTransfer, 'send', fake_send)
+        sent_info = [dict(info, sent_as='raw') for info in disk_info]
 
         ins_ref = self._create_instance()
         """ dest is different host case """
         out = self.libvirtconnection.migrate_disk_and_power_off(
                None, ins_ref, '10.0.0.2', None, None)
-        self.assertEquals(out, disk_info_text)
+        self.assertEquals(utils.loads(out), sent_info)
 
         """ dest is same host case """
         out = self.libvirtconnection.migrate_disk_and_power_off(
                None, ins_ref, '10.0.0.1', None, None)
-        self.assertEquals(out, disk_info_text)
+        self.assertEquals(utils.loads(out), sent_info)
+        self.assertEquals(hosts, ['10.0.0.2', None])
 
     def test_wait_for_running(self):
         """Test for nova.virt.libvirt.connection.LivirtConnection
@@ -2465,6 +2524,62 @@ class LibvirtConnectionTestCase(test.TestCase):
                       disk_info_text, None, None, None)
         self.assertTrue(isinstance(ref, eventlet.event.Event))
 
+    def _finish_migration(self, disk_info, root_gb=10):
+        """Run finish_migration, return the qemu-img commands and the
+        disks extended."""
+        commands = []
+        extended = []
+
+        def fake_execute(*args, **kwargs):
+            if args[0] == 'qemu-img':
+                commands.append(args)
+
+        self.flags(use_cow_images=True)
+        self.stubs.Set(connection.disk, 'extend',
+                       lambda path, size: extended.append(path))
+        self.stubs.Set(self.libvirtconnection, 'to_xml',
+                       lambda instance, network_info: '')
+        self.stubs.Set(self.libvirtconnection, 'plug_vifs',
+                       lambda instance, network_info: None)
+        self.stubs.Set(self.libvirtconnection, '_create_image',
+                       lambda *args, **kwargs: None)
+        self.stubs.Set(self.libvirtconnection, '_create_new_domain',
+                       lambda xml: None)
+        self.stubs.Set(utils, 'execute', fake_execute)
+        fw = base_firewall.NoopFirewallDriver()
+        self.stubs.Set(self.libvirtconnection, 'firewall_driver', fw)
+
+        ins_ref = self._create_instance({'root_gb': root_gb})
+        self.libvirtconnection.finish_migration(
+                      context.get_admin_context(), None, ins_ref,
+                      utils.dumps(disk_info), None, None, None)
+        return commands, extended
+
+    def test_finish_migration_keeps_overlays(self):
+        disk_info = [{'type': 'qcow2', 'path': '/test/disk',
+                      'virt_disk_size': 10 * 1024 * 1024 * 1024,
+                      'backing_file': 'abcd', 'sent_as': 'qcow2'},
+                     {'type': 'qcow2', 'path': '/test/disk.local',
+                      'virt_disk_size': 20 * 1024 * 1024 * 1024,
+                      'backing_file': 'efgh', 'sent_as': 'raw'}]
+        commands, _extended = self._finish_migration(disk_info)
+        self.assertEqual([args[-2] for args in commands],
+                         ['/test/disk.local'])
+
+    def test_finish_migration_flattens_growing_overlays(self):
+        disk_info = [{'type': 'qcow2', 'path': '/test/disk',
+                      'virt_disk_size': 10 * 1024 * 1024 * 1024,
+                      'backing_file': 'abcd', 'sent_as': 'qcow2'}]
+        commands, extended = self._finish_migration(disk_info, root_gb=20)
+        # flattened to raw before the filesystem is grown, then back
+        # to qcow2 without a backing file
+        self.assertEqual(commands,
+                         [('qemu-img', 'convert', '-f', 'qcow2', '-O', 'raw',
+                           '/test/disk', '/test/disk_raw'),
+                          ('qemu-img', 'convert', '-f', 'raw', '-O', 'qcow2',
+                           '/test/disk', '/test/disk_qcow')])
+        self.assertEqual(extended, ['/test/disk'])
+
     def test_finish_revert_migration(self):
         """Test for nova.virt.libvirt.connection.LivirtConnection
         .finish_revert_migration. """
@@ -2499,6 +2614,313 @@ class LibvirtConnectionTestCase(test.TestCase):
             self.assertTrue(isinstance(ref, eventlet.event.Event))
 
 
+class LibvirtSnapshotTestCase(test.TestCase):
+    """Snapshots of a running fake domain whose disk is a real file."""
+
+    def setUp(self):
+        super(LibvirtSnapshotTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.disk_path = os.path.join(self.tmpdir, 'disk')
+        self.disk = ''.join(chr(i % 251) for i in xrange(8 * 65536))
+        with open(self.disk_path, 'wb') as disk:
+            disk.write(self.disk)
+
+        self.flags(libvirt_type='qemu',
+                   image_service='nova.image.fake.FakeImageService')
+        self.stubs.Set(connection, 'libvirt', fakelibvirt)
+        self.stubs.Set(connection, 'libvirt_utils', fake_libvirt_utils)
+        self.stubs.Set(connection, 'SNAPSHOT_POLL_INTERVAL', 0)
+        self.stubs.Set(fake_libvirt_utils, 'file_open',
+                       libvirt_utils.file_open)
+        self.stubs.Set(fake_libvirt_utils, 'get_disk_size',
+                       lambda path: len(self.disk))
+        self.stubs.Set(fake_libvirt_utils, 'get_disk_backing_file',
+                       lambda path, basename=True: '/base/image')
+        self.stubs.Set(fake_libvirt_utils, 'extract_snapshot',
+                       self._extract_snapshot)
+        self.stubs.Set(fake_image._FakeImageService, 'update', self._update)
+
+        self.events = []
+        self.uploaded = None
+        self.extraction_error = None
+        self.conn = connection.LibvirtConnection(False)
+        self.dom = self.conn._conn.defineXML(self._domain_xml())
+        self.dom.create()
+        self.stubs.Set(self.dom, 'managedSave', self._managed_save)
+        self.stubs.Set(self.dom, 'create', self._create)
+
+        self.context = context.get_admin_context()
+        image_service = fake_image.FakeImageService()
+        self.image_id = image_service.create(self.context,
+                                             {'name': 'snap-1'})['id']
+        self.instance = {'name': 'instance-00000001',
+                         'uuid': 'd7b5a6b1-2d1c-4c8e-9b57-6a4b1c5a2f0e',
+                         'image_ref': '155d900f-4e14-4e4c-a73d-069cbf4541e6',
+                         'kernel_id': None,
+                         'ramdisk_id': None,
+                         'project_id': 'fake'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(LibvirtSnapshotTestCase, self).tearDown()
+
+    def _domain_xml(self):
+        return """<domain type='qemu'>
+  <name>instance-00000001</name>
+  <memory>131072</memory>
+  <vcpu>1</vcpu>
+  <os>
+    <type>hvm</type>
+  </os>
+  <devices>
+    <disk type='file' device='disk'>
+      <driver name='qemu' type='qcow2'/>
+      <source file='%s'/>
+      <target dev='vda' bus='virtio'/>
+    </disk>
+  </devices>
+</domain>""" % self.disk_path
+
+    def _managed_save(self, flags):
+        self.events.append('stopped')
+        fakelibvirt.Domain.managedSave(self.dom, flags)
+
+    def _create(self):
+        self.events.append('started')
+        fakelibvirt.Domain.create(self.dom)
+
+    def _extract_snapshot(self, disk_path, source_fmt, snapshot_name,
+                          out_path, dest_fmt, progress=None):
+        self.events.append(('extract', snapshot_name is None))
+        with open(disk_path, 'rb') as source:
+            data = source.read()
+        with open(out_path, 'wb') as out:
+            # Like qemu-img, create the whole image first, and report a
+            # progress running a bit ahead of what was written
+            out.truncate(len(data))
+            for offset in xrange(0, len(data), 65536):
+                if offset and self.extraction_error:
+                    raise self.extraction_error
+                out.write(data[offset:offset + 65536])
+                out.flush()
+                self.events.append('written')
+                if progress is not None:
+                    progress(min(100.0 * out.tell() / len(data) + 0.5,
+                                 100.0))
+                eventlet.sleep(0)
+
+    def _update(self, context, image_id, metadata, data=None):
+        # Reads as much as is available, up to the edge of the extraction
+        chunks = []
+        while True:
+            chunk = data.read(4096)
+            self.events.append('read')
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.uploaded = ''.join(chunks)
+
+    def _enable_live_snapshots(self):
+        self.stubs.Set(fakelibvirt.Connection, 'getLibVersion',
+                       lambda conn: 1000000)
+        self.stubs.Set(fakelibvirt.Connection, 'getVersion',
+                       lambda conn: 1003000)
+
+    def test_live_snapshot_streams_upload(self):
+        self._enable_live_snapshots()
+        self.conn.snapshot(self.context, self.instance, self.image_id)
+
+        self.assertEqual(self.uploaded, self.disk)
+        # The guest kept running and the delta was extracted
+        self.assertEqual(self.events[0], ('extract', True))
+        self.assertFalse('stopped' in self.events)
+        self.assertTrue(self.dom.isActive())
+        self.assertEqual(self.dom.isPersistent(), 1)
+        self.assertEqual(self.dom.blockJobInfo(self.disk_path, 0), {})
+        # The upload began before the extraction was over
+        last_write = len(self.events) - self.events[::-1].index('written')
+        self.assertTrue(self.events.index('read') < last_write)
+
+    def test_snapshot_needs_recent_qemu(self):
+        self.conn.snapshot(self.context, self.instance, self.image_id)
+
+        self.assertEqual(self.uploaded, self.disk)
+        self.assertEqual(self.events[:2], ['stopped', ('extract', False)])
+
+    def test_cold_snapshot_restarts_guest_before_upload_ends(self):
+        self._enable_live_snapshots()
+        self.flags(libvirt_live_snapshot=False)
+        self.conn.snapshot(self.context, self.instance, self.image_id)
+
+        self.assertEqual(self.uploaded, self.disk)
+        self.assertEqual(self.events[:2], ['stopped', ('extract', False)])
+        self.assertEqual(self.events[-1], 'read')
+        started = self.events.index('started')
+        self.assertFalse('written' in self.events[started:])
+        self.assertTrue(self.events.index('read') < started)
+        self.assertTrue(self.dom.isActive())
+
+    def test_snapshot_not_streamed(self):
+        self.flags(libvirt_stream_snapshots=False)
+        self.conn.snapshot(self.context, self.instance, self.image_id)
+
+        self.assertEqual(self.uploaded, self.disk)
+        self.assertEqual(self.events.index('started'),
+                         self.events.index('read') - 1)
+
+    def test_failed_extraction_is_not_uploaded(self):
+        self.extraction_error = exception.ProcessExecutionError()
+        self.assertRaises(exception.ProcessExecutionError, self.conn.snapshot,
+                          self.context, self.instance, self.image_id)
+
+        self.assertEqual(self.uploaded, None)
+        self.assertTrue('started' in self.events)
+        self.assertTrue(self.dom.isActive())
+
+
+class SnapshotStreamTestCase(test.TestCase):
+
+    def test_progress_trails_reports(self):
+        stream = connection._SnapshotStream('/snap', 1024 * 1024)
+        stream.progress(0.5)
+        self.assertEqual(stream.available, 0)
+        stream.progress(10.0)
+        self.assertEqual(stream.available, 0)
+        stream.progress(20.0)
+        self.assertEqual(stream.available, 1024 * 1024 * 9 / 100 // 512 * 512)
+        stream.progress(100.0)
+        self.assertEqual(stream.available, 1024 * 1024 * 19 / 100 // 512 * 512)
+
+
+class DiskTransferTestCase(test.TestCase):
+    """Disk transfers between two local directories."""
+
+    def setUp(self):
+        super(DiskTransferTestCase, self).setUp()
+        self.src_dir = tempfile.mkdtemp()
+        self.instances_path = tempfile.mkdtemp()
+        self.flags(instances_path=self.instances_path)
+        os.mkdir(os.path.join(self.instances_path, FLAGS.base_dir_name))
+        self.dest_dir = os.path.join(self.instances_path, 'instance-00000001')
+        os.mkdir(self.dest_dir)
+        self.flattened = []
+        self.stubs.Set(libvirt_utils, 'extract_snapshot',
+                       self._extract_snapshot)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+        shutil.rmtree(self.instances_path)
+        super(DiskTransferTestCase, self).tearDown()
+
+    def _extract_snapshot(self, disk_path, source_fmt, snapshot_name,
+                          out_path, dest_fmt, progress=None):
+        # Flattening the overlay gives the whole virtual disk
+        self.flattened.append(disk_path)
+        self._write_sparse(out_path)
+
+    def _write_sparse(self, path, size=64 * 1024 * 1024):
+        with open(path, 'wb') as f:
+            f.write('start')
+            f.seek(size - 3)
+            f.write('end')
+
+    def _disk(self, name, disk_type, backing_file=''):
+        with open(os.path.join(self.src_dir, name), 'wb') as f:
+            f.write('%s overlay' % name)
+        return {'type': disk_type,
+                'path': os.path.join(self.dest_dir, name),
+                'backing_file': backing_file,
+                'virt_disk_size': 64 * 1024 * 1024,
+                'disk_size': 4096}
+
+    def _read(self, name):
+        with open(os.path.join(self.dest_dir, name), 'rb') as f:
+            return f.read()
+
+    def test_overlay_sent_when_backing_file_present(self):
+        open(os.path.join(self.instances_path, FLAGS.base_dir_name,
+                          'abcd'), 'w').close()
+        disk_info = [self._disk('disk', 'qcow2', 'abcd')]
+
+        sent = transfer.DiskTransfer().send(self.src_dir, disk_info)
+
+        self.assertEqual(sent[0]['sent_as'], 'qcow2')
+        self.assertEqual(self._read('disk'), 'disk overlay')
+        self.assertEqual(self.flattened, [])
+        self.assertTrue(sent[0]['bytes_sent'] < 64 * 1024)
+
+    def test_overlay_flattened_without_backing_file(self):
+        disk_info = [self._disk('disk', 'qcow2', 'abcd')]
+
+        sent = transfer.DiskTransfer().send(self.src_dir, disk_info)
+
+        self.assertEqual(sent[0]['sent_as'], 'raw')
+        self.assertEqual(self.flattened,
+                         [os.path.join(self.src_dir, 'disk')])
+        self.assertEqual(os.listdir(self.src_dir), ['disk'])
+        # The holes of the flattened disk were neither sent nor written
+        self.assertTrue(sent[0]['bytes_sent'] < 1024 * 1024)
+        copy = os.stat(os.path.join(self.dest_dir, 'disk'))
+        self.assertEqual(copy.st_size, 64 * 1024 * 1024)
+        self.assertTrue(copy.st_blocks * 512 < 1024 * 1024)
+
+    def test_disks_sent_concurrently(self):
+        self.flags(libvirt_disk_transfer_concurrency=2)
+        disk_info = [self._disk('disk', 'raw'),
+                     self._disk('disk.local', 'raw'),
+                     self._disk('disk.swap', 'raw')]
+        copy_image = libvirt_utils.copy_image
+        self.copying = []
+        self.most_copying = 0
+
+        def fake_copy_image(src, dest, host=None):
+            self.copying.append(src)
+            self.most_copying = max(self.most_copying, len(self.copying))
+            eventlet.sleep(0.01)
+            copy_image(src, dest, host)
+            self.copying.remove(src)
+
+        self.stubs.Set(libvirt_utils, 'copy_image', fake_copy_image)
+        sent = transfer.DiskTransfer().send(self.src_dir, disk_info)
+
+        self.assertEqual(self.most_copying, 2)
+        self.assertEqual([info['sent_as'] for info in sent], ['raw'] * 3)
+        for name in ('disk', 'disk.local', 'disk.swap'):
+            self.assertEqual(self._read(name), '%s overlay' % name)
+
+    def test_failure_raised_once_every_disk_is_sent(self):
+        disk_info = [self._disk('disk', 'raw'),
+                     self._disk('disk.local', 'raw')]
+        copy_image = libvirt_utils.copy_image
+
+        def fake_copy_image(src, dest, host=None):
+            if src.endswith('disk'):
+                raise exception.ProcessExecutionError()
+            eventlet.sleep(0.01)
+            copy_image(src, dest, host)
+
+        self.stubs.Set(libvirt_utils, 'copy_image', fake_copy_image)
+        self.assertRaises(exception.ProcessExecutionError,
+                          transfer.DiskTransfer().send, self.src_dir,
+                          disk_info)
+        self.assertEqual(self._read('disk.local'), 'disk.local overlay')
+
+    def test_remote_backing_file_check(self):
+        self.mox.StubOutWithMock(utils, 'execute')
+        base = os.path.join(self.instances_path, FLAGS.base_dir_name)
+        utils.execute('ssh', 'dest', 'test', '-e',
+                      os.path.join(base, 'abcd'))
+        utils.execute('ssh', 'dest', 'test', '-e',
+                      os.path.join(base, 'efgh')).AndRaise(
+                              exception.ProcessExecutionError())
+        self.mox.ReplayAll()
+
+        disk_transfer = transfer.DiskTransfer('dest')
+        self.assertTrue(disk_transfer._has_backing_file('abcd'))
+        self.assertFalse(disk_transfer._has_backing_file('efgh'))
+        self.assertFalse(disk_transfer._has_backing_file(''))
+
+
 class LibvirtNonblockingTestCase(test.TestCase):
     """Test libvirt_nonblocking option"""
 
@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the in-process memcache replacement."""
+
+from nova.common import memorycache
+from nova import test
+from nova import utils
+
+
+class MemoryCacheTestCase(test.TestCase):
+
+    def setUp(self):
+        super(MemoryCacheTestCase, self).setUp()
+        utils.set_time_override()
+        self.client = memorycache.Client([], debug=0, max_items=3)
+
+    def tearDown(self):
+        utils.clear_time_override()
+        super(MemoryCacheTestCase, self).tearDown()
+
+    def _stats(self):
+        return self.client.get_stats()[0][1]
+
+    def test_get_set(self):
+        self.assertEqual(self.client.get('foo'), None)
+        self.assertTrue(self.client.set('foo', 'bar'))
+        self.assertEqual(self.client.get('foo'), 'bar')
+        stats = self._stats()
+        self.assertEqual(stats['get_hits'], 1)
+        self.assertEqual(stats['get_misses'], 1)
+        self.assertEqual(stats['curr_items'], 1)
+
+    def test_expiry(self):
+        self.client.set('short', '1', time=5)
+        self.client.set('long', '2', time=10)
+        self.client.set('forever', '3')
+        utils.advance_time_seconds(5)
+        self.assertEqual(self.client.get('short'), None)
+        self.assertEqual(self.client.get('long'), '2')
+        utils.advance_time_seconds(5)
+        self.assertEqual(self.client.get('forever'), '3')
+        self.assertEqual(sorted(self.client.cache), ['forever'])
+        self.assertEqual(self._stats()['reclaimed'], 2)
+
+    def test_set_again_replaces_timeout(self):
+        self.client.set('foo', '1', time=5)
+        self.client.set('foo', '2', time=20)
+        utils.advance_time_seconds(10)
+        self.assertEqual(self.client.get('foo'), '2')
+        self.client.set('foo', '3')
+        utils.advance_time_seconds(20)
+        self.assertEqual(self.client.get('foo'), '3')
+
+    def test_expiry_heap_stays_bounded(self):
+        for i in xrange(1000):
+            self.client.set('foo', str(i), time=60)
+        self.assertTrue(len(self.client._expiry) < 100)
+        self.assertEqual(self.client.get('foo'), '999')
+
+    def test_lru_eviction(self):
+        for key in ('a', 'b', 'c'):
+            self.client.set(key, key)
+        self.client.get('a')
+        self.client.set('d', 'd')
+        self.assertEqual(sorted(self.client.cache), ['a', 'c', 'd'])
+        self.assertEqual(self._stats()['evictions'], 1)
+
+    def test_add(self):
+        self.assertTrue(self.client.add('foo', '1'))
+        self.assertFalse(self.client.add('foo', '2'))
+        self.assertEqual(self.client.get('foo'), '1')
+
+    def test_incr(self):
+        self.assertEqual(self.client.incr('foo'), None)
+        self.client.set('foo', '1', time=5)
+        self.assertEqual(self.client.incr('foo'), 2)
+        self.assertEqual(self.client.incr('foo', 3), 5)
+        self.assertEqual(self.client.get('foo'), '5')
+        utils.advance_time_seconds(5)
+        self.assertEqual(self.client.incr('foo'), None)
+
+    def test_delete(self):
+        self.client.set('foo', '1', time=5)
+        self.client.delete('foo')
+        self.assertEqual(self.client.get('foo'), None)
+        self.client.set('foo', '2')
+        utils.advance_time_seconds(5)
+        self.assertEqual(self.client.get('foo'), '2')
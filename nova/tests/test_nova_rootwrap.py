@@ -15,11 +15,23 @@
 #    under the License.
 
 import os
+import shutil
+import stat
 import subprocess
+import sys
+import tempfile
 
+from eventlet import greenpool
+
+from nova import exception
+from nova import flags
 from nova.rootwrap import filters
 from nova.rootwrap import wrapper
 from nova import test
+from nova import utils
+
+
+FLAGS = flags.FLAGS
 
 
 class RootwrapTestCase(test.TestCase):
@@ -117,3 +129,74 @@ class RootwrapTestCase(test.TestCase):
         usercmd = ["cat", "/"]
         filtermatch = wrapper.match_filter(self.filters, usercmd)
         self.assertTrue(filtermatch is self.filters[-1])
+
+
+class RootwrapDaemonTestCase(test.TestCase):
+    """Runs commands through a real "nova-rootwrap --daemon" process."""
+
+    def setUp(self):
+        super(RootwrapDaemonTestCase, self).setUp()
+        rootwrap = os.path.join(os.path.dirname(__file__), os.pardir,
+                                os.pardir, 'bin', 'nova-rootwrap')
+        self.flags(root_helper='false',
+                   root_helper_daemon='%s %s --daemon' % (sys.executable,
+                                                           rootwrap))
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        client = utils._ROOTWRAP_CLIENT
+        if client is not None and client._process is not None:
+            client._process.stdin.close()
+            client._process.wait()
+        utils._ROOTWRAP_CLIENT = None
+        shutil.rmtree(self.tmpdir)
+        super(RootwrapDaemonTestCase, self).tearDown()
+
+    def test_socket_belongs_to_sudo_user(self):
+        # As root, hand the socket to nobody, otherwise to ourselves.
+        uid = 65534 if os.getuid() == 0 else os.getuid()
+        gid = 65534 if os.getuid() == 0 else os.getgid()
+        env = dict(os.environ, SUDO_UID=str(uid), SUDO_GID=str(gid))
+        process = subprocess.Popen(FLAGS.root_helper_daemon.split(),
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, env=env)
+        try:
+            path = process.stdout.readline().split()[0]
+            info = os.stat(path)
+            self.assertEqual((info.st_uid, info.st_gid), (uid, gid))
+            self.assertEqual(stat.S_IMODE(info.st_mode), 0600)
+        finally:
+            process.stdin.close()
+            process.wait()
+
+    def test_stdin_and_stdout_are_streamed(self):
+        path = os.path.join(self.tmpdir, 'out')
+        data = ''.join(chr(i % 256) for i in xrange(300000))
+        out, _err = utils.execute('tee', path, process_input=data,
+                                  run_as_root=True)
+        self.assertEqual(out, data)
+        with open(path) as f:
+            self.assertEqual(f.read(), data)
+
+    def test_unauthorized_command(self):
+        try:
+            utils.execute('foo_bar_not_exist_and_not_matched',
+                          run_as_root=True)
+        except exception.ProcessExecutionError, e:
+            self.assertEqual(e.exit_code, 99)
+            self.assertTrue('Unauthorized command' in e.stdout)
+        else:
+            self.fail('Unauthorized command was run')
+
+    def test_daemon_is_reused_by_concurrent_commands(self):
+        def run(i):
+            path = os.path.join(self.tmpdir, str(i))
+            return utils.execute('tee', path, process_input=str(i),
+                                 run_as_root=True)[0]
+
+        pool = greenpool.GreenPool()
+        results = list(pool.imap(run, xrange(10)))
+        self.assertEqual(results, [str(i) for i in xrange(10)])
+        pid = utils._ROOTWRAP_CLIENT._process.pid
+        run(10)
+        self.assertEqual(utils._ROOTWRAP_CLIENT._process.pid, pid)
@@ -21,6 +21,7 @@ Unittets for S3 objectstore clone.
 """
 
 import boto
+import hashlib
 import os
 import shutil
 import tempfile
@@ -128,6 +129,55 @@ class S3APITestCase(test.TestCase):
 
         self._ensure_no_buckets(bucket.get_all_keys())
 
+    def test_large_key_round_trip(self):
+        """Objects larger than one chunk are streamed intact."""
+        contents = ''.join(chr(i % 251) for i in xrange(
+            s3server.CHUNK_SIZE * 3 + 17))
+        b = self.conn.create_bucket('testbucket')
+        k = b.new_key('bigkey')
+        k.set_contents_from_string(contents)
+        self.assertEquals(k.etag.strip('"'), hashlib.md5(contents).hexdigest())
+
+        key = self.conn.get_bucket('testbucket').get_key('bigkey')
+        self.assertEquals(key.get_contents_as_string(), contents)
+        self.assertEquals(os.listdir(os.path.join(FLAGS.buckets_path,
+                                                  'testbucket')),
+                          ['bigkey'])
+
+    def test_get_key_range(self):
+        """Range requests return the requested slice of the object."""
+        b = self.conn.create_bucket('testbucket')
+        k = b.new_key('somekey')
+        k.set_contents_from_string('0123456789')
+
+        key = self.conn.get_bucket('testbucket').get_key('somekey')
+        for byte_range, expected in (('bytes=2-4', '234'),
+                                     ('bytes=7-', '789'),
+                                     ('bytes=-3', '789'),
+                                     ('bytes=5-100', '56789')):
+            self.assertEquals(
+                key.get_contents_as_string(headers={'Range': byte_range}),
+                expected)
+        self.assertRaises(boto_exception.S3ResponseError,
+                          key.get_contents_as_string,
+                          headers={'Range': 'bytes=10-'})
+
+    def test_listing_follows_puts_and_deletes(self):
+        """The cached key index reflects every mutation."""
+        b = self.conn.create_bucket('testbucket')
+        for name in ('c', 'a', 'b'):
+            b.new_key(name).set_contents_from_string(name)
+        self.assertEquals([k.name for k in b.get_all_keys()],
+                          ['a', 'b', 'c'])
+
+        b.new_key('aa').set_contents_from_string('aa')
+        b.new_key('b').set_contents_from_string('overwritten')
+        b.delete_key('c')
+        self.assertEquals([k.name for k in b.get_all_keys()],
+                          ['a', 'aa', 'b'])
+        self.assertEquals([k.name for k in b.get_all_keys(marker='a')],
+                          ['aa', 'b'])
+
     def test_unknown_bucket(self):
         bucket_name = 'falalala'
         self.assertRaises(boto_exception.S3ResponseError,
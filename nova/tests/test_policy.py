@@ -187,3 +187,169 @@ class DefaultPolicyTestCase(test.TestCase):
         self._set_brain("default_noexist")
         self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
                 self.context, "example:noexist", {})
+
+
+class InterpretingBrain(nova.common.policy.Brain):
+    """Evaluates match lists without compiling them, for reference."""
+
+    def check(self, match_list, target_dict, cred_dict):
+        if not match_list:
+            return True
+        for and_list in match_list:
+            if isinstance(and_list, basestring):
+                and_list = (and_list,)
+            if all([self._check(item, target_dict, cred_dict)
+                    for item in and_list]):
+                return True
+        return False
+
+
+class CompiledBrainTestCase(test.TestCase):
+    rules = {
+        "default": [["role:member"]],
+        "admin_or_owner": [["role:admin"], ["project_id:%(project_id)s"]],
+        "admin_api": [["role:ADMIN"]],
+        "owner_and_member": [["project_id:%(project_id)s", "role:member"]],
+        "chained": [["rule:admin_or_owner", "rule:missing"]],
+        "user": [["user_id:%(user_id)s"]],
+        "literal": [["project_id:fake"]],
+        "mixed": [["rule:admin_api"], "user_id:%(user_id)s",
+                  ["is_admin:True"]],
+        "allow": [],
+        "deny": [["false:false"]],
+        "no_colon": [["nocolon"]],
+        "string_rule": "role:admin",
+        "templated_key": [["%(key)s:fake"]],
+        "bad_template": [["project_id:%(nope)s"]],
+    }
+
+    targets = [{},
+               {'project_id': 'fake', 'user_id': 'fake'},
+               {'project_id': 'other', 'user_id': 'fake', 'key': 'user_id'},
+               {'project_id': 'fake', 'key': 'project_id'}]
+
+    creds = [{'roles': [], 'project_id': 'fake', 'user_id': 'fake'},
+             {'roles': ['Member'], 'project_id': 'fake', 'user_id': 'bob'},
+             {'roles': ['admin'], 'project_id': 'other', 'user_id': 'fake'},
+             {'roles': ['member'], 'project_id': 'x', 'is_admin': 'True'},
+             {'project_id': 'fake'}]
+
+    def _outcome(self, brain, match_list, target, creds):
+        try:
+            return brain.check(match_list, target, creds)
+        except Exception, e:
+            return type(e)
+
+    def _assert_equivalent(self, default_rule):
+        compiled = nova.common.policy.Brain(self.rules, default_rule)
+        reference = InterpretingBrain(self.rules, default_rule)
+        names = self.rules.keys() + ['missing', 'default']
+        for name in names:
+            match_list = ('rule:%s' % name,)
+            for target in self.targets:
+                for creds in self.creds:
+                    # Twice, so cached compiled rules are used as well
+                    for _i in xrange(2):
+                        self.assertEqual(
+                            self._outcome(compiled, match_list, target,
+                                          creds),
+                            self._outcome(reference, match_list, target,
+                                          creds),
+                            (name, target, creds))
+
+    def test_equivalent_with_default_rule(self):
+        self._assert_equivalent('default')
+
+    def test_equivalent_without_default_rule(self):
+        self._assert_equivalent(None)
+
+    def test_replaced_rule_is_recompiled(self):
+        brain = nova.common.policy.Brain({'rule': [["role:admin"]]})
+        creds = {'roles': ['member']}
+        self.assertFalse(brain.check(('rule:rule',), {}, creds))
+        brain.add_rule('rule', [["role:member"]])
+        self.assertTrue(brain.check(('rule:rule',), {}, creds))
+
+
+class PolicyDecisionCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(PolicyDecisionCacheTestCase, self).setUp()
+        policy.reset()
+        policy.init()
+        self.urls = []
+
+        def fakeurlopen(url, post_data):
+            self.urls.append(url)
+            return StringIO.StringIO("True")
+
+        self.stubs.Set(urllib2, 'urlopen', fakeurlopen)
+        rules = {"example:http": [["role:admin"],
+                                  ["http:http://example.com/%(id)s"]]}
+        common_policy.set_brain(common_policy.HttpBrain(rules))
+        self.context = context.RequestContext('fake', 'fake', roles=['a'])
+
+    def tearDown(self):
+        policy.reset()
+        super(PolicyDecisionCacheTestCase, self).tearDown()
+
+    def test_decisions_are_reused_per_context_and_target(self):
+        for _i in xrange(3):
+            policy.enforce(self.context, "example:http", {'id': 1})
+        policy.enforce(self.context, "example:http", {'id': 2})
+        self.assertEqual(self.urls, ['http://example.com/1',
+                                     'http://example.com/2'])
+
+        other = context.RequestContext('fake', 'fake', roles=['a'])
+        policy.enforce(other, "example:http", {'id': 1})
+        self.assertEqual(len(self.urls), 3)
+
+    def test_changed_roles_are_not_served_from_cache(self):
+        policy.enforce(self.context, "example:http", {'id': 1})
+        self.context.elevated()
+        policy.enforce(self.context, "example:http", {'id': 1})
+        self.assertEqual(len(self.urls), 1)
+        self.assertTrue('admin' in self.context.roles)
+
+    def test_unhashable_target_is_not_cached(self):
+        target = {'id': 1, 'metadata': [{'key': 'a'}]}
+        policy.enforce(self.context, "example:http", target)
+        policy.enforce(self.context, "example:http", target)
+        self.assertEqual(len(self.urls), 2)
+
+    def test_new_brain_discards_decisions(self):
+        policy.enforce(self.context, "example:http", {'id': 1})
+        common_policy.set_brain(common_policy.HttpBrain(
+                {"example:http": [["false:false"]]}))
+        self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                          self.context, "example:http", {'id': 1})
+
+
+class PolicyReloadIntervalTestCase(test.TestCase):
+    def setUp(self):
+        super(PolicyReloadIntervalTestCase, self).setUp()
+        policy.reset()
+        self.context = context.RequestContext('fake', 'fake')
+        self.stats = []
+        real_getmtime = os.path.getmtime
+
+        def fake_getmtime(path):
+            self.stats.append(path)
+            return real_getmtime(path)
+
+        self.stubs.Set(os.path, 'getmtime', fake_getmtime)
+
+    def tearDown(self):
+        policy.reset()
+        super(PolicyReloadIntervalTestCase, self).tearDown()
+
+    def test_policy_file_is_polled_on_interval(self):
+        self.flags(policy_reload_interval=3600)
+        for _i in xrange(5):
+            policy.enforce(self.context, "compute:get", {})
+        self.assertEqual(len(self.stats), 1)
+
+    def test_zero_interval_checks_every_time(self):
+        self.flags(policy_reload_interval=0)
+        for _i in xrange(5):
+            policy.enforce(self.context, "compute:get", {})
+        self.assertEqual(len(self.stats), 5)
@@ -15,6 +15,11 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import httplib
+import json
+import socket
+
+import eventlet
 import mox
 
 from nova import context
@@ -26,6 +31,7 @@ from nova import flags
 from nova import log as logging
 from nova.network.quantum import client as quantum_client
 from nova.network.quantum import fake_client
+from nova.network.quantum import http_pool
 from nova.network.quantum import manager as quantum_manager
 from nova.network.quantum import quantum_connection
 from nova.network.quantum import melange_connection
@@ -157,6 +163,97 @@ class QuantumConnectionTestCase(test.TestCase):
                             qc.get_network_name, t, net1_uuid)
 
 
+class FakeHTTPResponse(object):
+
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeHTTPConnection(object):
+    """Answers requests with the tenant in the url, counts connections."""
+
+    opened = []
+
+    def __init__(self, host, port):
+        self.opened.append(self)
+        self.closed = False
+        self.fail = False
+
+    def request(self, method, url, body, headers):
+        if self.closed or self.fail:
+            raise socket.error('connection reset')
+        self.url = url
+
+    def getresponse(self):
+        # Let the other requests run meanwhile
+        eventlet.sleep(0)
+        tenant = self.url.split('/')[3]
+        return FakeHTTPResponse(httplib.OK,
+                                json.dumps({'network': {'name': tenant}}))
+
+    def close(self):
+        self.closed = True
+
+
+class QuantumClientTestCase(test.TestCase):
+
+    def setUp(self):
+        super(QuantumClientTestCase, self).setUp()
+        FakeHTTPConnection.opened = []
+
+    def _client(self, **kwargs):
+        return quantum_client.Client(tenant='default', format='json',
+                                     testing_stub=FakeHTTPConnection,
+                                     **kwargs)
+
+    def test_connections_are_reused(self):
+        client = self._client(pool_size=1)
+        for _i in xrange(3):
+            client.show_network_details('net1')
+        self.assertEquals(len(FakeHTTPConnection.opened), 1)
+
+    def test_no_pool(self):
+        client = self._client()
+        for _i in xrange(3):
+            client.show_network_details('net1')
+        self.assertEquals(len(FakeHTTPConnection.opened), 3)
+        self.assertTrue(all(c.closed for c in FakeHTTPConnection.opened))
+
+    def test_stale_connection_is_replaced(self):
+        client = self._client(pool_size=1)
+        client.show_network_details('net1')
+        FakeHTTPConnection.opened[0].closed = True
+        net = client.show_network_details('net1')
+        self.assertEquals(net['network']['name'], 'default')
+        self.assertEquals(len(FakeHTTPConnection.opened), 2)
+
+    def test_retries(self):
+        failures = [True, True, False]
+
+        def connect():
+            connection = FakeHTTPConnection(None, None)
+            connection.fail = failures.pop(0)
+            return connection
+
+        pool = http_pool.HTTPConnectionPool(connect)
+        self.assertRaises(socket.error, pool.request, 'GET', '/', retries=1)
+        response, data = pool.request('GET', '/v1.1/tenants/t1', retries=1)
+        self.assertEquals(response.status, httplib.OK)
+
+    def test_concurrent_tenants(self):
+        client = self._client(pool_size=2)
+        pool = eventlet.GreenPool()
+        names = pool.imap(lambda tenant: client.show_network_details(
+                                  'net1', tenant=tenant)['network']['name'],
+                          ['t%d' % i for i in xrange(4)])
+        self.assertEquals(list(names), ['t0', 't1', 't2', 't3'])
+        self.assertEquals(client.tenant, 'default')
+
+
 # this is a base class to be used by other QuantumManager Test classes
 class QuantumNovaTestCase(test.TestCase):
 
@@ -0,0 +1,152 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests for the SSH connection handling of the SAN volume drivers.
+"""
+
+import socket
+
+import paramiko
+
+from nova import exception
+from nova import test
+from nova.volume import san
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.active = True
+        self.keepalive = None
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+
+class FakeChannel(object):
+    def __init__(self, exit_status):
+        self.exit_status = exit_status
+        self.timeout = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+
+class FakeStream(object):
+    def __init__(self, data='', channel=None):
+        self.data = data
+        self.channel = channel
+
+    def read(self):
+        return self.data
+
+    def close(self):
+        pass
+
+
+class FakeSSHClient(object):
+    """Counts handshakes and runs commands against canned output."""
+
+    connects = 0
+    channels = []
+    failures = []
+
+    def __init__(self):
+        self.transport = None
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, *args, **kwargs):
+        FakeSSHClient.connects += 1
+        self.transport = FakeTransport()
+
+    def get_transport(self):
+        return self.transport
+
+    def exec_command(self, cmd):
+        if FakeSSHClient.failures:
+            raise FakeSSHClient.failures.pop(0)
+        channel = FakeChannel(0)
+        FakeSSHClient.channels.append(channel)
+        return (FakeStream(), FakeStream(cmd, channel), FakeStream())
+
+    def close(self):
+        if self.transport:
+            self.transport.active = False
+
+
+class SanSSHPoolTestCase(test.TestCase):
+    """Test case for SSHPool and SanISCSIDriver._run_ssh"""
+
+    def setUp(self):
+        super(SanSSHPoolTestCase, self).setUp()
+        self.flags(san_ip='127.0.0.1', san_password='secret',
+                   san_ssh_keepalive=15, san_ssh_command_timeout=60)
+        FakeSSHClient.connects = 0
+        FakeSSHClient.channels = []
+        FakeSSHClient.failures = []
+        self.stubs.Set(paramiko, 'SSHClient', FakeSSHClient)
+        self.driver = san.SanISCSIDriver()
+
+    def test_connections_are_reused(self):
+        for i in xrange(20):
+            out, _err = self.driver._run_ssh('echo %d' % i)
+            self.assertEqual(out, 'echo %d' % i)
+        self.assertEqual(FakeSSHClient.connects, 1)
+
+    def test_keepalive_and_command_timeout(self):
+        self.driver._run_ssh('true')
+        ssh = self.driver.sshpool.get()
+        self.assertEqual(ssh.get_transport().keepalive, 15)
+        self.assertEqual(FakeSSHClient.channels[0].timeout, 60)
+
+    def test_dead_connection_is_replaced(self):
+        self.driver._run_ssh('true')
+        ssh = self.driver.sshpool.get()
+        ssh.get_transport().active = False
+        self.driver.sshpool.put(ssh)
+        self.driver._run_ssh('true')
+        self.assertEqual(FakeSSHClient.connects, 2)
+
+    def test_channel_failure_is_retried(self):
+        FakeSSHClient.failures = [paramiko.SSHException('no channel')]
+        out, _err = self.driver._run_ssh('true')
+        self.assertEqual(out, 'true')
+        self.assertEqual(FakeSSHClient.connects, 2)
+
+    def test_socket_error_is_not_retried(self):
+        FakeSSHClient.failures = [socket.error('reset')]
+        self.assertRaises(socket.error, self.driver._run_ssh, 'true')
+        self.assertEqual(FakeSSHClient.connects, 1)
+
+    def test_pool_is_bounded(self):
+        pool = san.SSHPool(max_size=2)
+        conns = [pool.get(), pool.get()]
+        self.assertEqual(pool.free(), 0)
+        for ssh in conns:
+            pool.put(ssh)
+        self.assertEqual(FakeSSHClient.connects, 2)
+
+    def test_missing_credentials(self):
+        self.flags(san_password='', san_private_key='')
+        self.assertRaises(exception.Error, self.driver._run_ssh, 'true')
@@ -20,6 +20,12 @@
 Unit Tests for remote procedure calls using queue
 """
 
+import os
+import signal
+import subprocess
+import sys
+import time
+
 import mox
 
 from nova import context
@@ -43,6 +49,9 @@ test_service_opts = [
     cfg.IntOpt("test_service_listen_port",
                default=0,
                help="Port number to bind test service to"),
+    cfg.IntOpt("test_service_workers",
+               default=None,
+               help="Number of workers for test service"),
     ]
 
 flags.FLAGS.register_opts(test_service_opts)
@@ -142,8 +151,8 @@ class ServiceTestCase(test.TestCase):
                                       binary).AndRaise(exception.NotFound())
         service.db.service_create(mox.IgnoreArg(),
                                   service_create).AndReturn(service_ref)
-        service.db.service_get(mox.IgnoreArg(),
-                               mox.IgnoreArg()).AndRaise(Exception())
+        service.db.service_heartbeat(mox.IgnoreArg(), mox.IgnoreArg(),
+                                     mox.IgnoreArg()).AndRaise(Exception())
 
         self.mox.ReplayAll()
         serv = service.Service(host,
@@ -175,10 +184,8 @@ class ServiceTestCase(test.TestCase):
                                       binary).AndRaise(exception.NotFound())
         service.db.service_create(mox.IgnoreArg(),
                                   service_create).AndReturn(service_ref)
-        service.db.service_get(mox.IgnoreArg(),
-                               service_ref['id']).AndReturn(service_ref)
-        service.db.service_update(mox.IgnoreArg(), service_ref['id'],
-                                  mox.ContainsKeyValue('report_count', 1))
+        service.db.service_heartbeat(mox.IgnoreArg(), service_ref['id'],
+                                     'nova')
 
         self.mox.ReplayAll()
         serv = service.Service(host,
@@ -191,6 +198,42 @@ class ServiceTestCase(test.TestCase):
 
         self.assert_(not serv.model_disconnected)
 
+    def test_report_state_recreates_missing_service(self):
+        host = 'foo'
+        binary = 'bar'
+        topic = 'test'
+        service_create = {'host': host,
+                          'binary': binary,
+                          'topic': topic,
+                          'report_count': 0,
+                          'availability_zone': 'nova'}
+        service_ref = {'host': host,
+                          'binary': binary,
+                          'topic': topic,
+                          'report_count': 0,
+                          'availability_zone': 'nova',
+                          'id': 1}
+        new_ref = dict(service_ref, id=2)
+
+        service.db.service_get_by_args(mox.IgnoreArg(),
+                                      host,
+                                      binary).AndReturn(service_ref)
+        service.db.service_heartbeat(mox.IgnoreArg(), 1, 'nova').AndRaise(
+                exception.ServiceNotFound(service_id=1))
+        service.db.service_create(mox.IgnoreArg(),
+                                  service_create).AndReturn(new_ref)
+        service.db.service_heartbeat(mox.IgnoreArg(), 2, 'nova')
+
+        self.mox.ReplayAll()
+        serv = service.Service(host,
+                               binary,
+                               topic,
+                               'nova.tests.test_service.FakeManager')
+        serv.start()
+        serv.report_state()
+        self.assertEqual(serv.service_id, 2)
+        self.assert_(not getattr(serv, 'model_disconnected', False))
+
 
 class TestWSGIService(test.TestCase):
 
@@ -205,6 +248,17 @@ class TestWSGIService(test.TestCase):
         self.assertNotEqual(0, test_service.port)
         test_service.stop()
 
+    def test_listen_before_start(self):
+        self.flags(test_service_workers=4)
+        test_service = service.WSGIService("test_service")
+        self.assertEquals(4, test_service.workers)
+        test_service.listen()
+        port = test_service.port
+        self.assertNotEqual(0, port)
+        test_service.start()
+        self.assertEquals(port, test_service.port)
+        test_service.stop()
+
 
 class TestLauncher(test.TestCase):
 
@@ -219,3 +273,164 @@ class TestLauncher(test.TestCase):
         launcher.launch_server(self.service)
         self.assertEquals(0, self.service.port)
         launcher.stop()
+
+
+class FakeServer(object):
+    def __init__(self):
+        self.listened = 0
+
+    def listen(self):
+        self.listened += 1
+
+
+class TestProcessLauncher(test.TestCase):
+
+    def setUp(self):
+        super(TestProcessLauncher, self).setUp()
+        self.launcher = service.ProcessLauncher()
+        self.server = FakeServer()
+        self.forked = []
+        self.killed = []
+        self.exited = []
+        self.in_child = False
+
+        def fake_fork():
+            if self.in_child:
+                return 0
+            pid = 100 + len(self.forked)
+            self.forked.append(pid)
+            return pid
+
+        def fake_waitpid(pid, options):
+            if self.exited:
+                return self.exited.pop(0), 0
+            self.launcher.running = False
+            return 0, 0
+
+        def fake_kill(pid, signo):
+            self.killed.append((pid, signo))
+
+        self.stubs.Set(os, 'fork', fake_fork)
+        self.stubs.Set(service, '_waitpid', fake_waitpid)
+        self.stubs.Set(os, 'kill', fake_kill)
+
+    def tearDown(self):
+        os.close(self.launcher.writepipe)
+        self.launcher.readpipe.close()
+        super(TestProcessLauncher, self).tearDown()
+
+    def test_launch_server_forks_workers(self):
+        self.launcher.launch_server(self.server, workers=3)
+        self.assertEquals(self.server.listened, 1)
+        self.assertEquals(self.forked, [100, 101, 102])
+        self.assertEquals(sorted(self.launcher.children), [100, 101, 102])
+
+    def test_dead_worker_is_replaced(self):
+        self.launcher.launch_server(self.server, workers=2)
+        self.exited = [100]
+        self.launcher._respawn_children()
+        self.assertEquals(self.forked, [100, 101, 102])
+        self.assertEquals(sorted(self.launcher.children), [101, 102])
+
+    def test_unknown_child_is_ignored(self):
+        self.launcher.launch_server(self.server, workers=2)
+        self.exited = [42]
+        self.launcher._respawn_children()
+        self.assertEquals(self.forked, [100, 101])
+
+    def test_sighup_restarts_workers(self):
+        self.launcher.launch_server(self.server, workers=2)
+        self.launcher._handle_signal(signal.SIGHUP, None)
+        self.assertTrue(self.launcher.running)
+        self.launcher._respawn_children()
+        self.assertEquals(sorted(self.killed),
+                          [(100, signal.SIGTERM), (101, signal.SIGTERM)])
+        self.assertEquals(self.launcher.sigcaught, None)
+
+    def test_sigterm_stops_respawning(self):
+        self.launcher.launch_server(self.server, workers=2)
+        self.launcher._handle_signal(signal.SIGTERM, None)
+        self.assertFalse(self.launcher.running)
+        self.exited = [100]
+        self.launcher._respawn_children()
+        self.assertEquals(self.forked, [100, 101])
+
+    def test_worker_exit_status(self):
+        statuses = []
+
+        def fake_exit(status):
+            statuses.append(status)
+
+        self.stubs.Set(os, '_exit', fake_exit)
+        self.in_child = True
+        wrap = service.ServerWrapper(self.server, 1)
+        for code in (None, 3, 'Fatal error'):
+            def fake_child_process(server):
+                raise SystemExit(code)
+
+            self.stubs.Set(self.launcher, '_child_process',
+                           fake_child_process)
+            self.launcher._start_child(wrap)
+        self.assertEquals(statuses, [0, 3, 1])
+
+
+LAUNCHER_SCRIPT = """
+import eventlet
+eventlet.monkey_patch()
+import eventlet.event
+import sys
+
+from nova import service
+
+
+class Server(object):
+    def listen(self):
+        pass
+
+    def start(self):
+        self.stopped = eventlet.event.Event()
+
+    def stop(self):
+        self.stopped.send()
+
+    def wait(self):
+        self.stopped.wait()
+
+
+launcher = service.ProcessLauncher()
+launcher.launch_server(Server(), workers=2)
+print ' '.join(str(pid) for pid in launcher.children)
+sys.stdout.flush()
+launcher.wait()
+"""
+
+
+class TestProcessLauncherSignals(test.TestCase):
+    """Runs a monkey patched launcher with real workers."""
+
+    def _alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def test_sigterm_stops_workers(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        process = subprocess.Popen([sys.executable, '-c', LAUNCHER_SCRIPT],
+                                   stdout=subprocess.PIPE, env=env)
+        pids = [int(pid) for pid in process.stdout.readline().split()]
+        try:
+            self.assertEquals(len(pids), 2)
+            process.send_signal(signal.SIGTERM)
+            for _i in xrange(100):
+                if process.poll() is not None:
+                    break
+                time.sleep(0.1)
+            self.assertEquals(process.poll(), 0)
+            self.assertEquals([pid for pid in pids if self._alive(pid)], [])
+        finally:
+            for pid in pids + [process.pid]:
+                if self._alive(pid):
+                    os.kill(pid, signal.SIGKILL)
+            process.wait()
@@ -0,0 +1,330 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for mount-free injection and nbd device allocation."""
+
+import glob
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from nova import exception
+from nova import test
+from nova import utils
+from nova.virt.disk import api as disk_api
+from nova.virt.disk import extfs
+from nova.virt.disk import nbd
+
+
+def _have_e2fsprogs():
+    if os.getuid() != 0:
+        return False
+    try:
+        utils.execute('mkfs.ext4', '-V')
+        return True
+    except (OSError, exception.ProcessExecutionError):
+        return False
+
+
+HAVE_E2FSPROGS = _have_e2fsprogs()
+
+
+class _Metadata(object):
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+
+class ExtfsTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ExtfsTestCase, self).setUp()
+        # The tests run as root, debugfs must not go through sudo
+        self.flags(root_helper='env', root_helper_daemon=None)
+        self.tmpdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmpdir, 'disk.raw')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(ExtfsTestCase, self).tearDown()
+
+    def _make_image(self, path, files, size_mb=8):
+        root = tempfile.mkdtemp(dir=self.tmpdir)
+        for name, data in files.items():
+            full = os.path.join(root, name)
+            if not os.path.isdir(os.path.dirname(full)):
+                os.makedirs(os.path.dirname(full))
+            with open(full, 'wb') as f:
+                f.write(data)
+        utils.execute('dd', 'if=/dev/zero', 'of=%s' % path, 'bs=1M',
+                      'count=%d' % size_mb)
+        utils.execute('mkfs.ext4', '-q', '-F', '-d', root, path)
+
+    def _read(self, path, image=None, offset=0):
+        fs = extfs.Filesystem(image or self.image, offset)
+        try:
+            return fs.read_file(path)
+        finally:
+            fs.close()
+
+    def _stat(self, path):
+        fs = extfs.Filesystem(self.image)
+        try:
+            return fs.stat(path)
+        finally:
+            fs.close()
+
+    def _checksum(self):
+        return utils.hash_file(open(self.image, 'rb'))
+
+    def _fsck(self):
+        # Raises if the file system needs fixing
+        utils.execute('e2fsck', '-fn', self.image)
+
+    @test.skip_unless(HAVE_E2FSPROGS, 'Test requires root and e2fsprogs')
+    def test_find_filesystem(self):
+        self._make_image(self.image, {})
+        self.assertEqual(extfs.find_filesystem(self.image), 0)
+        self.assertEqual(extfs.find_filesystem(self.image, '1'), None)
+
+        with open(self.image, 'r+b') as f:
+            f.seek(1024 + 56)
+            f.write('\0\0')
+        self.assertEqual(extfs.find_filesystem(self.image), None)
+
+        qcow = os.path.join(self.tmpdir, 'disk.qcow2')
+        with open(qcow, 'wb') as f:
+            f.write('QFI\xfb' + '\0' * 4096)
+        self.assertEqual(extfs.find_filesystem(qcow), None)
+
+    @test.skip_unless(HAVE_E2FSPROGS, 'Test requires root and e2fsprogs')
+    def test_find_filesystem_in_partition(self):
+        part = os.path.join(self.tmpdir, 'part.raw')
+        self._make_image(part, {'hello': 'world\n'})
+        mbr = '\0' * 446
+        mbr += struct.pack('<BBBBBBBBII', 0, 0, 0, 0, 0x83, 0, 0, 0,
+                           2048, 8 * 2048)
+        mbr += '\0' * 48 + '\x55\xaa'
+        with open(self.image, 'wb') as f:
+            f.write(mbr)
+            f.seek(2048 * 512)
+            f.write(open(part, 'rb').read())
+
+        self.assertEqual(extfs.find_filesystem(self.image, '1'), 1048576)
+        self.assertEqual(extfs.find_filesystem(self.image, '2'), None)
+        self.assertEqual(extfs.find_filesystem(self.image), None)
+        self.assertEqual(self._read('/hello', offset=1048576), 'world\n')
+
+        disk_api.inject_files(self.image, [('/a/b', 'data')], partition='1')
+        self.assertEqual(self._read('/a/b', offset=1048576), 'data')
+
+    @test.skip_unless(HAVE_E2FSPROGS, 'Test requires root and e2fsprogs')
+    def test_inject_data(self):
+        self._make_image(self.image, {
+            'etc/passwd': 'root:x:0:0:root:/root:/bin/sh\n',
+            'etc/shadow': 'root:*:15000:0:99999:7:::\n',
+            'root/.ssh/authorized_keys': 'ssh-rsa OLD\n'})
+        self.stubs.Set(disk_api, '_DiskImage', None)
+
+        disk_api.inject_data(self.image, key='ssh-rsa NEW',
+                             net='auto lo\n',
+                             metadata=[_Metadata('foo', 'bar')],
+                             admin_password='secret')
+
+        self.assertEqual(self._read('/root/.ssh/authorized_keys'),
+                         'ssh-rsa OLD\n\n'
+                         '# The following ssh key was injected by Nova\n'
+                         'ssh-rsa NEW\n')
+        self.assertEqual(self._stat('/root/.ssh')[:3],
+                         ('directory', 0700, 0))
+        self.assertEqual(self._read('/etc/network/interfaces'), 'auto lo\n')
+        self.assertEqual(self._stat('/etc/network'),
+                         ('directory', 0755, 0, 0))
+        self.assertEqual(self._read('/meta.js'), '{"foo": "bar"}')
+        self.assertEqual(self._stat('/meta.js'), ('regular', 0644, 0, 0))
+        shadow = self._read('/etc/shadow').split(':')
+        self.assertTrue(shadow[1].startswith('$1$'))
+        self._fsck()
+
+    @test.skip_unless(HAVE_E2FSPROGS, 'Test requires root and e2fsprogs')
+    def test_replace_keeps_owner_mode_and_xattrs(self):
+        self._make_image(self.image, {'etc/motd': 'old\n'})
+        label = os.path.join(self.tmpdir, 'label')
+        with open(label, 'wb') as f:
+            f.write('system_u:object_r:etc_t:s0\0')
+        utils.execute('debugfs', '-w', '-f', '-', self.image,
+                      process_input='sif /etc/motd mode 0100600\n'
+                                    'sif /etc/motd uid 42\n'
+                                    'sif /etc/motd gid 43\n'
+                                    'ea_set -f %s /etc/motd '
+                                    'security.selinux\n' % label)
+
+        disk_api.inject_files(self.image, [('etc/motd', 'new\n')])
+
+        self.assertEqual(self._read('/etc/motd'), 'new\n')
+        self.assertEqual(self._stat('/etc/motd'), ('regular', 0600, 42, 43))
+        out, _err = utils.execute('debugfs', '-R',
+                                  'ea_get /etc/motd security.selinux',
+                                  self.image)
+        self.assertTrue('system_u:object_r:etc_t:s0' in out)
+        self._fsck()
+
+    @test.skip_unless(HAVE_E2FSPROGS, 'Test requires root and e2fsprogs')
+    def test_failure_leaves_image_untouched(self):
+        self._make_image(self.image, {'etc': 'not a directory'})
+        before = self._checksum()
+        fs = extfs.Filesystem(self.image)
+        try:
+            fs.write_file('/motd', 'hello')
+            self.assertRaises(exception.Error, fs.make_dir, '/etc/network')
+        finally:
+            fs.close()
+        self.assertEqual(self._checksum(), before)
+
+    @test.skip_unless(HAVE_E2FSPROGS, 'Test requires root and e2fsprogs')
+    def test_failed_commit_keeps_files_and_mounts(self):
+        self._make_image(self.image, {'etc/shadow': 'root:*:15000::::::\n',
+                                      'etc/motd': 'old\n'})
+        mounted = []
+
+        class FakeDiskImage(object):
+            def __init__(self, image, partition, use_cow):
+                self.mount_dir = self.errors = None
+
+            def mount(self):
+                mounted.append(True)
+                return False
+
+        self.stubs.Set(disk_api, '_DiskImage', FakeDiskImage)
+        # motd is written first and fits, shadow doesn't fit
+        self.assertRaises(exception.Error, disk_api.inject_files,
+                          self.image, [('etc/motd', 'new\n'),
+                                       ('etc/shadow', 'x' * (16 << 20)),
+                                       ('new/dir/file', 'data')])
+        self.assertEqual(mounted, [True])
+
+        self.assertEqual(self._read('/etc/motd'), 'old\n')
+        self.assertEqual(self._read('/etc/shadow'), 'root:*:15000::::::\n')
+        self.assertEqual(self._stat('/etc/.motd.nova-inject'), None)
+        self.assertEqual(self._stat('/etc/.shadow.nova-inject'), None)
+        self.assertEqual(self._stat('/new'), None)
+        self._fsck()
+
+    def test_unsupported_image_is_mounted(self):
+        with open(self.image, 'wb') as f:
+            f.write('\0' * 4096)
+        mounted = []
+
+        class FakeDiskImage(object):
+            def __init__(self, image, partition, use_cow):
+                self.mount_dir = self.errors = None
+
+            def mount(self):
+                mounted.append(True)
+                return False
+
+        self.stubs.Set(disk_api, '_DiskImage', FakeDiskImage)
+        self.assertRaises(exception.Error, disk_api.inject_files,
+                          self.image, [('/foo', 'bar')])
+        self.assertEqual(mounted, [True])
+
+
+class NbdAllocationTestCase(test.TestCase):
+
+    def setUp(self):
+        super(NbdAllocationTestCase, self).setUp()
+        self.flags(disable_process_locking=True, timeout_nbd=10,
+                   max_nbd_devices=16)
+        self.pids = set(['nbd0'])
+        self.devices = ['nbd0', 'nbd1', 'nbd10', 'nbd2']
+        self.commands = []
+        self.now = 1000.0
+        self.sleeps = []
+
+        def fake_exists(path):
+            if path == '/sys/block/nbd0':
+                return True
+            name = path.split('/')[3]
+            return path.endswith('/pid') and name in self.pids
+
+        def fake_trycmd(*cmd, **kwargs):
+            self.commands.append(cmd)
+            return '', ''
+
+        def fake_sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+        self.stubs.Set(os.path, 'exists', fake_exists)
+        self.stubs.Set(glob, 'glob',
+                       lambda pattern: ['/sys/block/%s' % d
+                                        for d in self.devices])
+        self.stubs.Set(utils, 'trycmd', fake_trycmd)
+        self.stubs.Set(time, 'time', lambda: self.now)
+        self.stubs.Set(time, 'sleep', fake_sleep)
+
+    def _mount(self):
+        return nbd.Mount('/tmp/disk.qcow2', '/tmp/mnt')
+
+    def test_picks_lowest_free_device(self):
+        self.pids.add('nbd1')
+        self.assertEqual(self._mount()._find_free_device(), '/dev/nbd2')
+        self.pids.add('nbd2')
+        self.assertEqual(self._mount()._find_free_device(), '/dev/nbd10')
+        self.flags(max_nbd_devices=10)
+        self.assertEqual(self._mount()._find_free_device(), None)
+
+    def test_get_dev_waits_with_backoff(self):
+        def connect(*cmd, **kwargs):
+            self.commands.append(cmd)
+            # the device shows up 0.05s after qemu-nbd returns
+            self.ready_at = self.now + 0.05
+            return '', ''
+
+        def fake_sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+            if self.now >= self.ready_at:
+                self.pids.add('nbd1')
+
+        self.stubs.Set(utils, 'trycmd', connect)
+        self.stubs.Set(time, 'sleep', fake_sleep)
+
+        mount = self._mount()
+        self.assertTrue(mount.get_dev())
+        self.assertEqual(mount.device, '/dev/nbd1')
+        self.assertEqual(self.commands,
+                         [('qemu-nbd', '-c', '/dev/nbd1', '/tmp/disk.qcow2')])
+        self.assertEqual(self.sleeps, [0.01, 0.02, 0.04])
+
+    def test_get_dev_times_out(self):
+        mount = self._mount()
+        self.assertFalse(mount.get_dev())
+        self.assertEqual(mount.error, 'nbd device /dev/nbd1 did not show up')
+        self.assertAlmostEqual(sum(self.sleeps), 10)
+        self.assertTrue(max(self.sleeps) <= nbd._POLL_MAX)
+        self.assertEqual(self.commands[-1], ('qemu-nbd', '-d', '/dev/nbd1'))
+        self.assertFalse(mount.linked)
+
+    def test_no_free_device(self):
+        self.pids.update(self.devices)
+        mount = self._mount()
+        self.assertFalse(mount.get_dev())
+        self.assertEqual(mount.error, 'No free nbd devices')
+        self.assertEqual(self.commands, [])
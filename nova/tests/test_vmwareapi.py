@@ -19,6 +19,8 @@
 Test suite for VMWareAPI.
 """
 
+import eventlet
+
 from nova import context
 from nova import db
 from nova import exception
@@ -30,6 +32,9 @@ from nova.tests.vmwareapi import db_fakes
 from nova.tests.vmwareapi import stubs
 from nova.virt import vmwareapi_conn
 from nova.virt.vmwareapi import fake as vmwareapi_fake
+from nova.virt.vmwareapi import vim_util
+from nova.virt.vmwareapi import vmops
+from nova.virt.vmwareapi import vmware_images
 
 
 FLAGS = flags.FLAGS
@@ -80,12 +85,14 @@ class VMWareAPIVMTestCase(test.TestCase):
         }
 
     def tearDown(self):
+        if self.conn._session.inventory is not None:
+            self.conn._session.inventory.stop()
         super(VMWareAPIVMTestCase, self).tearDown()
         vmwareapi_fake.cleanup()
 
-    def _create_instance_in_the_db(self):
-        values = {'name': 1,
-                  'id': 1,
+    def _create_instance_in_the_db(self, name=1):
+        values = {'name': name,
+                  'id': name,
                   'project_id': self.project_id,
                   'user_id': self.user_id,
                   'image_ref': "1",
@@ -263,3 +270,177 @@ class VMWareAPIVMTestCase(test.TestCase):
 
     def test_get_console_output(self):
         pass
+
+    def _count_host_queries(self):
+        queries = []
+        for name in ("get_objects", "get_object_properties"):
+            def fake(*args, **kwargs):
+                queries.append(args)
+                return orig(*args, **kwargs)
+            orig = getattr(vim_util, name)
+            self.stubs.Set(vim_util, name, fake)
+        return queries
+
+    def test_inventory_cache_serves_lookups(self):
+        self._create_vm()
+        queries = self._count_host_queries()
+        self.assertEquals(self.conn.list_instances(), [1])
+        info = self.conn.get_info({'name': 1})
+        self._check_vm_info(info, power_state.RUNNING)
+        self.conn.suspend(self.instance)
+        info = self.conn.get_info({'name': 1})
+        self._check_vm_info(info, power_state.PAUSED)
+        # Only suspend read the power state from the host
+        self.assertEquals(len(queries), 1)
+
+    def test_inventory_cache_follows_changes(self):
+        inventory = self.conn._session.inventory
+        ds = vmwareapi_fake._get_objects("Datastore")[0]
+        vm = vmwareapi_fake.VirtualMachine(name="other", ds=ds,
+                                           instance_uuid="fake-uuid")
+        vmwareapi_fake._create_object("VirtualMachine", vm)
+        eventlet.sleep(0.1)
+        self.assertEquals(inventory.get_vm_ref("other"), vm.obj)
+        self.assertEquals(inventory.get_vm_ref_by_uuid("fake-uuid"), vm.obj)
+
+        vm.set("name", "renamed")
+        eventlet.sleep(0.1)
+        self.assertEquals(inventory.get_vm_ref("other"), None)
+        self.assertEquals(inventory.get_vm_ref("renamed"), vm.obj)
+
+        del vmwareapi_fake._db_content["VirtualMachine"][vm.obj]
+        eventlet.sleep(0.1)
+        self.assertEquals(inventory.get_vm_ref("renamed"), None)
+        self.assertEquals(inventory.list_vms(), [])
+
+    def test_task_completion_is_not_polled(self):
+        polls = []
+        orig = vim_util.get_dynamic_property
+
+        def fake_get_dynamic_property(vim, mobj, type, property_name):
+            if type == "Task":
+                polls.append(mobj)
+            return orig(vim, mobj, type, property_name)
+
+        self.stubs.Set(vim_util, "get_dynamic_property",
+                       fake_get_dynamic_property)
+        self._create_vm()
+        self.assertEquals(polls, [])
+
+    def test_polled_task_is_forgotten(self):
+        inventory = self.conn._session.inventory
+        orig_wait_for_task = inventory.wait_for_task
+
+        def fake_wait_for_task(task_ref, timeout):
+            # The updates stop while the task is being waited for
+            orig_wait_for_task(task_ref, 0)
+            inventory.ready = False
+            return None
+
+        self.stubs.Set(inventory, "wait_for_task", fake_wait_for_task)
+        self._create_vm()
+        self.assertEquals(inventory._tasks, {})
+
+    def test_without_inventory_cache(self):
+        self.conn._session.inventory.stop()
+        self.flags(vmwareapi_inventory_cache=False)
+        self.conn = vmwareapi_conn.get_connection(False)
+        self.assertEquals(self.conn._session.inventory, None)
+        self._create_vm()
+        info = self.conn.get_info({'name': 1})
+        self._check_vm_info(info, power_state.RUNNING)
+        self.conn.destroy(self.instance, self.network_info)
+        self.assertEquals(self.conn.list_instances(), [])
+
+    def _count_fetches(self):
+        fetches = []
+
+        def fake_fetch_image(context, image, instance, **kwargs):
+            fetches.append(kwargs.get("file_path"))
+            # Lets the other spawns run meanwhile
+            eventlet.sleep(0.01)
+            vmwareapi_fake.fake_fetch_image(context, image, instance,
+                                            **kwargs)
+
+        self.stubs.Set(vmware_images, "fetch_image", fake_fetch_image)
+        return fetches
+
+    def _spawn(self, name):
+        self._create_instance_in_the_db(name)
+        self.conn.spawn(self.context, self.instance, self.image,
+                        self.network_info)
+
+    def test_spawn_uses_image_cache(self):
+        fetches = self._count_fetches()
+        self.image['checksum'] = 'abc'
+        threads = [eventlet.spawn(self._spawn, name) for name in (1, 2)]
+        for thread in threads:
+            thread.wait()
+        self._spawn(3)
+        self.assertEquals(len(fetches), 1)
+        self.assertTrue(fetches[0].startswith("vmware-tmp/"))
+        files = vmwareapi_fake._db_content["files"]
+        self.assertTrue("[fake-ds] vmware_base/1_abc/1-flat.vmdk" in files)
+        for name in (1, 2, 3):
+            self.assertTrue("[fake-ds] %s/%s.vmdk" % (name, name) in files)
+        self.assertEquals(sorted(self.conn.list_instances()), [1, 2, 3])
+
+    def test_failed_upload_is_not_cached(self):
+        def fake_fetch_image(context, image, instance, **kwargs):
+            raise exception.ImageNotFound(image_id=image)
+
+        self.stubs.Set(vmware_images, "fetch_image", fake_fetch_image)
+        self.assertRaises(exception.ImageNotFound, self._spawn, 1)
+        files = vmwareapi_fake._db_content["files"]
+        self.assertFalse([f for f in files
+                          if f.startswith("[fake-ds] vmware-tmp/")])
+        self.assertEquals(self._cache_entries(), [])
+
+        fetches = self._count_fetches()
+        self._spawn(2)
+        self._spawn(3)
+        self.assertEquals(len(fetches), 1)
+
+    def test_spawn_without_image_cache(self):
+        self.flags(vmwareapi_image_cache_folder='')
+        fetches = self._count_fetches()
+        self._spawn(1)
+        self._spawn(2)
+        self.assertEquals(fetches, ["1/1-flat.vmdk", "2/2-flat.vmdk"])
+
+    def _cache_entries(self):
+        prefix = "[fake-ds] vmware_base/"
+        return sorted(set(f[len(prefix):].split("/")[0]
+                          for f in vmwareapi_fake._db_content["files"]
+                          if f.startswith(prefix)))
+
+    def test_manage_image_cache(self):
+        self._spawn(1)
+        used = [self.instance]
+        self.stubs.Set(db, "instance_get_all_by_host",
+                       lambda context, host: used)
+        self.now = 1000
+        self.stubs.Set(vmops.time, "time", lambda: self.now)
+        self.flags(remove_unused_base_images=True,
+                   remove_unused_original_minimum_age_seconds=3600)
+
+        self.conn.manage_image_cache(self.context)
+        self.assertEquals(self._cache_entries(), ["1"])
+
+        # Unused images are marked, and unmarked once used again
+        del used[:]
+        self.conn.manage_image_cache(self.context)
+        self.assertEquals(self._cache_entries(), ["1", "1.unused-1000"])
+        used.append(self.instance)
+        self.conn.manage_image_cache(self.context)
+        self.assertEquals(self._cache_entries(), ["1"])
+
+        # and removed once unused for long enough
+        del used[:]
+        self.conn.manage_image_cache(self.context)
+        self.now += 3599
+        self.conn.manage_image_cache(self.context)
+        self.assertEquals(self._cache_entries(), ["1", "1.unused-1000"])
+        self.now += 1
+        self.conn.manage_image_cache(self.context)
+        self.assertEquals(self._cache_entries(), [])
@@ -0,0 +1,194 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Tests for the console session relay and the XCP VNC proxy."""
+
+import json
+
+import eventlet
+from eventlet.green import socket
+import webob
+
+from nova import rpc
+from nova import test
+from nova.vnc import relay
+from nova.vnc import xvp_proxy
+
+
+def _recv_all(sock):
+    data = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return ''.join(data)
+        data.append(chunk)
+
+
+class RelayTestCase(test.TestCase):
+
+    def _tcp_pair(self, bufsize):
+        # Unlike a socketpair, the sender gets room back bit by bit as
+        # the other end reads
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, bufsize)
+        sock.connect(listener.getsockname())
+        accepted, _addr = listener.accept()
+        accepted.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, bufsize)
+        listener.close()
+        return sock, accepted
+
+    def _session(self, tcp_bufsize=None, **kwargs):
+        self.client, client_side = socket.socketpair()
+        if tcp_bufsize:
+            self.server, server_side = self._tcp_pair(tcp_bufsize)
+        else:
+            self.server, server_side = socket.socketpair()
+        self.stats = relay.ProxyStats()
+        session = relay.Session(client_side, server_side, stats=self.stats,
+                                **kwargs)
+        return eventlet.spawn(session.run)
+
+    def _check_relay(self, use_splice):
+        thread = self._session(use_splice=use_splice, buffer_size=4096)
+        request = 'x' * 100000
+        self.client.sendall(request)
+        self.client.shutdown(socket.SHUT_WR)
+        self.assertEqual(_recv_all(self.server), request)
+
+        # The other direction keeps working after the half close
+        self.server.sendall('reply')
+        self.server.shutdown(socket.SHUT_WR)
+        self.assertEqual(_recv_all(self.client), 'reply')
+        thread.wait()
+
+        report = self.stats.report()
+        self.assertEqual(report['bytes_to_server'], 100000)
+        self.assertEqual(report['bytes_to_client'], 5)
+        self.assertEqual(report['sessions_total'], 1)
+        self.assertEqual(report['sessions_active'], 0)
+
+    def test_relay_copy(self):
+        self._check_relay(use_splice=False)
+
+    @test.skip_if(relay._splice is None, 'Test requires splice(2)')
+    def test_relay_splice(self):
+        self._check_relay(use_splice=True)
+
+    def test_idle_session_is_closed(self):
+        thread = self._session(idle_timeout=0.2)
+        self.client.sendall('ping')
+        self.assertEqual(self.server.recv(4), 'ping')
+        thread.wait()
+        self.assertEqual(_recv_all(self.client), '')
+        self.assertEqual(self.stats.sessions_idle_closed, 1)
+        self.assertEqual(self.stats.sessions_active, 0)
+
+    def test_idle_session_is_closed_copy(self):
+        thread = self._session(idle_timeout=0.2, use_splice=False)
+        self.client.sendall('ping')
+        self.assertEqual(self.server.recv(4), 'ping')
+        thread.wait()
+        self.assertEqual(_recv_all(self.client), '')
+        self.assertEqual(self.stats.sessions_idle_closed, 1)
+
+    def _check_slow_reader(self, use_splice):
+        # Each chunk takes longer than the idle timeout to be read
+        thread = self._session(idle_timeout=0.3, use_splice=use_splice,
+                               buffer_size=65536, tcp_bufsize=4096)
+        request = 'x' * (1 << 17)
+        writer = eventlet.spawn(self.client.sendall, request)
+        received = 0
+        while received < len(request):
+            chunk = self.server.recv(8192)
+            if not chunk:
+                break
+            received += len(chunk)
+            eventlet.sleep(0.05)
+        self.assertEqual(received, len(request))
+        writer.wait()
+        self.client.shutdown(socket.SHUT_WR)
+        self.server.shutdown(socket.SHUT_WR)
+        thread.wait()
+        self.assertEqual(self.stats.sessions_idle_closed, 0)
+        self.assertEqual(self.stats.bytes_to_server, len(request))
+
+    def test_slow_reader_is_not_idle(self):
+        self._check_slow_reader(use_splice=False)
+
+    @test.skip_if(relay._splice is None, 'Test requires splice(2)')
+    def test_slow_reader_is_not_idle_splice(self):
+        self._check_slow_reader(use_splice=True)
+
+    def test_rate_is_capped(self):
+        sleeps = []
+        self.now = 1000.0
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            self.now += seconds
+
+        self.stubs.Set(relay.time, 'time', lambda: self.now)
+        self.stubs.Set(eventlet, 'sleep', fake_sleep)
+        thread = self._session(max_rate=1000, use_splice=False)
+        self.client.sendall('x' * 3000)
+        self.client.shutdown(socket.SHUT_WR)
+        self.assertEqual(len(_recv_all(self.server)), 3000)
+        self.server.shutdown(socket.SHUT_WR)
+        thread.wait()
+        # One second of burst, then 2000 bytes at 1000 bytes/s
+        self.assertEqual(sum(sleeps), 2.0)
+
+    def test_stats_report(self):
+        stats = relay.ProxyStats()
+        self.assertEqual(stats.report()['connect_time_avg'], 0.0)
+        stats.connected(0.5)
+        stats.connected(1.5)
+        report = stats.report()
+        self.assertEqual(report['connect_time_avg'], 1.0)
+        self.assertEqual(report['connect_time_max'], 1.5)
+
+
+class XCPVNCProxyTestCase(test.TestCase):
+
+    def _call(self, path):
+        responses = []
+
+        def start_response(status, headers):
+            responses.append(status)
+
+        body = xvp_proxy.XCPVNCProxy()(webob.Request.blank(path).environ,
+                                       start_response)
+        return responses[0], body
+
+    def test_stats_path(self):
+        self.flags(xvpvncproxy_stats_path='/stats')
+        status, body = self._call('/stats')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(json.loads(body)['sessions_active'], 0)
+
+    def test_stats_path_disabled(self):
+        status, body = self._call('/stats')
+        self.assertEqual(status, '400 Invalid Request')
+
+    def test_signed_token_checked_locally(self):
+        self.flags(console_token_keys=['k1:secret'])
+        self.stubs.Set(rpc, 'call', None)
+        status, body = self._call('/console?token=v1.k1.forged.sig')
+        self.assertEqual(status, '401 Not Authorized')
@@ -34,6 +34,8 @@ from nova import rpc
 from nova import test
 from nova import utils
 import nova.volume.api
+import nova.volume.driver
+import nova.volume.wipe
 
 FLAGS = flags.FLAGS
 LOG = logging.getLogger(__name__)
@@ -404,6 +406,116 @@ class VolumeDriverTestCase(DriverTestCase):
         self.volume.driver.delete_volume({'name': 'test1', 'size': 1024})
 
 
+class VolumeWipeTestCase(test.TestCase):
+    """Test case for the background volume wiper"""
+
+    def setUp(self):
+        super(VolumeWipeTestCase, self).setUp()
+        self.flags(volume_group='vg', volume_wipe_chunk_mb=100,
+                   volume_wipe_use_discard=False)
+        self.commands = []
+        self.lvs_output = ''
+
+        def _fake_execute(*cmd, **kwargs):
+            self.commands.append(cmd)
+            if cmd[0] == 'lvs':
+                return self.lvs_output, ''
+            return '', ''
+        self.wiper = nova.volume.wipe.VolumeWiper(_fake_execute)
+
+    def test_queue_delete_renames_then_wipes(self):
+        self.lvs_output = '  250.00\n'
+        self.wiper.queue_delete('volume-00000001')
+        self.assertEqual(self.commands[0],
+                         ('lvrename', 'vg', 'volume-00000001',
+                          'pending-wipe-volume-00000001'))
+        self.wiper.wait()
+        dds = [cmd for cmd in self.commands if cmd[0] == 'dd']
+        self.assertEqual([cmd[4:6] for cmd in dds],
+                         [('count=100', 'seek=0'),
+                          ('count=100', 'seek=100'),
+                          ('count=50', 'seek=200')])
+        self.assertEqual(self.commands[-1],
+                         ('lvremove', '-f',
+                          'vg/pending-wipe-volume-00000001'))
+        self.assertEqual(self.wiper.pending, set())
+
+    def test_resume_only_queues_pending_volumes(self):
+        self.lvs_output = ('  volume-00000001\n'
+                           '  pending-wipe-volume-00000002\n')
+        self.stubs.Set(self.wiper, 'wipe', lambda name: None)
+        self.wiper.resume()
+        self.assertEqual(self.wiper.pending,
+                         set(['pending-wipe-volume-00000002']))
+        self.wiper.wait()
+        self.assertEqual(self.commands[-1],
+                         ('lvremove', '-f',
+                          'vg/pending-wipe-volume-00000002'))
+
+    def test_failed_wipe_keeps_volume(self):
+        def _fail(lv_name):
+            raise exception.ProcessExecutionError()
+        self.stubs.Set(self.wiper, 'wipe', _fail)
+        self.wiper.queue_delete('volume-00000001')
+        self.wiper.wait()
+        self.assertFalse([cmd for cmd in self.commands
+                          if cmd[0] == 'lvremove'])
+
+    def test_discard_replaces_zeroing(self):
+        self.flags(volume_wipe_use_discard=True)
+        self.stubs.Set(self.wiper, '_discard_zeroes', lambda path: True)
+        self.wiper.wipe('pending-wipe-volume-00000001')
+        self.assertEqual(self.commands,
+                         [('blkdiscard',
+                           '/dev/vg/pending-wipe-volume-00000001')])
+
+    def test_throttle_spaces_out_chunks(self):
+        throttle = nova.volume.wipe.Throttle(mb_per_sec=100)
+        self.assertEqual(throttle._cost(50, 50), 0.5)
+        throttle = nova.volume.wipe.Throttle(mb_per_sec=100, iops=10)
+        self.assertEqual(throttle._cost(50, 50), 5.0)
+
+    def test_driver_delete_is_async(self):
+        self.flags(volume_wipe_async=True)
+        driver = nova.volume.driver.VolumeDriver(
+                execute=lambda *a, **k: ('', ''))
+        self.mox.StubOutWithMock(driver.wiper, 'queue_delete')
+        driver.wiper.queue_delete('volume-00000001')
+        self.mox.ReplayAll()
+        driver.delete_volume({'name': 'volume-00000001', 'size': 1})
+
+    def test_driver_delete_snapshot_then_volume(self):
+        self.flags(volume_wipe_async=True)
+        # logical volume name -> name of its origin, None for volumes
+        lvs = {'volume-00000001': None,
+               '_snapshot-00000001': 'volume-00000001'}
+
+        def _fake_execute(*cmd, **kwargs):
+            self.commands.append(cmd)
+            if cmd[0] == 'lvdisplay':
+                name = cmd[-1].split('/')[1]
+                if name not in lvs:
+                    raise exception.ProcessExecutionError()
+                if name in lvs.values():
+                    return '  owi-a-\n', ''
+                return '  -wi-a-\n', ''
+            if cmd[0] == 'lvs':
+                return '  1024.00\n', ''
+            if cmd[0] == 'lvrename':
+                lvs[cmd[3]] = lvs.pop(cmd[2])
+            elif cmd[0] == 'lvremove':
+                del lvs[cmd[-1].split('/')[1]]
+            return '', ''
+
+        driver = nova.volume.driver.VolumeDriver(execute=_fake_execute)
+        driver.delete_snapshot({'name': 'snapshot-00000001',
+                                'volume_size': 1})
+        self.assertEqual(lvs, {'volume-00000001': None})
+        driver.delete_volume({'name': 'volume-00000001', 'size': 1})
+        driver.wiper.wait()
+        self.assertEqual(lvs, {})
+
+
 class ISCSITestCase(DriverTestCase):
     """Test Case for ISCSIDriver"""
     driver_name = "nova.volume.driver.ISCSIDriver"
@@ -471,6 +583,35 @@ class ISCSITestCase(DriverTestCase):
 
         self._detach_volume(volume_id_list)
 
+    def test_ensure_exports_only_recreates_missing(self):
+        """Only targets and luns missing from the target state are made."""
+        volume_id_list = self._attach_volume()
+        volumes = [db.volume_get(self.context, i) for i in volume_id_list]
+        tids = [db.volume_get_iscsi_target_num(self.context, i)
+                for i in volume_id_list]
+        names = ["%s%s" % (FLAGS.iscsi_target_prefix, v['name'])
+                 for v in volumes]
+
+        tgtadm = self.volume.driver.tgtadm
+        self.mox.StubOutWithMock(tgtadm, 'show_targets')
+        self.mox.StubOutWithMock(tgtadm, 'new_target')
+        self.mox.StubOutWithMock(tgtadm, 'new_logicalunit')
+        tgtadm.show_targets().AndReturn({tids[0]: (names[0], set([0])),
+                                         tids[1]: (names[1], set())})
+        tgtadm.new_logicalunit(tids[1], 0, mox.IgnoreArg(),
+                               check_exit_code=False).InAnyOrder()
+        tgtadm.new_target(names[2], tids[2],
+                          check_exit_code=False).InAnyOrder()
+        tgtadm.new_logicalunit(tids[2], 0, mox.IgnoreArg(),
+                               check_exit_code=False).InAnyOrder()
+        self.mox.ReplayAll()
+
+        self.volume.driver.ensure_exports(self.context, volumes)
+        self.mox.VerifyAll()
+        self.mox.UnsetStubs()
+
+        self._detach_volume(volume_id_list)
+
 
 class VolumePolicyTestCase(test.TestCase):
 
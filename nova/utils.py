@@ -57,6 +57,7 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova.openstack.common import cfg
+from nova.rootwrap import client as rootwrap_client
 
 
 LOG = logging.getLogger(__name__)
@@ -166,6 +167,18 @@ def fetchfile(url, target):
     execute('curl', '--fail', url, '-o', target)
 
 
+_ROOTWRAP_CLIENT = None
+
+
+def _rootwrap_client():
+    """Return the client of this process' rootwrap daemon."""
+    global _ROOTWRAP_CLIENT
+    if (_ROOTWRAP_CLIENT is None or
+        _ROOTWRAP_CLIENT.daemon_cmd != FLAGS.root_helper_daemon):
+        _ROOTWRAP_CLIENT = rootwrap_client.Client(FLAGS.root_helper_daemon)
+    return _ROOTWRAP_CLIENT
+
+
 def execute(*cmd, **kwargs):
     """Helper method to execute command with optional retry.
 
@@ -184,7 +197,8 @@ def execute(*cmd, **kwargs):
     :param attempts:           How many times to retry cmd.
     :param run_as_root:        True | False. Defaults to False. If set to True,
                                the command is prefixed by the command specified
-                               in the root_helper FLAG.
+                               in the root_helper FLAG, or handed to the
+                               root_helper_daemon if that FLAG is set.
 
     :raises exception.Error: on receiving unknown arguments
     :raises exception.ProcessExecutionError:
@@ -210,28 +224,36 @@ def execute(*cmd, **kwargs):
         raise exception.Error(_('Got unknown keyword args '
                                 'to utils.execute: %r') % kwargs)
 
-    if run_as_root:
+    use_daemon = run_as_root and FLAGS.root_helper_daemon and not shell
+    if run_as_root and not use_daemon:
         cmd = shlex.split(FLAGS.root_helper) + list(cmd)
     cmd = map(str, cmd)
 
     while attempts > 0:
         attempts -= 1
         try:
-            LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
-            _PIPE = subprocess.PIPE  # pylint: disable=E1101
-            obj = subprocess.Popen(cmd,
-                                   stdin=_PIPE,
-                                   stdout=_PIPE,
-                                   stderr=_PIPE,
-                                   close_fds=True,
-                                   shell=shell)
-            result = None
-            if process_input is not None:
-                result = obj.communicate(process_input)
+            if use_daemon:
+                LOG.debug(_('Running cmd (rootwrap daemon): %s'),
+                          ' '.join(cmd))
+                _returncode, stdout, stderr = _rootwrap_client().execute(
+                        cmd, process_input)
+                result = (stdout, stderr)
             else:
-                result = obj.communicate()
-            obj.stdin.close()  # pylint: disable=E1101
-            _returncode = obj.returncode  # pylint: disable=E1101
+                LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
+                _PIPE = subprocess.PIPE  # pylint: disable=E1101
+                obj = subprocess.Popen(cmd,
+                                       stdin=_PIPE,
+                                       stdout=_PIPE,
+                                       stderr=_PIPE,
+                                       close_fds=True,
+                                       shell=shell)
+                result = None
+                if process_input is not None:
+                    result = obj.communicate(process_input)
+                else:
+                    result = obj.communicate()
+                obj.stdin.close()  # pylint: disable=E1101
+                _returncode = obj.returncode  # pylint: disable=E1101
             if _returncode:
                 LOG.debug(_('Result was %s') % _returncode)
                 if not ignore_exit_code and _returncode not in check_exit_code:
@@ -287,7 +309,7 @@ def trycmd(*args, **kwargs):
 
 
 def ssh_execute(ssh, cmd, process_input=None,
-                addl_env=None, check_exit_code=True):
+                addl_env=None, check_exit_code=True, timeout=None):
     LOG.debug(_('Running cmd (SSH): %s'), ' '.join(cmd))
     if addl_env:
         raise exception.Error(_('Environment not supported over SSH'))
@@ -298,6 +320,9 @@ def ssh_execute(ssh, cmd, process_input=None,
 
     stdin_stream, stdout_stream, stderr_stream = ssh.exec_command(cmd)
     channel = stdout_stream.channel
+    if timeout:
+        # reads below raise socket.timeout instead of hanging forever
+        channel.settimeout(timeout)
 
     #stdin.write('process_input would go here')
     #stdin.flush()
@@ -30,6 +30,7 @@ import json
 import os
 import random
 import re
+import shutil
 import tempfile
 
 from nova import exception
@@ -37,6 +38,7 @@ from nova import flags
 from nova import log as logging
 from nova.openstack.common import cfg
 from nova import utils
+from nova.virt.disk import extfs
 from nova.virt.disk import guestfs
 from nova.virt.disk import loop
 from nova.virt.disk import nbd
@@ -51,6 +53,10 @@ disk_opts = [
     cfg.ListOpt('img_handlers',
                 default=['loop', 'nbd', 'guestfs'],
                 help='Order of methods used to mount disk images'),
+    cfg.BoolOpt('img_direct_injection',
+                default=True,
+                help='Inject files into raw images holding an ext2/3/4 '
+                     'file system with debugfs, without mounting them'),
 
     # NOTE(yamahata): ListOpt won't work because the command may include a
     #                 comma. For example:
@@ -222,6 +228,32 @@ class _DiskImage(object):
 
 # Public module functions
 
+def _inject_directly(image, partition, use_cow, inject, *args):
+    """Make the changes of inject(fs, *args) without mounting the image.
+
+    Returns False, leaving the files of the image untouched, when the
+    image or the changes are not supported by extfs or when debugfs fails
+    to apply them; the caller then mounts it.
+    """
+    if use_cow or not FLAGS.img_direct_injection:
+        return False
+    offset = extfs.find_filesystem(image, partition)
+    if offset is None:
+        return False
+    fs = extfs.Filesystem(image, offset)
+    try:
+        try:
+            inject(fs, *args)
+            fs.commit()
+        except (exception.Error, exception.ProcessExecutionError), e:
+            LOG.debug(_('Unable to inject into %(image)s directly, '
+                        'mounting it instead: %(e)s') % locals())
+            return False
+    finally:
+        fs.close()
+    return True
+
+
 def inject_data(image,
                 key=None, net=None, metadata=None, admin_password=None,
                 partition=None, use_cow=False):
@@ -232,7 +264,13 @@ def inject_data(image,
 
     If partition is not specified it mounts the image as a single partition.
 
+    Raw images with an ext2/3/4 file system are changed without mounting
+    them when possible.
+
     """
+    if _inject_directly(image, partition, use_cow, _inject_data_into_extfs,
+                        key, net, metadata, admin_password):
+        return
     img = _DiskImage(image=image, partition=partition, use_cow=use_cow)
     if img.mount():
         try:
@@ -247,6 +285,9 @@ def inject_data(image,
 
 def inject_files(image, files, partition=None, use_cow=False):
     """Injects arbitrary files into a disk image"""
+    if _inject_directly(image, partition, use_cow, _inject_files_into_extfs,
+                        files):
+        return
     img = _DiskImage(image=image, partition=partition, use_cow=use_cow)
     if img.mount():
         try:
@@ -333,6 +374,11 @@ def _inject_key_into_fs(key, fs, execute=None):
     utils.execute('chown', 'root', sshdir, run_as_root=True)
     utils.execute('chmod', '700', sshdir, run_as_root=True)
     keyfile = os.path.join(sshdir, 'authorized_keys')
+    utils.execute('tee', '-a', keyfile,
+                  process_input=_key_data(key), run_as_root=True)
+
+
+def _key_data(key):
     key_data = [
         '\n',
         '# The following ssh key was injected by Nova',
@@ -340,8 +386,7 @@ def _inject_key_into_fs(key, fs, execute=None):
         key.strip(),
         '\n',
     ]
-    utils.execute('tee', '-a', keyfile,
-                  process_input=''.join(key_data), run_as_root=True)
+    return ''.join(key_data)
 
 
 def _inject_net_into_fs(net, fs, execute=None):
@@ -392,6 +437,45 @@ def _inject_admin_password_into_fs(admin_passwd, fs, execute=None):
     os.unlink(tmp_shadow)
 
 
+def _inject_files_into_extfs(fs, files):
+    """Same as _inject_file_into_fs() for each file, on an extfs image."""
+    for (path, contents) in files:
+        fs.make_dir(os.path.dirname('/' + path.lstrip('/')))
+        fs.write_file(path, contents)
+
+
+def _inject_data_into_extfs(fs, key, net, metadata, admin_password):
+    """Same as inject_data_into_fs(), on an extfs.Filesystem."""
+    if key:
+        fs.make_dir('/root/.ssh', mode=0700, uid=0)
+        fs.write_file('/root/.ssh/authorized_keys', _key_data(key),
+                      append=True)
+    if net:
+        fs.make_dir('/etc/network', mode=0755, uid=0, gid=0)
+        fs.write_file('/etc/network/interfaces', net)
+    if metadata:
+        metadata = dict([(m.key, m.value) for m in metadata])
+        fs.write_file('/meta.js', json.dumps(metadata))
+    if admin_password:
+        passwd = fs.read_file('/etc/passwd')
+        shadow = fs.read_file('/etc/shadow')
+        if passwd is None or shadow is None:
+            raise exception.Error(_('No /etc/passwd or /etc/shadow found'))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            tmp_passwd = os.path.join(tmpdir, 'passwd')
+            tmp_shadow = os.path.join(tmpdir, 'shadow')
+            with open(tmp_passwd, 'wb') as f:
+                f.write(passwd)
+            with open(tmp_shadow, 'wb') as f:
+                f.write(shadow)
+            _set_passwd('root', admin_password, tmp_passwd, tmp_shadow)
+            with open(tmp_shadow, 'rb') as f:
+                fs.write_file('/etc/shadow', f.read())
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
 def _set_passwd(username, admin_passwd, passwd_file, shadow_file):
     """set the password for username to admin_passwd
 
@@ -0,0 +1,332 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Write small files into ext2/3/4 file systems without mounting them
+
+Injection only places a handful of small files, so rather than attaching
+the image to a loop or nbd device and mounting it, the changes are made
+with debugfs directly on the image file.  Reads go through one debugfs
+call each, all writes are queued and applied by commit(), so nothing is
+changed if anything fails before that.
+
+Only raw images holding a cleanly unmounted ext2/3/4 file system, either
+directly or in a primary MBR partition, are handled; find_filesystem()
+returns None for anything else and callers fall back to mounting.
+"""
+
+import os
+import re
+import shutil
+import struct
+import tempfile
+
+from nova import exception
+from nova import log as logging
+from nova import utils
+
+
+LOG = logging.getLogger(__name__)
+
+SECTOR_SIZE = 512
+EXT_SUPER_MAGIC = 0xEF53
+EXT_STATE_CLEAN = 0x0001
+EXT_FEATURE_INCOMPAT_RECOVER = 0x0004
+QCOW_MAGIC = 'QFI\xfb'
+MBR_GPT_PROTECTIVE = 0xEE
+MBR_EXTENDED = (0x05, 0x0F, 0x85)
+
+# Paths are passed on debugfs command lines, only allow plain ones
+_SAFE_PATH_RE = re.compile(r'^/[A-Za-z0-9_.+@,:/-]*$')
+_STAT_RE = re.compile(r'Type:\s+(\S+)\s+Mode:\s+([0-7]+).*?'
+                      r'User:\s+(\d+)\s+Group:\s+(\d+)', re.S)
+_XATTR_RE = re.compile(r'^\s+(\S+) \(\d+\)', re.M)
+
+S_IFDIR = 0040000
+S_IFREG = 0100000
+
+
+def _partition_offset(header, partition):
+    """Byte offset of primary MBR partition number partition, or None."""
+    if not partition:
+        return 0
+    try:
+        number = int(partition)
+    except ValueError:
+        return None
+    if not 1 <= number <= 4 or header[510:512] != '\x55\xaa':
+        return None
+    entry = 446 + 16 * (number - 1)
+    part_type = ord(header[entry + 4])
+    start, = struct.unpack('<I', header[entry + 8:entry + 12])
+    if (not part_type or part_type == MBR_GPT_PROTECTIVE or
+        part_type in MBR_EXTENDED or not start):
+        return None
+    return start * SECTOR_SIZE
+
+
+def find_filesystem(image, partition=None):
+    """Return the offset of a writable ext file system in image, or None."""
+    if '?' in image:
+        return None
+    try:
+        with open(image, 'rb') as f:
+            header = f.read(SECTOR_SIZE)
+            if header.startswith(QCOW_MAGIC):
+                return None
+            offset = _partition_offset(header, partition)
+            if offset is None:
+                return None
+            f.seek(offset + 1024)
+            superblock = f.read(1024)
+    except IOError:
+        return None
+    if len(superblock) < 100:
+        return None
+    magic, state = struct.unpack('<HH', superblock[56:60])
+    incompat, = struct.unpack('<I', superblock[96:100])
+    if (magic != EXT_SUPER_MAGIC or not state & EXT_STATE_CLEAN or
+        incompat & EXT_FEATURE_INCOMPAT_RECOVER):
+        return None
+    return offset
+
+
+def _temporary_name(path):
+    """Name path is written under until it replaces the original."""
+    head, tail = os.path.split(path)
+    return os.path.join(head, '.%s.nova-inject' % tail)
+
+
+def _check_path(path):
+    path = os.path.normpath('/' + path.lstrip('/'))
+    if not _SAFE_PATH_RE.match(path):
+        raise exception.Error(_('Unsupported path for direct '
+                                'injection: %r') % path)
+    return path
+
+
+class Filesystem(object):
+    """Queue of changes to an ext file system inside an image file."""
+
+    def __init__(self, image, offset=0):
+        self.device = image
+        if offset:
+            self.device = '%s?offset=%d' % (image, offset)
+        self._tmpdir = tempfile.mkdtemp()
+        # Commands creating directories, and changing existing ones
+        self._commands = []
+        self._finish = []
+        self._created = []
+        # Final state of the paths changed by the queued commands
+        self._dirs = {}
+        self._files = {}
+
+    def close(self):
+        """Drop the queued changes and temporary files."""
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+        self._commands = []
+        self._finish = []
+        self._created = []
+        self._files = {}
+
+    def _debugfs(self, *args, **kwargs):
+        out, err = utils.execute('debugfs', *(args + (self.device,)),
+                                 run_as_root=True, **kwargs)
+        # debugfs exits 0 whatever happens, the errors are on stderr
+        # after its version banner.
+        errors = [line for line in err.splitlines()
+                  if line.strip() and not line.startswith('debugfs ')]
+        return out, errors
+
+    def _tmpfile(self, data=None):
+        fd, path = tempfile.mkstemp(dir=self._tmpdir)
+        with os.fdopen(fd, 'wb') as f:
+            if data:
+                f.write(data)
+        return path
+
+    def stat(self, path):
+        """Return (type, mode, uid, gid) of path, or None if missing."""
+        path = _check_path(path)
+        if path in self._files:
+            return ('regular',) + tuple(self._files[path][1:4])
+        if path in self._dirs:
+            return ('directory',) + tuple(self._dirs[path])
+        out, errors = self._debugfs('-R', 'stat %s' % path)
+        match = _STAT_RE.search(out)
+        if errors or not match:
+            return None
+        file_type, mode, uid, gid = match.groups()
+        return file_type, int(mode, 8) & 07777, int(uid), int(gid)
+
+    def read_file(self, path):
+        """Return the contents of the regular file path, or None."""
+        path = _check_path(path)
+        if path in self._files:
+            return self._files[path][0]
+        st = self.stat(path)
+        if st is None:
+            return None
+        if st[0] != 'regular':
+            raise exception.Error(_('%s is not a regular file') % path)
+        target = self._tmpfile()
+        _out, errors = self._debugfs('-R', 'dump %s %s' % (path, target))
+        if errors:
+            raise exception.Error(_('Could not read %(path)s: %(errors)s')
+                                  % {'path': path, 'errors': errors})
+        with open(target, 'rb') as f:
+            return f.read()
+
+    def make_dir(self, path, mode=None, uid=None, gid=None):
+        """Like mkdir -p, then chmod and chown the last directory.
+
+        A mode, uid or gid of None leaves that attribute alone.
+        """
+        path = _check_path(path)
+        parts = path.strip('/').split('/')
+        for i in xrange(1, len(parts) + 1):
+            current = '/' + '/'.join(parts[:i])
+            if current in self._dirs:
+                continue
+            st = self.stat(current)
+            if st is None:
+                # Created like mkdir -p running as root would
+                self._commands.append('mkdir %s' % current)
+                self._created.append(current)
+                self._dirs[current] = [0755, 0, 0]
+                self._set_inode(self._commands, current, S_IFDIR,
+                                *self._dirs[current])
+            elif st[0] != 'directory':
+                raise exception.Error(_('%s is not a directory') % current)
+            else:
+                self._dirs[current] = list(st[1:])
+
+        attrs = self._dirs[path]
+        wanted = [attrs[0] if mode is None else mode,
+                  attrs[1] if uid is None else uid,
+                  attrs[2] if gid is None else gid]
+        if wanted != attrs:
+            self._dirs[path] = wanted
+            if path in self._created:
+                self._set_inode(self._commands, path, S_IFDIR, *wanted)
+            else:
+                self._set_inode(self._finish, path, S_IFDIR, *wanted)
+
+    def write_file(self, path, data, append=False):
+        """Replace or append to path, keeping owner, mode and xattrs.
+
+        New files are created like tee running as root would, the
+        parent directory must exist.
+        """
+        path = _check_path(path)
+        entry = self._files.get(path)
+        if entry is None:
+            st = self.stat(path)
+            if st is None:
+                entry = ['', 0644, 0, 0, [], False]
+            elif st[0] != 'regular':
+                raise exception.Error(_('%s is not a regular file') % path)
+            else:
+                old_data = ''
+                if append:
+                    old_data = self.read_file(path)
+                entry = [old_data, st[1], st[2], st[3],
+                         self._dump_xattrs(path), True]
+            self._files[path] = entry
+
+        if append:
+            entry[0] += data
+        else:
+            entry[0] = data
+
+    def _dump_xattrs(self, path):
+        """Save the extended attributes (e.g. SELinux labels) of path."""
+        out, errors = self._debugfs('-R', 'ea_list %s' % path)
+        if errors:
+            # e.g. a debugfs too old to know about extended attributes
+            raise exception.Error(_('Could not list extended attributes of '
+                                    '%(path)s: %(errors)s')
+                                  % {'path': path, 'errors': errors})
+        xattrs = []
+        for name in _XATTR_RE.findall(out):
+            if not re.match(r'^[A-Za-z0-9_.-]+$', name):
+                raise exception.Error(_('Unsupported extended attribute '
+                                        '%(name)r on %(path)s') % locals())
+            value_file = self._tmpfile()
+            _out, errors = self._debugfs('-R', 'ea_get -f %s %s %s'
+                                         % (value_file, path, name))
+            if errors:
+                raise exception.Error(_('Could not read extended attribute '
+                                        '%(name)s of %(path)s') % locals())
+            xattrs.append((name, value_file))
+        return xattrs
+
+    def _set_inode(self, commands, path, file_type, mode, uid, gid):
+        commands.extend(['sif %s mode 0%o' % (path, file_type | mode),
+                         'sif %s uid %d' % (path, uid),
+                         'sif %s gid %d' % (path, gid)])
+
+    def _run(self, commands):
+        """Run commands in a single debugfs -w call, return its errors."""
+        if not commands:
+            return []
+        _out, errors = self._debugfs('-w', '-f', '-',
+                                     process_input='\n'.join(commands) + '\n')
+        return errors
+
+    def commit(self):
+        """Apply all queued changes.
+
+        debugfs goes on after a failed command, so this takes two runs.
+        The first creates the new directories and writes every file under
+        a temporary name next to its destination; if anything fails, what
+        it created is removed again and the original files are untouched.
+        Only then does the second run swap the new files in and change
+        the attributes of existing directories, which allocates nothing.
+        """
+        prepare = list(self._commands)
+        rollback = []
+        swap = []
+        for path in sorted(self._files):
+            data, mode, uid, gid, xattrs, exists = self._files[path]
+            tmp = _temporary_name(path)
+            prepare.append('write %s %s' % (self._tmpfile(data), tmp))
+            self._set_inode(prepare, tmp, S_IFREG, mode, uid, gid)
+            for name, value_file in xattrs:
+                prepare.append('ea_set -f %s %s %s'
+                               % (value_file, tmp, name))
+            rollback.append('rm %s' % tmp)
+            if exists:
+                swap.append('rm %s' % path)
+            # debugfs ln and unlink leave the link count alone, together
+            # they move the entry of the new file to its final name.
+            swap.extend(['ln %s %s' % (tmp, path), 'unlink %s' % tmp])
+        rollback.extend('rmdir %s' % path for path in reversed(self._created))
+        swap.extend(self._finish)
+        self._commands = []
+        self._finish = []
+        self._created = []
+        self._files = {}
+
+        errors = self._run(prepare)
+        if errors:
+            # Files that were never written give errors of their own
+            self._run(rollback)
+        else:
+            errors = self._run(swap)
+        if errors:
+            raise exception.Error(_('debugfs failed to update %(image)s: '
+                                    '%(errors)s')
+                                  % {'image': self.device, 'errors': errors})
@@ -15,7 +15,9 @@
 # under the License.
 """Support for mounting images with qemu-nbd"""
 
+import glob
 import os
+import re
 import time
 
 from nova import flags
@@ -30,70 +32,83 @@ nbd_opts = [
                help='time to wait for a NBD device coming up'),
     cfg.IntOpt('max_nbd_devices',
                default=16,
-               help='maximum number of possible nbd devices'),
+               help='maximum number of nbd devices to use, the devices '
+                    'present are found in /sys/block'),
     ]
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(nbd_opts)
 
+# Polling intervals while waiting for qemu-nbd to attach the image
+_POLL_START = 0.01
+_POLL_MAX = 0.5
+
+
+def _nbd_number(path):
+    match = re.search(r'nbd(\d+)$', path)
+    return int(match.group(1)) if match else None
+
 
 class Mount(mount.Mount):
     """qemu-nbd support disk images."""
     mode = 'nbd'
 
-    # NOTE(padraig): There are three issues with this nbd device handling
-    #  1. max_nbd_devices should be inferred (#861504)
-    #  2. We assume nothing else on the system uses nbd devices
-    #  3. Multiple workers on a system can race against each other
-    # A patch has been proposed in Nov 2011, to add add a -f option to
-    # qemu-nbd, akin to losetup -f. One could test for this by running qemu-nbd
-    # with just the -f option, where it will fail if not supported, or if there
-    # are no free devices. Note that patch currently hardcodes 16 devices.
-    # We might be able to alleviate problem 2. by scanning /proc/partitions
-    # like the aformentioned patch does.
-    _DEVICES = ['/dev/nbd%s' % i for i in range(FLAGS.max_nbd_devices)]
-
-    def _allocate_nbd(self):
-        if not os.path.exists("/sys/block/nbd0"):
-            self.error = _('nbd unavailable: module not loaded')
-            return None
-        while True:
-            if not self._DEVICES:
-                # really want to log this info, not raise
-                self.error = _('No free nbd devices')
-                return None
-            device = self._DEVICES.pop()
-            if not os.path.exists("/sys/block/%s/pid" %
-                                  os.path.basename(device)):
+    # NOTE: free devices are found by looking for nbd devices without a
+    # pid file in sysfs, so devices used by anything else on the host are
+    # skipped too.  Choosing a device and attaching the image to it is
+    # done under a host wide lock, so that workers and other services on
+    # the host can't pick the same device in between.
+
+    @staticmethod
+    def _find_free_device():
+        numbers = [_nbd_number(path) for path in glob.glob('/sys/block/nbd*')]
+        for number in sorted(n for n in numbers if n is not None):
+            if number >= FLAGS.max_nbd_devices:
                 break
-        return device
+            if not os.path.exists('/sys/block/nbd%d/pid' % number):
+                return '/dev/nbd%d' % number
+        return None
 
-    def _free_nbd(self, device):
-        self._DEVICES.append(device)
+    @staticmethod
+    def _wait_for_device(device):
+        """Wait for qemu-nbd, which forks, to set the device up."""
+        pid_file = '/sys/block/%s/pid' % os.path.basename(device)
+        deadline = time.time() + FLAGS.timeout_nbd
+        interval = _POLL_START
+        while not os.path.exists(pid_file):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, _POLL_MAX)
+        return True
 
-    def get_dev(self):
-        device = self._allocate_nbd()
+    @utils.synchronized('nbd-allocation', external=True)
+    def _connect(self):
+        if not os.path.exists('/sys/block/nbd0'):
+            self.error = _('nbd unavailable: module not loaded')
+            return None
+        device = self._find_free_device()
         if not device:
-            return False
+            # really want to log this info, not raise
+            self.error = _('No free nbd devices')
+            return None
         _out, err = utils.trycmd('qemu-nbd', '-c', device, self.image,
                                  run_as_root=True)
         if err:
             self.error = _('qemu-nbd error: %s') % err
-            self._free_nbd(device)
-            return False
-
-        # NOTE(vish): this forks into another process, so give it a chance
-        #             to set up before continuing
-        for _i in range(FLAGS.timeout_nbd):
-            if os.path.exists("/sys/block/%s/pid" % os.path.basename(device)):
-                self.device = device
-                break
-            time.sleep(1)
-        else:
+            return None
+        if not self._wait_for_device(device):
             self.error = _('nbd device %s did not show up') % device
-            self._free_nbd(device)
-            return False
+            utils.trycmd('qemu-nbd', '-d', device, run_as_root=True)
+            return None
+        return device
 
+    def get_dev(self):
+        device = self._connect()
+        if not device:
+            return False
+        self.device = device
         self.linked = True
         return True
 
@@ -101,6 +116,5 @@ class Mount(mount.Mount):
         if not self.linked:
             return
         utils.execute('qemu-nbd', '-d', self.device, run_as_root=True)
-        self._free_nbd(self.device)
         self.linked = False
         self.device = None
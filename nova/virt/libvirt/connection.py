@@ -71,6 +71,7 @@ from nova.virt.disk import api as disk
 from nova.virt.libvirt import config
 from nova.virt.libvirt import firewall
 from nova.virt.libvirt import imagecache
+from nova.virt.libvirt import transfer
 from nova.virt.libvirt import utils as libvirt_utils
 
 
@@ -126,6 +127,16 @@ libvirt_opts = [
                help='Snapshot image format (valid options are : '
                     'raw, qcow2, vmdk, vdi). '
                     'Defaults to same as source image'),
+    cfg.BoolOpt('libvirt_live_snapshot',
+                default=True,
+                help='Snapshot running instances with qcow2 disks without '
+                     'stopping them, through a block copy of their disk. '
+                     'Needs libvirt 1.0.0 and qemu 1.3.0 or newer'),
+    cfg.BoolOpt('libvirt_stream_snapshots',
+                default=True,
+                help='Upload raw snapshots to the image service while they '
+                     'are being extracted. Needs a qemu-img reporting its '
+                     'progress (-p)'),
     cfg.StrOpt('libvirt_vif_driver',
                default='nova.virt.libvirt.vif.LibvirtBridgeDriver',
                help='The libvirt VIF driver to configure the VIFs.'),
@@ -166,6 +177,18 @@ FLAGS.register_opts(libvirt_opts)
 flags.DECLARE('live_migration_retry_count', 'nova.compute.manager')
 flags.DECLARE('vncserver_proxyclient_address', 'nova.vnc')
 
+# Live snapshots need block copies of the disks of transient domains
+MIN_LIBVIRT_LIVESNAPSHOT_VERSION = (1, 0, 0)
+MIN_QEMU_LIVESNAPSHOT_VERSION = (1, 3, 0)
+
+# Seconds between two checks of a block job or of a snapshot extraction
+SNAPSHOT_POLL_INTERVAL = 0.5
+
+SNAPSHOT_CHUNK_SIZE = 65536
+
+# Percentage between two progress reports of qemu-img
+SNAPSHOT_PROGRESS_STEP = 1.0
+
 
 def patch_tpool_proxy():
     """eventlet.tpool.Proxy doesn't work with old-style class in __str__()
@@ -209,6 +232,67 @@ def _get_eph_disk(ephemeral):
     return 'disk.eph' + str(ephemeral['num'])
 
 
+class _SnapshotStream(object):
+    """Reads a raw snapshot while it is being extracted.
+
+    qemu-img converts an image in order and reports how far it got, what
+    lies below that point won't change anymore.  Reads return that part of
+    the image as it grows, and the end of the file once the extraction is
+    finished.  They fail if the extraction failed, so that an incomplete
+    image is never uploaded.
+
+    The reported progress is a rounded float sum of the sectors qemu-img
+    went through and can run a little ahead of what it wrote, reading
+    there would upload holes it fills later.  Only the previous report,
+    less one more reporting step, is trusted.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.available = 0
+        self.finished = False
+        self.failed = False
+        self._file = None
+        self._offset = 0
+        self._reported = 0.0
+
+    def progress(self, percent):
+        written = self._reported - SNAPSHOT_PROGRESS_STEP
+        self._reported = percent
+        available = max(int(self.size * written / 100) // 512 * 512, 0)
+        self.available = max(self.available, available)
+
+    def finish(self, failed=False):
+        self.finished = True
+        self.failed = failed
+
+    def read(self, size=-1):
+        if size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(SNAPSHOT_CHUNK_SIZE)
+                if not chunk:
+                    return ''.join(chunks)
+                chunks.append(chunk)
+
+        while not self.finished and self._offset >= self.available:
+            greenthread.sleep(SNAPSHOT_POLL_INTERVAL)
+        if self.failed:
+            raise IOError(_("Extraction of %s failed") % self.path)
+        if self._file is None:
+            self._file = libvirt_utils.file_open(self.path, 'rb')
+        if not self.finished:
+            size = min(size, self.available - self._offset)
+        data = self._file.read(size)
+        self._offset += len(data)
+        return data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
 class LibvirtConnection(driver.ComputeDriver):
 
     def __init__(self, read_only):
@@ -668,29 +752,161 @@ class LibvirtConnection(driver.ComputeDriver):
         snapshot_name = uuid.uuid4().hex
 
         (state, _max_mem, _mem, _cpus, _t) = virt_dom.info()
-        if state == power_state.RUNNING:
-            virt_dom.managedSave(0)
-        # Make the snapshot
-        libvirt_utils.create_snapshot(disk_path, snapshot_name)
+        backing_file = None
+        if (state == power_state.RUNNING and source_format == 'qcow2' and
+            self._can_live_snapshot()):
+            backing_file = libvirt_utils.get_disk_backing_file(disk_path,
+                                                               basename=False)
+        live = bool(backing_file)
+        disk_size = libvirt_utils.get_disk_size(disk_path)
+        timings = {'start': time.time(), 'downtime': 0.0}
 
-        # Export the snapshot to a raw image
         with utils.tempdir() as tmpdir:
-            try:
-                out_path = os.path.join(tmpdir, snapshot_name)
-                libvirt_utils.extract_snapshot(disk_path, source_format,
-                                               snapshot_name, out_path,
-                                               image_format)
-            finally:
-                libvirt_utils.delete_snapshot(disk_path, snapshot_name)
+            out_path = os.path.join(tmpdir, snapshot_name)
+            if live:
+                # qemu writes the delta as another user
+                os.chmod(tmpdir, 0701)
+                disk_delta = out_path + '.delta'
+                self._live_snapshot(virt_dom, disk_path, backing_file,
+                                    disk_delta, disk_size)
+                source = (disk_delta, 'qcow2', None)
+            else:
                 if state == power_state.RUNNING:
-                    virt_dom.create()
+                    timings['stopped'] = time.time()
+                    virt_dom.managedSave(0)
+                # Make the snapshot
+                libvirt_utils.create_snapshot(disk_path, snapshot_name)
+                source = (disk_path, source_format, snapshot_name)
+
+            def extract(progress):
+                libvirt_utils.extract_snapshot(source[0], source[1],
+                                               source[2], out_path,
+                                               image_format,
+                                               progress=progress)
+
+            def extracted():
+                timings['extracted'] = time.time()
+                if live:
+                    return
+                try:
+                    libvirt_utils.delete_snapshot(disk_path, snapshot_name)
+                finally:
+                    if state == power_state.RUNNING:
+                        virt_dom.create()
+                        timings['downtime'] = (time.time() -
+                                               timings['stopped'])
+
+            self._upload_snapshot(context, image_service, image_href,
+                                  metadata, out_path, image_format,
+                                  disk_size, extract, extracted)
+
+        now = time.time()
+        timings['extraction'] = timings['extracted'] - timings['start']
+        timings['upload'] = now - timings['extracted']
+        LOG.info(_("Snapshot uploaded: the instance was stopped for "
+                   "%(downtime).1f seconds, the extraction took "
+                   "%(extraction).1f seconds and the upload ended "
+                   "%(upload).1f seconds after it"), timings,
+                 instance=instance)
+
+    def _can_live_snapshot(self):
+        """Whether running domains can be snapshotted with block copies."""
+        if (not FLAGS.libvirt_live_snapshot or
+            FLAGS.libvirt_type not in ('kvm', 'qemu') or
+            not hasattr(libvirt, 'VIR_DOMAIN_BLOCK_REBASE_COPY')):
+            return False
+
+        def version(parts):
+            return parts[0] * 1000000 + parts[1] * 1000 + parts[2]
+
+        try:
+            return (self._conn.getLibVersion() >=
+                        version(MIN_LIBVIRT_LIVESNAPSHOT_VERSION) and
+                    self._conn.getVersion() >=
+                        version(MIN_QEMU_LIVESNAPSHOT_VERSION))
+        except libvirt.libvirtError:
+            return False
+
+    def _live_snapshot(self, virt_dom, disk_path, backing_file, disk_delta,
+                       disk_size):
+        """Copy the disk of a running domain without stopping it.
 
-            # Upload that image to the image service
+        disk_delta gets the same backing file as the disk and a block job
+        mirrors the top of the disk into it.  Once both are in sync the job
+        is aborted, which leaves disk_delta with the disk as it was at that
+        moment.  qemu only copies the disks of transient domains, so the
+        domain is undefined during the copy and defined again afterwards.
+        """
+        libvirt_utils.create_cow_image(backing_file, disk_delta, disk_size)
+        xml = virt_dom.XMLDesc(0)
+
+        # Abort any block job an earlier snapshot may have left behind
+        try:
+            virt_dom.blockJobAbort(disk_path, 0)
+        except libvirt.libvirtError:
+            pass
+
+        persistent = virt_dom.isPersistent()
+        if persistent:
+            virt_dom.undefine()
+        try:
+            virt_dom.blockRebase(disk_path, disk_delta, 0,
+                                 libvirt.VIR_DOMAIN_BLOCK_REBASE_COPY |
+                                 libvirt.VIR_DOMAIN_BLOCK_REBASE_REUSE_EXT |
+                                 libvirt.VIR_DOMAIN_BLOCK_REBASE_SHALLOW)
+            while True:
+                status = virt_dom.blockJobInfo(disk_path, 0)
+                if not status:
+                    raise exception.Error(_("The copy of %s stopped before "
+                                            "it was complete") % disk_path)
+                if status['end'] and status['cur'] == status['end']:
+                    break
+                greenthread.sleep(SNAPSHOT_POLL_INTERVAL)
+            virt_dom.blockJobAbort(disk_path, 0)
+        finally:
+            if persistent:
+                self._conn.defineXML(xml)
+        # NOTE(vish): libvirt changes ownership of images
+        libvirt_utils.chown(disk_delta, os.getuid())
+
+    def _upload_snapshot(self, context, image_service, image_href, metadata,
+                         out_path, image_format, size, extract, extracted):
+        """Extract a snapshot into out_path and upload it.
+
+        extract(progress) writes the image and extracted() is called as
+        soon as it's done, whether it failed or not.  Raw images are
+        written in order and are uploaded while they are being extracted
+        if libvirt_stream_snapshots is set, other images once extracted.
+        """
+        if image_format != 'raw' or not FLAGS.libvirt_stream_snapshots:
+            try:
+                extract(None)
+            finally:
+                extracted()
             with libvirt_utils.file_open(out_path) as image_file:
-                image_service.update(context,
-                                     image_href,
-                                     metadata,
+                image_service.update(context, image_href, metadata,
                                      image_file)
+            return
+
+        stream = _SnapshotStream(out_path, size)
+
+        def _extract():
+            try:
+                extract(stream.progress)
+            except Exception:
+                stream.finish(failed=True)
+                raise
+            else:
+                stream.finish()
+            finally:
+                extracted()
+
+        extraction = greenthread.spawn(_extract)
+        try:
+            image_service.update(context, image_href, metadata, stream)
+        finally:
+            stream.close()
+            extraction.wait()
 
     @exception.wrap_exception()
     def reboot(self, instance, network_info, reboot_type='SOFT'):
@@ -2488,7 +2704,7 @@ class LibvirtConnection(driver.ComputeDriver):
         self._destroy(instance, network_info, cleanup=False)
 
         # copy disks to destination
-        # if disk type is qcow2, convert to raw then send to dest.
+        # qcow2 disks are sent as raw unless dest has their backing file.
         # rename instance dir to +_resize at first for using
         # shared storage for instance dir (eg. NFS).
         same_host = (dest == self.get_host_ip_addr())
@@ -2500,25 +2716,9 @@ class LibvirtConnection(driver.ComputeDriver):
                 utils.execute('mkdir', '-p', inst_base)
             else:
                 utils.execute('ssh', dest, 'mkdir', '-p', inst_base)
-            for info in disk_info:
-                # assume inst_base == dirname(info['path'])
-                to_path = "%s:%s" % (dest, info['path'])
-                fname = os.path.basename(info['path'])
-                from_path = os.path.join(inst_base_resize, fname)
-                if info['type'] == 'qcow2':
-                    tmp_path = from_path + "_rbase"
-                    utils.execute('qemu-img', 'convert', '-f', 'qcow2',
-                                  '-O', 'raw', from_path, tmp_path)
-                    if same_host:
-                        utils.execute('mv', tmp_path, info['path'])
-                    else:
-                        utils.execute('scp', tmp_path, to_path)
-                        utils.execute('rm', '-f', tmp_path)
-                else:  # raw
-                    if same_host:
-                        utils.execute('cp', from_path, info['path'])
-                    else:
-                        utils.execute('scp', from_path, to_path)
+            # assume inst_base == dirname(info['path'])
+            disk_transfer = transfer.DiskTransfer(None if same_host else dest)
+            disk_info = disk_transfer.send(inst_base_resize, disk_info)
         except Exception, e:
             try:
                 if os.path.exists(inst_base_resize):
@@ -2529,7 +2729,7 @@ class LibvirtConnection(driver.ComputeDriver):
                 pass
             raise e
 
-        return disk_info_text
+        return utils.dumps(disk_info)
 
     def _wait_for_running(self, instance):
         try:
@@ -2552,13 +2752,24 @@ class LibvirtConnection(driver.ComputeDriver):
         disk_info = utils.loads(disk_info)
         for info in disk_info:
             fname = os.path.basename(info['path'])
+            size = None
             if fname == 'disk':
-                disk.extend(info['path'],
-                            instance['root_gb'] * 1024 * 1024 * 1024)
+                size = instance['root_gb'] * 1024 * 1024 * 1024
             elif fname == 'disk.local':
-                disk.extend(info['path'],
-                            instance['ephemeral_gb'] * 1024 * 1024 * 1024)
-            if FLAGS.use_cow_images:
+                size = instance['ephemeral_gb'] * 1024 * 1024 * 1024
+            sent_as = info.get('sent_as', 'raw')
+            if (sent_as == 'qcow2' and size is not None and
+                    size > int(info.get('virt_disk_size', 0))):
+                # The filesystem of an overlay can't be grown in place,
+                # flatten it against its backing file, which is here
+                path_raw = info['path'] + '_raw'
+                libvirt_utils.extract_snapshot(info['path'], 'qcow2', None,
+                                               path_raw, 'raw')
+                utils.execute('mv', path_raw, info['path'])
+                sent_as = 'raw'
+            if size is not None:
+                disk.extend(info['path'], size)
+            if FLAGS.use_cow_images and sent_as == 'raw':
                 # back to qcow2 (no backing_file though) so that snapshot
                 # will be available
                 path_qcow = info['path'] + '_qcow'
@@ -55,6 +55,12 @@ imagecache_opts = [
     cfg.BoolOpt('checksum_base_images',
                 default=False,
                 help='Write a checksum for files in _base to disk'),
+    cfg.IntOpt('checksum_base_images_budget_mb',
+               default=10240,
+               help='Megabytes of base images hashed by each run of the '
+                    'image cache manager. Files left unverified are checked '
+                    'by the next runs and files unchanged since their last '
+                    'verification are not hashed again. 0 for no limit'),
     cfg.StrOpt('image_info_filename_pattern',
                default='$instances_path/$base_dir_name/%(image)s.sha1',
                help='Allows image information files to be stored in '
@@ -111,6 +117,15 @@ def read_stored_checksum(base_path):
     return stored_checksum
 
 
+def _stat(path):
+    """Return what tells whether a file changed, None if it's missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+
 def write_stored_checksum(target):
     """Write a checksum to disk for a file in _base."""
 
@@ -130,6 +145,14 @@ def write_stored_checksum(target):
 
 class ImageCacheManager(object):
     def __init__(self):
+        # Kept between passes: the results of the checksum verifications
+        # with the state of the files they were made on, the backing file
+        # of the instance disks, and the instances of other hosts whose
+        # directory is in instances_path when it's shared.
+        self._verified = {}
+        self._backing_files = {}
+        self._remote_instances = []
+        self._checked_dirs = set()
         self._reset_state()
 
     def _reset_state(self):
@@ -145,6 +168,8 @@ class ImageCacheManager(object):
         self.removable_base_files = []
         self.unexplained_images = []
 
+        self.hashed_bytes = 0
+
     def _store_image(self, base_dir, ent, original=False):
         """Store a base image for later examination."""
         entpath = os.path.join(base_dir, ent)
@@ -173,13 +198,51 @@ class ImageCacheManager(object):
                   not is_valid_info_file(os.path.join(base_dir, ent))):
                 self._store_image(base_dir, ent, original=False)
 
+    def _list_instance_dirs(self):
+        """List the directories of instances_path holding a disk."""
+        try:
+            entries = os.listdir(FLAGS.instances_path)
+        except OSError:
+            return []
+        return [ent for ent in entries
+                if ent != FLAGS.base_dir_name and
+                   os.path.exists(os.path.join(FLAGS.instances_path, ent,
+                                               'disk'))]
+
     def _list_running_instances(self, context):
-        """List running instances (on all compute nodes)."""
+        """List the instances using the images of this node.
+
+        Those are the instances of this node, and the instances of other
+        nodes when instances_path is shared with them.  Other nodes are
+        only listed when the directory of an instance that isn't known
+        yet shows up in instances_path.
+        """
         self.used_images = {}
         self.image_popularity = {}
         self.instance_names = {}
 
-        instances = db.instance_get_all(context)
+        instances = db.instance_get_all_by_host(context, FLAGS.host)
+        local_names = set(instance['name'] for instance in instances)
+        instance_dirs = self._list_instance_dirs()
+        unknown_dirs = [ent for ent in instance_dirs
+                        if ent not in local_names and
+                           ent not in self._checked_dirs]
+        if unknown_dirs:
+            LOG.debug(_('Listing the instances of all nodes to explain '
+                        '%s'), ' '.join(unknown_dirs))
+            self._remote_instances = [
+                    instance for instance in db.instance_get_all(context)
+                    if instance['host'] != FLAGS.host]
+            # The directories of local instances are left out, they must
+            # be explained again if their instance moves to another node
+            self._checked_dirs = set(ent for ent in instance_dirs
+                                     if ent not in local_names)
+        instance_dirs = set(instance_dirs)
+        instances = list(instances) + [
+                instance for instance in self._remote_instances
+                if instance['name'] in instance_dirs and
+                   instance['name'] not in local_names]
+
         for instance in instances:
             self.instance_names[instance['name']] = instance['uuid']
 
@@ -196,16 +259,34 @@ class ImageCacheManager(object):
             self.image_popularity.setdefault(image_ref_str, 0)
             self.image_popularity[image_ref_str] += 1
 
+    def _get_backing_file(self, disk_path, backing_files):
+        """Return the backing file of an instance disk.
+
+        qemu-img is only asked again when the disk was replaced since the
+        previous pass.  The result is stored in backing_files.
+        """
+        state = _stat(disk_path)
+        cached = self._backing_files.get(disk_path)
+        if state is not None and cached and cached[0] == state[:2]:
+            backing_file = cached[1]
+        else:
+            backing_file = virtutils.get_disk_backing_file(disk_path)
+        if state is not None:
+            backing_files[disk_path] = (state[:2], backing_file)
+        return backing_file
+
     def _list_backing_images(self):
         """List the backing images currently in use."""
         inuse_images = []
+        backing_files = {}
         for ent in os.listdir(FLAGS.instances_path):
             if ent in self.instance_names:
                 LOG.debug(_('%s is a valid instance name'), ent)
                 disk_path = os.path.join(FLAGS.instances_path, ent, 'disk')
                 if os.path.exists(disk_path):
                     LOG.debug(_('%s has a disk file'), ent)
-                    backing_file = virtutils.get_disk_backing_file(disk_path)
+                    backing_file = self._get_backing_file(disk_path,
+                                                          backing_files)
                     LOG.debug(_('Instance %(instance)s is backed by '
                                 '%(backing)s'),
                               {'instance': ent,
@@ -225,6 +306,7 @@ class ImageCacheManager(object):
                                      'backing': backing_file})
                         self.unexplained_images.remove(backing_path)
 
+        self._backing_files = backing_files
         return inuse_images
 
     def _find_base_file(self, base_dir, fingerprint):
@@ -254,21 +336,59 @@ class ImageCacheManager(object):
             if m:
                 yield img, False, True
 
+    def _may_hash(self, size):
+        """Whether a file of size bytes can be hashed during this pass.
+
+        The first file is always hashed, so that files larger than the
+        budget get verified too.
+        """
+        budget = FLAGS.checksum_base_images_budget_mb * 1024 * 1024
+        return (not budget or not self.hashed_bytes or
+                self.hashed_bytes + size <= budget)
+
     def _verify_checksum(self, img_id, base_file):
         """Compare the checksum stored on disk with the current file.
 
         Note that if the checksum fails to verify this is logged, but no actual
         action occurs. This is something sysadmins should monitor for and
         handle manually when it occurs.
+
+        Files are only hashed again once they changed, and the bytes hashed
+        by a pass are limited by checksum_base_images_budget_mb: files left
+        over are skipped, as if they had no checksum, until a later pass.
         """
 
         stored_checksum = read_stored_checksum(base_file)
+        state = _stat(base_file)
         if stored_checksum:
-            f = open(base_file, 'r')
-            current_checksum = utils.hash_file(f)
-            f.close()
+            verified = self._verified.get(base_file)
+            if (verified and verified['state'] == state and
+                verified['checksum'] == stored_checksum):
+                LOG.debug(_('%(id)s (%(base_file)s): unchanged since it '
+                            'was last verified'),
+                          {'id': img_id,
+                           'base_file': base_file})
+                result = verified['result']
 
-            if current_checksum != stored_checksum:
+            elif state is not None and not self._may_hash(state[2]):
+                LOG.debug(_('%(id)s (%(base_file)s): image verification '
+                            'postponed, %(hashed)d bytes hashed already'),
+                          {'id': img_id,
+                           'base_file': base_file,
+                           'hashed': self.hashed_bytes})
+                return None
+
+            else:
+                f = open(base_file, 'r')
+                current_checksum = utils.hash_file(f)
+                f.close()
+                self.hashed_bytes += state[2]
+                result = current_checksum == stored_checksum
+                self._verified[base_file] = {'state': state,
+                                             'checksum': stored_checksum,
+                                             'result': result}
+
+            if not result:
                 LOG.error(_('%(id)s (%(base_file)s): image verification '
                             'failed'),
                           {'id': img_id,
@@ -287,11 +407,27 @@ class ImageCacheManager(object):
             # NOTE(mikal): If the checksum file is missing, then we should
             # create one. We don't create checksums when we download images
             # from glance because that would delay VM startup.
-            if FLAGS.checksum_base_images:
+            if (FLAGS.checksum_base_images and state is not None and
+                self._may_hash(state[2])):
                 write_stored_checksum(base_file)
+                self.hashed_bytes += state[2]
+                stored_checksum = read_stored_checksum(base_file)
+                if stored_checksum:
+                    self._verified[base_file] = {'state': state,
+                                                 'checksum': stored_checksum,
+                                                 'result': True}
 
             return None
 
+    def _touch(self, base_file):
+        """Mark a base file as used without voiding its verification."""
+        verified = self._verified.get(base_file)
+        unchanged = verified is not None and (verified['state'] ==
+                                              _stat(base_file))
+        os.utime(base_file, None)
+        if unchanged:
+            verified['state'] = _stat(base_file)
+
     def _remove_base_file(self, base_file):
         """Remove a single base file if it is old enough.
 
@@ -391,7 +527,7 @@ class ImageCacheManager(object):
                            'base_file': base_file})
                 if os.path.exists(base_file):
                     virtutils.chown(base_file, os.getuid())
-                    os.utime(base_file, None)
+                    self._touch(base_file)
 
     def verify_base_images(self, context):
         """Verify that base images are in a reasonable state."""
@@ -415,6 +551,10 @@ class ImageCacheManager(object):
 
         LOG.debug(_('Verify base images'))
         self._list_base_images(base_dir)
+        listed = set(self.unexplained_images)
+        for base_file in self._verified.keys():
+            if base_file not in listed:
+                del self._verified[base_file]
         self._list_running_instances(context)
 
         # Determine what images are on disk because they're in use
@@ -458,4 +598,5 @@ class ImageCacheManager(object):
                     self._remove_base_file(base_file)
 
         # That's it
-        LOG.debug(_('Verification complete'))
+        LOG.debug(_('Verification complete, %d bytes hashed'),
+                  self.hashed_bytes)
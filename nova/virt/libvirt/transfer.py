@@ -0,0 +1,134 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Copies the disks of an instance to another host for resize and migration.
+
+A qcow2 disk whose backing file the destination already has in its image
+cache is sent as it is, only its overlay crosses the wire.  Other qcow2
+disks are flattened to raw first.  Disks are copied sparse, so the holes
+of raw disks aren't sent, and the disks of an instance are copied
+concurrently.
+"""
+
+import os
+import time
+
+import eventlet
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+from nova.openstack.common import cfg
+from nova import utils
+from nova.virt.libvirt import utils as libvirt_utils
+
+
+LOG = logging.getLogger(__name__)
+
+transfer_opts = [
+    cfg.IntOpt('libvirt_disk_transfer_concurrency',
+               default=4,
+               help='Number of disks of an instance copied at the same time '
+                    'by resizes and migrations'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(transfer_opts)
+
+flags.DECLARE('base_dir_name', 'nova.compute.manager')
+
+
+def _allocated_size(path):
+    """Bytes of the file actually stored on disk, holes excluded."""
+    return os.stat(path).st_blocks * 512
+
+
+class DiskTransfer(object):
+    """Copies disks to the same paths on another host.
+
+    :param host: host to copy the disks to, None to copy them on this host
+    """
+
+    def __init__(self, host=None):
+        self.host = host
+
+    def _exists(self, path):
+        if not self.host:
+            return os.path.exists(path)
+        try:
+            utils.execute('ssh', self.host, 'test', '-e', path)
+        except exception.ProcessExecutionError:
+            return False
+        return True
+
+    def _has_backing_file(self, backing_file):
+        if not backing_file:
+            return False
+        base_dir = os.path.join(FLAGS.instances_path, FLAGS.base_dir_name)
+        return self._exists(os.path.join(base_dir, backing_file))
+
+    def _send(self, src, info):
+        """Copy the disk at src to info['path'] and report what was sent.
+
+        info is the description get_instance_disk_info gave of the disk.
+        """
+        start = time.time()
+        if info['type'] == 'qcow2' and not self._has_backing_file(
+                info.get('backing_file')):
+            flat = src + '_rbase'
+            libvirt_utils.extract_snapshot(src, 'qcow2', None, flat, 'raw')
+            try:
+                sent = _allocated_size(flat)
+                libvirt_utils.copy_image(flat, info['path'], host=self.host)
+            finally:
+                libvirt_utils.file_delete(flat)
+            disk_type = 'raw'
+        else:
+            sent = _allocated_size(src)
+            libvirt_utils.copy_image(src, info['path'], host=self.host)
+            disk_type = info['type']
+        return dict(info, sent_as=disk_type, bytes_sent=sent,
+                    seconds=time.time() - start)
+
+    def send(self, src_dir, disk_info):
+        """Copy the disks of an instance from src_dir.
+
+        :param src_dir: directory holding the disks under their file names
+        :param disk_info: the disks, as listed by get_instance_disk_info
+        :returns: disk_info with the format each disk was sent as, raw
+                  for the flattened disks, and the bytes_sent and seconds
+                  spent on each of them
+        """
+        start = time.time()
+        pool = eventlet.GreenPool(FLAGS.libvirt_disk_transfer_concurrency)
+        threads = [pool.spawn(self._send,
+                              os.path.join(src_dir,
+                                           os.path.basename(info['path'])),
+                              info)
+                   for info in disk_info]
+        # Let every copy finish before raising the first failure
+        pool.waitall()
+        sent = [thread.wait() for thread in threads]
+
+        total = {'count': len(sent),
+                 'host': self.host or 'localhost',
+                 'bytes': sum(info['bytes_sent'] for info in sent),
+                 'seconds': time.time() - start}
+        LOG.info(_('Sent %(count)d disks, %(bytes)d bytes, to %(host)s in '
+                   '%(seconds).1f seconds') % total)
+        return sent
@@ -21,14 +21,22 @@
 
 import os
 import random
+import re
+
+from eventlet.green import subprocess
 
 from nova import exception
 from nova import flags
+from nova import log as logging
 from nova import utils
 from nova.virt import images
 
 
 FLAGS = flags.FLAGS
+LOG = logging.getLogger(__name__)
+
+# The progress lines qemu-img -p writes, like "    (42.00/100%)\r"
+_QEMU_IMG_PROGRESS = re.compile(r'\((\d+(?:\.\d+)?)/100%\)')
 
 
 def execute(*args, **kwargs):
@@ -60,16 +68,21 @@ def create_image(disk_format, path, size):
     execute('qemu-img', 'create', '-f', disk_format, path, size)
 
 
-def create_cow_image(backing_file, path):
+def create_cow_image(backing_file, path, size=None):
     """Create COW image
 
     Creates a COW image with the given backing file
 
     :param backing_file: Existing image on which to base the COW image
     :param path: Desired location of the COW image
+    :param size: Virtual size of the COW image, defaults to the size of
+                 the backing file
     """
-    execute('qemu-img', 'create', '-f', 'qcow2', '-o',
-             'cluster_size=2M,backing_file=%s' % backing_file, path)
+    qemu_img_cmd = ['qemu-img', 'create', '-f', 'qcow2', '-o',
+                    'cluster_size=2M,backing_file=%s' % backing_file, path]
+    if size is not None:
+        qemu_img_cmd.append(size)
+    execute(*qemu_img_cmd)
 
 
 def get_disk_size(path):
@@ -85,31 +98,39 @@ def get_disk_size(path):
     return int(size[0])
 
 
-def get_disk_backing_file(path):
+def get_disk_backing_file(path, basename=True):
     """Get the backing file of a disk image
 
     :param path: Path to the disk image
+    :param basename: Return only the file name of the backing store
     :returns: a path to the image's backing store
     """
     out, err = execute('qemu-img', 'info', path)
     backing_file = [i.split('actual path:')[1].strip()[:-1]
         for i in out.split('\n') if 0 <= i.find('backing file')]
     if backing_file:
-        backing_file = os.path.basename(backing_file[0])
+        backing_file = backing_file[0]
+        if basename:
+            backing_file = os.path.basename(backing_file)
     return backing_file
 
 
-def copy_image(src, dest):
+def copy_image(src, dest, host=None):
     """Copy a disk image
 
     :param src: Source image
     :param dest: Destination path
+    :param host: Host to copy the image to, None for this host
     """
-    # We shell out to cp because that will intelligently copy
-    # sparse files.  I.E. holes will not be written to DEST,
-    # rather recreated efficiently.  In addition, since
-    # coreutils 8.11, holes can be read efficiently too.
-    execute('cp', src, dest)
+    if host:
+        # rsync keeps the holes of sparse files out of the transfer
+        execute('rsync', '--sparse', src, '%s:%s' % (host, dest))
+    else:
+        # We shell out to cp because that will intelligently copy
+        # sparse files.  I.E. holes will not be written to DEST,
+        # rather recreated efficiently.  In addition, since
+        # coreutils 8.11, holes can be read efficiently too.
+        execute('cp', src, dest)
 
 
 def mkfs(fs, path, label=None):
@@ -195,24 +216,54 @@ def delete_snapshot(disk_path, snapshot_name):
     execute(*qemu_img_cmd, run_as_root=True)
 
 
-def extract_snapshot(disk_path, source_fmt, snapshot_name, out_path, dest_fmt):
+def extract_snapshot(disk_path, source_fmt, snapshot_name, out_path, dest_fmt,
+                     progress=None):
     """Extract a named snapshot from a disk image
 
     :param disk_path: Path to disk image
-    :param snapshot_name: Name of snapshot in disk image
+    :param snapshot_name: Name of snapshot in disk image, None to extract
+                          the current content of the image
     :param out_path: Desired path of extracted snapshot
+    :param progress: Called with the percentage of the image converted
+                     so far, qemu-img converts the image in order
     """
-    qemu_img_cmd = ('qemu-img',
-                    'convert',
-                    '-f',
-                    source_fmt,
-                    '-O',
-                    dest_fmt,
-                    '-s',
-                    snapshot_name,
-                    disk_path,
-                    out_path)
-    execute(*qemu_img_cmd)
+    qemu_img_cmd = ['qemu-img', 'convert', '-f', source_fmt, '-O', dest_fmt]
+    if snapshot_name:
+        qemu_img_cmd += ['-s', snapshot_name]
+    if progress is None:
+        execute(*(qemu_img_cmd + [disk_path, out_path]))
+    else:
+        _execute_with_progress(qemu_img_cmd + ['-p', disk_path, out_path],
+                               progress)
+
+
+def _execute_with_progress(cmd, progress):
+    """Run a qemu-img command, passing the progress it reports to progress.
+    """
+    LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
+    obj = subprocess.Popen(cmd,
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE,
+                           close_fds=True)
+    line = ''
+    while True:
+        char = obj.stdout.read(1)
+        if not char:
+            break
+        if char not in '\r\n':
+            line += char
+            continue
+        match = _QEMU_IMG_PROGRESS.search(line)
+        if match:
+            progress(float(match.group(1)))
+        line = ''
+    stderr = obj.stderr.read()
+    returncode = obj.wait()
+    if returncode:
+        raise exception.ProcessExecutionError(exit_code=returncode,
+                                              stdout='',
+                                              stderr=stderr,
+                                              cmd=' '.join(cmd))
 
 
 def load_file(path):
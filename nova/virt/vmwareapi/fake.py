@@ -20,8 +20,11 @@ A fake VMWare VI API implementation.
 """
 
 import pprint
+import time
 import uuid
 
+import eventlet
+
 from nova import exception
 from nova import log as logging
 from nova.virt.vmwareapi import error_util
@@ -164,6 +167,8 @@ class VirtualMachine(ManagedObject):
     def __init__(self, **kwargs):
         super(VirtualMachine, self).__init__("VirtualMachine")
         self.set("name", kwargs.get("name"))
+        self.set("config.instanceUuid", kwargs.get("instance_uuid",
+                                                   str(uuid.uuid4())))
         self.set("runtime.connectionState",
                  kwargs.get("conn_state", "connected"))
         self.set("summary.config.guestId", kwargs.get("guest", "otherGuest"))
@@ -231,6 +236,7 @@ class Datastore(ManagedObject):
         super(Datastore, self).__init__("Datastore")
         self.set("summary.type", "VMFS")
         self.set("summary.name", "fake-ds")
+        self.set("browser", "DatastoreBrowser")
 
 
 class HostNetworkSystem(ManagedObject):
@@ -336,7 +342,7 @@ class Task(ManagedObject):
 
     def __init__(self, task_name, state="running"):
         super(Task, self).__init__("Task")
-        info = DataObject
+        info = DataObject()
         info.name = task_name
         info.state = state
         self.set("info", info)
@@ -394,11 +400,9 @@ def _remove_file(file_path):
         _db_content.get("files").remove(file_path)
     else:
         # Removes the files in the folder and the folder too from the db
-        for file in _db_content.get("files"):
-            if file.find(file_path) != -1:
-                lst_files = _db_content.get("files")
-                if lst_files and lst_files.count(file):
-                    lst_files.remove(file)
+        lst_files = _db_content.get("files")
+        lst_files[:] = [file for file in lst_files
+                        if file.find(file_path) == -1]
 
 
 def fake_plug_vifs(*args, **kwargs):
@@ -458,6 +462,8 @@ class FakeVim(object):
         contents and the cookies for the session.
         """
         self._session = None
+        self._collectors = {}
+        self._update_version = 0
         self.client = DataObject()
         self.client.factory = FakeFactory()
 
@@ -586,13 +592,38 @@ class FakeVim(object):
         ds_path = kwargs.get("datastorePath")
         if _db_content.get("files", None) is None:
             raise exception.NoFilesFound()
+        # Only folders can be searched, a file path is an error
+        if ds_path.endswith(".vmdk"):
+            return create_task(method, "error").obj
         for file in _db_content.get("files"):
             if file.find(ds_path) != -1:
                 task_mdo = create_task(method, "success")
+                # The names of the files and folders in the folder
+                result = DataObject()
+                result.file = []
+                for name in sorted(set(
+                        file[len(ds_path) + 1:].split("/")[0]
+                        for file in _db_content.get("files")
+                        if file.startswith(ds_path + "/"))):
+                    file_info = DataObject()
+                    file_info.path = name
+                    result.file.append(file_info)
+                task_mdo.get("info").result = result
                 return task_mdo.obj
         task_mdo = create_task(method, "error")
         return task_mdo.obj
 
+    def _move_file(self, method, *args, **kwargs):
+        """Moves a file or a folder and its contents in the datastore."""
+        src_path = kwargs.get("sourceName")
+        dest_path = kwargs.get("destinationName")
+        files = _db_content.get("files")
+        for i, file in enumerate(files):
+            if file == src_path or file.startswith(src_path + "/"):
+                files[i] = dest_path + file[len(src_path):]
+        task_mdo = create_task(method, "success")
+        return task_mdo.obj
+
     def _make_dir(self, method, *args, **kwargs):
         """Creates a directory in the datastore."""
         ds_path = kwargs.get("name")
@@ -648,6 +679,111 @@ class FakeVim(object):
                 continue
         return lst_ret_objs
 
+    def _create_property_collector(self, method, *args, **kwargs):
+        """Creates a property collector without any filter."""
+        collector = "PropertyCollector-%s" % uuid.uuid4()
+        self._collectors[collector] = {}
+        return collector
+
+    def _destroy_property_collector(self, method, *args, **kwargs):
+        """Destroys a property collector and its filters."""
+        self._collectors.pop(args[0], None)
+
+    def _create_filter(self, method, *args, **kwargs):
+        """Creates a property filter, nothing of it has been reported."""
+        filter_ref = "PropertyFilter-%s" % uuid.uuid4()
+        self._collectors[args[0]][filter_ref] = (kwargs.get("spec"), {})
+        return filter_ref
+
+    def _destroy_property_filter(self, method, *args, **kwargs):
+        """Destroys a property filter."""
+        for filters in self._collectors.values():
+            filters.pop(args[0], None)
+
+    def _get_object_update(self, ref, kind, values, reported):
+        """Builds the update of an object from its last reported values."""
+        obj_update = DataObject()
+        obj_update.obj = ref
+        obj_update.kind = kind
+        obj_update.changeSet = []
+        for name, val in values.items():
+            if name not in reported or reported[name] != val:
+                change = DataObject()
+                change.name = name
+                change.op = "assign"
+                change.val = val
+                obj_update.changeSet.append(change)
+        for name in set(reported) - set(values):
+            change = DataObject()
+            change.name = name
+            change.op = "remove"
+            obj_update.changeSet.append(change)
+        return obj_update
+
+    def _get_filter_update(self, filter_ref, spec, reported):
+        """Gets the changes of the objects of a filter since last time."""
+        prop_spec = spec.propSet[0]
+        obj_ref = spec.objectSet[0].obj
+        table = _db_content.get(prop_spec.type, {})
+        if obj_ref == "RootFolder":
+            mdos = table.values()
+        else:
+            mdos = [table[obj_ref]] if obj_ref in table else []
+        obj_updates = []
+        for mdo in mdos:
+            values = {}
+            for prop in prop_spec.pathSet:
+                try:
+                    values[prop] = mdo.get(prop)
+                except exception.Error:
+                    continue
+            if mdo.obj not in reported:
+                obj_updates.append(self._get_object_update(mdo.obj, "enter",
+                                                           values, {}))
+            elif values != reported[mdo.obj]:
+                obj_updates.append(self._get_object_update(mdo.obj,
+                                    "modify", values, reported[mdo.obj]))
+            reported[mdo.obj] = values
+        for ref in set(reported) - set(mdo.obj for mdo in mdos):
+            obj_update = DataObject()
+            obj_update.obj = ref
+            obj_update.kind = "leave"
+            obj_updates.append(obj_update)
+            del reported[ref]
+        if not obj_updates:
+            return None
+        filter_update = DataObject()
+        filter_update.filter = filter_ref
+        filter_update.objectSet = obj_updates
+        return filter_update
+
+    def _wait_for_updates(self, method, *args, **kwargs):
+        """Waits for changes of the objects of the collector's filters."""
+        collector = args[0]
+        max_wait = getattr(kwargs.get("options"), "maxWaitSeconds", None)
+        deadline = time.time() + (max_wait or 0)
+        while True:
+            if collector not in self._collectors:
+                raise error_util.VimFaultException(["ManagedObjectNotFound"],
+                        _("Property collector %s doesn't exist") % collector)
+            filter_updates = []
+            for filter_ref, (spec, reported) in \
+                    self._collectors[collector].items():
+                filter_update = self._get_filter_update(filter_ref, spec,
+                                                        reported)
+                if filter_update is not None:
+                    filter_updates.append(filter_update)
+            if filter_updates:
+                self._update_version += 1
+                update_set = DataObject()
+                update_set.version = str(self._update_version)
+                update_set.filterSet = filter_updates
+                update_set.truncated = False
+                return update_set
+            if max_wait is not None and time.time() >= deadline:
+                return None
+            eventlet.sleep(0.01)
+
     def _add_port_group(self, method, *args, **kwargs):
         """Adds a port group to the host system."""
         _host_sk = _db_content["HostSystem"].keys()[0]
@@ -704,6 +840,9 @@ class FakeVim(object):
         elif attr_name == "SearchDatastore_Task":
             return lambda *args, **kwargs: self._search_ds(attr_name,
                                                 *args, **kwargs)
+        elif attr_name == "MoveDatastoreFile_Task":
+            return lambda *args, **kwargs: self._move_file(attr_name,
+                                                *args, **kwargs)
         elif attr_name == "MakeDirectory":
             return lambda *args, **kwargs: self._make_dir(attr_name,
                                                 *args, **kwargs)
@@ -712,6 +851,21 @@ class FakeVim(object):
                                                 attr_name, *args, **kwargs)
         elif attr_name == "AcquireCloneTicket":
             return lambda *args, **kwargs: self._just_return()
+        elif attr_name == "CreatePropertyCollector":
+            return lambda *args, **kwargs: self._create_property_collector(
+                                                attr_name, *args, **kwargs)
+        elif attr_name == "DestroyPropertyCollector":
+            return lambda *args, **kwargs: self._destroy_property_collector(
+                                                attr_name, *args, **kwargs)
+        elif attr_name == "CreateFilter":
+            return lambda *args, **kwargs: self._create_filter(attr_name,
+                                                *args, **kwargs)
+        elif attr_name == "DestroyPropertyFilter":
+            return lambda *args, **kwargs: self._destroy_property_filter(
+                                                attr_name, *args, **kwargs)
+        elif attr_name == "WaitForUpdatesEx":
+            return lambda *args, **kwargs: self._wait_for_updates(attr_name,
+                                                *args, **kwargs)
         elif attr_name == "AddPortGroup":
             return lambda *args, **kwargs: self._add_port_group(attr_name,
                                                 *args, **kwargs)
@@ -0,0 +1,268 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+A local cache of the virtual machines and running tasks of an ESX host.
+
+The cache is fed by a property collector of its own: a greenthread keeps
+calling WaitForUpdatesEx on it and applies the changes it returns, so
+looking up a VM by name or uuid doesn't cost a round trip to the host.
+Tasks being waited for get a property filter on the same collector and
+their completion is signalled by the same stream of updates.
+
+vSphere reports the changes made by a task no later than the completion
+of the task, so once a task is known to be finished the cache reflects
+its effects.
+"""
+
+import time
+
+import eventlet
+from eventlet import event
+
+from nova import log as logging
+from nova.virt.vmwareapi import vim_util
+
+
+LOG = logging.getLogger(__name__)
+
+# Properties of the virtual machines kept in the cache
+VM_PROPERTIES = ["name", "config.instanceUuid", "runtime.connectionState",
+                 "runtime.powerState", "summary.config.numCpu",
+                 "summary.config.memorySizeMB"]
+
+# Longest a WaitForUpdatesEx call blocks, well below the SOAP timeout
+UPDATE_WAIT_SECONDS = 30
+
+TIME_BETWEEN_RECONNECTS = 2.0
+
+
+def _key(ref):
+    """Hashable key for a managed object reference."""
+    return str(getattr(ref, 'value', ref))
+
+
+class _TaskWaiter(object):
+    """A task being waited for and the property filter watching it."""
+
+    def __init__(self, task_ref):
+        self.task_ref = task_ref
+        self.filter = None
+        self.done = event.Event()
+
+
+class Inventory(object):
+    """Cache of the virtual machines of an ESX host, see the module doc."""
+
+    def __init__(self, session):
+        self._session = session
+        self._collector = None
+        self._vm_filter = None
+        self._version = ''
+        self._vms = {}
+        self._names = {}
+        self._uuids = {}
+        self._tasks = {}
+        self._thread = None
+        self.ready = False
+
+    def start(self):
+        """Load the inventory and start following its changes."""
+        self._connect()
+        self._thread = eventlet.spawn(self._run)
+
+    def stop(self):
+        """Stop following the changes and drop the property collector."""
+        self.ready = False
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+        self._destroy_collector()
+
+    def get_vm_ref(self, name):
+        """Get the reference to the VM with the name, None if unknown."""
+        key = self._names.get(name)
+        return key and self._vms[key]['ref']
+
+    def get_vm_ref_by_uuid(self, uuid):
+        """Get the reference to the VM with the vSphere instance uuid."""
+        key = self._uuids.get(uuid)
+        return key and self._vms[key]['ref']
+
+    def get_vm_properties(self, vm_ref):
+        """Get the cached properties of a VM, None if unknown."""
+        vm = self._vms.get(_key(vm_ref))
+        return vm and dict(vm['props'])
+
+    def list_vms(self):
+        """List the cached (reference, properties) of every VM."""
+        return [(vm['ref'], dict(vm['props'])) for vm in self._vms.values()]
+
+    def wait_for_task(self, task_ref, timeout):
+        """
+        Wait for the task to finish and return its info, or None if it
+        is still running after timeout seconds.
+        """
+        key = _key(task_ref)
+        waiter = self._tasks.get(key)
+        if waiter is None:
+            waiter = _TaskWaiter(task_ref)
+            self._tasks[key] = waiter
+            waiter.filter = self._create_filter("Task", ["info"],
+                    vim_util.get_obj_spec(self._factory(), task_ref))
+        task_info = None
+        with eventlet.Timeout(timeout, False):
+            task_info = waiter.done.wait()
+        if task_info is not None:
+            del self._tasks[key]
+            self._destroy_filter(waiter.filter)
+        return task_info
+
+    def forget_task(self, task_ref):
+        """Stop watching a task whose completion was learnt elsewhere."""
+        waiter = self._tasks.pop(_key(task_ref), None)
+        if waiter is not None and waiter.filter is not None:
+            self._destroy_filter(waiter.filter)
+
+    def _factory(self):
+        return self._session._get_vim().client.factory
+
+    def _call(self, method, *args, **kwargs):
+        return self._session._call_method(self._session._get_vim(), method,
+                                          *args, **kwargs)
+
+    def _create_filter(self, type, properties, object_spec):
+        client_factory = self._factory()
+        property_spec = vim_util.build_property_spec(client_factory,
+                                type=type, properties_to_collect=properties)
+        filter_spec = vim_util.build_property_filter_spec(client_factory,
+                                [property_spec], [object_spec])
+        return self._call("CreateFilter", self._collector, spec=filter_spec,
+                          partialUpdates=False)
+
+    def _destroy_filter(self, filter_ref):
+        try:
+            self._call("DestroyPropertyFilter", filter_ref)
+        except Exception, excep:
+            # The filter goes away with the collector anyway
+            LOG.debug(excep)
+
+    def _destroy_collector(self):
+        if self._collector is None:
+            return
+        try:
+            self._call("DestroyPropertyCollector", self._collector)
+        except Exception, excep:
+            LOG.debug(excep)
+        self._collector = None
+
+    def _connect(self):
+        """Create the property collector and load the whole inventory."""
+        self.ready = False
+        self._destroy_collector()
+        self._version = ''
+        self._vms.clear()
+        self._names.clear()
+        self._uuids.clear()
+        vim = self._session._get_vim()
+        self._collector = self._call("CreatePropertyCollector",
+                                 vim.get_service_content().propertyCollector)
+        client_factory = self._factory()
+        self._vm_filter = self._create_filter("VirtualMachine", VM_PROPERTIES,
+                vim_util.build_object_spec(client_factory,
+                        vim.get_service_content().rootFolder,
+                        [vim_util.build_recursive_traversal_spec(
+                                client_factory)]))
+        for waiter in self._tasks.values():
+            waiter.filter = self._create_filter("Task", ["info"],
+                    vim_util.get_obj_spec(client_factory, waiter.task_ref))
+        while self._update(0):
+            pass
+        self.ready = True
+        LOG.debug(_("Loaded the inventory of %d VMs") % len(self._vms))
+
+    def _run(self):
+        while True:
+            try:
+                self._update(UPDATE_WAIT_SECONDS)
+            except Exception, excep:
+                LOG.warn(_("Lost the inventory updates, reloading: %s")
+                         % excep)
+                self.ready = False
+                time.sleep(TIME_BETWEEN_RECONNECTS)
+                try:
+                    self._connect()
+                except Exception, excep:
+                    LOG.warn(_("Unable to reload the inventory: %s") % excep)
+
+    def _update(self, max_wait):
+        """Apply the next set of changes, return True if truncated."""
+        options = self._factory().create('ns0:WaitOptions')
+        options.maxWaitSeconds = max_wait
+        update_set = self._call("WaitForUpdatesEx", self._collector,
+                                version=self._version, options=options)
+        if not update_set:
+            return False
+        vm_filter = _key(self._vm_filter)
+        for filter_update in getattr(update_set, 'filterSet', None) or []:
+            is_vm = _key(filter_update.filter) == vm_filter
+            for obj_update in getattr(filter_update, 'objectSet', None) or []:
+                changes = getattr(obj_update, 'changeSet', None) or []
+                if is_vm:
+                    self._vm_changed(obj_update.obj, obj_update.kind, changes)
+                else:
+                    self._task_changed(obj_update.obj, changes)
+        self._version = update_set.version
+        return bool(getattr(update_set, 'truncated', False))
+
+    def _vm_changed(self, vm_ref, kind, changes):
+        key = _key(vm_ref)
+        vm = self._vms.get(key)
+        if vm is not None:
+            self._unindex(key, vm['props'])
+        if kind == 'leave':
+            self._vms.pop(key, None)
+            return
+        if vm is None:
+            vm = self._vms[key] = {'ref': vm_ref, 'props': {}}
+        for change in changes:
+            if change.op in ('remove', 'indirectRemove'):
+                vm['props'].pop(change.name, None)
+            else:
+                vm['props'][change.name] = getattr(change, 'val', None)
+        self._index(key, vm['props'])
+
+    def _index(self, key, props):
+        if props.get("name") is not None:
+            self._names[props["name"]] = key
+        if props.get("config.instanceUuid") is not None:
+            self._uuids[props["config.instanceUuid"]] = key
+
+    def _unindex(self, key, props):
+        for index, prop in ((self._names, "name"),
+                            (self._uuids, "config.instanceUuid")):
+            if index.get(props.get(prop)) == key:
+                del index[props[prop]]
+
+    def _task_changed(self, task_ref, changes):
+        waiter = self._tasks.get(_key(task_ref))
+        if waiter is None or waiter.done.ready():
+            return
+        for change in changes:
+            task_info = getattr(change, 'val', None)
+            if (change.name == "info" and task_info is not None and
+                    task_info.state not in ('queued', 'running')):
+                waiter.done.send(task_info)
@@ -27,11 +27,13 @@ import urllib2
 import uuid
 
 from nova.compute import power_state
+from nova import db
 from nova import exception
 from nova import flags
 from nova import log as logging
 from nova.openstack.common import cfg
 from nova import utils
+from nova.virt.vmwareapi import error_util
 from nova.virt.vmwareapi import vim_util
 from nova.virt.vmwareapi import vm_util
 from nova.virt.vmwareapi import vmware_images
@@ -42,8 +44,18 @@ vmware_vif_driver_opt = cfg.StrOpt('vmware_vif_driver',
         default='nova.virt.vmwareapi.vif.VMWareVlanBridgeDriver',
         help='The VMWare VIF driver to configure the VIFs.')
 
+vmware_image_cache_opt = cfg.StrOpt('vmwareapi_image_cache_folder',
+        default='vmware_base',
+        help='Folder of the datastores where images are cached, so that '
+             'they are downloaded from glance once per datastore. '
+             'Empty to download the image for every instance')
+
 FLAGS = flags.FLAGS
 FLAGS.register_opt(vmware_vif_driver_opt)
+FLAGS.register_opt(vmware_image_cache_opt)
+flags.DECLARE('remove_unused_base_images', 'nova.virt.libvirt.imagecache')
+flags.DECLARE('remove_unused_original_minimum_age_seconds',
+              'nova.virt.libvirt.imagecache')
 
 LOG = logging.getLogger(__name__)
 
@@ -52,6 +64,13 @@ VMWARE_POWER_STATES = {
                     'poweredOn': power_state.RUNNING,
                     'suspended': power_state.PAUSED}
 
+# Marks a cached image which no instance of this host used, at that time
+UNUSED_MARKER = "%s.unused-%d"
+
+
+def _image_cache_lock(datastore_name, cache_key):
+    return "vmware-image-cache-%s-%s" % (datastore_name, cache_key)
+
 
 class VMWareVMOps(object):
     """Management class for VM-related tasks."""
@@ -64,18 +83,11 @@ class VMWareVMOps(object):
     def list_instances(self):
         """Lists the VM instances that are registered with the ESX host."""
         LOG.debug(_("Getting list of instances"))
-        vms = self._session._call_method(vim_util, "get_objects",
-                     "VirtualMachine",
-                     ["name", "runtime.connectionState"])
         lst_vm_names = []
-        for vm in vms:
-            vm_name = None
-            conn_state = None
-            for prop in vm.propSet:
-                if prop.name == "name":
-                    vm_name = prop.val
-                elif prop.name == "runtime.connectionState":
-                    conn_state = prop.val
+        for props in self._get_vm_properties(
+                ["name", "runtime.connectionState"]):
+            vm_name = props.get("name")
+            conn_state = props.get("runtime.connectionState")
             # Ignoring the oprhaned or inaccessible VMs
             if conn_state not in ["orphaned", "inaccessible"]:
                 lst_vm_names.append(vm_name)
@@ -97,6 +109,10 @@ class VMWareVMOps(object):
         4. Upload the disk file.
         5. Attach the disk to the VM by reconfiguring the same.
         6. Power on the VM.
+
+        With vmwareapi_image_cache_folder set, steps 2 to 4 upload the
+        image to the cache folder of the datastore, if it isn't there
+        already, and the disk of the VM is copied from there.
         """
         vm_ref = self._get_vm_ref_from_the_name(instance.name)
         if vm_ref:
@@ -120,14 +136,14 @@ class VMWareVMOps(object):
                 # Local storage identifier
                 if ds_type == "VMFS":
                     data_store_name = ds_name
-                    return data_store_name
+                    return data_store_name, elem.obj
 
             if data_store_name is None:
                 msg = _("Couldn't get a local Datastore reference")
                 LOG.error(msg, instance=instance)
                 raise exception.Error(msg)
 
-        data_store_name = _get_datastore_ref()
+        data_store_name, data_store_ref = _get_datastore_ref()
 
         def _get_image_properties():
             """
@@ -211,17 +227,12 @@ class VMWareVMOps(object):
             self._set_machine_id(client_factory, instance, network_info)
 
         # Naming the VM files in correspondence with the VM instance name
-        # The flat vmdk file name
-        flat_uploaded_vmdk_name = "%s/%s-flat.vmdk" % (instance.name,
-                                                       instance.name)
         # The vmdk meta-data file
         uploaded_vmdk_name = "%s/%s.vmdk" % (instance.name, instance.name)
-        flat_uploaded_vmdk_path = vm_util.build_datastore_path(data_store_name,
-                                            flat_uploaded_vmdk_name)
         uploaded_vmdk_path = vm_util.build_datastore_path(data_store_name,
                                             uploaded_vmdk_name)
 
-        def _create_virtual_disk():
+        def _create_virtual_disk(vmdk_path):
             """Create a virtual disk of the size of flat vmdk file."""
             # Create a Virtual Disk of the size of the flat vmdk file. This is
             # done just to generate the meta-data file whose specifics
@@ -243,7 +254,7 @@ class VMWareVMOps(object):
                 self._session._get_vim(),
                 "CreateVirtualDisk_Task",
                 service_content.virtualDiskManager,
-                name=uploaded_vmdk_path,
+                name=vmdk_path,
                 datacenter=self._get_datacenter_name_and_ref()[0],
                 spec=vmdk_create_spec)
             self._session._wait_for_task(instance['uuid'], vmdk_create_task)
@@ -254,13 +265,11 @@ class VMWareVMOps(object):
                          "data_store_name": data_store_name},
                       instance=instance)
 
-        _create_virtual_disk()
-
-        def _delete_disk_file():
-            LOG.debug(_("Deleting the file %(flat_uploaded_vmdk_path)s "
+        def _delete_disk_file(flat_vmdk_path):
+            LOG.debug(_("Deleting the file %(flat_vmdk_path)s "
                         "on the ESX host local"
                         "store %(data_store_name)s") %
-                        {"flat_uploaded_vmdk_path": flat_uploaded_vmdk_path,
+                        {"flat_vmdk_path": flat_vmdk_path,
                          "data_store_name": data_store_name},
                       instance=instance)
             # Delete the -flat.vmdk file created. .vmdk file is retained.
@@ -268,19 +277,17 @@ class VMWareVMOps(object):
                         self._session._get_vim(),
                         "DeleteDatastoreFile_Task",
                         service_content.fileManager,
-                        name=flat_uploaded_vmdk_path)
+                        name=flat_vmdk_path)
             self._session._wait_for_task(instance['uuid'], vmdk_delete_task)
-            LOG.debug(_("Deleted the file %(flat_uploaded_vmdk_path)s on the "
+            LOG.debug(_("Deleted the file %(flat_vmdk_path)s on the "
                         "ESX host local store %(data_store_name)s") %
-                        {"flat_uploaded_vmdk_path": flat_uploaded_vmdk_path,
+                        {"flat_vmdk_path": flat_vmdk_path,
                          "data_store_name": data_store_name},
                       instance=instance)
 
-        _delete_disk_file()
-
         cookies = self._session._get_vim().client.options.transport.cookiejar
 
-        def _fetch_image_on_esx_datastore():
+        def _fetch_image_on_esx_datastore(flat_vmdk_name):
             """Fetch image from Glance to ESX datastore."""
             LOG.debug(_("Downloading image file data %(image_ref)s to the ESX "
                         "data store %(data_store_name)s") %
@@ -297,13 +304,99 @@ class VMWareVMOps(object):
                 data_center_name=self._get_datacenter_name_and_ref()[1],
                 datastore_name=data_store_name,
                 cookies=cookies,
-                file_path=flat_uploaded_vmdk_name)
+                file_path=flat_vmdk_name)
             LOG.debug(_("Downloaded image file data %(image_ref)s to the ESX "
                         "data store %(data_store_name)s") %
                         {'image_ref': instance.image_ref,
                          'data_store_name': data_store_name},
                       instance=instance)
-        _fetch_image_on_esx_datastore()
+
+        def _upload_image(vmdk_name):
+            """Upload the image to the datastore as vmdk_name."""
+            flat_vmdk_name = vmdk_name.replace(".vmdk", "-flat.vmdk")
+            _create_virtual_disk(vm_util.build_datastore_path(
+                    data_store_name, vmdk_name))
+            _delete_disk_file(vm_util.build_datastore_path(
+                    data_store_name, flat_vmdk_name))
+            _fetch_image_on_esx_datastore(flat_vmdk_name)
+
+        def _fetch_image_to_cache():
+            """
+            Upload the image to the image cache of the datastore unless
+            it is there already, return the path of the cached vmdk.
+            """
+            cache_key = instance.image_ref
+            if image_meta.get('checksum'):
+                cache_key = "%s_%s" % (cache_key, image_meta['checksum'])
+            cached_vmdk_name = "%s/%s/%s.vmdk" % (
+                    FLAGS.vmwareapi_image_cache_folder, cache_key,
+                    instance.image_ref)
+            cached_vmdk_path = vm_util.build_datastore_path(data_store_name,
+                                                            cached_vmdk_name)
+            # The move out of vmware-tmp creates the folder of the key with
+            # the image in it, so the folder is only there once it is whole
+            cached_folder_path = vm_util.build_datastore_path(
+                    data_store_name, os.path.dirname(cached_vmdk_name))
+
+            @utils.synchronized(_image_cache_lock(data_store_name, cache_key))
+            def _fetch_if_missing():
+                ds_browser = self._get_datastore_browser(data_store_ref)
+                if self._path_exists(ds_browser, cached_folder_path):
+                    LOG.debug(_("Using cached image %s") % cached_vmdk_path,
+                              instance=instance)
+                    return
+                # Upload to a folder of its own and move it in the cache
+                # once complete, so that a cached image is always whole
+                for folder in ("vmware-tmp",
+                               FLAGS.vmwareapi_image_cache_folder):
+                    folder_path = vm_util.build_datastore_path(
+                                                data_store_name, folder)
+                    if not self._path_exists(ds_browser, folder_path):
+                        try:
+                            self._mkdir(folder_path)
+                        except error_util.VimFaultException, exc:
+                            # Another image is being cached meanwhile
+                            if (error_util.FAULT_ALREADY_EXISTS not in
+                                    exc.fault_list):
+                                raise
+                tmp_folder = "vmware-tmp/%s" % uuid.uuid4()
+                tmp_folder_path = vm_util.build_datastore_path(
+                                            data_store_name, tmp_folder)
+                self._mkdir(tmp_folder_path)
+                try:
+                    _upload_image("%s/%s.vmdk" % (tmp_folder,
+                                                  instance.image_ref))
+                    self._move_datastore_file(instance, tmp_folder_path,
+                                              cached_folder_path)
+                except Exception:
+                    with utils.save_and_reraise_exception():
+                        self._delete_datastore_file(tmp_folder_path)
+
+            _fetch_if_missing()
+            return cached_vmdk_path
+
+        def _copy_cached_image(cached_vmdk_path):
+            """Copy the cached image to the disk of the instance."""
+            LOG.debug(_("Copying cached image %s to the disk of the "
+                        "instance") % cached_vmdk_path, instance=instance)
+            copy_spec = vm_util.get_copy_virtual_disk_spec(client_factory,
+                                                           adapter_type)
+            copy_disk_task = self._session._call_method(
+                self._session._get_vim(),
+                "CopyVirtualDisk_Task",
+                service_content.virtualDiskManager,
+                sourceName=cached_vmdk_path,
+                sourceDatacenter=self._get_datacenter_name_and_ref()[0],
+                destName=uploaded_vmdk_path,
+                destSpec=copy_spec)
+            self._session._wait_for_task(instance['uuid'], copy_disk_task)
+            LOG.debug(_("Copied cached image %s to the disk of the "
+                        "instance") % cached_vmdk_path, instance=instance)
+
+        if FLAGS.vmwareapi_image_cache_folder:
+            _copy_cached_image(_fetch_image_to_cache())
+        else:
+            _upload_image(uploaded_vmdk_name)
 
         vm_ref = self._get_vm_ref_from_the_name(instance.name)
 
@@ -680,21 +773,19 @@ class VMWareVMOps(object):
         lst_properties = ["summary.config.numCpu",
                     "summary.config.memorySizeMB",
                     "runtime.powerState"]
-        vm_props = self._session._call_method(vim_util,
-                    "get_object_properties", None, vm_ref, "VirtualMachine",
-                    lst_properties)
+        props = {}
+        for vm_props in self._get_vm_properties(lst_properties, vm_ref):
+            props.update(vm_props)
         max_mem = None
         pwr_state = None
         num_cpu = None
-        for elem in vm_props:
-            for prop in elem.propSet:
-                if prop.name == "summary.config.numCpu":
-                    num_cpu = int(prop.val)
-                elif prop.name == "summary.config.memorySizeMB":
-                    # In MB, but we want in KB
-                    max_mem = int(prop.val) * 1024
-                elif prop.name == "runtime.powerState":
-                    pwr_state = VMWARE_POWER_STATES[prop.val]
+        if props.get("summary.config.numCpu") is not None:
+            num_cpu = int(props["summary.config.numCpu"])
+        if props.get("summary.config.memorySizeMB") is not None:
+            # In MB, but we want in KB
+            max_mem = int(props["summary.config.memorySizeMB"]) * 1024
+        if props.get("runtime.powerState") is not None:
+            pwr_state = VMWARE_POWER_STATES[props["runtime.powerState"]]
 
         return {'state': pwr_state,
                 'max_mem': max_mem,
@@ -789,14 +880,7 @@ class VMWareVMOps(object):
                                    datastorePath=ds_path)
         # Wait till the state changes from queued or running.
         # If an error state is returned, it means that the path doesn't exist.
-        while True:
-            task_info = self._session._call_method(vim_util,
-                                       "get_dynamic_property",
-                                       search_task, "Task", "info")
-            if task_info.state in  ['queued', 'running']:
-                time.sleep(2)
-                continue
-            break
+        task_info = self._session._get_task_info(search_task)
         if task_info.state == "error":
             return False
         return True
@@ -813,8 +897,149 @@ class VMWareVMOps(object):
                     name=ds_path, createParentDirectories=False)
         LOG.debug(_("Created directory with path %s") % ds_path)
 
+    def _get_datastore_browser(self, ds_ref):
+        """Get the reference to the browser of the datastore."""
+        return self._session._call_method(vim_util, "get_dynamic_property",
+                                          ds_ref, "Datastore", "browser")
+
+    def _list_folder(self, ds_browser, ds_path):
+        """List the names in the datastore folder, None if it is missing."""
+        search_task = self._session._call_method(self._session._get_vim(),
+                                   "SearchDatastore_Task",
+                                   ds_browser,
+                                   datastorePath=ds_path)
+        task_info = self._session._get_task_info(search_task)
+        if task_info.state == "error":
+            return None
+        return [file_info.path for file_info in
+                getattr(task_info.result, "file", None) or []]
+
+    def _move_datastore_file(self, instance, src_path, dest_path):
+        """Move a file or folder within the datastores."""
+        dc_ref = self._get_datacenter_name_and_ref()[0]
+        move_task = self._session._call_method(self._session._get_vim(),
+                    "MoveDatastoreFile_Task",
+                    self._session._get_vim().get_service_content().fileManager,
+                    sourceName=src_path, sourceDatacenter=dc_ref,
+                    destinationName=dest_path, destinationDatacenter=dc_ref,
+                    force=False)
+        self._session._wait_for_task(instance['uuid'], move_task)
+
+    def _delete_datastore_file(self, ds_path):
+        """Delete a file or folder of a datastore, logging failures."""
+        delete_task = self._session._call_method(self._session._get_vim(),
+                    "DeleteDatastoreFile_Task",
+                    self._session._get_vim().get_service_content().fileManager,
+                    name=ds_path)
+        task_info = self._session._get_task_info(delete_task)
+        if task_info.state == "error":
+            LOG.error(_("Failed to delete %(ds_path)s, error was %(error)s")
+                      % {'ds_path': ds_path,
+                         'error': task_info.error.localizedMessage})
+
+    def manage_image_cache(self, context):
+        """
+        Age the images cached on the datastores.
+
+        A cached image which no instance of this host uses is marked with
+        the time it was first found unused; it is removed once it stayed
+        unused for remove_unused_original_minimum_age_seconds, if
+        remove_unused_base_images is set.
+        """
+        folder = FLAGS.vmwareapi_image_cache_folder
+        if not folder:
+            return
+        used_images = set(str(instance['image_ref']) for instance in
+                          db.instance_get_all_by_host(context, FLAGS.host))
+        data_stores = self._session._call_method(vim_util, "get_objects",
+                        "Datastore", ["summary.name"])
+        now = int(time.time())
+        for data_store in data_stores:
+            ds_name = data_store.propSet[0].val
+            entries = self._list_folder(
+                    self._get_datastore_browser(data_store.obj),
+                    vm_util.build_datastore_path(ds_name, folder))
+            if not entries:
+                continue
+            cache_keys = []
+            markers = {}
+            for entry in entries:
+                cache_key, sep, unused_since = entry.rpartition(".unused-")
+                if not sep:
+                    cache_keys.append(entry)
+                elif unused_since.isdigit():
+                    markers[cache_key] = (entry, int(unused_since))
+            for cache_key in cache_keys:
+                image_id = cache_key.split("_")[0]
+                self._age_cached_image(ds_name, cache_key,
+                                       image_id in used_images,
+                                       markers.pop(cache_key, None), now)
+            # Markers of images which are gone
+            for entry, _unused_since in markers.values():
+                self._delete_datastore_file(vm_util.build_datastore_path(
+                        ds_name, "%s/%s" % (folder, entry)))
+
+    def _age_cached_image(self, ds_name, cache_key, in_use, marker, now):
+        """Mark, unmark or remove a single cached image."""
+        folder = FLAGS.vmwareapi_image_cache_folder
+        image_path = vm_util.build_datastore_path(ds_name,
+                                "%s/%s" % (folder, cache_key))
+
+        @utils.synchronized(_image_cache_lock(ds_name, cache_key))
+        def _age():
+            if in_use:
+                LOG.debug(_("Cached image %s is in use") % image_path)
+                if marker is not None:
+                    self._delete_datastore_file(vm_util.build_datastore_path(
+                            ds_name, "%s/%s" % (folder, marker[0])))
+                return
+            if marker is None:
+                LOG.info(_("Cached image %s is not in use") % image_path)
+                self._mkdir(vm_util.build_datastore_path(ds_name,
+                        "%s/%s" % (folder, UNUSED_MARKER % (cache_key, now))))
+                return
+            age = now - marker[1]
+            if (not FLAGS.remove_unused_base_images or
+                    age < FLAGS.remove_unused_original_minimum_age_seconds):
+                LOG.info(_("Cached image %(image_path)s unused for "
+                           "%(age)d seconds, keeping it") % locals())
+                return
+            LOG.info(_("Removing cached image %(image_path)s unused for "
+                       "%(age)d seconds") % locals())
+            self._delete_datastore_file(image_path)
+            self._delete_datastore_file(vm_util.build_datastore_path(
+                    ds_name, "%s/%s" % (folder, marker[0])))
+
+        _age()
+
+    def _get_vm_properties(self, properties, vm_ref=None):
+        """
+        Get the properties of the VM, or of every VM if vm_ref is None,
+        as a list of dicts. The inventory cache is used when it is up to
+        date, so the properties must be among the ones it keeps.
+        """
+        inventory = self._session._get_inventory()
+        if inventory is not None:
+            if vm_ref is None:
+                return [props for _ref, props in inventory.list_vms()]
+            props = inventory.get_vm_properties(vm_ref)
+            if props is not None:
+                return [props]
+        if vm_ref is None:
+            vms = self._session._call_method(vim_util, "get_objects",
+                        "VirtualMachine", properties)
+        else:
+            vms = self._session._call_method(vim_util,
+                        "get_object_properties", None, vm_ref,
+                        "VirtualMachine", properties)
+        return [dict((prop.name, prop.val) for prop in vm.propSet)
+                for vm in vms]
+
     def _get_vm_ref_from_the_name(self, vm_name):
         """Get reference to the VM with the name specified."""
+        inventory = self._session._get_inventory()
+        if inventory is not None:
+            return inventory.get_vm_ref(vm_name)
         vms = self._session._call_method(vim_util, "get_objects",
                     "VirtualMachine", ["name"])
         for vm in vms:
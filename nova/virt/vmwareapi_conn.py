@@ -29,22 +29,24 @@ A connection to the VMware ESX platform.
 :vmwareapi_api_retry_count:  The API retry count in case of failure such as
                              network failures (socket errors etc.)
                              (default: 10).
+:vmwareapi_inventory_cache:  Keep a local cache of the VMs of the host, fed
+                             by a property collector, instead of fetching
+                             the inventory for every lookup
+                             (default: True).
 
 """
 
 import time
 
-from eventlet import event
-
 from nova import context
 from nova import db
 from nova import exception
 from nova import flags
 from nova import log as logging
 from nova.openstack.common import cfg
-from nova import utils
 from nova.virt import driver
 from nova.virt.vmwareapi import error_util
+from nova.virt.vmwareapi import inventory
 from nova.virt.vmwareapi import vim
 from nova.virt.vmwareapi import vim_util
 from nova.virt.vmwareapi import vmops
@@ -77,6 +79,12 @@ vmwareapi_opts = [
     cfg.StrOpt('vmwareapi_vlan_interface',
                default='vmnic0',
                help='Physical ethernet adapter name for vlan networking'),
+    cfg.BoolOpt('vmwareapi_inventory_cache',
+                default=True,
+                help='Keep a local cache of the VMs of the host, updated by '
+                     'a property collector, and learn about task completion '
+                     'from it instead of polling every task. '
+                     'Used only if connection_type is vmwareapi'),
     ]
 
 FLAGS = flags.FLAGS
@@ -118,6 +126,9 @@ class VMWareESXConnection(driver.ComputeDriver):
         super(VMWareESXConnection, self).__init__()
         session = VMWareAPISession(host_ip, host_username, host_password,
                                    api_retry_count, scheme=scheme)
+        if FLAGS.vmwareapi_inventory_cache:
+            session._start_inventory()
+        self._session = session
         self._vmops = vmops.VMWareVMOps(session)
 
     def init_host(self, host):
@@ -201,6 +212,10 @@ class VMWareESXConnection(driver.ComputeDriver):
         """This method is supported only by libvirt."""
         return
 
+    def manage_image_cache(self, context):
+        """Age the images cached on the datastores."""
+        self._vmops.manage_image_cache(context)
+
     def host_power_action(self, host, action):
         """Reboots, shuts down or powers up the host."""
         raise NotImplementedError()
@@ -238,6 +253,7 @@ class VMWareAPISession(object):
         self._scheme = scheme
         self._session_id = None
         self.vim = None
+        self.inventory = None
         self._create_session()
 
     def _get_vim_object(self):
@@ -277,6 +293,23 @@ class VMWareAPISession(object):
                               "got this exception: %s") % excep)
                 raise exception.Error(excep)
 
+    def _start_inventory(self):
+        """Start keeping the local inventory cache up to date."""
+        self.inventory = inventory.Inventory(self)
+        try:
+            self.inventory.start()
+        except Exception, excep:
+            # Hosts without WaitForUpdatesEx are queried as they used to be
+            LOG.warn(_("Unable to set up the inventory cache, falling back "
+                       "to querying the host: %s") % excep)
+            self.inventory = None
+
+    def _get_inventory(self):
+        """Gets the inventory cache if it is up to date, else None."""
+        if self.inventory is not None and self.inventory.ready:
+            return self.inventory
+        return None
+
     def __del__(self):
         """Logs-out the session."""
         # Logout to avoid un-necessary increase in session count at the
@@ -368,43 +401,58 @@ class VMWareAPISession(object):
 
     def _wait_for_task(self, instance_uuid, task_ref):
         """
-        Return a Deferred that will give the result of the given task.
-        The task is polled until it completes.
-        """
-        done = event.Event()
-        loop = utils.LoopingCall(self._poll_task, instance_uuid, task_ref,
-                                      done)
-        loop.start(FLAGS.vmwareapi_task_poll_interval)
-        ret_val = done.wait()
-        loop.stop()
-        return ret_val
-
-    def _poll_task(self, instance_uuid, task_ref, done):
-        """
-        Poll the given task, and fires the given Deferred if we
-        get a result.
+        Wait for the given task to complete, return "success" or raise
+        the error it failed with.
         """
+        task_info = self._get_task_info(task_ref)
+        task_name = task_info.name
+        action = dict(
+            instance_uuid=instance_uuid,
+            action=task_name[0:255],
+            error=None)
         try:
-            task_info = self._call_method(vim_util, "get_dynamic_property",
-                            task_ref, "Task", "info")
-            task_name = task_info.name
-            action = dict(
-                instance_uuid=instance_uuid,
-                action=task_name[0:255],
-                error=None)
-            if task_info.state in ['queued', 'running']:
-                return
-            elif task_info.state == 'success':
+            if task_info.state == 'success':
                 LOG.debug(_("Task [%(task_name)s] %(task_ref)s "
                             "status: success") % locals())
-                done.send("success")
-            else:
-                error_info = str(task_info.error.localizedMessage)
-                action["error"] = error_info
-                LOG.warn(_("Task [%(task_name)s] %(task_ref)s "
-                          "status: error %(error_info)s") % locals())
-                done.send_exception(exception.Error(error_info))
+                return "success"
+            error_info = str(task_info.error.localizedMessage)
+            action["error"] = error_info
+            LOG.warn(_("Task [%(task_name)s] %(task_ref)s "
+                      "status: error %(error_info)s") % locals())
+            raise exception.Error(error_info)
+        finally:
             db.instance_action_create(context.get_admin_context(), action)
-        except Exception, excep:
-            LOG.warn(_("In vmwareapi:_poll_task, Got this error %s") % excep)
-            done.send_exception(excep)
+
+    def _get_task_info(self, task_ref):
+        """
+        Wait for the given task to complete and return its info.
+
+        The completion is learnt from the inventory cache; the task is
+        polled only while the cache isn't receiving updates.
+        """
+        try:
+            while True:
+                inventory = self._get_inventory()
+                if inventory is not None:
+                    task_info = inventory.wait_for_task(task_ref,
+                                        FLAGS.vmwareapi_task_poll_interval)
+                    if task_info is not None:
+                        return task_info
+                    if inventory.ready:
+                        continue
+                try:
+                    task_info = self._call_method(vim_util,
+                                    "get_dynamic_property", task_ref, "Task",
+                                    "info")
+                except Exception, excep:
+                    LOG.warn(_("In vmwareapi:_get_task_info, "
+                               "Got this error %s") % excep)
+                    raise
+                if task_info.state not in ['queued', 'running']:
+                    return task_info
+                time.sleep(FLAGS.vmwareapi_task_poll_interval)
+        finally:
+            # The inventory keeps watching the task, across reconnects,
+            # until told otherwise when it was polled instead.
+            if self.inventory is not None:
+                self.inventory.forget_task(task_ref)
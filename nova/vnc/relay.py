@@ -0,0 +1,282 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Relays the traffic of console sessions between two sockets.
+
+On Linux the data is moved with splice(2) through a pipe, so it never
+has to be copied into the Python process.  Where splice isn't available
+the data goes through one buffer per direction, allocated once for the
+whole session.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import sys
+import time
+
+import eventlet
+from eventlet import hubs
+
+from nova import log as logging
+
+
+LOG = logging.getLogger(__name__)
+
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+
+
+def _load_splice():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        splice = libc.splice
+    except (OSError, AttributeError):
+        return None
+    splice.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                       ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+    splice.restype = ctypes.c_long
+    return splice
+
+
+_splice = _load_splice()
+
+
+def splice(fd_in, fd_out, size):
+    """Move up to size bytes from fd_in to fd_out, one of them a pipe.
+
+    Returns the number of bytes moved, 0 at end of file, or None when
+    the call would have blocked.
+    """
+    moved = _splice(fd_in, None, fd_out, None, size,
+                    SPLICE_F_MOVE | SPLICE_F_NONBLOCK)
+    if moved >= 0:
+        return moved
+    err = ctypes.get_errno()
+    if err == errno.EAGAIN:
+        return None
+    raise OSError(err, os.strerror(err))
+
+
+class ProxyStats(object):
+    """Counters shared by all the sessions of a proxy."""
+
+    def __init__(self):
+        self.sessions_active = 0
+        self.sessions_total = 0
+        self.sessions_idle_closed = 0
+        self.bytes_to_server = 0
+        self.bytes_to_client = 0
+        self.connect_count = 0
+        self.connect_time_total = 0.0
+        self.connect_time_max = 0.0
+
+    def connected(self, seconds):
+        """Record how long setting up a session took."""
+        self.connect_count += 1
+        self.connect_time_total += seconds
+        self.connect_time_max = max(self.connect_time_max, seconds)
+
+    def report(self):
+        report = dict(self.__dict__)
+        report['connect_time_avg'] = 0.0
+        if self.connect_count:
+            report['connect_time_avg'] = (self.connect_time_total /
+                                          self.connect_count)
+        return report
+
+
+class _Idle(Exception):
+    pass
+
+
+class Session(object):
+    """Relays the traffic between a client and a server socket.
+
+    :param idle_timeout: close the session after that many seconds
+                         without traffic in either direction, 0 to never
+    :param max_rate: bytes per second allowed for both directions
+                     together, 0 for no limit
+    :param buffer_size: largest chunk moved at once
+    :param use_splice: move the data with splice(2) when possible
+    """
+
+    def __init__(self, client, server, stats=None, idle_timeout=0,
+                 max_rate=0, buffer_size=65536, use_splice=True):
+        self.client = client
+        self.server = server
+        self.stats = stats or ProxyStats()
+        self.idle_timeout = idle_timeout
+        self.max_rate = max_rate
+        self.chunk_size = buffer_size
+        if max_rate:
+            self.chunk_size = max(1, min(buffer_size, max_rate))
+        self.use_splice = use_splice and _splice is not None
+        self.last_activity = time.time()
+        self._allowance = float(max_rate)
+        self._checked = self.last_activity
+        self._closing = False
+
+    def run(self):
+        """Relay in both directions until both are finished."""
+        self.stats.sessions_active += 1
+        self.stats.sessions_total += 1
+        try:
+            to_server = eventlet.spawn(self._pump, self.client, self.server,
+                                       'bytes_to_server')
+            to_client = eventlet.spawn(self._pump, self.server, self.client,
+                                       'bytes_to_client')
+            to_server.wait()
+            to_client.wait()
+        finally:
+            self.stats.sessions_active -= 1
+            self.client.close()
+            self.server.close()
+
+    def _pump(self, source, dest, counter):
+        try:
+            if self.use_splice and self._pump_splice(source, dest, counter):
+                return
+            self._pump_copy(source, dest, counter)
+        except _Idle:
+            if not self._closing:
+                LOG.audit(_('Closing idle console session'))
+                self.stats.sessions_idle_closed += 1
+            self._shutdown()
+        except (socket.error, OSError, IOError), e:
+            # Terminate the proxy in both directions
+            LOG.debug(_('Console session ended: %s'), e)
+            self._shutdown()
+
+    def _shutdown(self):
+        """Wake up and end the other direction too."""
+        self._closing = True
+        for sock in (self.client, self.server):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def _end_of_input(self, dest):
+        try:
+            dest.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+
+    def _remaining(self):
+        """Seconds left before the session is idle, None for no limit."""
+        if self._closing:
+            raise _Idle()
+        if not self.idle_timeout:
+            return None
+        remaining = self.last_activity + self.idle_timeout - time.time()
+        if remaining <= 0:
+            raise _Idle()
+        return remaining
+
+    def _wait(self, sock, read):
+        """Wait for sock to be readable or writable, raise _Idle if idle."""
+        while True:
+            timeout = self._remaining()
+            try:
+                hubs.trampoline(sock, read=read, write=not read,
+                                timeout=timeout, timeout_exc=_Idle)
+                return
+            except _Idle:
+                # The other direction may have had traffic meanwhile
+                continue
+
+    def _transferred(self, counter, nbytes):
+        setattr(self.stats, counter, getattr(self.stats, counter) + nbytes)
+        now = time.time()
+        self.last_activity = now
+        if not self.max_rate:
+            return
+        # Token bucket allowing bursts of up to one second of traffic
+        self._allowance = min(self.max_rate, self._allowance +
+                              (now - self._checked) * self.max_rate)
+        self._allowance -= nbytes
+        self._checked = now
+        if self._allowance < 0:
+            eventlet.sleep(-self._allowance / self.max_rate)
+
+    def _pump_copy(self, source, dest, counter):
+        # The sockets are shared with the other direction, so their own
+        # timeouts are left alone and _wait() tells when they're ready.
+        buf = bytearray(self.chunk_size)
+        while True:
+            self._wait(source, read=True)
+            try:
+                nbytes = source.recv_into(buf)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    continue
+                raise
+            if not nbytes:
+                self._end_of_input(dest)
+                return
+            sent = 0
+            while sent < nbytes:
+                self._wait(dest, read=False)
+                try:
+                    sent += dest.send(buffer(buf, sent, nbytes - sent))
+                except socket.error, e:
+                    if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        continue
+                    raise
+                # A slow reader taking the data bit by bit isn't idle
+                self.last_activity = time.time()
+            self._transferred(counter, nbytes)
+
+    def _pump_splice(self, source, dest, counter):
+        """Relay with splice, return False if it is not supported here."""
+        pipe_out, pipe_in = os.pipe()
+        moved_any = False
+        try:
+            while True:
+                try:
+                    nbytes = splice(source.fileno(), pipe_in, self.chunk_size)
+                except OSError, e:
+                    if not moved_any and e.errno in (errno.EINVAL,
+                                                     errno.ENOSYS):
+                        return False
+                    raise
+                if nbytes is None:
+                    self._wait(source, read=True)
+                    continue
+                if not nbytes:
+                    self._end_of_input(dest)
+                    return True
+                moved_any = True
+                pending = nbytes
+                while pending:
+                    sent = splice(pipe_out, dest.fileno(), pending)
+                    if sent is None:
+                        self._wait(dest, read=False)
+                    else:
+                        pending -= sent
+                        # A slow reader taking the data bit by bit isn't idle
+                        self.last_activity = time.time()
+                self._transferred(counter, nbytes)
+        finally:
+            os.close(pipe_out)
+            os.close(pipe_in)
@@ -18,7 +18,9 @@
 
 """Eventlet WSGI Services to proxy VNC for XCP protocol."""
 
-import socket
+import json
+import time
+
 import webob
 
 import eventlet
@@ -26,11 +28,13 @@ import eventlet.green
 import eventlet.greenio
 import eventlet.wsgi
 
+from nova.consoleauth import tokens
 from nova import context
 from nova import flags
 from nova import log as logging
 from nova.openstack.common import cfg
 from nova import rpc
+from nova.vnc import relay
 from nova import version
 from nova import wsgi
 
@@ -44,6 +48,26 @@ xvp_proxy_opts = [
     cfg.StrOpt('xvpvncproxy_host',
                default='0.0.0.0',
                help='Address that the XCP VNC proxy should bind to'),
+    cfg.IntOpt('xvpvncproxy_idle_timeout',
+               default=0,
+               help='Seconds without traffic after which a console session '
+                    'is closed, 0 to keep idle sessions open'),
+    cfg.IntOpt('xvpvncproxy_max_session_rate',
+               default=0,
+               help='Maximum bytes per second relayed for one console '
+                    'session, 0 for no limit'),
+    cfg.IntOpt('xvpvncproxy_buffer_size',
+               default=65536,
+               help='Largest chunk of console traffic relayed at once'),
+    cfg.BoolOpt('xvpvncproxy_use_splice',
+                default=True,
+                help='Relay console traffic with splice(2) where the kernel '
+                     'supports it, so it is not copied through the proxy'),
+    cfg.StrOpt('xvpvncproxy_stats_path',
+               default='',
+               help='URL path on which the XCP VNC proxy reports its '
+                    'session and traffic counters as JSON, e.g. /stats. '
+                    'Empty to disable'),
     ]
 
 FLAGS = flags.FLAGS
@@ -55,26 +79,9 @@ flags.DECLARE('consoleauth_topic', 'nova.consoleauth')
 class XCPVNCProxy(object):
     """Class to use the xvp auth protocol to proxy instance vnc consoles."""
 
-    def one_way_proxy(self, source, dest):
-        """Proxy tcp connection from source to dest."""
-        while True:
-            try:
-                d = source.recv(32384)
-            except Exception as e:
-                d = None
-
-            # If recv fails, send a write shutdown the other direction
-            if d is None or len(d) == 0:
-                dest.shutdown(socket.SHUT_WR)
-                break
-            # If send fails, terminate proxy in both directions
-            try:
-                # sendall raises an exception on write error, unlike send
-                dest.sendall(d)
-            except Exception as e:
-                source.close()
-                dest.close()
-                break
+    def __init__(self):
+        self.stats = relay.ProxyStats()
+        self.verifier = tokens.Verifier()
 
     def handshake(self, req, connect_info, sockets):
         """Execute hypervisor-specific vnc auth handshaking (if needed)."""
@@ -105,13 +112,13 @@ class XCPVNCProxy(object):
 
         client = req.environ['eventlet.input'].get_socket()
         client.sendall("HTTP/1.1 200 OK\r\n\r\n")
-        socketsserver = None
         sockets['client'] = client
         sockets['server'] = server
 
     def proxy_connection(self, req, connect_info, start_response):
         """Spawn bi-directional vnc proxy."""
         sockets = {}
+        start = time.time()
         t0 = eventlet.spawn(self.handshake, req, connect_info, sockets)
         t0.wait()
 
@@ -121,21 +128,25 @@ class XCPVNCProxy(object):
                            [('content-type', 'text/html')])
             return "Invalid Request"
 
-        client = sockets['client']
-        server = sockets['server']
-
-        t1 = eventlet.spawn(self.one_way_proxy, client, server)
-        t2 = eventlet.spawn(self.one_way_proxy, server, client)
-        t1.wait()
-        t2.wait()
-
-        # Make sure our sockets are closed
-        server.close()
-        client.close()
+        self.stats.connected(time.time() - start)
+        session = relay.Session(sockets['client'], sockets['server'],
+                                stats=self.stats,
+                                idle_timeout=FLAGS.xvpvncproxy_idle_timeout,
+                                max_rate=FLAGS.xvpvncproxy_max_session_rate,
+                                buffer_size=FLAGS.xvpvncproxy_buffer_size,
+                                use_splice=FLAGS.xvpvncproxy_use_splice)
+        # Closes both sockets when done
+        session.run()
 
     def __call__(self, environ, start_response):
         try:
             req = webob.Request(environ)
+            if (FLAGS.xvpvncproxy_stats_path and
+                req.path_info == FLAGS.xvpvncproxy_stats_path):
+                start_response('200 OK',
+                               [('content-type', 'application/json')])
+                return json.dumps(self.stats.report())
+
             LOG.audit(_("Request: %s"), req)
             token = req.params.get('token')
             if not token:
@@ -144,10 +155,13 @@ class XCPVNCProxy(object):
                                [('content-type', 'text/html')])
                 return "Invalid Request"
 
-            ctxt = context.get_admin_context()
-            connect_info = rpc.call(ctxt, FLAGS.consoleauth_topic,
-                                    {'method': 'check_token',
-                                     'args': {'token': token}})
+            if tokens.is_signed(token):
+                connect_info = self.verifier.verify(token)
+            else:
+                ctxt = context.get_admin_context()
+                connect_info = rpc.call(ctxt, FLAGS.consoleauth_topic,
+                                        {'method': 'check_token',
+                                         'args': {'token': token}})
 
             if not connect_info:
                 LOG.audit(_("Request made with invalid token: %s"), req)
@@ -22,12 +22,15 @@ Drivers for volumes.
 
 import time
 
+from eventlet import greenpool
+
 from nova import exception
 from nova import flags
 from nova import log as logging
 from nova.openstack.common import cfg
 from nova import utils
 from nova.volume import iscsi
+from nova.volume import wipe
 
 
 LOG = logging.getLogger(__name__)
@@ -48,6 +51,9 @@ volume_opts = [
     cfg.StrOpt('iscsi_target_prefix',
                default='iqn.2010-10.org.openstack:',
                help='prefix for iscsi volumes'),
+    cfg.IntOpt('iscsi_export_concurrency',
+               default=8,
+               help='Number of exports recreated in parallel on startup'),
     cfg.StrOpt('iscsi_ip_address',
                default='$my_ip',
                help='use this ip for iscsi'),
@@ -75,10 +81,12 @@ class VolumeDriver(object):
     def __init__(self, execute=utils.execute, *args, **kwargs):
         # NOTE(vish): db is set by Manager
         self.db = None
+        self.wiper = wipe.VolumeWiper(execute)
         self.set_execute(execute)
 
     def set_execute(self, execute):
         self._execute = execute
+        self.wiper.set_execute(execute)
 
     def _try_execute(self, *command, **kwargs):
         # NOTE(vish): Volume commands can partially fail due to timing, but
@@ -105,6 +113,8 @@ class VolumeDriver(object):
         if not FLAGS.volume_group in volume_groups:
             raise exception.Error(_("volume group %s doesn't exist")
                                   % FLAGS.volume_group)
+        if FLAGS.volume_wipe_async:
+            self.wiper.resume()
 
     def _create_volume(self, volume_name, sizestr):
         self._try_execute('lvcreate', '-L', sizestr, '-n',
@@ -127,7 +137,6 @@ class VolumeDriver(object):
     def _delete_volume(self, volume, size_in_g):
         """Deletes a logical volume."""
         # zero out old volumes to prevent data leaking between users
-        # TODO(ja): reclaiming space should be done lazy and low priority
         self._copy_volume('/dev/zero', self.local_path(volume), size_in_g)
         self._try_execute('lvremove', '-f', "%s/%s" %
                           (FLAGS.volume_group,
@@ -176,6 +185,10 @@ class VolumeDriver(object):
             if (out[0] == 'o') or (out[0] == 'O'):
                 raise exception.VolumeIsBusy(volume_name=volume['name'])
 
+        if FLAGS.volume_wipe_async:
+            # the wiper zeroes and removes the renamed LV in the background
+            self.wiper.queue_delete(volume['name'])
+            return
         self._delete_volume(volume, volume['size'])
 
     def create_snapshot(self, snapshot):
@@ -194,6 +207,8 @@ class VolumeDriver(object):
 
         # TODO(yamahata): zeroing out the whole snapshot triggers COW.
         # it's quite slow.
+        # NOTE: snapshots are wiped inline even with volume_wipe_async, a
+        # snapshot waiting for its wipe would keep its origin volume busy.
         self._delete_volume(snapshot, snapshot['volume_size'])
 
     def local_path(self, volume):
@@ -206,6 +221,11 @@ class VolumeDriver(object):
         """Synchronously recreates an export for a logical volume."""
         raise NotImplementedError()
 
+    def ensure_exports(self, context, volumes):
+        """Synchronously recreates the exports for a list of volumes."""
+        for volume in volumes:
+            self.ensure_export(context, volume)
+
     def create_export(self, context, volume):
         """Exports the volume. Can optionally return a Dictionary of changes
         to the volume object to be persisted."""
@@ -271,12 +291,64 @@ class ISCSIDriver(VolumeDriver):
                        "provisioned for volume: %d"), volume['id'])
             return
 
+        self._ensure_target(iscsi_target, volume)
+
+    def _ensure_target(self, iscsi_target, volume, current=None):
+        """Creates whatever part of the export is missing from current.
+
+        current is the (name, luns) tuple returned by show_targets for
+        iscsi_target, or None if the target state is unknown.
+        """
         iscsi_name = "%s%s" % (FLAGS.iscsi_target_prefix, volume['name'])
         volume_path = "/dev/%s/%s" % (FLAGS.volume_group, volume['name'])
 
-        self.tgtadm.new_target(iscsi_name, iscsi_target, check_exit_code=False)
-        self.tgtadm.new_logicalunit(iscsi_target, 0, volume_path,
-                                    check_exit_code=False)
+        if current is None or current[0] != iscsi_name:
+            self.tgtadm.new_target(iscsi_name, iscsi_target,
+                                   check_exit_code=False)
+        if current is None or 0 not in current[1]:
+            self.tgtadm.new_logicalunit(iscsi_target, 0, volume_path,
+                                        check_exit_code=False)
+
+    def ensure_exports(self, context, volumes):
+        """Synchronously recreates the exports for a list of volumes.
+
+        The target tids come from a single db query per host and the
+        target state is read once, so only the missing targets and
+        logical units are created, iscsi_export_concurrency at a time.
+        """
+        iscsi_targets = {}
+        for host in set(volume['host'] for volume in volumes):
+            iscsi_targets.update(
+                self.db.volume_get_iscsi_target_nums_by_host(context, host))
+
+        try:
+            current = self.tgtadm.show_targets()
+        except (exception.ProcessExecutionError, IOError):
+            LOG.exception(_("Unable to list iscsi targets, recreating "
+                            "all exports"))
+            current = {}
+
+        pool = greenpool.GreenPool(FLAGS.iscsi_export_concurrency)
+        for volume in volumes:
+            iscsi_target = iscsi_targets.get(volume['id'])
+            if iscsi_target is None:
+                LOG.info(_("Skipping ensure_export. No iscsi_target "
+                           "provisioned for volume: %d"), volume['id'])
+                continue
+            target = current.get(iscsi_target)
+            iscsi_name = "%s%s" % (FLAGS.iscsi_target_prefix, volume['name'])
+            if target and target[0] == iscsi_name and 0 in target[1]:
+                continue
+            pool.spawn_n(self._ensure_target_safe, iscsi_target, volume,
+                         target)
+        pool.waitall()
+
+    def _ensure_target_safe(self, iscsi_target, volume, current):
+        try:
+            self._ensure_target(iscsi_target, volume, current)
+        except Exception:
+            LOG.exception(_("volume %s: failed to recreate export"),
+                          volume['name'])
 
     def _ensure_iscsi_targets(self, context, host):
         """Ensure that target ids have been created in datastore."""
@@ -20,6 +20,8 @@ Helper code for the iSCSI volume driver.
 
 """
 
+import re
+
 from nova import flags
 from nova.openstack.common import cfg
 from nova import utils
@@ -48,7 +50,7 @@ class TargetAdmin(object):
         self._execute = execute
 
     def _run(self, *args, **kwargs):
-        self._execute(self._cmd, *args, run_as_root=True, **kwargs)
+        return self._execute(self._cmd, *args, run_as_root=True, **kwargs)
 
     def new_target(self, name, tid, **kwargs):
         """Create a new iSCSI target."""
@@ -62,6 +64,10 @@ class TargetAdmin(object):
         """Query the given target ID."""
         raise NotImplementedError()
 
+    def show_targets(self):
+        """Return every configured target as {tid: (name, set of luns)}."""
+        raise NotImplementedError()
+
     def new_logicalunit(self, tid, lun, path, **kwargs):
         """Create a new LUN on a target using the supplied path."""
         raise NotImplementedError()
@@ -101,6 +107,23 @@ class TgtAdm(TargetAdmin):
                   '--tid=%s' % tid,
                   **kwargs)
 
+    def show_targets(self):
+        out, _err = self._run('--op', 'show',
+                              '--lld=iscsi', '--mode=target')
+        targets = {}
+        luns = None
+        for line in (out or '').splitlines():
+            match = re.match(r'^Target (\d+): (\S+)', line)
+            if match:
+                luns = set()
+                targets[int(match.group(1))] = (match.group(2), luns)
+                continue
+            match = re.match(r'^\s+LUN: (\d+)', line)
+            # lun0 is the controller, the first real lun is lun1
+            if match and luns is not None and int(match.group(1)) > 0:
+                luns.add(int(match.group(1)) - 1)
+        return targets
+
     def new_logicalunit(self, tid, lun, path, **kwargs):
         self._run('--op', 'new',
                   '--lld=iscsi', '--mode=logicalunit',
@@ -139,6 +162,25 @@ class IetAdm(TargetAdmin):
                   '--tid=%s' % tid,
                   **kwargs)
 
+    @staticmethod
+    def _read_volumes():
+        with open('/proc/net/iet/volume') as f:
+            return f.read()
+
+    def show_targets(self):
+        targets = {}
+        luns = None
+        for line in self._read_volumes().splitlines():
+            match = re.match(r'^tid:(\d+) name:(\S+)', line)
+            if match:
+                luns = set()
+                targets[int(match.group(1))] = (match.group(2), luns)
+                continue
+            match = re.match(r'^\s+lun:(\d+)', line)
+            if match and luns is not None:
+                luns.add(int(match.group(1)))
+        return targets
+
     def new_logicalunit(self, tid, lun, path, **kwargs):
         self._run('--op', 'new',
                   '--tid=%s' % tid,
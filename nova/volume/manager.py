@@ -94,11 +94,14 @@ class VolumeManager(manager.SchedulerDependentManager):
 
         volumes = self.db.volume_get_all_by_host(ctxt, self.host)
         LOG.debug(_("Re-exporting %s volumes"), len(volumes))
+        exports = []
         for volume in volumes:
             if volume['status'] in ['available', 'in-use']:
-                self.driver.ensure_export(ctxt, volume)
+                exports.append(volume)
             else:
                 LOG.info(_("volume %s: skipping export"), volume['name'])
+        # the service only starts consuming rpc once this has returned
+        self.driver.ensure_exports(ctxt, exports)
 
     def create_volume(self, context, volume_id, snapshot_id=None):
         """Creates and exports the volume."""
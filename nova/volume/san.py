@@ -32,6 +32,8 @@ import string
 import uuid
 from xml.etree import ElementTree
 
+from eventlet import pools
+
 from nova import exception
 from nova import flags
 from nova import log as logging
@@ -71,28 +73,39 @@ san_opts = [
     cfg.StrOpt('san_zfs_volume_base',
                default='rpool/',
                help='The ZFS path under which to create zvols for volumes.'),
+    cfg.IntOpt('san_ssh_pool_size',
+               default=5,
+               help='Maximum number of SSH connections kept open to the SAN'),
+    cfg.IntOpt('san_ssh_conn_timeout',
+               default=30,
+               help='Timeout in seconds when opening an SSH connection'),
+    cfg.IntOpt('san_ssh_keepalive',
+               default=30,
+               help='Seconds between keepalive packets on idle SSH '
+                    'connections (0 = disabled)'),
+    cfg.IntOpt('san_ssh_command_timeout',
+               default=300,
+               help='Seconds to wait for a SAN command to produce output '
+                    '(0 = wait forever)'),
     ]
 
 FLAGS = flags.FLAGS
 FLAGS.register_opts(san_opts)
 
 
-class SanISCSIDriver(nova.volume.driver.ISCSIDriver):
-    """Base class for SAN-style storage volumes
+class SSHPool(pools.Pool):
+    """A bounded pool of authenticated SSH connections to the SAN.
 
-    A SAN-style storage value is 'different' because the volume controller
-    probably won't run on it, so we need to access is over SSH or another
-    remote protocol.
+    Connections are checked before they are handed out, so one that was
+    dropped while idle is transparently replaced by a fresh one.
     """
 
-    def __init__(self):
-        super(SanISCSIDriver, self).__init__()
-        self.run_local = FLAGS.san_is_local
-
-    def _build_iscsi_target_name(self, volume):
-        return "%s%s" % (FLAGS.iscsi_target_prefix, volume['name'])
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = FLAGS.san_ssh_pool_size
+        super(SSHPool, self).__init__(max_size=max_size)
 
-    def _connect_to_ssh(self):
+    def create(self):
         ssh = paramiko.SSHClient()
         #TODO(justinsb): We need a better SSH key policy
         ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -100,7 +113,8 @@ class SanISCSIDriver(nova.volume.driver.ISCSIDriver):
             ssh.connect(FLAGS.san_ip,
                         port=FLAGS.san_ssh_port,
                         username=FLAGS.san_login,
-                        password=FLAGS.san_password)
+                        password=FLAGS.san_password,
+                        timeout=FLAGS.san_ssh_conn_timeout)
         elif FLAGS.san_private_key:
             privatekeyfile = os.path.expanduser(FLAGS.san_private_key)
             # It sucks that paramiko doesn't support DSA keys
@@ -108,11 +122,50 @@ class SanISCSIDriver(nova.volume.driver.ISCSIDriver):
             ssh.connect(FLAGS.san_ip,
                         port=FLAGS.san_ssh_port,
                         username=FLAGS.san_login,
-                        pkey=privatekey)
+                        pkey=privatekey,
+                        timeout=FLAGS.san_ssh_conn_timeout)
         else:
             raise exception.Error(_("Specify san_password or san_private_key"))
+        if FLAGS.san_ssh_keepalive:
+            ssh.get_transport().set_keepalive(FLAGS.san_ssh_keepalive)
         return ssh
 
+    @staticmethod
+    def is_alive(ssh):
+        transport = ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def get(self):
+        """Return a live connection, reconnecting if the pooled one died."""
+        ssh = super(SSHPool, self).get()
+        if self.is_alive(ssh):
+            return ssh
+        LOG.debug(_("Replacing dead SSH connection to %s"), FLAGS.san_ip)
+        ssh.close()
+        try:
+            return self.create()
+        except Exception:
+            with utils.save_and_reraise_exception():
+                # keep the slot; the next get() will try to reconnect
+                self.put(ssh)
+
+
+class SanISCSIDriver(nova.volume.driver.ISCSIDriver):
+    """Base class for SAN-style storage volumes
+
+    A SAN-style storage value is 'different' because the volume controller
+    probably won't run on it, so we need to access is over SSH or another
+    remote protocol.
+    """
+
+    def __init__(self):
+        super(SanISCSIDriver, self).__init__()
+        self.run_local = FLAGS.san_is_local
+        self.sshpool = SSHPool()
+
+    def _build_iscsi_target_name(self, volume):
+        return "%s%s" % (FLAGS.iscsi_target_prefix, volume['name'])
+
     def _execute(self, *cmd, **kwargs):
         if self.run_local:
             return utils.execute(*cmd, **kwargs)
@@ -121,16 +174,30 @@ class SanISCSIDriver(nova.volume.driver.ISCSIDriver):
             command = ' '.join(*cmd)
             return self._run_ssh(command, check_exit_code)
 
-    def _run_ssh(self, command, check_exit_code=True):
-        #TODO(justinsb): SSH connection caching (?)
-        ssh = self._connect_to_ssh()
-
-        #TODO(justinsb): Reintroduce the retry hack
-        ret = utils.ssh_execute(ssh, command, check_exit_code=check_exit_code)
-
-        ssh.close()
-
-        return ret
+    def _run_ssh(self, command, check_exit_code=True, attempts=2):
+        timeout = FLAGS.san_ssh_command_timeout or None
+        while True:
+            attempts -= 1
+            ssh = self.sshpool.get()
+            try:
+                return utils.ssh_execute(ssh, command,
+                                         check_exit_code=check_exit_code,
+                                         timeout=timeout)
+            except paramiko.SSHException:
+                # paramiko raises SSHException when the channel cannot be
+                # opened, i.e. before the command ran, so it is safe to
+                # try again on a fresh connection.
+                ssh.close()
+                if attempts <= 0:
+                    raise
+                LOG.warn(_("SSH connection to %s failed, retrying"),
+                         FLAGS.san_ip)
+            except (socket.error, EOFError):
+                # The command may have run; never retry it blindly.
+                ssh.close()
+                raise
+            finally:
+                self.sshpool.put(ssh)
 
     def ensure_export(self, context, volume):
         """Synchronously recreates an export for a logical volume."""
@@ -0,0 +1,228 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Helper code for wiping deleted logical volumes in the background.
+
+Instead of zeroing a volume inline, the driver renames the LV to a
+pending-wipe name and hands it to a :class:`VolumeWiper`.  The renamed LVs
+are the persistent queue: after a restart :meth:`VolumeWiper.resume` finds
+them again with ``lvs`` and finishes the job.
+
+"""
+
+import os
+import time
+
+from eventlet import event
+from eventlet import greenpool
+from eventlet import greenthread
+from eventlet import queue
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+from nova.openstack.common import cfg
+from nova import utils
+
+
+LOG = logging.getLogger(__name__)
+
+wipe_opts = [
+    cfg.BoolOpt('volume_wipe_async',
+                default=False,
+                help='Rename deleted volumes and zero them in the background '
+                     'instead of blocking the delete request'),
+    cfg.IntOpt('volume_wipe_concurrency',
+               default=1,
+               help='Maximum number of volumes wiped at the same time'),
+    cfg.IntOpt('volume_wipe_chunk_mb',
+               default=256,
+               help='Size in MB of each dd invocation used to zero a volume'),
+    cfg.IntOpt('volume_wipe_bandwidth_mb',
+               default=0,
+               help='Total MB/s allowed for background wipes (0 = unlimited)'),
+    cfg.IntOpt('volume_wipe_iops',
+               default=0,
+               help='Total 1MB writes/s allowed for background wipes '
+                    '(0 = unlimited)'),
+    cfg.BoolOpt('volume_wipe_use_discard',
+                default=True,
+                help='Discard instead of zeroing when the device guarantees '
+                     'that discarded blocks read back as zeroes'),
+    ]
+
+FLAGS = flags.FLAGS
+FLAGS.register_opts(wipe_opts)
+
+PENDING_PREFIX = 'pending-wipe-'
+
+
+def pending_name(lv_name):
+    """Return the name a logical volume gets while it waits to be wiped."""
+    return PENDING_PREFIX + lv_name
+
+
+class Throttle(object):
+    """Spaces out work so it stays under a bandwidth and IOPS budget.
+
+    The budget is shared by every greenthread using the same instance.
+    """
+
+    def __init__(self, mb_per_sec=0, iops=0):
+        self.mb_per_sec = mb_per_sec
+        self.iops = iops
+        self._next_slot = 0
+
+    def _cost(self, size_mb, ios):
+        cost = 0
+        if self.mb_per_sec:
+            cost = max(cost, float(size_mb) / self.mb_per_sec)
+        if self.iops:
+            cost = max(cost, float(ios) / self.iops)
+        return cost
+
+    def consume(self, size_mb, ios):
+        """Wait until ``size_mb`` / ``ios`` fit into the budget."""
+        cost = self._cost(size_mb, ios)
+        if not cost:
+            return
+        now = time.time()
+        start = max(now, self._next_slot)
+        self._next_slot = start + cost
+        if start > now:
+            greenthread.sleep(start - now)
+
+
+class VolumeWiper(object):
+    """Zeroes and removes pending-wipe logical volumes in the background."""
+
+    def __init__(self, execute=utils.execute):
+        self.set_execute(execute)
+        self.throttle = Throttle(FLAGS.volume_wipe_bandwidth_mb,
+                                 FLAGS.volume_wipe_iops)
+        self._queue = queue.LightQueue()
+        self._pool = greenpool.GreenPool(FLAGS.volume_wipe_concurrency)
+        self._pending = set()
+        self._drained = None
+        self._dispatcher = None
+
+    def set_execute(self, execute):
+        """Set the function to be used to execute commands."""
+        self._execute = execute
+
+    @property
+    def pending(self):
+        """Names of the logical volumes still waiting to be wiped."""
+        return set(self._pending)
+
+    def queue_delete(self, lv_name):
+        """Rename ``lv_name`` out of the way and schedule it for wiping."""
+        new_name = pending_name(lv_name)
+        self._execute('lvrename', FLAGS.volume_group, lv_name, new_name,
+                      run_as_root=True)
+        self._enqueue(new_name)
+
+    def resume(self):
+        """Requeue pending-wipe volumes left behind by a previous run."""
+        out, _err = self._execute('lvs', '--noheadings', '-o', 'lv_name',
+                                  FLAGS.volume_group, run_as_root=True)
+        names = [name for name in (out or '').split()
+                 if name.startswith(PENDING_PREFIX)]
+        if names:
+            LOG.info(_("Resuming wipe of %d deleted volumes"), len(names))
+        for name in names:
+            self._enqueue(name)
+
+    def _enqueue(self, lv_name):
+        if lv_name in self._pending:
+            return
+        self._pending.add(lv_name)
+        self._queue.put(lv_name)
+        if self._dispatcher is None:
+            self._dispatcher = greenthread.spawn(self._dispatch)
+
+    def _dispatch(self):
+        while True:
+            lv_name = self._queue.get()
+            # spawn_n blocks while the pool is full, which is what
+            # bounds the number of concurrent wipes.
+            self._pool.spawn_n(self._wipe_and_remove, lv_name)
+
+    def wait(self):
+        """Block until every queued wipe has finished."""
+        if not self._pending:
+            return
+        if self._drained is None:
+            self._drained = event.Event()
+        self._drained.wait()
+
+    def _wipe_and_remove(self, lv_name):
+        try:
+            self.wipe(lv_name)
+            self._execute('lvremove', '-f',
+                          '%s/%s' % (FLAGS.volume_group, lv_name),
+                          run_as_root=True)
+            LOG.debug(_("Wiped and removed %s"), lv_name)
+        except Exception:
+            # The LV keeps its pending-wipe name, so the next
+            # resume() will try again.
+            LOG.exception(_("Failed to wipe %s"), lv_name)
+        finally:
+            self._pending.discard(lv_name)
+            if not self._pending and self._drained is not None:
+                drained, self._drained = self._drained, None
+                drained.send()
+
+    def wipe(self, lv_name):
+        """Make sure no data of ``lv_name`` can leak to the next user."""
+        path = '/dev/%s/%s' % (FLAGS.volume_group, lv_name)
+        if FLAGS.volume_wipe_use_discard and self._discard_zeroes(path):
+            LOG.debug(_("Discarding %s"), lv_name)
+            self._execute('blkdiscard', path, run_as_root=True)
+            return
+
+        size_mb = self._size_mb(lv_name)
+        chunk = max(FLAGS.volume_wipe_chunk_mb, 1)
+        LOG.debug(_("Zeroing %(size_mb)dMB of %(lv_name)s") % locals())
+        for offset in xrange(0, size_mb, chunk):
+            count = min(chunk, size_mb - offset)
+            self.throttle.consume(count, count)
+            self._execute('dd', 'if=/dev/zero', 'of=%s' % path,
+                          'bs=1M', 'count=%d' % count, 'seek=%d' % offset,
+                          'oflag=direct', run_as_root=True)
+
+    def _size_mb(self, lv_name):
+        out, _err = self._execute('lvs', '--noheadings', '--nosuffix',
+                                  '--units', 'm', '-o', 'lv_size',
+                                  '%s/%s' % (FLAGS.volume_group, lv_name),
+                                  run_as_root=True)
+        try:
+            return int(float(out.strip()))
+        except (AttributeError, ValueError):
+            raise exception.Error(_("Unable to determine size of %s")
+                                  % lv_name)
+
+    @staticmethod
+    def _discard_zeroes(path):
+        """True if discarded blocks of the device are guaranteed zero."""
+        dev = os.path.basename(os.path.realpath(path))
+        sysfs = '/sys/block/%s/queue/discard_zeroes_data' % dev
+        try:
+            with open(sysfs) as f:
+                return f.read().strip() == '1'
+        except IOError:
+            return False
@@ -79,20 +79,35 @@ class Server(object):
                              custom_pool=self._pool,
                              log=self._wsgi_logger)
 
-    def start(self, backlog=128):
-        """Start serving a WSGI application.
+    def listen(self, backlog=128):
+        """Bind the listening socket without serving requests yet.
+
+        Binding separately from :meth:`start` lets a parent process open
+        the socket once and share it with forked workers.
 
         :param backlog: Maximum number of queued connections.
         :returns: None
         :raises: nova.exception.InvalidInput
 
         """
+        if self._socket:
+            return
         if backlog < 1:
             raise exception.InvalidInput(
                     reason='The backlog must be more than 1')
         self._socket = eventlet.listen((self.host, self.port), backlog=backlog)
-        self._server = eventlet.spawn(self._start)
         (self.host, self.port) = self._socket.getsockname()
+
+    def start(self, backlog=128):
+        """Start serving a WSGI application.
+
+        :param backlog: Maximum number of queued connections.
+        :returns: None
+        :raises: nova.exception.InvalidInput
+
+        """
+        self.listen(backlog)
+        self._server = eventlet.spawn(self._start)
         LOG.info(_("Started %(name)s on %(host)s:%(port)s") % self.__dict__)
 
     def stop(self):
@@ -110,7 +125,8 @@ class Server(object):
     def wait(self):
         """Block, until the server has stopped.
 
-        Waits on the server's eventlet to finish, then returns.
+        Waits on the server's eventlet to finish and for the requests it
+        was still handling to complete, then returns.
 
         :returns: None
 
@@ -119,6 +135,7 @@ class Server(object):
             self._server.wait()
         except greenlet.GreenletExit:
             LOG.info(_("WSGI server has stopped."))
+        self._pool.waitall()
 
 
 class Request(webob.Request):
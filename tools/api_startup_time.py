@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# Copyright 2012 OpenStack LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""api_startup_time.py - Times the cold start of the OpenStack API router
+
+Each run builds the compute API router in a fresh python process, first
+importing every extension, then with an extension manifest so that
+extensions only adding resources are deferred to their first request.
+
+"""
+
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+CHILD = """
+import gettext
+import sys
+import time
+gettext.install('nova', unicode=1)
+start = time.time()
+from nova import flags
+flags.FLAGS(sys.argv[:1] + sys.argv[2:])
+flags.FLAGS.osapi_extension_manifest = sys.argv[1]
+from nova.api.openstack import compute
+compute.APIRouter()
+print time.time() - start
+"""
+
+
+def parse_options():
+    """process command line options."""
+
+    parser = optparse.OptionParser('usage: %prog [options] [nova flags]')
+    parser.add_option('--runs', type='int', default=5,
+                      help='Number of processes started for each case')
+
+    return parser.parse_args()
+
+
+def time_startup(manifest, runs, args):
+    timings = []
+    for _i in xrange(runs):
+        out = subprocess.Popen([sys.executable, '-c', CHILD, manifest] + args,
+                               stdout=subprocess.PIPE).communicate()[0]
+        timings.append(float(out.split()[-1]))
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    """Main loop."""
+    options, args = parse_options()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        manifest = os.path.join(tmpdir, 'osapi_extensions.json')
+        eager = time_startup('', options.runs, args)
+        # The first run writes the manifest
+        time_startup(manifest, 1, args)
+        lazy = time_startup(manifest, options.runs, args)
+    finally:
+        shutil.rmtree(tmpdir)
+    print 'all extensions imported: %.3fs' % eager
+    print 'with manifest:           %.3fs' % lazy
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Copyright 2012 OpenStack LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""memorycache_bench.py - Times gets on the in-process memcache client
+
+Fills a cache with keys stored with a timeout, then times gets of random
+keys, for nova.common.memorycache.Client and for the previous client,
+which scanned every key for expired ones on each get.
+
+"""
+
+import gettext
+import optparse
+import os
+import random
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova.common import memorycache
+from nova import utils
+
+
+class LinearClient(object):
+    """The client before entries expired from a heap."""
+
+    def __init__(self, *args, **kwargs):
+        self.cache = {}
+
+    def get(self, key):
+        for k in self.cache.keys():
+            (timeout, _value) = self.cache[k]
+            if timeout and utils.utcnow_ts() >= timeout:
+                del self.cache[k]
+
+        return self.cache.get(key, (0, None))[1]
+
+    def set(self, key, value, time=0, min_compress_len=0):
+        timeout = 0
+        if time != 0:
+            timeout = utils.utcnow_ts() + time
+        self.cache[key] = (timeout, value)
+        return True
+
+
+def parse_options():
+    """process command line options."""
+
+    parser = optparse.OptionParser('usage: %prog [options]')
+    parser.add_option('--sizes', default='1000,10000',
+                      help='Comma separated numbers of keys in the cache')
+    parser.add_option('--gets', type='int', default=2000,
+                      help='Number of gets timed for each size')
+    parser.add_option('--skip-linear', action='store_true', default=False,
+                      help='Only time the current client')
+
+    return parser.parse_args()[0]
+
+
+def time_gets(client, size, gets):
+    for i in xrange(size):
+        client.set('key-%d' % i, str(i), time=3600)
+    keys = ['key-%d' % random.randrange(size) for _i in xrange(gets)]
+    start = time.time()
+    for key in keys:
+        client.get(key)
+    return (time.time() - start) / gets
+
+
+def main():
+    """Main loop."""
+    options = parse_options()
+    clients = [('current', lambda: memorycache.Client(max_items=0))]
+    if not options.skip_linear:
+        clients.insert(0, ('before', LinearClient))
+
+    print '%8s  %s' % ('keys', '  '.join('%14s' % name
+                                         for name, _cls in clients))
+    for size in [int(size) for size in options.sizes.split(',')]:
+        timings = [time_gets(client(), size, options.gets)
+                   for _name, client in clients]
+        print '%8d  %s' % (size, '  '.join('%11.1fus' % (timing * 1e6)
+                                           for timing in timings))
+
+if __name__ == '__main__':
+    main()
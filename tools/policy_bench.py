@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+# Copyright 2012 OpenStack LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""policy_bench.py - Times policy checks against etc/nova/policy.json
+
+Times Brain.check with compiled rules against a brain interpreting the
+match lists on every check, then nova.policy.enforce on one request
+context and on a fresh context for each check, against enforce without
+the decisions cached per context and looking at the policy file on
+every call.
+
+"""
+
+import gettext
+import optparse
+import os
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova.common import policy as common_policy
+from nova import context
+from nova import exception
+from nova import flags
+from nova import policy
+
+
+FLAGS = flags.FLAGS
+
+ACTIONS = ['compute:create',
+           'compute_extension:admin_actions:pause',
+           # denied to members
+           'compute_extension:admin_actions:lock',
+           'compute_extension:console_output']
+
+TARGET = {'project_id': 'project'}
+
+
+class InterpretingBrain(common_policy.HttpBrain):
+    """Evaluates match lists on every check, as Brain did before."""
+
+    def check(self, match_list, target_dict, cred_dict):
+        if not match_list:
+            return True
+        for and_list in match_list:
+            if isinstance(and_list, basestring):
+                and_list = (and_list,)
+            if all([self._check(item, target_dict, cred_dict)
+                    for item in and_list]):
+                return True
+        return False
+
+
+def parse_options():
+    """process command line options."""
+
+    parser = optparse.OptionParser('usage: %prog [options]')
+    parser.add_option('--checks', type='int', default=20000,
+                      help='Number of checks timed in each case')
+
+    return parser.parse_args()[0]
+
+
+def per_check(checks, func):
+    start = time.time()
+    for i in xrange(checks):
+        func(ACTIONS[i % len(ACTIONS)])
+    return (time.time() - start) / checks
+
+
+def new_context():
+    return context.RequestContext('user', 'project', roles=['member'])
+
+
+def time_brain(brain_class, checks):
+    with open(policy._POLICY_PATH) as f:
+        brain = brain_class.load_json(f.read(), FLAGS.policy_default_rule)
+    creds = new_context().to_dict()
+    return per_check(checks, lambda action: brain.check(
+            ('rule:%s' % action,), TARGET, creds))
+
+
+def time_enforce_before(checks, fresh):
+    """enforce() without the decisions cache nor the reload interval."""
+    FLAGS.set_override('policy_reload_interval', 0)
+    policy.reset()
+    policy.init()
+    with open(policy._POLICY_PATH) as f:
+        common_policy.set_brain(InterpretingBrain.load_json(
+                f.read(), FLAGS.policy_default_rule))
+    ctxt = new_context()
+
+    def enforce(action):
+        policy.init()
+        creds = (new_context() if fresh else ctxt).to_dict()
+        policy._check(action, TARGET, creds)
+
+    return per_check(checks, enforce)
+
+
+def time_enforce(checks, fresh, reload_interval):
+    FLAGS.set_override('policy_reload_interval', reload_interval)
+    policy.reset()
+    ctxt = new_context()
+
+    def enforce(action):
+        try:
+            policy.enforce(new_context() if fresh else ctxt, action, TARGET)
+        except exception.PolicyNotAuthorized:
+            pass
+
+    return per_check(checks, enforce)
+
+
+def main():
+    """Main loop."""
+    options = parse_options()
+    FLAGS(sys.argv[:1])
+    FLAGS.set_override('policy_file',
+                       os.path.join(POSSIBLE_TOPDIR, 'etc', 'nova',
+                                    'policy.json'))
+    policy.init()
+    reload_interval = FLAGS.policy_reload_interval
+
+    cases = [('Brain.check, %d actions' % len(ACTIONS),
+              time_brain(InterpretingBrain, options.checks),
+              time_brain(common_policy.HttpBrain, options.checks))]
+    for fresh, title in ((False, 'enforce, one context'),
+                         (True, 'enforce, fresh context')):
+        cases.append((title,
+                      time_enforce_before(options.checks, fresh),
+                      time_enforce(options.checks, fresh, reload_interval)))
+
+    print '%-28s %12s %12s' % ('', 'before', 'after')
+    for title, before, after in cases:
+        print '%-28s %9.1fus %9.1fus' % (title, before * 1e6, after * 1e6)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Copyright 2012 OpenStack LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""quantum_client_bench.py - Times the Quantum client against a fake server
+
+Starts a fake Quantum server on localhost and creates and attaches the
+ports of a number of instances through the Quantum client, the way
+QuantumManager.allocate_for_instance does, first opening a connection
+for every request and one vif after the other, then with keep-alive
+connections and the ports of each instance created concurrently.
+
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import gettext
+import json
+import optparse
+import os
+import sys
+import time
+
+import eventlet.wsgi
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova.network.quantum import client as quantum_client
+from nova.network.quantum import quantum_connection
+
+
+class NullLog(object):
+
+    def write(self, data):
+        pass
+
+
+class FakeQuantum(object):
+    """Answers port creations and attachments, counts the connections."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.peers = set()
+        self.requests = 0
+
+    def __call__(self, environ, start_response):
+        self.peers.add(environ['REMOTE_PORT'])
+        self.requests += 1
+        environ['wsgi.input'].read()
+        if self.latency:
+            eventlet.sleep(self.latency)
+        if environ['REQUEST_METHOD'] == 'POST':
+            body = json.dumps({'port': {'id': str(self.requests)}})
+            start_response('200 OK', [('Content-Type', 'application/json'),
+                                      ('Content-Length', str(len(body)))])
+            return [body]
+        start_response('204 No Content', [('Content-Length', '0')])
+        return []
+
+
+def parse_options():
+    """process command line options."""
+
+    parser = optparse.OptionParser('usage: %prog [options]')
+    parser.add_option('--instances', type='int', default=50,
+                      help='Number of instances whose ports are created')
+    parser.add_option('--vifs', type='int', default=4,
+                      help='Number of vifs of each instance')
+    parser.add_option('--latency', type='float', default=0.002,
+                      help='Seconds the fake server takes for each request')
+    parser.add_option('--pool-size', type='int', default=10,
+                      help='Keep-alive connections of the pooled client')
+
+    return parser.parse_args()[0]
+
+
+def run(server, port, options, pool_size, concurrent):
+    client = quantum_client.Client('127.0.0.1', port, format='json',
+                                   pool_size=pool_size)
+    q_conn = quantum_connection.QuantumClientConnection(client=client)
+    server.peers.clear()
+    start = time.time()
+    pool = eventlet.GreenPool()
+    for i in xrange(options.instances):
+        for vif in xrange(options.vifs):
+            args = ('tenant', 'net%d' % vif, 'vif-%d-%d' % (i, vif))
+            if concurrent:
+                pool.spawn(q_conn.create_and_attach_port, *args)
+            else:
+                q_conn.create_and_attach_port(*args)
+        pool.waitall()
+    return time.time() - start, len(server.peers)
+
+
+def main():
+    """Main loop."""
+    options = parse_options()
+    server = FakeQuantum(options.latency)
+    sock = eventlet.listen(('127.0.0.1', 0))
+    eventlet.spawn_n(eventlet.wsgi.server, sock, server, log=NullLog())
+    port = sock.getsockname()[1]
+
+    for title, pool_size, concurrent in (
+            ('new connection per request, serial', 0, False),
+            ('keep-alive connections, serial', options.pool_size, False),
+            ('keep-alive connections, concurrent', options.pool_size, True)):
+        seconds, connections = run(server, port, options, pool_size,
+                                   concurrent)
+        print '%-40s %7.3fs %6d connections' % (title, seconds, connections)
+
+if __name__ == '__main__':
+    main()
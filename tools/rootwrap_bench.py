@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# Copyright 2012 OpenStack LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""rootwrap_bench.py - Times commands run as root through utils.execute
+
+Runs the same command with run_as_root, first starting nova-rootwrap for
+every call through root_helper, then through a single long running
+"nova-rootwrap --daemon" set as root_helper_daemon.  Without --sudo,
+nova-rootwrap runs as the current user, which leaves out the cost of
+sudo itself.
+
+"""
+
+import gettext
+import optparse
+import os
+import sys
+import time
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import flags
+from nova import utils
+
+
+FLAGS = flags.FLAGS
+
+
+def parse_options():
+    """process command line options."""
+
+    parser = optparse.OptionParser('usage: %prog [options]')
+    parser.add_option('--runs', type='int', default=200,
+                      help='Number of commands run in each mode')
+    parser.add_option('--sudo', action='store_true', default=False,
+                      help='Run nova-rootwrap through sudo')
+
+    return parser.parse_args()[0]
+
+
+def time_commands(runs):
+    start = time.time()
+    for _i in xrange(runs):
+        utils.execute('tee', '/dev/null', process_input='x',
+                      run_as_root=True)
+    return (time.time() - start) / runs
+
+
+def main():
+    """Main loop."""
+    options = parse_options()
+    FLAGS(sys.argv[:1])
+    rootwrap = '%s %s' % (sys.executable,
+                          os.path.join(POSSIBLE_TOPDIR, 'bin',
+                                       'nova-rootwrap'))
+    if options.sudo:
+        rootwrap = 'sudo ' + rootwrap
+
+    FLAGS.set_override('root_helper', rootwrap)
+    FLAGS.set_override('root_helper_daemon', None)
+    per_command = time_commands(options.runs)
+
+    FLAGS.set_override('root_helper_daemon', rootwrap + ' --daemon')
+    # The first command starts the daemon, don't time it
+    time_commands(1)
+    with_daemon = time_commands(options.runs)
+    # Closing its stdin stops the daemon
+    process = utils._rootwrap_client()._process
+    process.stdin.close()
+    process.wait()
+
+    print '%-28s %7.1f ms/command' % ('nova-rootwrap per command',
+                                      per_command * 1000)
+    print '%-28s %7.1f ms/command' % ('rootwrap daemon', with_daemon * 1000)
+
+if __name__ == '__main__':
+    main()